@@ -3,8 +3,8 @@ from django.utils.translation import gettext_lazy as _
 from django.utils.html import format_html
 from django.db.models import Count, Sum, Avg
 from .models import (
-    AIModel, AIRequest, ChatConversation, ChatMessage,
-    AITemplate, AIUsageStats
+    AIModel, AIRequest, AIRequestArchive, ChatConversation, ChatMessage,
+    AITemplate, AIUsageStats, BatchJob
 )
 
 
@@ -94,6 +94,28 @@ class AIRequestAdmin(admin.ModelAdmin):
         return False
 
 
+@admin.register(AIRequestArchive)
+class AIRequestArchiveAdmin(admin.ModelAdmin):
+    """AI请求归档管理"""
+    list_display = ('month', 'first_request_id', 'last_request_id', 'row_count', 'file_size', 'file_format', 'path', 'created_at')
+    list_filter = ('month', 'file_format')
+    search_fields = ('path',)
+    readonly_fields = (
+        'month', 'path', 'file_format', 'first_request_id', 'last_request_id', 'start_time', 'end_time',
+        'row_count', 'file_size', 'created_at', 'updated_at'
+    )
+    date_hierarchy = 'month'
+    ordering = ['-month', '-first_request_id']
+
+    def has_add_permission(self, request):
+        """禁止手动添加归档"""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        """禁止修改归档"""
+        return False
+
+
 class ChatMessageInline(admin.TabularInline):
     """聊天消息内联"""
     model = ChatMessage
@@ -114,7 +136,7 @@ class ChatConversationAdmin(admin.ModelAdmin):
     list_display = ('title', 'user', 'ai_model', 'message_count', 'total_tokens', 'total_cost', 'is_archived', 'created_at')
     list_filter = ('ai_model', 'is_archived', 'is_active', 'created_at')
     search_fields = ('title', 'user__username', 'ai_model__name', 'system_prompt')
-    readonly_fields = ('total_tokens', 'total_cost', 'message_count', 'created_at', 'updated_at')
+    readonly_fields = ('total_tokens', 'total_cost', 'message_count', 'last_message_at', 'created_at', 'updated_at')
     date_hierarchy = 'created_at'
     ordering = ['-updated_at']
     inlines = [ChatMessageInline]
@@ -124,7 +146,7 @@ class ChatConversationAdmin(admin.ModelAdmin):
             'fields': ('user', 'ai_model', 'title', 'system_prompt')
         }),
         (_('统计信息'), {
-            'fields': ('total_tokens', 'total_cost', 'message_count')
+            'fields': ('total_tokens', 'total_cost', 'message_count', 'last_message_at')
         }),
         (_('状态设置'), {
             'fields': ('is_archived', 'is_active')
@@ -135,14 +157,9 @@ class ChatConversationAdmin(admin.ModelAdmin):
         }),
     )
 
-    def message_count(self, obj):
-        """显示消息数量"""
-        return obj.messages.count()
-    message_count.short_description = '消息数量'
-
     def get_queryset(self, request):
         """优化查询"""
-        return super().get_queryset(request).select_related('user', 'ai_model').prefetch_related('messages')
+        return super().get_queryset(request).select_related('user', 'ai_model')
 
 
 @admin.register(ChatMessage)
@@ -280,6 +297,57 @@ class AIUsageStatsAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related('user', 'ai_model')
 
 
+@admin.register(BatchJob)
+class BatchJobAdmin(admin.ModelAdmin):
+    """批量推理任务管理"""
+    list_display = ('id', 'name', 'user', 'ai_model', 'status', 'progress_display', 'failed_items', 'total_cost', 'created_at')
+    list_filter = ('status', 'ai_model', 'created_at')
+    search_fields = ('name', 'user__username', 'ai_model__name', 'task_id')
+    readonly_fields = (
+        'user', 'ai_model', 'input_file', 'output_file', 'total_items', 'processed_items',
+        'succeeded_items', 'failed_items', 'total_tokens', 'total_cost', 'checkpoint_offset',
+        'task_id', 'error_message', 'started_at', 'completed_at', 'created_at', 'updated_at'
+    )
+    date_hierarchy = 'created_at'
+    ordering = ['-created_at']
+
+    fieldsets = (
+        (_('任务信息'), {
+            'fields': ('name', 'user', 'ai_model', 'status', 'parameters', 'concurrency')
+        }),
+        (_('文件'), {
+            'fields': ('input_file', 'output_file')
+        }),
+        (_('进度'), {
+            'fields': ('total_items', 'processed_items', 'succeeded_items', 'failed_items', 'checkpoint_offset')
+        }),
+        (_('统计信息'), {
+            'fields': ('total_tokens', 'total_cost')
+        }),
+        (_('执行信息'), {
+            'fields': ('task_id', 'error_message', 'started_at', 'completed_at'),
+            'classes': ('collapse',)
+        }),
+        (_('时间信息'), {
+            'fields': ('created_at', 'updated_at'),
+            'classes': ('collapse',)
+        }),
+    )
+
+    def progress_display(self, obj):
+        """显示进度"""
+        return f'{obj.progress}%'
+    progress_display.short_description = '进度'
+
+    def has_add_permission(self, request):
+        """禁止手动添加任务"""
+        return False
+
+    def get_queryset(self, request):
+        """优化查询"""
+        return super().get_queryset(request).select_related('user', 'ai_model')
+
+
 # 自定义管理界面标题
 admin.site.site_header = 'AI功能管理'
 admin.site.site_title = 'AI管理'
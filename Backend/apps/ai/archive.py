@@ -0,0 +1,247 @@
+"""
+AI请求的按月归档
+
+超过保留期（AI_REQUEST_ARCHIVE_DAYS 天）的请求按创建月份分段写入压缩的JSONL文件（默认存储中的
+AI_REQUEST_ARCHIVE_DIR/<年>/<月>/），在同一事务中记录归档段（AIRequestArchive）并从请求表删除。
+安装了 zstandard 时使用 zstd 压缩，否则使用 gzip。
+
+归档后的请求仍可按ID（get_archived_request）或时间范围（iter_archived_requests、分页的
+page_archived_requests）读取：先按归档段的ID范围或时间范围定位文件，再逐行读取。
+"""
+import gzip
+import heapq
+import io
+import json
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = getattr(settings, 'AI_REQUEST_ARCHIVE_DAYS', 90)
+ARCHIVE_DIR = getattr(settings, 'AI_REQUEST_ARCHIVE_DIR', 'ai_archive/requests')
+# 每个归档文件最多包含的请求数（同一月份的请求较多时分为多段）
+ARCHIVE_SEGMENT_ROWS = getattr(settings, 'AI_REQUEST_ARCHIVE_SEGMENT_ROWS', 50000)
+ARCHIVE_DELETE_BATCH_SIZE = getattr(settings, 'AI_REQUEST_ARCHIVE_DELETE_BATCH_SIZE', 1000)
+ARCHIVE_ZSTD_LEVEL = getattr(settings, 'AI_REQUEST_ARCHIVE_ZSTD_LEVEL', 10)
+ARCHIVE_FORMAT = 'jsonl.zst' if zstandard is not None else 'jsonl.gz'
+
+# 写入归档的字段（外键只保存ID）
+ARCHIVE_FIELDS = (
+    'id', 'user_id', 'ai_model_id', 'request_type', 'input_data', 'output_data', 'status',
+    'processing_time', 'cost', 'error_message', 'metadata', 'is_active', 'created_at', 'updated_at'
+)
+
+
+def _month_start(value):
+    """所在月份的第一天零点（本地时区）"""
+    return timezone.localtime(value).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(month_start):
+    return (month_start + timedelta(days=32)).replace(day=1)
+
+
+def _encode_record(row: Dict[str, Any]) -> bytes:
+    record = {
+        **row,
+        'cost': str(row['cost']),
+        'created_at': row['created_at'].isoformat(),
+        'updated_at': row['updated_at'].isoformat()
+    }
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8') + b'\n'
+
+
+def _decode_record(line: str) -> Dict[str, Any]:
+    record = json.loads(line)
+    record['cost'] = Decimal(record['cost'])
+    record['created_at'] = parse_datetime(record['created_at'])
+    record['updated_at'] = parse_datetime(record['updated_at'])
+    return record
+
+
+def _compressor(fileobj, file_format: str):
+    """压缩写入流（关闭时不关闭底层文件）"""
+    if file_format == 'jsonl.zst':
+        return zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).stream_writer(fileobj, closefd=False)
+    return gzip.GzipFile(fileobj=fileobj, mode='wb')
+
+
+def _decompressor(fileobj, file_format: str):
+    if file_format == 'jsonl.zst':
+        if zstandard is None:
+            raise RuntimeError('读取zstd归档文件需要安装 zstandard')
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(fileobj))
+    return gzip.GzipFile(fileobj=fileobj, mode='rb')
+
+
+def _archive_segment(month_start, month_end, segment_rows: int, delete_batch_size: int):
+    """把 [month_start, month_end) 内ID最小的至多 segment_rows 个请求写入一个归档文件并从请求表删除"""
+    from .models import AIRequest, AIRequestArchive
+
+    rows = AIRequest.objects.filter(
+        created_at__gte=month_start, created_at__lt=month_end
+    ).order_by('id').values(*ARCHIVE_FIELDS)[:segment_rows]
+
+    ids = []
+    start_time = end_time = None
+    with tempfile.TemporaryFile() as tmp:
+        with _compressor(tmp, ARCHIVE_FORMAT) as stream:
+            for row in rows.iterator(chunk_size=2000):
+                stream.write(_encode_record(row))
+                ids.append(row['id'])
+                start_time = row['created_at'] if start_time is None else min(start_time, row['created_at'])
+                end_time = row['created_at'] if end_time is None else max(end_time, row['created_at'])
+        if not ids:
+            return None
+        file_size = tmp.tell()
+        tmp.seek(0)
+        path = default_storage.save(
+            f"{ARCHIVE_DIR}/{month_start:%Y/%m}/requests-{month_start:%Y%m}-{ids[0]}-{ids[-1]}.{ARCHIVE_FORMAT}",
+            File(tmp)
+        )
+
+    try:
+        with transaction.atomic():
+            archive = AIRequestArchive.objects.create(
+                month=month_start.date(),
+                path=path,
+                file_format=ARCHIVE_FORMAT,
+                first_request_id=ids[0],
+                last_request_id=ids[-1],
+                start_time=start_time,
+                end_time=end_time,
+                row_count=len(ids),
+                file_size=file_size
+            )
+            # 归档不是删除：直接执行 DELETE（AIRequest 没有被其他表引用）。QuerySet.delete() 会因为
+            # post_delete 信号逐行加载记录并为每条请求写入删除日志
+            table = connection.ops.quote_name(AIRequest._meta.db_table)
+            with connection.cursor() as cursor:
+                for offset in range(0, len(ids), delete_batch_size):
+                    batch = ids[offset:offset + delete_batch_size]
+                    cursor.execute(f"DELETE FROM {table} WHERE id IN ({', '.join(['%s'] * len(batch))})", batch)
+    except Exception:
+        default_storage.delete(path)
+        raise
+    return archive
+
+
+def archive_requests(days: Optional[int] = None, segment_rows: int = ARCHIVE_SEGMENT_ROWS,
+                     delete_batch_size: int = ARCHIVE_DELETE_BATCH_SIZE) -> Dict[str, int]:
+    """把创建时间早于 days 天前的请求按月归档，从最早的月份开始，返回归档的段数和请求数"""
+    from .models import AIRequest
+
+    days = ARCHIVE_AFTER_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    result = {'segments': 0, 'requests': 0}
+    while True:
+        oldest = AIRequest.objects.filter(created_at__lt=cutoff).order_by('created_at').values_list(
+            'created_at', flat=True
+        ).first()
+        if oldest is None:
+            return result
+        month_start = _month_start(oldest)
+        archive = _archive_segment(month_start, min(_next_month(month_start), cutoff), segment_rows,
+                                   delete_batch_size)
+        if archive is None:
+            continue
+        result['segments'] += 1
+        result['requests'] += archive.row_count
+        logger.info(f"已归档AI请求 {archive.row_count} 条: {archive.path}")
+
+
+def read_archive(archive) -> Iterator[Dict[str, Any]]:
+    """逐条读取归档段中的请求"""
+    with default_storage.open(archive.path, 'rb') as raw:
+        with _decompressor(raw, archive.file_format) as stream:
+            for line in io.TextIOWrapper(stream, encoding='utf-8'):
+                if line.strip():
+                    yield _decode_record(line)
+
+
+def get_archived_request(request_id: int, user_id=None) -> Optional[Dict[str, Any]]:
+    """按ID读取已归档的请求（指定 user_id 时只返回该用户的请求）"""
+    from .models import AIRequestArchive
+
+    archives = AIRequestArchive.objects.filter(
+        first_request_id__lte=request_id, last_request_id__gte=request_id
+    ).order_by('-first_request_id')
+    for archive in archives:
+        for record in read_archive(archive):
+            if record['id'] == request_id:
+                if user_id is not None and record['user_id'] != user_id:
+                    return None
+                return record
+    return None
+
+
+def _matches(record, start, end, user_id, filters) -> bool:
+    if start is not None and record['created_at'] < start:
+        return False
+    if end is not None and record['created_at'] >= end:
+        return False
+    if user_id is not None and record['user_id'] != user_id:
+        return False
+    return all(record.get(key) == value for key, value in filters.items())
+
+
+def page_archived_requests(start, end, user_id=None, before: Optional[Tuple] = None, limit: int = 20,
+                           **filters) -> List[Dict[str, Any]]:
+    """按 (created_at, id) 倒序取时间范围 [start, end) 内排在 before 之后的至多 limit 条归档请求
+
+    逐段读取并过滤，只保留当前最新的 limit 条；归档段按最晚创建时间倒序读取，
+    后续各段都早于已取得的结果时停止读取。
+    """
+    from .models import AIRequestArchive
+
+    archives = AIRequestArchive.objects.filter(end_time__gte=start, start_time__lt=end)
+    if before is not None:
+        archives = archives.filter(start_time__lte=before[0])
+    newest: List[Tuple] = []
+    for archive in archives.order_by('-end_time', '-first_request_id'):
+        if len(newest) == limit and archive.end_time < newest[0][0]:
+            break
+        for record in read_archive(archive):
+            position = (record['created_at'], record['id'])
+            if before is not None and position >= before:
+                continue
+            if not _matches(record, start, end, user_id, filters):
+                continue
+            if len(newest) < limit:
+                heapq.heappush(newest, (*position, record))
+            elif position > newest[0][:2]:
+                heapq.heapreplace(newest, (*position, record))
+    return [item[2] for item in sorted(newest, key=lambda item: item[:2], reverse=True)]
+
+
+def iter_archived_requests(start=None, end=None, user_id=None, **filters) -> Iterator[Dict[str, Any]]:
+    """按创建时间范围 [start, end) 读取已归档的请求，可按用户及 ai_model_id、status、request_type 等字段过滤
+
+    归档文件包含所有用户的请求，按用户查询时仍需读取时间范围内的全部归档段。
+    """
+    from .models import AIRequestArchive
+
+    archives = AIRequestArchive.objects.all()
+    if start is not None:
+        archives = archives.filter(end_time__gte=start)
+    if end is not None:
+        archives = archives.filter(start_time__lt=end)
+    for archive in archives.order_by('start_time', 'first_request_id'):
+        for record in read_archive(archive):
+            if _matches(record, start, end, user_id, filters):
+                yield record
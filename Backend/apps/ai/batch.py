@@ -0,0 +1,247 @@
+"""
+批量推理任务的执行逻辑（由Celery任务 run_ai_batch_job 调用）
+"""
+import asyncio
+import json
+import os
+from decimal import Decimal
+from itertools import islice
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.utils import timezone
+import logging
+
+from .models import BatchJob
+from .providers import ModelProviderError, resolve_model
+from .usage import record_usage_event
+from server.ai_manager import get_ai_manager
+from server.token_estimator import estimate_tokens, count_messages_tokens
+
+logger = logging.getLogger(__name__)
+
+# 每行请求中可覆盖任务参数的字段
+BATCH_ITEM_PARAMS = ('temperature', 'max_tokens', 'top_p')
+# 批量请求优先级低于在线请求（速率限制排队时让出名额）
+BATCH_PRIORITY = -10
+BATCH_MAX_ITEMS = getattr(settings, 'AI_BATCH_MAX_ITEMS', 50000)
+BATCH_MAX_RETRIES = getattr(settings, 'AI_BATCH_MAX_RETRIES', 2)
+# 每个断点段包含的请求数 = 并发数 * 该系数
+BATCH_CHUNK_FACTOR = getattr(settings, 'AI_BATCH_CHUNK_FACTOR', 4)
+
+
+def parse_batch_item(line: bytes) -> Dict[str, Any]:
+    """解析一行批量请求：{"custom_id", "messages" | "prompt", 以及可选的 temperature 等参数}"""
+    try:
+        item = json.loads(line)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        raise ValueError('不是有效的JSON')
+    if not isinstance(item, dict):
+        raise ValueError('每行必须是JSON对象')
+
+    messages = item.get('messages')
+    if messages is None and isinstance(item.get('prompt'), str) and item['prompt'].strip():
+        messages = [{'role': 'user', 'content': item['prompt']}]
+    if not isinstance(messages, list) or not messages:
+        raise ValueError('缺少 messages 或 prompt')
+    for message in messages:
+        if not isinstance(message, dict) or 'role' not in message or 'content' not in message:
+            raise ValueError('消息格式不正确，需包含 role 和 content')
+
+    return {
+        'custom_id': item.get('custom_id'),
+        'messages': messages,
+        'params': {key: item[key] for key in BATCH_ITEM_PARAMS if key in item}
+    }
+
+
+def iter_batch_lines(input_file, skip: int = 0) -> Iterator[Tuple[int, bytes]]:
+    """逐行读取输入文件，产出 (序号, 行内容)，忽略空行并跳过前 skip 个请求"""
+    index = 0
+    for line in input_file:
+        line = line.strip()
+        if not line:
+            continue
+        if index >= skip:
+            yield index, line
+        index += 1
+
+
+def validate_batch_file(input_file, max_items: int = BATCH_MAX_ITEMS,
+                        max_errors: int = 10) -> Tuple[int, List[str]]:
+    """校验上传的JSONL文件，返回 (请求数, 错误列表)"""
+    count = 0
+    errors = []
+    for index, line in iter_batch_lines(input_file):
+        count += 1
+        if count > max_items:
+            errors.append(f'请求数超过上限 {max_items}')
+            break
+        try:
+            parse_batch_item(line)
+        except ValueError as e:
+            errors.append(f'第 {index + 1} 个请求: {str(e)}')
+            if len(errors) >= max_errors:
+                break
+    input_file.seek(0)
+    return count, errors
+
+
+def _output_name(job: BatchJob) -> str:
+    return f"ai/batches/output/{timezone.now():%Y/%m}/batch-{job.id}.jsonl"
+
+
+async def _current_status(job_id: int) -> Optional[str]:
+    return await BatchJob.objects.filter(id=job_id).values_list('status', flat=True).afirst()
+
+
+async def _run_item(ai_manager, provider_name: str, model: str, job_params: Dict[str, Any],
+                    index: int, line: bytes) -> Dict[str, Any]:
+    """执行单个请求，可重试的错误按 Retry-After 或指数退避重试"""
+    try:
+        item = parse_batch_item(line)
+    except ValueError as e:
+        return {'index': index, 'custom_id': None, 'success': False, 'error': str(e)}
+
+    params = {**job_params, **item['params']}
+    record = {'index': index, 'custom_id': item['custom_id']}
+    for attempt in range(BATCH_MAX_RETRIES + 1):
+        try:
+            result = await ai_manager.chat_completion(
+                provider_name, item['messages'], model=model, priority=BATCH_PRIORITY, **params
+            )
+        except Exception as e:
+            result = {'error': True, 'message': str(e), 'retryable': False}
+
+        if result.get('success'):
+            usage = result.get('usage') or {}
+            if not usage.get('total_tokens'):
+                prompt_tokens = count_messages_tokens(item['messages'], model)
+                completion_tokens = estimate_tokens(result.get('content') or '', model)
+                usage = {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens,
+                    'estimated': True
+                }
+            record.update({'success': True, 'content': result.get('content'), 'usage': usage})
+            return record
+
+        if not result.get('retryable') or attempt == BATCH_MAX_RETRIES:
+            break
+        await asyncio.sleep(result.get('retry_after') or 2 ** attempt)
+
+    record.update({'success': False, 'error': result.get('message', '请求失败')})
+    return record
+
+
+async def _record_chunk_usage(job: BatchJob, succeeded: int, failed: int, tokens: int, cost: Decimal):
+    """按段汇总记录一个使用事件，避免每个请求一次记录"""
+    await sync_to_async(record_usage_event)(
+        job.user_id, job.ai_model_id, tokens=tokens, cost=cost,
+        requests=succeeded + failed, successes=succeeded
+    )
+
+
+async def process_batch_job(job_id: int) -> Dict[str, Any]:
+    """执行批量推理任务
+
+    按段（并发数 * BATCH_CHUNK_FACTOR 个请求）处理，段内并发调用 AIManager，段内结果按输入顺序
+    追加到输出文件并落盘后，再原子地更新进度计数和断点。重新执行时从 processed_items 继续，
+    并把输出文件截断到 checkpoint_offset，丢弃中断时写了一半的段。输出文件需位于本地存储。
+    """
+    job = await BatchJob.objects.select_related('ai_model').aget(id=job_id)
+    if job.is_finished():
+        return {'status': job.status, 'job_id': job_id, 'message': '任务已结束'}
+
+    try:
+        route = resolve_model(job.ai_model)
+    except ModelProviderError as e:
+        await BatchJob.objects.filter(id=job_id).aupdate(
+            status='failed', error_message=str(e), completed_at=timezone.now()
+        )
+        return {'status': 'failed', 'job_id': job_id, 'message': str(e)}
+    provider_name, model = route.provider_name, route.model
+    ai_manager = get_ai_manager()
+
+    if not job.output_file:
+        job.output_file.name = _output_name(job)
+    output_path = default_storage.path(job.output_file.name)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # 只启动等待中或中断后重新投递的任务，避免覆盖已取消的状态
+    started = await BatchJob.objects.filter(id=job_id, status__in=['pending', 'running']).aupdate(
+        status='running',
+        output_file=job.output_file.name,
+        started_at=job.started_at or timezone.now(),
+        error_message=''
+    )
+    if not started:
+        return {'status': await _current_status(job_id), 'job_id': job_id, 'message': '任务已结束'}
+
+    job_params = {key: job.parameters[key] for key in BATCH_ITEM_PARAMS if key in job.parameters}
+    # 与交互式接口一致，AIModel.cost_per_request 按每个token计费
+    cost_per_token = job.ai_model.cost_per_request
+    semaphore = asyncio.Semaphore(job.concurrency)
+    chunk_size = job.concurrency * BATCH_CHUNK_FACTOR
+
+    async def run(index: int, line: bytes) -> Dict[str, Any]:
+        async with semaphore:
+            return await _run_item(ai_manager, provider_name, model, job_params, index, line)
+
+    try:
+        with job.input_file.open('rb') as input_file, open(output_path, 'ab') as output:
+            # 丢弃断点之后写了一半的段
+            if output.seek(0, os.SEEK_END) > job.checkpoint_offset:
+                output.truncate(job.checkpoint_offset)
+                output.seek(0, os.SEEK_END)
+            lines = iter_batch_lines(input_file, skip=job.processed_items)
+            while True:
+                chunk = list(islice(lines, chunk_size))
+                if not chunk:
+                    break
+                if await _current_status(job_id) == 'cancelled':
+                    logger.info(f"批量任务已取消: {job_id}")
+                    return {'status': 'cancelled', 'job_id': job_id}
+
+                records = await asyncio.gather(*(run(index, line) for index, line in chunk))
+                output.write(b''.join(
+                    json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n' for record in records
+                ))
+                output.flush()
+                os.fsync(output.fileno())
+
+                succeeded = sum(1 for record in records if record['success'])
+                failed = len(records) - succeeded
+                tokens = sum(record['usage']['total_tokens'] for record in records if record['success'])
+                cost = cost_per_token * tokens
+                await BatchJob.objects.filter(id=job_id).aupdate(
+                    processed_items=F('processed_items') + len(records),
+                    succeeded_items=F('succeeded_items') + succeeded,
+                    failed_items=F('failed_items') + failed,
+                    total_tokens=F('total_tokens') + tokens,
+                    total_cost=F('total_cost') + cost,
+                    checkpoint_offset=output.tell()
+                )
+                await _record_chunk_usage(job, succeeded, failed, tokens, cost)
+    except Exception as e:
+        logger.error(f"批量任务执行失败: {job_id} - {str(e)}")
+        await BatchJob.objects.filter(id=job_id).aupdate(status='failed', error_message=str(e))
+        return {'status': 'failed', 'job_id': job_id, 'message': str(e)}
+    finally:
+        await ai_manager.release_sessions()
+
+    await BatchJob.objects.filter(id=job_id, status='running').aupdate(
+        status='completed', completed_at=timezone.now()
+    )
+    job = await BatchJob.objects.aget(id=job_id)
+    logger.info(f"批量任务完成: {job_id} - 成功 {job.succeeded_items}, 失败 {job.failed_items}")
+    return {
+        'status': job.status,
+        'job_id': job_id,
+        'processed_items': job.processed_items,
+        'succeeded_items': job.succeeded_items,
+        'failed_items': job.failed_items
+    }
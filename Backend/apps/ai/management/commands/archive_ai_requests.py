@@ -0,0 +1,32 @@
+"""
+Django管理命令：把超过保留期的AI请求按月归档到压缩文件
+使用方法：python manage.py archive_ai_requests [--days 90] [--segment-rows 50000]
+"""
+
+from django.core.management.base import BaseCommand
+
+from apps.ai.archive import ARCHIVE_AFTER_DAYS, ARCHIVE_SEGMENT_ROWS, archive_requests
+
+
+class Command(BaseCommand):
+    help = '把创建时间早于保留天数的AI请求按月写入归档文件并从请求表删除'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=ARCHIVE_AFTER_DAYS,
+            help=f'保留最近多少天的请求（默认：{ARCHIVE_AFTER_DAYS}）'
+        )
+        parser.add_argument(
+            '--segment-rows',
+            type=int,
+            default=ARCHIVE_SEGMENT_ROWS,
+            help=f'每个归档文件最多包含的请求数（默认：{ARCHIVE_SEGMENT_ROWS}）'
+        )
+
+    def handle(self, *args, **options):
+        result = archive_requests(options['days'], segment_rows=options['segment_rows'])
+        self.stdout.write(self.style.SUCCESS(
+            f"归档完成，共归档 {result['requests']} 条请求（{result['segments']} 个文件）"
+        ))
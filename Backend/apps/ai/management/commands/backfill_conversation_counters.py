@@ -0,0 +1,52 @@
+"""
+Django管理命令：回填对话的消息数和最后消息时间
+使用方法：python manage.py backfill_conversation_counters [--batch-size 1000]
+"""
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from apps.ai.models import ChatConversation, ChatMessage
+
+
+class Command(BaseCommand):
+    help = '根据聊天消息回填对话的 message_count 和 last_message_at'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='每批更新的对话数（默认：1000）'
+        )
+        parser.add_argument(
+            '--start-id',
+            type=int,
+            default=0,
+            help='从该对话ID开始（用于中断后继续）'
+        )
+
+    def handle(self, *args, **options):
+        """按主键分批执行 UPDATE ... SET = (子查询)，每批一条语句，不把消息读入内存"""
+        batch_size = options['batch_size']
+        messages = ChatMessage.objects.filter(conversation=OuterRef('pk')).order_by().values('conversation')
+        message_count = Subquery(messages.annotate(count=Count('id')).values('count'), output_field=IntegerField())
+        last_message_at = Subquery(messages.annotate(last=Max('created_at')).values('last'))
+
+        last_id = options['start_id'] - 1
+        updated = 0
+        while True:
+            ids = list(
+                ChatConversation.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            updated += ChatConversation.objects.filter(pk__gte=ids[0], pk__lte=ids[-1]).update(
+                message_count=Coalesce(message_count, 0),
+                last_message_at=last_message_at
+            )
+            last_id = ids[-1]
+            self.stdout.write(f'已回填至对话 {last_id}（共 {updated} 个）')
+
+        self.stdout.write(self.style.SUCCESS(f'回填完成，共更新 {updated} 个对话'))
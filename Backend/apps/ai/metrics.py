@@ -0,0 +1,120 @@
+"""
+AI服务提供商调用指标的跨进程汇总
+
+调用指标（server.telemetry）在各工作进程内分别统计。发布器由后台线程每隔 AI_METRICS_PUBLISH_INTERVAL 秒
+把本进程可合并的指标状态写入共享缓存（每个进程一个键，过期时间为若干个发布间隔），并登记在工作进程列表中；
+指标接口合并所有未过期的进程状态后导出，从任一进程抓取都得到全部进程的汇总。退出的进程在其键过期后不再计入。
+"""
+import atexit
+import os
+import socket
+import threading
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import caches
+import logging
+
+from server.telemetry import ProviderTelemetry, get_provider_telemetry
+
+logger = logging.getLogger(__name__)
+
+METRICS_PUBLISH_INTERVAL = getattr(settings, 'AI_METRICS_PUBLISH_INTERVAL', 15)
+METRICS_CACHE_ALIAS = getattr(settings, 'AI_METRICS_CACHE_ALIAS', 'default')
+METRICS_KEY_PREFIX = 'ai:metrics:'
+# 进程状态的过期时间（发布间隔的倍数）
+METRICS_STATE_TTL_FACTOR = 4
+
+
+def _state_key(worker_id: str) -> str:
+    return f"{METRICS_KEY_PREFIX}worker:{worker_id}"
+
+
+def _workers_key() -> str:
+    return f"{METRICS_KEY_PREFIX}workers"
+
+
+class TelemetryPublisher:
+    """定期把本进程的指标状态发布到共享缓存"""
+
+    def __init__(self, interval: float = METRICS_PUBLISH_INTERVAL, cache_alias: str = METRICS_CACHE_ALIAS):
+        self.interval = interval
+        self.cache_alias = cache_alias
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @property
+    def ttl(self) -> int:
+        return max(int(self.interval * METRICS_STATE_TTL_FACTOR), 1)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='ai-metrics-publish', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.publish()
+            except Exception as e:
+                logger.error(f"发布AI调用指标失败: {str(e)}")
+
+    def publish(self):
+        """写入本进程的指标状态；工作进程列表只在本进程不在列表中时更新，并顺带移除状态已过期的进程"""
+        cache = caches[self.cache_alias]
+        cache.set(_state_key(self.worker_id), get_provider_telemetry().export_state(), self.ttl)
+        workers = cache.get(_workers_key()) or []
+        if self.worker_id in workers:
+            return
+        alive = cache.get_many([_state_key(worker_id) for worker_id in workers])
+        workers = [worker_id for worker_id in workers if _state_key(worker_id) in alive]
+        workers.append(self.worker_id)
+        cache.set(_workers_key(), workers, None)
+
+    def stop(self):
+        self._stopped.set()
+
+
+_publisher: Optional[TelemetryPublisher] = None
+_publisher_lock = threading.Lock()
+
+
+def get_telemetry_publisher() -> TelemetryPublisher:
+    """获取本进程的指标发布器"""
+    global _publisher
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                _publisher = TelemetryPublisher()
+    return _publisher
+
+
+def start_telemetry_publisher():
+    """启动本进程的指标发布（重复调用无副作用）；发布失败不影响调用"""
+    try:
+        get_telemetry_publisher().start()
+    except Exception as e:
+        logger.error(f"启动AI调用指标发布失败: {str(e)}")
+
+
+def collect_provider_telemetry() -> ProviderTelemetry:
+    """合并所有工作进程的指标（本进程使用实时数据，其余进程使用最近一次发布的状态）"""
+    publisher = get_telemetry_publisher()
+    local = get_provider_telemetry()
+    telemetry = ProviderTelemetry(local.namespace, local.significant_figures)
+    telemetry.merge_state(local.export_state())
+    try:
+        cache = caches[publisher.cache_alias]
+        workers = [worker_id for worker_id in cache.get(_workers_key()) or [] if worker_id != publisher.worker_id]
+        states = cache.get_many([_state_key(worker_id) for worker_id in workers])
+    except Exception as e:
+        logger.error(f"读取其他进程的AI调用指标失败: {str(e)}")
+        return telemetry
+    for state in states.values():
+        telemetry.merge_state(state)
+    return telemetry
@@ -0,0 +1,171 @@
+# Generated by Django 4.2.7 on 2026-10-17 10:00
+
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ai", "0002_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BatchJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="创建时间"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新时间"),
+                ),
+                (
+                    "is_active",
+                    models.BooleanField(default=True, verbose_name="激活状态"),
+                ),
+                (
+                    "name",
+                    models.CharField(blank=True, max_length=200, verbose_name="任务名称"),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "等待中"),
+                            ("running", "运行中"),
+                            ("completed", "已完成"),
+                            ("failed", "失败"),
+                            ("cancelled", "已取消"),
+                        ],
+                        default="pending",
+                        max_length=20,
+                        verbose_name="状态",
+                    ),
+                ),
+                (
+                    "input_file",
+                    models.FileField(
+                        upload_to="ai/batches/input/%Y/%m/", verbose_name="输入文件"
+                    ),
+                ),
+                (
+                    "output_file",
+                    models.FileField(
+                        blank=True,
+                        upload_to="ai/batches/output/%Y/%m/",
+                        verbose_name="输出文件",
+                    ),
+                ),
+                (
+                    "parameters",
+                    models.JSONField(blank=True, default=dict, verbose_name="请求参数"),
+                ),
+                (
+                    "concurrency",
+                    models.PositiveIntegerField(
+                        default=8,
+                        validators=[
+                            django.core.validators.MinValueValidator(1),
+                            django.core.validators.MaxValueValidator(64),
+                        ],
+                        verbose_name="并发数",
+                    ),
+                ),
+                (
+                    "total_items",
+                    models.PositiveIntegerField(default=0, verbose_name="请求总数"),
+                ),
+                (
+                    "processed_items",
+                    models.PositiveIntegerField(default=0, verbose_name="已处理数"),
+                ),
+                (
+                    "succeeded_items",
+                    models.PositiveIntegerField(default=0, verbose_name="成功数"),
+                ),
+                (
+                    "failed_items",
+                    models.PositiveIntegerField(default=0, verbose_name="失败数"),
+                ),
+                (
+                    "total_tokens",
+                    models.PositiveBigIntegerField(default=0, verbose_name="总Token数"),
+                ),
+                (
+                    "total_cost",
+                    models.DecimalField(
+                        decimal_places=4,
+                        default=0.0,
+                        max_digits=12,
+                        verbose_name="总成本",
+                    ),
+                ),
+                (
+                    "checkpoint_offset",
+                    models.PositiveBigIntegerField(
+                        default=0, verbose_name="输出文件断点偏移"
+                    ),
+                ),
+                (
+                    "task_id",
+                    models.CharField(blank=True, max_length=255, verbose_name="Celery任务ID"),
+                ),
+                (
+                    "error_message",
+                    models.TextField(blank=True, verbose_name="错误信息"),
+                ),
+                (
+                    "started_at",
+                    models.DateTimeField(blank=True, null=True, verbose_name="开始时间"),
+                ),
+                (
+                    "completed_at",
+                    models.DateTimeField(blank=True, null=True, verbose_name="完成时间"),
+                ),
+                (
+                    "ai_model",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="batch_jobs",
+                        to="ai.aimodel",
+                        verbose_name="AI模型",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ai_batch_jobs",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="用户",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "批量推理任务",
+                "verbose_name_plural": "批量推理任务",
+                "db_table": "ai_batch_jobs",
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["user", "status"], name="ai_batch_jo_user_id_090235_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ai", "0003_batchjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatconversation",
+            name="last_message_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="最后消息时间"
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatconversation",
+            name="message_count",
+            field=models.PositiveIntegerField(default=0, verbose_name="消息数"),
+        ),
+        migrations.AddIndex(
+            model_name="chatconversation",
+            index=models.Index(
+                fields=["user", "is_active", "-updated_at"],
+                name="ai_chat_con_user_id_a6a6cb_idx",
+            ),
+        ),
+    ]
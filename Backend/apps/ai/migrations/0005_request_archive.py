@@ -0,0 +1,97 @@
+# Generated by Django 4.2.7 on 2026-10-17 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ai", "0004_conversation_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AIRequestArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="创建时间"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新时间"),
+                ),
+                (
+                    "is_active",
+                    models.BooleanField(default=True, verbose_name="激活状态"),
+                ),
+                ("month", models.DateField(verbose_name="归档月份")),
+                ("path", models.CharField(max_length=500, verbose_name="文件路径")),
+                (
+                    "file_format",
+                    models.CharField(
+                        choices=[
+                            ("jsonl.zst", "JSONL（zstd压缩）"),
+                            ("jsonl.gz", "JSONL（gzip压缩）"),
+                        ],
+                        max_length=20,
+                        verbose_name="文件格式",
+                    ),
+                ),
+                (
+                    "first_request_id",
+                    models.BigIntegerField(verbose_name="起始请求ID"),
+                ),
+                (
+                    "last_request_id",
+                    models.BigIntegerField(verbose_name="结束请求ID"),
+                ),
+                ("start_time", models.DateTimeField(verbose_name="最早创建时间")),
+                ("end_time", models.DateTimeField(verbose_name="最晚创建时间")),
+                (
+                    "row_count",
+                    models.PositiveIntegerField(default=0, verbose_name="请求数"),
+                ),
+                (
+                    "file_size",
+                    models.PositiveBigIntegerField(
+                        default=0, verbose_name="文件大小(字节)"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "AI请求归档",
+                "verbose_name_plural": "AI请求归档",
+                "db_table": "ai_request_archives",
+                "ordering": ["-month", "-first_request_id"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="airequest",
+            index=models.Index(
+                fields=["created_at"], name="ai_requests_created_518c4b_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="airequestarchive",
+            index=models.Index(
+                fields=["first_request_id", "last_request_id"],
+                name="ai_request__first_r_20c906_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="airequestarchive",
+            index=models.Index(
+                fields=["start_time", "end_time"], name="ai_request__start_t_578878_idx"
+            ),
+        ),
+    ]
@@ -168,6 +168,7 @@ class AIRequest(BaseModel):
         indexes = [
             models.Index(fields=['user', 'status']),
             models.Index(fields=['ai_model', 'created_at']),
+            models.Index(fields=['created_at']),
         ]
 
     def __str__(self):
@@ -233,12 +234,25 @@ class ChatConversation(BaseModel):
         default=False,
         verbose_name='已归档'
     )
+    # 由 chat_message_created 信号原子维护，列表页无需逐行统计消息
+    message_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='消息数'
+    )
+    last_message_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='最后消息时间'
+    )
 
     class Meta:
         verbose_name = '聊天对话'
         verbose_name_plural = '聊天对话'
         db_table = 'ai_chat_conversations'
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['user', 'is_active', '-updated_at']),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.title}"
@@ -361,10 +375,12 @@ class AITemplate(BaseModel):
     def __str__(self):
         return self.name
 
-    def increment_usage(self):
-        """增加使用次数"""
-        self.usage_count += 1
-        self.save(update_fields=['usage_count'])
+    def increment_usage(self, count=1):
+        """增加使用次数（在进程内累计，定期批量写入数据库）"""
+        from .templating import get_template_usage_counter
+
+        self.usage_count += count
+        get_template_usage_counter().add(self.pk, count)
 
 
 class AIUsageStats(BaseModel):
@@ -419,29 +435,194 @@ class AIUsageStats(BaseModel):
 
     @classmethod
     def record_usage(cls, user, ai_model, tokens=0, cost=0, success=True):
-        """记录使用情况"""
-        today = timezone.now().date()
-        stats, created = cls.objects.get_or_create(
-            user=user,
-            ai_model=ai_model,
-            date=today,
-            defaults={
-                'request_count': 0,
-                'token_count': 0,
-                'total_cost': 0,
-                'success_count': 0,
-                'error_count': 0,
-            }
-        )
-
-        stats.request_count += 1
-        stats.token_count += tokens
-        stats.total_cost += cost
-
-        if success:
-            stats.success_count += 1
-        else:
-            stats.error_count += 1
-
-        stats.save()
-        return stats
+        """记录使用情况（只写入使用事件缓冲区，由 flush_ai_usage 任务汇总后累加到统计表）"""
+        from .usage import record_usage_event
+        record_usage_event(user, ai_model, tokens=tokens, cost=cost, success=success)
+
+
+class BatchJob(BaseModel):
+    """批量推理任务
+
+    输入为JSONL文件，每行一个请求；结果按输入顺序写入输出JSONL文件。
+    每处理完一段请求就记录断点（已完成的行数及输出文件偏移量），任务中断后可从断点继续。
+    """
+    STATUS_CHOICES = [
+        ('pending', '等待中'),
+        ('running', '运行中'),
+        ('completed', '已完成'),
+        ('failed', '失败'),
+        ('cancelled', '已取消'),
+    ]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='ai_batch_jobs',
+        verbose_name='用户'
+    )
+    ai_model = models.ForeignKey(
+        AIModel,
+        on_delete=models.CASCADE,
+        related_name='batch_jobs',
+        verbose_name='AI模型'
+    )
+    name = models.CharField(
+        max_length=200,
+        blank=True,
+        verbose_name='任务名称'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name='状态'
+    )
+    input_file = models.FileField(
+        upload_to='ai/batches/input/%Y/%m/',
+        verbose_name='输入文件'
+    )
+    output_file = models.FileField(
+        upload_to='ai/batches/output/%Y/%m/',
+        blank=True,
+        verbose_name='输出文件'
+    )
+    parameters = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='请求参数'
+    )
+    concurrency = models.PositiveIntegerField(
+        default=8,
+        validators=[MinValueValidator(1), MaxValueValidator(64)],
+        verbose_name='并发数'
+    )
+    total_items = models.PositiveIntegerField(
+        default=0,
+        verbose_name='请求总数'
+    )
+    processed_items = models.PositiveIntegerField(
+        default=0,
+        verbose_name='已处理数'
+    )
+    succeeded_items = models.PositiveIntegerField(
+        default=0,
+        verbose_name='成功数'
+    )
+    failed_items = models.PositiveIntegerField(
+        default=0,
+        verbose_name='失败数'
+    )
+    total_tokens = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='总Token数'
+    )
+    total_cost = models.DecimalField(
+        max_digits=12,
+        decimal_places=4,
+        default=0.0000,
+        verbose_name='总成本'
+    )
+    checkpoint_offset = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='输出文件断点偏移'
+    )
+    task_id = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name='Celery任务ID'
+    )
+    error_message = models.TextField(
+        blank=True,
+        verbose_name='错误信息'
+    )
+    started_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='开始时间'
+    )
+    completed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='完成时间'
+    )
+
+    class Meta:
+        verbose_name = '批量推理任务'
+        verbose_name_plural = '批量推理任务'
+        db_table = 'ai_batch_jobs'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'status']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.name or self.id} ({self.status})"
+
+    @property
+    def progress(self):
+        """处理进度（百分比）"""
+        if not self.total_items:
+            return 0
+        return round(self.processed_items / self.total_items * 100, 2)
+
+    def is_finished(self):
+        """是否已结束（完成、失败或取消）"""
+        return self.status in ('completed', 'failed', 'cancelled')
+
+
+class AIRequestArchive(BaseModel):
+    """AI请求归档段
+
+    超过保留期的AI请求按月写入压缩的JSONL文件（每个文件为一段），从请求表中删除；
+    这里记录每段的文件位置、ID范围和时间范围，按ID或时间查询归档时先据此定位文件。
+    """
+    FORMAT_CHOICES = [
+        ('jsonl.zst', 'JSONL（zstd压缩）'),
+        ('jsonl.gz', 'JSONL（gzip压缩）'),
+    ]
+
+    month = models.DateField(
+        verbose_name='归档月份'
+    )
+    path = models.CharField(
+        max_length=500,
+        verbose_name='文件路径'
+    )
+    file_format = models.CharField(
+        max_length=20,
+        choices=FORMAT_CHOICES,
+        verbose_name='文件格式'
+    )
+    first_request_id = models.BigIntegerField(
+        verbose_name='起始请求ID'
+    )
+    last_request_id = models.BigIntegerField(
+        verbose_name='结束请求ID'
+    )
+    start_time = models.DateTimeField(
+        verbose_name='最早创建时间'
+    )
+    end_time = models.DateTimeField(
+        verbose_name='最晚创建时间'
+    )
+    row_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='请求数'
+    )
+    file_size = models.PositiveBigIntegerField(
+        default=0,
+        verbose_name='文件大小(字节)'
+    )
+
+    class Meta:
+        verbose_name = 'AI请求归档'
+        verbose_name_plural = 'AI请求归档'
+        db_table = 'ai_request_archives'
+        ordering = ['-month', '-first_request_id']
+        indexes = [
+            models.Index(fields=['first_request_id', 'last_request_id']),
+            models.Index(fields=['start_time', 'end_time']),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} #{self.first_request_id}-{self.last_request_id} ({self.row_count})"
@@ -0,0 +1,139 @@
+"""
+AIModel 到 AIManager 提供商的解析
+
+AIModel.configuration 约定::
+
+    {
+        "provider": "SILICONFLOW",        # 提供商类型（AIManager.provider_classes 中的名称）
+        "model": "Qwen/Qwen3-8B",         # 上游模型名，默认为 AIModel.name
+        "max_concurrent": 8,              # 并发上限（与 max_requests_per_minute 一起设置速率限制）
+        "priority": 0,                    # 速率限制排队优先级
+        "provider_options": {...}         # 创建提供商实例的其他参数，如千帆的 secret_key、连接池大小
+    }
+
+填写了 api_key 的模型使用自己的提供商实例（api_endpoint + api_key + provider_options），
+按模型缓存；未填写时使用按提供商类型全局注册的实例。
+"""
+import hashlib
+import json
+import threading
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+
+from .metrics import start_telemetry_publisher
+from server.ai_manager import get_ai_manager
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 按模型注册的提供商名称前缀
+MODEL_PROVIDER_PREFIX = 'model:'
+
+
+class ModelProviderError(Exception):
+    """AI模型无法解析为可用的服务提供商"""
+
+
+class ModelRoute(NamedTuple):
+    """AI模型对应的提供商调用参数"""
+    provider_name: str
+    model: str
+    priority: int
+
+
+class ModelProviderRegistry:
+    """按 AIModel 缓存解析结果和提供商实例
+
+    缓存项带有模型配置的指纹（更新时间、端点、密钥、配置、速率限制），每次解析时比较：
+    本进程保存模型时由信号立即失效，其他进程中的缓存在下次请求读到新的模型记录时重建。
+    """
+
+    def __init__(self, ai_manager=None):
+        self.ai_manager = ai_manager or get_ai_manager()
+        if self.ai_manager.rate_limiter is None:
+            # 模型的 max_requests_per_minute 是全局预算：配置了Redis时由所有工作进程共享
+            self.ai_manager.configure_rate_limiter(redis_url=getattr(settings, 'AI_RATE_LIMIT_REDIS_URL', None) or None)
+        response_cache_config = getattr(settings, 'AI_RESPONSE_CACHE', None)
+        if self.ai_manager.response_cache is None and response_cache_config:
+            self.ai_manager.configure_response_cache(**response_cache_config)
+        # 各工作进程定期发布调用指标，供指标接口汇总
+        start_telemetry_publisher()
+        self._routes: Dict[int, Tuple[str, ModelRoute]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(ai_model) -> str:
+        raw = json.dumps(
+            [ai_model.updated_at, ai_model.api_endpoint, ai_model.api_key, ai_model.configuration,
+             ai_model.max_requests_per_minute],
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def resolve(self, ai_model) -> ModelRoute:
+        """解析AI模型对应的提供商，首次解析或模型变更后注册提供商实例并同步速率限制"""
+        fingerprint = self.fingerprint(ai_model)
+        cached = self._routes.get(ai_model.pk)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+
+        with self._lock:
+            cached = self._routes.get(ai_model.pk)
+            if cached is not None and cached[0] == fingerprint:
+                return cached[1]
+            route = self._build_route(ai_model)
+            self._routes[ai_model.pk] = (fingerprint, route)
+            return route
+
+    def _build_route(self, ai_model) -> ModelRoute:
+        configuration = ai_model.configuration or {}
+        provider_type = configuration.get('provider')
+        if not provider_type:
+            raise ModelProviderError('AI模型未配置服务提供商')
+
+        if ai_model.api_key:
+            provider_name = f"{MODEL_PROVIDER_PREFIX}{ai_model.pk}"
+            options = {**configuration.get('provider_options', {}), 'provider_type': provider_type,
+                       'name': provider_type}
+            if not self.ai_manager.register_provider(provider_name, ai_model.api_key, ai_model.api_endpoint,
+                                                     **options):
+                raise ModelProviderError(f'AI服务提供商注册失败: {provider_type}')
+        else:
+            provider_name = provider_type
+            if self.ai_manager.get_provider(provider_name) is None:
+                raise ModelProviderError(f'AI服务提供商未注册: {provider_type}')
+
+        route = ModelRoute(
+            provider_name=provider_name,
+            model=configuration.get('model', ai_model.name),
+            priority=configuration.get('priority', 0)
+        )
+        if ai_model.max_requests_per_minute or configuration.get('max_concurrent'):
+            self.ai_manager.set_rate_limit(
+                route.provider_name, route.model, ai_model.max_requests_per_minute or None,
+                configuration.get('max_concurrent')
+            )
+        return route
+
+    def invalidate(self, model_id: int):
+        """模型变更或删除后丢弃缓存，并注销按模型注册的提供商实例"""
+        with self._lock:
+            self._routes.pop(model_id, None)
+            self.ai_manager.unregister_provider(f"{MODEL_PROVIDER_PREFIX}{model_id}")
+
+
+_registry: Optional[ModelProviderRegistry] = None
+
+
+def get_model_providers() -> ModelProviderRegistry:
+    """获取AI模型提供商解析器"""
+    global _registry
+    if _registry is None:
+        _registry = ModelProviderRegistry()
+    return _registry
+
+
+def resolve_model(ai_model) -> ModelRoute:
+    """解析AI模型对应的提供商调用参数"""
+    return get_model_providers().resolve(ai_model)
@@ -0,0 +1,153 @@
+"""
+AI请求记录的缓冲写入
+
+接口在请求结束后才把完整的 AIRequest（未保存的实例）交给写入器，由后台线程按批 bulk_create 写入，
+每个请求只插入一次，请求路径上不等待数据库。记录在写入后（至多 AI_REQUEST_WRITER_FLUSH_INTERVAL 秒）
+才出现在请求列表中，created_at 为写入时间。
+"""
+import atexit
+import threading
+from collections import deque
+from typing import List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+import logging
+
+logger = logging.getLogger(__name__)
+
+REQUEST_WRITER_FLUSH_INTERVAL = getattr(settings, 'AI_REQUEST_WRITER_FLUSH_INTERVAL', 1.0)
+REQUEST_WRITER_BATCH_SIZE = getattr(settings, 'AI_REQUEST_WRITER_BATCH_SIZE', 500)
+REQUEST_WRITER_MAX_PENDING = getattr(settings, 'AI_REQUEST_WRITER_MAX_PENDING', 100000)
+
+
+def write_requests(requests: List) -> int:
+    """批量插入请求记录，并补写逐条保存时由 post_save 信号记录的系统日志"""
+    from apps.core.models import SystemLog
+    from .models import AIRequest
+
+    if not requests:
+        return 0
+    with transaction.atomic():
+        AIRequest.objects.bulk_create(requests, batch_size=REQUEST_WRITER_BATCH_SIZE)
+        SystemLog.objects.bulk_create([
+            SystemLog(
+                level='info',
+                module='ai',
+                action='request_created',
+                message=f'用户 {ai_request.user.username} 创建了AI请求',
+                user=ai_request.user,
+                extra_data={'ai_model': ai_request.ai_model.name, 'request_type': ai_request.request_type}
+            )
+            for ai_request in requests
+        ], batch_size=REQUEST_WRITER_BATCH_SIZE)
+    cache.delete('available_ai_models')
+    return len(requests)
+
+
+class AIRequestWriter:
+    """进程内缓冲：积累到 batch_size 条或每隔 flush_interval 秒由后台线程写入，进程退出前再写入一次
+
+    缓冲区超过 max_pending 条时丢弃最早的记录；进程被强制终止时会丢失尚未写入的记录。
+    """
+
+    def __init__(self, batch_size: int = REQUEST_WRITER_BATCH_SIZE,
+                 flush_interval: float = REQUEST_WRITER_FLUSH_INTERVAL,
+                 max_pending: int = REQUEST_WRITER_MAX_PENDING):
+        self.pending: deque = deque(maxlen=max_pending)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._wakeup = threading.Event()
+
+    def add(self, ai_request):
+        with self._lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(ai_request)
+            full = len(self.pending) >= self.batch_size
+        if self._thread is None:
+            self._start()
+        if full:
+            self._wakeup.set()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='ai-request-writer', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"写入AI请求记录失败: {str(e)}")
+
+    def flush(self) -> int:
+        """写入缓冲区中的请求记录，返回写入的条数；写入失败的记录放回缓冲区"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+                if not batch:
+                    return written
+                try:
+                    write_requests(batch)
+                except Exception:
+                    # 事务已回滚，清除 bulk_create 可能已设置的主键后重新排队
+                    for ai_request in batch:
+                        ai_request.pk = None
+                        ai_request._state.adding = True
+                    with self._lock:
+                        self.pending.extendleft(reversed(batch))
+                    raise
+                written += len(batch)
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"写入AI请求记录失败: {str(e)}")
+
+    def __len__(self):
+        return len(self.pending)
+
+
+_request_writer: Optional[AIRequestWriter] = None
+_request_writer_lock = threading.Lock()
+
+
+def get_request_writer() -> AIRequestWriter:
+    """获取AI请求记录写入器"""
+    global _request_writer
+    if _request_writer is None:
+        with _request_writer_lock:
+            if _request_writer is None:
+                _request_writer = AIRequestWriter()
+    return _request_writer
+
+
+def record_request(ai_request):
+    """提交一条已结束的请求记录（只写入缓冲区）；失败时记录日志并丢弃，不影响请求本身"""
+    try:
+        get_request_writer().add(ai_request)
+    except Exception as e:
+        logger.error(f"记录AI请求失败: {str(e)}")
+
+
+def flush_requests() -> int:
+    """立即写入缓冲区中的请求记录，返回写入的条数"""
+    return get_request_writer().flush()
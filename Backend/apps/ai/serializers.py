@@ -2,11 +2,16 @@ from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import (
     AIModel, AIRequest, ChatConversation, ChatMessage,
-    AITemplate, AIUsageStats
+    AITemplate, AIUsageStats, BatchJob
 )
+from .batch import BATCH_ITEM_PARAMS, validate_batch_file
+from .templating import get_compiled_template
 
 User = get_user_model()
 
+# 一次批量渲染的最大变量组数
+TEMPLATE_BATCH_MAX_ITEMS = 1000
+
 
 class AIModelSerializer(serializers.ModelSerializer):
     """AI模型序列化器"""
@@ -40,6 +45,25 @@ class AIRequestSerializer(serializers.ModelSerializer):
         ]
 
 
+class ArchivedAIRequestSerializer(serializers.Serializer):
+    """已归档AI请求序列化器（字段与 AIRequestSerializer 一致）"""
+    id = serializers.IntegerField()
+    user = serializers.CharField()
+    ai_model = serializers.IntegerField(source='ai_model_id')
+    ai_model_name = serializers.CharField(allow_null=True)
+    request_type = serializers.CharField()
+    input_data = serializers.JSONField()
+    output_data = serializers.JSONField(allow_null=True)
+    status = serializers.CharField()
+    processing_time = serializers.FloatField(allow_null=True)
+    cost = serializers.DecimalField(max_digits=10, decimal_places=4)
+    error_message = serializers.CharField(allow_blank=True)
+    metadata = serializers.JSONField()
+    created_at = serializers.DateTimeField()
+    updated_at = serializers.DateTimeField()
+    archived = serializers.BooleanField(default=True)
+
+
 class AIRequestCreateSerializer(serializers.ModelSerializer):
     """AI请求创建序列化器"""
 
@@ -76,25 +100,20 @@ class ChatConversationSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
     ai_model_name = serializers.CharField(source='ai_model.name', read_only=True)
     messages = ChatMessageSerializer(many=True, read_only=True)
-    message_count = serializers.SerializerMethodField()
 
     class Meta:
         model = ChatConversation
         fields = [
             'id', 'user', 'ai_model', 'ai_model_name', 'title',
             'system_prompt', 'total_tokens', 'total_cost',
-            'is_archived', 'message_count', 'messages',
+            'is_archived', 'message_count', 'last_message_at', 'messages',
             'created_at', 'updated_at'
         ]
         read_only_fields = [
             'id', 'user', 'ai_model_name', 'total_tokens', 'total_cost',
-            'message_count', 'created_at', 'updated_at'
+            'message_count', 'last_message_at', 'created_at', 'updated_at'
         ]
 
-    def get_message_count(self, obj):
-        """获取消息数量"""
-        return obj.messages.count()
-
     def create(self, validated_data):
         """创建对话"""
         validated_data['user'] = self.context['request'].user
@@ -102,10 +121,9 @@ class ChatConversationSerializer(serializers.ModelSerializer):
 
 
 class ChatConversationListSerializer(serializers.ModelSerializer):
-    """聊天对话列表序列化器（简化版）"""
-    ai_model_name = serializers.CharField(source='ai_model.name', read_only=True)
-    message_count = serializers.SerializerMethodField()
-    last_message_time = serializers.SerializerMethodField()
+    """聊天对话列表序列化器（简化版，ai_model_name 由列表查询 annotate 提供）"""
+    ai_model_name = serializers.CharField(read_only=True)
+    last_message_time = serializers.DateTimeField(source='last_message_at', read_only=True)
 
     class Meta:
         model = ChatConversation
@@ -115,15 +133,6 @@ class ChatConversationListSerializer(serializers.ModelSerializer):
             'last_message_time', 'created_at', 'updated_at'
         ]
 
-    def get_message_count(self, obj):
-        """获取消息数量"""
-        return obj.messages.count()
-
-    def get_last_message_time(self, obj):
-        """获取最后消息时间"""
-        last_message = obj.messages.last()
-        return last_message.created_at if last_message else None
-
 
 class SendMessageSerializer(serializers.Serializer):
     """发送消息序列化器"""
@@ -154,12 +163,13 @@ class AITemplateSerializer(serializers.ModelSerializer):
     """AI模板序列化器"""
     creator = serializers.StringRelatedField(read_only=True)
     ai_model_name = serializers.CharField(source='ai_model.name', read_only=True)
+    placeholders = serializers.SerializerMethodField()
 
     class Meta:
         model = AITemplate
         fields = [
             'id', 'name', 'template_type', 'description', 'content',
-            'variables', 'ai_model', 'ai_model_name', 'creator',
+            'variables', 'placeholders', 'ai_model', 'ai_model_name', 'creator',
             'is_public', 'usage_count', 'created_at', 'updated_at'
         ]
         read_only_fields = [
@@ -167,6 +177,10 @@ class AITemplateSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
 
+    def get_placeholders(self, obj):
+        """模板内容中出现的变量名（按首次出现的顺序）"""
+        return list(get_compiled_template(obj).names)
+
     def create(self, validated_data):
         """创建模板"""
         validated_data['creator'] = self.context['request'].user
@@ -324,8 +338,71 @@ class TemplateRenderSerializer(serializers.Serializer):
         try:
             template = AITemplate.objects.get(id=value, is_active=True)
             # 检查是否有权限访问
-            if not template.is_public and template.creator != self.context['request'].user:
+            if not template.is_public and template.creator_id != self.context['request'].user.pk:
                 raise serializers.ValidationError("无权限访问此模板")
             return template
         except AITemplate.DoesNotExist:
             raise serializers.ValidationError("模板不存在")
+
+
+class TemplateBatchRenderSerializer(TemplateRenderSerializer):
+    """模板批量渲染序列化器"""
+    variables = None
+    variables_list = serializers.ListField(
+        child=serializers.DictField(),
+        min_length=1,
+        max_length=TEMPLATE_BATCH_MAX_ITEMS
+    )
+
+
+class BatchJobSerializer(serializers.ModelSerializer):
+    """批量推理任务序列化器"""
+    ai_model_name = serializers.CharField(source='ai_model.name', read_only=True)
+    progress = serializers.ReadOnlyField()
+
+    class Meta:
+        model = BatchJob
+        fields = [
+            'id', 'name', 'ai_model', 'ai_model_name', 'status', 'parameters',
+            'concurrency', 'total_items', 'processed_items', 'succeeded_items',
+            'failed_items', 'progress', 'total_tokens', 'total_cost',
+            'error_message', 'started_at', 'completed_at', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+
+class BatchJobCreateSerializer(serializers.ModelSerializer):
+    """批量推理任务创建序列化器（上传JSONL文件，每行一个请求）"""
+
+    class Meta:
+        model = BatchJob
+        fields = ['name', 'ai_model', 'input_file', 'parameters', 'concurrency']
+
+    def validate_ai_model(self, value):
+        """验证AI模型是否可用"""
+        if not value.is_available():
+            raise serializers.ValidationError("选择的AI模型当前不可用")
+        return value
+
+    def validate_parameters(self, value):
+        """验证请求参数"""
+        unknown = set(value) - set(BATCH_ITEM_PARAMS)
+        if unknown:
+            raise serializers.ValidationError(f"不支持的参数: {', '.join(sorted(unknown))}")
+        return value
+
+    def validate_input_file(self, value):
+        """校验JSONL文件格式并统计请求数"""
+        count, errors = validate_batch_file(value)
+        if errors:
+            raise serializers.ValidationError(errors)
+        if not count:
+            raise serializers.ValidationError("文件中没有请求")
+        self.context['total_items'] = count
+        return value
+
+    def create(self, validated_data):
+        """创建任务"""
+        validated_data['user'] = self.context['request'].user
+        validated_data['total_items'] = self.context['total_items']
+        return super().create(validated_data)
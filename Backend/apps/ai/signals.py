@@ -1,8 +1,20 @@
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.core.cache import cache
+from django.db.models import F, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
 from apps.core.models import SystemLog
-from .models import AIRequest, ChatMessage, AIUsageStats
+from .models import AIModel, AIRequest, ChatConversation, ChatMessage
+from .providers import get_model_providers
+from .usage import record_usage_event
+
+
+@receiver(post_save, sender=AIModel)
+@receiver(post_delete, sender=AIModel)
+def ai_model_changed(sender, instance, **kwargs):
+    """AI模型变更或删除后，丢弃缓存的提供商实例"""
+    get_model_providers().invalidate(instance.pk)
 
 
 @receiver(post_save, sender=AIRequest)
@@ -28,23 +40,39 @@ def ai_request_created(sender, instance, created, **kwargs):
 def chat_message_created(sender, instance, created, **kwargs):
     """聊天消息创建后的处理"""
     if created:
-        # 更新对话的token和成本统计
-        conversation = instance.conversation
-        conversation.total_tokens += instance.tokens
-        conversation.total_cost += instance.cost
-        conversation.save(update_fields=['total_tokens', 'total_cost', 'updated_at'])
+        # 原子地累加对话的消息数、token和成本统计（不读取、不整行保存对话）
+        ChatConversation.objects.filter(pk=instance.conversation_id).update(
+            message_count=F('message_count') + 1,
+            last_message_at=Greatest(Coalesce('last_message_at', instance.created_at), instance.created_at),
+            total_tokens=F('total_tokens') + instance.tokens,
+            total_cost=F('total_cost') + instance.cost,
+            updated_at=timezone.now()
+        )
 
-        # 如果是AI回复，记录使用统计
+        # 如果是AI回复，记录使用事件（由 flush_ai_usage 任务写入统计表）
         if instance.role == 'assistant':
-            AIUsageStats.record_usage(
-                user=conversation.user,
-                ai_model=conversation.ai_model,
+            conversation = instance.conversation
+            record_usage_event(
+                user=conversation.user_id,
+                ai_model=conversation.ai_model_id,
                 tokens=instance.tokens,
                 cost=instance.cost,
                 success=True
             )
 
 
+@receiver(post_delete, sender=ChatMessage)
+def chat_message_deleted(sender, instance, **kwargs):
+    """聊天消息删除后的处理（最后消息时间取剩余消息中最新的一条）"""
+    last_message_at = ChatMessage.objects.filter(
+        conversation_id=instance.conversation_id
+    ).order_by('-created_at').values('created_at')[:1]
+    ChatConversation.objects.filter(pk=instance.conversation_id, message_count__gt=0).update(
+        message_count=F('message_count') - 1,
+        last_message_at=Subquery(last_message_at)
+    )
+
+
 @receiver(post_delete, sender=AIRequest)
 def ai_request_deleted(sender, instance, **kwargs):
     """AI请求删除后的处理"""
@@ -0,0 +1,73 @@
+"""
+Celery任务：AI批量推理相关后台任务
+"""
+
+import asyncio
+import logging
+from celery import shared_task
+
+from .batch import process_batch_job
+from .usage import flush_usage
+from .archive import archive_requests
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, name='run_ai_batch_job', acks_late=True, reject_on_worker_lost=True)
+def run_ai_batch_job(self, job_id):
+    """
+    执行批量推理任务
+
+    任务在工作进程异常退出后会被重新投递，并从上次的断点继续执行。
+
+    Args:
+        job_id (int): BatchJob ID
+
+    Returns:
+        dict: 任务执行结果
+    """
+    try:
+        logger.info(f"开始执行批量推理任务 {job_id} - Task ID: {self.request.id}")
+        result = asyncio.run(process_batch_job(job_id))
+        result['task_id'] = self.request.id
+        return result
+
+    except Exception as e:
+        logger.error(f"批量推理任务异常: {job_id} - {e}")
+        return {
+            'status': 'error',
+            'job_id': job_id,
+            'message': f'任务执行异常: {str(e)}',
+            'task_id': self.request.id
+        }
+
+
+@shared_task(name='flush_ai_usage', ignore_result=True)
+def flush_ai_usage():
+    """
+    把使用事件缓冲区中的事件汇总写入 AIUsageStats（由 CELERY_BEAT_SCHEDULE 定期执行）
+
+    Returns:
+        int: 写入的事件数
+    """
+    flushed = flush_usage()
+    if flushed:
+        logger.info(f"已写入AI使用事件 {flushed} 条")
+    return flushed
+
+
+@shared_task(name='archive_ai_requests', ignore_result=True)
+def archive_ai_requests(days=None):
+    """
+    把超过保留期的AI请求按月写入归档文件并从请求表删除（由 CELERY_BEAT_SCHEDULE 每天执行）
+
+    Args:
+        days (int): 保留天数，默认为 AI_REQUEST_ARCHIVE_DAYS
+
+    Returns:
+        dict: 归档的段数和请求数
+    """
+    result = archive_requests(days)
+    if result['requests']:
+        logger.info(f"已归档AI请求 {result['requests']} 条（{result['segments']} 个文件）")
+    return result
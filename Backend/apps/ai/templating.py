@@ -0,0 +1,211 @@
+"""
+AI模板的编译与渲染
+
+模板内容中的 {变量名} 为占位符，{{ 和 }} 表示字面的 { 和 }；没有对应变量的占位符原样保留。
+模板只在首次使用（或更新后）解析为片段列表，按 (模板ID, updated_at) 缓存在进程内；
+渲染时一次拼接所有片段，变量值中的花括号不会再被替换。
+
+AITemplate.variables 中声明的变量用于渲染前的校验::
+
+    ["topic", {"name": "tone", "default": "正式"}, {"name": "length", "required": true}]
+
+只有显式声明 "required": true 的变量为必填（已有模板中的字符串列表只是变量说明，不要求传入）；
+default 在未传入该变量时使用。默认值只从上述列表中的对象读取，variables 为字典（如 {"topic": "主题"}）时
+只作为变量说明，不提供默认值。
+
+与此前逐个变量 str.replace 的实现不同：{{name}} 现在渲染为字面的 {name}，而不是 {变量值}；
+需要在变量值两侧输出花括号时写作 {{{name}}}。
+"""
+import atexit
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+import logging
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_CACHE_SIZE = getattr(settings, 'AI_TEMPLATE_CACHE_SIZE', 1024)
+TEMPLATE_USAGE_FLUSH_INTERVAL = getattr(settings, 'AI_TEMPLATE_USAGE_FLUSH_INTERVAL', 10)
+
+# 变量名由字母、数字、下划线（含中文）、点和连字符组成，其余花括号内容（如JSON）按字面文本处理
+TOKEN_PATTERN = re.compile(r'\{\{|\}\}|\{(\w[\w.-]*)\}')
+
+
+class TemplateVariableError(Exception):
+    """缺少模板的必填变量"""
+
+    def __init__(self, missing: List[str]):
+        self.missing = missing
+        super().__init__(f"缺少必填变量: {', '.join(missing)}")
+
+
+class CompiledTemplate:
+    """解析后的模板：片段为 (文本, 变量名)，变量名为 None 时是字面文本，否则文本是占位符原文"""
+    __slots__ = ('segments', 'names', 'required', 'defaults')
+
+    def __init__(self, segments: List[Tuple[str, Optional[str]]], required: Tuple[str, ...],
+                 defaults: Dict[str, Any]):
+        self.segments = segments
+        self.names = tuple(dict.fromkeys(name for _, name in segments if name is not None))
+        self.required = required
+        self.defaults = defaults
+
+    def missing(self, variables: Dict[str, Any]) -> List[str]:
+        """未传入的必填变量"""
+        return [name for name in self.required if name not in variables]
+
+    def render(self, variables: Dict[str, Any]) -> str:
+        missing = self.missing(variables)
+        if missing:
+            raise TemplateVariableError(missing)
+        values = {**self.defaults, **variables} if self.defaults else variables
+        return ''.join(
+            text if name is None or name not in values else str(values[name])
+            for text, name in self.segments
+        )
+
+    def render_many(self, variable_sets: Iterable[Dict[str, Any]]) -> List[str]:
+        """渲染多组变量（先校验全部变量组，任何一组缺少必填变量都不渲染）"""
+        variable_sets = list(variable_sets)
+        for variables in variable_sets:
+            missing = self.missing(variables)
+            if missing:
+                raise TemplateVariableError(missing)
+        return [self.render(variables) for variables in variable_sets]
+
+
+def _parse_declarations(declared) -> Tuple[Tuple[str, ...], Dict[str, Any]]:
+    """从变量定义中取出必填变量和默认值（字典形式的定义只是变量说明）"""
+    if isinstance(declared, dict):
+        return (), {}
+    required, defaults = [], {}
+    for item in declared or []:
+        if not isinstance(item, dict) or not item.get('name'):
+            continue
+        if 'default' in item:
+            defaults[item['name']] = item['default']
+        elif item.get('required') is True:
+            required.append(item['name'])
+    return tuple(required), defaults
+
+
+def compile_template(content: str, declared=None) -> CompiledTemplate:
+    """把模板内容解析为片段列表（相邻的字面文本合并为一段）"""
+    segments: List[Tuple[str, Optional[str]]] = []
+    literal: List[str] = []
+    position = 0
+    for match in TOKEN_PATTERN.finditer(content):
+        literal.append(content[position:match.start()])
+        position = match.end()
+        token = match.group(0)
+        if match.group(1) is None:
+            literal.append(token[0])
+            continue
+        if literal:
+            segments.append((''.join(literal), None))
+            literal = []
+        segments.append((token, match.group(1)))
+    literal.append(content[position:])
+    text = ''.join(literal)
+    if text:
+        segments.append((text, None))
+    required, defaults = _parse_declarations(declared)
+    return CompiledTemplate(segments, required, defaults)
+
+
+_compiled_templates: 'OrderedDict[Tuple[int, Any], CompiledTemplate]' = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def get_compiled_template(template) -> CompiledTemplate:
+    """获取模板的编译结果（按模板ID和更新时间缓存，模板更新后自动重新编译）"""
+    key = (template.pk, template.updated_at)
+    with _compiled_lock:
+        compiled = _compiled_templates.get(key)
+        if compiled is not None:
+            _compiled_templates.move_to_end(key)
+            return compiled
+    compiled = compile_template(template.content, template.variables)
+    with _compiled_lock:
+        _compiled_templates[key] = compiled
+        while len(_compiled_templates) > TEMPLATE_CACHE_SIZE:
+            _compiled_templates.popitem(last=False)
+    return compiled
+
+
+class TemplateUsageCounter:
+    """模板使用次数的进程内计数器：后台线程定期用 F() 表达式累加到模板表，进程退出前再写入一次"""
+
+    def __init__(self, flush_interval: float = TEMPLATE_USAGE_FLUSH_INTERVAL):
+        self.counts: Counter = Counter()
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def add(self, template_id: int, count: int = 1):
+        with self._lock:
+            self.counts[template_id] += count
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='ai-template-usage-flush', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"写入模板使用次数失败: {str(e)}")
+
+    def flush(self) -> int:
+        """把累计的使用次数写入数据库，返回更新的模板数；写入失败的计数放回计数器"""
+        from .models import AITemplate
+
+        with self._flush_lock:
+            with self._lock:
+                counts, self.counts = self.counts, Counter()
+            if not counts:
+                return 0
+            try:
+                with transaction.atomic():
+                    for template_id, count in sorted(counts.items()):
+                        AITemplate.objects.filter(pk=template_id).update(usage_count=F('usage_count') + count)
+            except Exception:
+                with self._lock:
+                    self.counts.update(counts)
+                raise
+            return len(counts)
+
+    def stop(self):
+        self._stopped.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"写入模板使用次数失败: {str(e)}")
+
+
+_usage_counter: Optional[TemplateUsageCounter] = None
+_usage_counter_lock = threading.Lock()
+
+
+def get_template_usage_counter() -> TemplateUsageCounter:
+    """获取模板使用次数计数器"""
+    global _usage_counter
+    if _usage_counter is None:
+        with _usage_counter_lock:
+            if _usage_counter is None:
+                _usage_counter = TemplateUsageCounter()
+    return _usage_counter
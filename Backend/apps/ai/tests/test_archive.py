@@ -0,0 +1,103 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from apps.ai.archive import archive_requests, get_archived_request, iter_archived_requests, page_archived_requests
+from apps.ai.models import AIModel, AIRequest, AIRequestArchive
+from apps.core.models import SystemLog
+
+User = get_user_model()
+
+
+class AIRequestArchiveTests(TestCase):
+    """归档写入、按ID和时间范围读取、删除请求表中的记录"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.user = User.objects.create(username='archive-user')
+        self.other = User.objects.create(username='archive-other')
+        self.ai_model = AIModel.objects.create(
+            name='archive-model', model_type='chatbot', description='归档测试', api_endpoint='http://127.0.0.1/v1'
+        )
+        self.now = timezone.now()
+
+    def create_request(self, user, days_ago: float, **fields) -> AIRequest:
+        ai_request = AIRequest.objects.create(
+            user=user, ai_model=self.ai_model, request_type='text',
+            input_data={'messages': [{'role': 'user', 'content': f'第{days_ago}天'}]},
+            output_data={'content': '回复'}, status='completed', cost=Decimal('0.0125'), **fields
+        )
+        AIRequest.objects.filter(pk=ai_request.pk).update(created_at=self.now - timedelta(days=days_ago))
+        ai_request.refresh_from_db()
+        return ai_request
+
+    def test_round_trip_and_delete(self):
+        old = [self.create_request(self.user if index % 2 else self.other, 120 + index) for index in range(12)]
+        recent = self.create_request(self.user, 10)
+        logs_before = SystemLog.objects.count()
+
+        result = archive_requests(days=90, segment_rows=5)
+
+        self.assertEqual(result['requests'], len(old))
+        self.assertEqual(AIRequestArchive.objects.count(), result['segments'])
+        self.assertGreaterEqual(result['segments'], 3)
+        self.assertEqual(list(AIRequest.objects.values_list('pk', flat=True)), [recent.pk])
+        # 归档不写删除日志
+        self.assertEqual(SystemLog.objects.count(), logs_before)
+        for archive in AIRequestArchive.objects.all():
+            self.assertTrue(default_storage.exists(archive.path))
+
+        for original in old:
+            record = get_archived_request(original.pk)
+            self.assertEqual(record['user_id'], original.user_id)
+            self.assertEqual(record['input_data'], original.input_data)
+            self.assertEqual(record['output_data'], original.output_data)
+            self.assertEqual(record['cost'], original.cost)
+            self.assertEqual(record['created_at'], original.created_at)
+        self.assertIsNone(get_archived_request(old[0].pk, user_id=self.user.pk))
+        self.assertIsNone(get_archived_request(recent.pk))
+
+        # 再次归档没有可归档的请求
+        self.assertEqual(archive_requests(days=90), {'segments': 0, 'requests': 0})
+
+    def test_range_and_paging(self):
+        old = [self.create_request(self.user if index % 3 else self.other, 100 + index * 0.5) for index in range(30)]
+        archive_requests(days=90, segment_rows=7)
+
+        start, end = self.now - timedelta(days=120), self.now - timedelta(days=100)
+        expected = sorted(
+            (item for item in old if item.user_id == self.user.pk and start <= item.created_at < end),
+            key=lambda item: (item.created_at, item.pk), reverse=True
+        )
+        self.assertEqual(
+            sorted(record['id'] for record in iter_archived_requests(start, end, user_id=self.user.pk)),
+            sorted(item.pk for item in expected)
+        )
+
+        pages, before = [], None
+        while True:
+            page = page_archived_requests(start, end, user_id=self.user.pk, before=before, limit=4)
+            if not page:
+                break
+            pages.append([record['id'] for record in page])
+            before = (page[-1]['created_at'], page[-1]['id'])
+        self.assertTrue(all(len(page) <= 4 for page in pages))
+        self.assertEqual([pk for page in pages for pk in page], [item.pk for item in expected])
@@ -0,0 +1,160 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.ai.models import AIModel, ChatConversation, ChatMessage
+from apps.ai.views import ChatConversationListView
+
+User = get_user_model()
+
+
+class ConversationCounterTestMixin:
+
+    def setUp(self):
+        self.user = User.objects.create(username='counter-user')
+        self.ai_model = AIModel.objects.create(
+            name='counter-model', model_type='chatbot', description='计数测试', api_endpoint='http://127.0.0.1/v1'
+        )
+        self.now = timezone.now()
+
+    def create_conversation(self, **fields) -> ChatConversation:
+        return ChatConversation.objects.create(user=self.user, ai_model=self.ai_model, title='对话', **fields)
+
+    def create_message(self, conversation, minutes_ago: int = 0, role='user', **fields) -> ChatMessage:
+        message = ChatMessage.objects.create(conversation=conversation, role=role, content='你好', **fields)
+        created_at = self.now - timedelta(minutes=minutes_ago)
+        ChatMessage.objects.filter(pk=message.pk).update(created_at=created_at)
+        message.created_at = created_at
+        return message
+
+
+class ConversationCounterSignalTests(ConversationCounterTestMixin, TestCase):
+    """消息写入和删除时对话计数的原子更新"""
+
+    def test_message_created_updates_counters(self):
+        conversation = self.create_conversation()
+        with mock.patch('apps.ai.signals.record_usage_event') as record_usage_event:
+            ChatMessage.objects.create(conversation=conversation, role='user', content='问题', tokens=3)
+            message = ChatMessage.objects.create(
+                conversation=conversation, role='assistant', content='回答', tokens=7, cost=Decimal('0.02')
+            )
+        record_usage_event.assert_called_once_with(
+            user=self.user.pk, ai_model=self.ai_model.pk, tokens=7, cost=Decimal('0.02'), success=True
+        )
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.message_count, 2)
+        self.assertEqual(conversation.last_message_at, message.created_at)
+        self.assertEqual(conversation.total_tokens, 10)
+        self.assertEqual(conversation.total_cost, Decimal('0.02'))
+
+    def test_last_message_at_does_not_move_backwards(self):
+        conversation = self.create_conversation()
+        later = self.now + timedelta(minutes=5)
+        # 更晚创建的消息先提交
+        ChatConversation.objects.filter(pk=conversation.pk).update(last_message_at=later)
+
+        ChatMessage.objects.create(conversation=conversation, role='user', content='迟到')
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.message_count, 1)
+        self.assertEqual(conversation.last_message_at, later)
+
+    def test_message_deleted_updates_counters(self):
+        conversation = self.create_conversation()
+        first = self.create_message(conversation, minutes_ago=10)
+        last = self.create_message(conversation, minutes_ago=1)
+        ChatConversation.objects.filter(pk=conversation.pk).update(last_message_at=last.created_at)
+
+        last.delete()
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.message_count, 1)
+        self.assertEqual(conversation.last_message_at, first.created_at)
+
+        first.delete()
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.message_count, 0)
+        self.assertIsNone(conversation.last_message_at)
+
+    def test_deleting_conversation_with_messages(self):
+        conversation = self.create_conversation()
+        self.create_message(conversation)
+        conversation.delete()
+        self.assertFalse(ChatMessage.objects.exists())
+
+
+class BackfillConversationCountersTests(ConversationCounterTestMixin, TestCase):
+    """backfill_conversation_counters 管理命令"""
+
+    def backfill(self, *args) -> str:
+        out = StringIO()
+        call_command('backfill_conversation_counters', *args, stdout=out)
+        return out.getvalue()
+
+    def test_backfills_counts_and_last_message_time(self):
+        conversations = [self.create_conversation() for _ in range(3)]
+        for minutes_ago in (30, 20, 10):
+            self.create_message(conversations[0], minutes_ago=minutes_ago)
+        self.create_message(conversations[1], minutes_ago=5)
+        ChatConversation.objects.update(message_count=0, last_message_at=None)
+        ChatConversation.objects.filter(pk=conversations[2].pk).update(message_count=9, last_message_at=self.now)
+
+        output = self.backfill('--batch-size', '2')
+
+        self.assertIn('共更新 3 个对话', output)
+        counters = {
+            conversation.pk: (conversation.message_count, conversation.last_message_at)
+            for conversation in ChatConversation.objects.all()
+        }
+        self.assertEqual(counters[conversations[0].pk], (3, self.now - timedelta(minutes=10)))
+        self.assertEqual(counters[conversations[1].pk], (1, self.now - timedelta(minutes=5)))
+        self.assertEqual(counters[conversations[2].pk], (0, None))
+
+    def test_start_id_skips_earlier_conversations(self):
+        first, second = self.create_conversation(), self.create_conversation()
+        self.create_message(first)
+        self.create_message(second)
+        ChatConversation.objects.update(message_count=0, last_message_at=None)
+
+        self.backfill('--start-id', str(second.pk))
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.message_count, 0)
+        self.assertEqual(second.message_count, 1)
+
+
+class ConversationListQueryTests(ConversationCounterTestMixin, TestCase):
+    """对话列表的查询次数不随对话和消息数量增长"""
+
+    def list_conversations(self):
+        request = APIRequestFactory().get('/api/ai/conversations/')
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = ChatConversationListView.as_view()(request)
+            response.render()
+        return response, len(queries)
+
+    def test_query_count_is_constant(self):
+        conversation = self.create_conversation()
+        self.create_message(conversation)
+        _, baseline = self.list_conversations()
+
+        for _ in range(5):
+            conversation = self.create_conversation()
+            for minutes_ago in range(3):
+                self.create_message(conversation, minutes_ago=minutes_ago)
+        response, queries = self.list_conversations()
+
+        self.assertEqual(queries, baseline)
+        self.assertEqual(len(response.data), 6)
+        self.assertEqual({item['message_count'] for item in response.data}, {1, 3})
+        self.assertEqual({item['ai_model_name'] for item in response.data}, {'counter-model'})
@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+import unittest
+import uuid
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from apps.ai import usage
+from apps.ai.models import AIModel, AIUsageStats
+from apps.ai.usage import (
+    LocalUsageBuffer, RedisUsageBuffer, aggregate_usage_events, apply_usage_totals, build_usage_event
+)
+
+User = get_user_model()
+
+REDIS_URL = os.environ.get('AI_TEST_REDIS_URL', 'redis://127.0.0.1:6379/15')
+
+
+def _redis_available() -> bool:
+    try:
+        import redis
+        redis.Redis.from_url(REDIS_URL, socket_connect_timeout=0.5).ping()
+        return True
+    except Exception:
+        return False
+
+
+class UsageTestMixin:
+
+    def setUp(self):
+        self.user = User.objects.create(username='usage-user')
+        self.other = User.objects.create(username='usage-other')
+        self.ai_model = AIModel.objects.create(
+            name='usage-model', model_type='chatbot', description='用量测试', api_endpoint='http://127.0.0.1/v1'
+        )
+
+    def event(self, user=None, tokens=10, cost='0.5', success=True, date='2026-01-01', **counts):
+        event = build_usage_event((user or self.user).pk, self.ai_model.pk, tokens, cost, success, **counts)
+        event['date'] = date
+        return event
+
+    def stats(self, user=None, date='2026-01-01') -> AIUsageStats:
+        return AIUsageStats.objects.get(user=user or self.user, ai_model=self.ai_model, date=date)
+
+
+class ApplyUsageTotalsTests(UsageTestMixin, TestCase):
+    """汇总使用事件并累加到统计表"""
+
+    def test_aggregate_groups_by_user_model_and_date(self):
+        totals = aggregate_usage_events([
+            self.event(tokens=10, cost='0.5'),
+            self.event(tokens=5, cost='0.25', success=False),
+            self.event(tokens=1, date='2026-01-02'),
+            self.event(user=self.other, tokens=7, requests=3, successes=2)
+        ])
+        self.assertEqual(len(totals), 3)
+        self.assertEqual(totals[(self.user.pk, self.ai_model.pk, '2026-01-01')], {
+            'requests': 2, 'successes': 1, 'errors': 1, 'tokens': 15, 'cost': Decimal('0.75')
+        })
+        self.assertEqual(totals[(self.other.pk, self.ai_model.pk, '2026-01-01')]['errors'], 1)
+
+    def test_creates_missing_rows(self):
+        updated = apply_usage_totals(aggregate_usage_events([
+            self.event(tokens=10, cost='0.5'),
+            self.event(user=self.other, tokens=3, cost='0.1', success=False)
+        ]))
+        self.assertEqual(updated, 2)
+        stats = self.stats()
+        self.assertEqual((stats.request_count, stats.success_count, stats.error_count), (1, 1, 0))
+        self.assertEqual(stats.token_count, 10)
+        self.assertEqual(stats.total_cost, Decimal('0.5'))
+        other = self.stats(user=self.other)
+        self.assertEqual((other.request_count, other.success_count, other.error_count), (1, 0, 1))
+
+    def test_accumulates_onto_existing_rows(self):
+        AIUsageStats.objects.create(
+            user=self.user, ai_model=self.ai_model, date='2026-01-01',
+            request_count=4, success_count=3, error_count=1, token_count=100, total_cost=Decimal('2.5')
+        )
+        apply_usage_totals(aggregate_usage_events([self.event(tokens=10, cost='0.5')]))
+        apply_usage_totals(aggregate_usage_events([self.event(tokens=5, cost='0.25', success=False)]))
+
+        stats = self.stats()
+        self.assertEqual((stats.request_count, stats.success_count, stats.error_count), (6, 4, 2))
+        self.assertEqual(stats.token_count, 115)
+        self.assertEqual(stats.total_cost, Decimal('3.25'))
+        self.assertEqual(AIUsageStats.objects.count(), 1)
+
+    def test_empty_totals(self):
+        self.assertEqual(apply_usage_totals({}), 0)
+        self.assertFalse(AIUsageStats.objects.exists())
+
+
+class LocalUsageBufferTests(UsageTestMixin, TestCase):
+    """进程内缓冲区的分批写入与失败重试"""
+
+    def test_flush_in_batches(self):
+        buffer = LocalUsageBuffer(max_events=100, flush_interval=3600)
+        for _ in range(5):
+            buffer.events.append(self.event(tokens=2))
+        self.assertEqual(buffer.flush(batch_size=2), 5)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.stats().request_count, 5)
+        self.assertEqual(self.stats().token_count, 10)
+
+    def test_failed_flush_keeps_events_in_order(self):
+        buffer = LocalUsageBuffer(max_events=100, flush_interval=3600)
+        events = [self.event(tokens=tokens) for tokens in range(3)]
+        buffer.events.extend(events)
+        with mock.patch.object(usage, 'apply_usage_totals', side_effect=RuntimeError('数据库不可用')):
+            with self.assertRaises(RuntimeError):
+                buffer.flush()
+        self.assertEqual(list(buffer.events), events)
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(self.stats().token_count, 3)
+
+    def test_drops_oldest_when_full(self):
+        buffer = LocalUsageBuffer(max_events=2, flush_interval=3600)
+        buffer._thread = threading.current_thread()
+        for tokens in range(3):
+            buffer.append(self.event(tokens=tokens))
+        self.assertEqual(buffer.dropped, 1)
+        self.assertEqual([event['tokens'] for event in buffer.events], [1, 2])
+
+
+@unittest.skipUnless(_redis_available(), 'Redis不可用')
+class RedisUsageBufferTests(UsageTestMixin, TestCase):
+    """Redis缓冲区的写入锁：写入期间续期，锁失效后停止"""
+
+    def setUp(self):
+        super().setUp()
+        self.stream_key = f"test:usage:{uuid.uuid4().hex}"
+        self.buffer = RedisUsageBuffer(url=REDIS_URL, stream_key=self.stream_key, lock_ttl=1)
+
+    def tearDown(self):
+        self.buffer.client.delete(self.stream_key, self.buffer.lock_key)
+        super().tearDown()
+
+    def test_lock_renewed_during_slow_flush(self):
+        for _ in range(3):
+            self.buffer.append(self.event())
+        other = RedisUsageBuffer(url=REDIS_URL, stream_key=self.stream_key, lock_ttl=1)
+        competing = []
+
+        def slow_apply(totals):
+            if not competing:
+                competing.append(None)
+                time.sleep(1.5)
+                competing[0] = other.flush()
+            return apply_usage_totals(totals)
+
+        with mock.patch.object(usage, 'apply_usage_totals', side_effect=slow_apply):
+            self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(competing, [0])
+        self.assertEqual(self.stats().request_count, 3)
+        self.assertEqual(len(self.buffer), 0)
+        self.assertFalse(self.buffer.client.exists(self.buffer.lock_key))
+
+    def test_stops_after_losing_lock(self):
+        for _ in range(4):
+            self.buffer.append(self.event())
+
+        def steal_lock(totals):
+            self.buffer.client.set(self.buffer.lock_key, 'other')
+            return apply_usage_totals(totals)
+
+        with mock.patch.object(usage, 'apply_usage_totals', side_effect=steal_lock):
+            self.assertEqual(self.buffer.flush(batch_size=2), 2)
+        self.assertEqual(len(self.buffer), 2)
+        self.assertEqual(self.buffer.client.get(self.buffer.lock_key), b'other')
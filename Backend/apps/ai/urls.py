@@ -11,6 +11,7 @@ urlpatterns = [
     # AI请求相关
     path('requests/', views.AIRequestListView.as_view(), name='request-list'),
     path('requests/<int:pk>/', views.AIRequestDetailView.as_view(), name='request-detail'),
+    path('requests/archive/', views.ArchivedAIRequestListView.as_view(), name='archived-request-list'),
 
     # 聊天对话相关
     path('conversations/', views.ChatConversationListView.as_view(), name='conversation-list'),
@@ -22,11 +23,23 @@ urlpatterns = [
     path('templates/', views.AITemplateListView.as_view(), name='template-list'),
     path('templates/<int:pk>/', views.AITemplateDetailView.as_view(), name='template-detail'),
     path('templates/render/', views.render_template, name='render-template'),
+    path('templates/render/batch/', views.render_template_batch, name='render-template-batch'),
 
     # 统计相关
     path('stats/user/', views.UserUsageStatsView.as_view(), name='user-stats'),
     path('stats/models/', views.ModelUsageStatsView.as_view(), name='model-stats'),
 
+    # 调用指标
+    path('metrics/providers/', views.provider_metrics, name='provider-metrics'),
+
+    # 批量推理相关
+    path('batches/', views.BatchJobListView.as_view(), name='batch-list'),
+    path('batches/<int:pk>/', views.BatchJobDetailView.as_view(), name='batch-detail'),
+    path('batches/<int:pk>/cancel/', views.cancel_batch_job, name='cancel-batch'),
+    path('batches/<int:pk>/resume/', views.resume_batch_job, name='resume-batch'),
+    path('batches/<int:pk>/results/', views.batch_job_results, name='batch-results'),
+
     # OpenAI兼容接口
     path('chat/completions/', views.chat_completion, name='chat-completion'),
+    path('chat/completions/stream/', views.chat_completion_stream, name='chat-completion-stream'),
 ]
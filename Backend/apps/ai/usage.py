@@ -0,0 +1,281 @@
+"""
+AI使用统计的写回（write-behind）管道
+
+请求路径只把使用事件追加到缓冲区（Redis Stream 或进程内环形缓冲区），不访问统计表；
+flush_ai_usage 任务定期取出事件，按 (用户, 模型, 日期) 汇总后用 F() 表达式原子累加到 AIUsageStats。
+"""
+import atexit
+import json
+import threading
+import uuid
+from collections import deque
+from decimal import Decimal
+from typing import Dict, Any, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 'redis'：事件写入Redis Stream，由Celery定时任务统一写入数据库（多进程部署）
+# 'local'：事件写入进程内环形缓冲区，由本进程的后台线程定期写入数据库（单进程或开发环境）
+USAGE_BUFFER_BACKEND = getattr(settings, 'AI_USAGE_BUFFER', 'redis')
+USAGE_REDIS_URL = getattr(settings, 'AI_USAGE_REDIS_URL', 'redis://127.0.0.1:6379/1')
+USAGE_STREAM_KEY = getattr(settings, 'AI_USAGE_STREAM_KEY', 'ai:usage:events')
+USAGE_FLUSH_INTERVAL = getattr(settings, 'AI_USAGE_FLUSH_INTERVAL', 10)
+USAGE_FLUSH_BATCH_SIZE = getattr(settings, 'AI_USAGE_FLUSH_BATCH_SIZE', 5000)
+USAGE_BUFFER_MAX_EVENTS = getattr(settings, 'AI_USAGE_BUFFER_MAX_EVENTS', 1000000)
+
+# 仅当写入锁仍由自己持有时续期 / 释放
+# KEYS: 锁; ARGV: 持有者令牌, 过期时间（毫秒）
+FLUSH_LOCK_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+FLUSH_LOCK_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def build_usage_event(user_id, ai_model_id, tokens: int = 0, cost=0, success: bool = True,
+                      requests: int = 1, successes: Optional[int] = None) -> Dict[str, Any]:
+    """构造使用事件（requests/successes 用于一次记录多个请求，如批量推理的一段）"""
+    successes = (requests if success else 0) if successes is None else successes
+    return {
+        'user_id': user_id,
+        'ai_model_id': ai_model_id,
+        'date': timezone.now().date().isoformat(),
+        'requests': requests,
+        'successes': successes,
+        'errors': requests - successes,
+        'tokens': int(tokens or 0),
+        'cost': str(cost or 0)
+    }
+
+
+def aggregate_usage_events(events: List[Dict[str, Any]]) -> Dict[Tuple[Any, Any, str], Dict[str, Any]]:
+    """按 (用户, 模型, 日期) 汇总使用事件"""
+    totals: Dict[Tuple[Any, Any, str], Dict[str, Any]] = {}
+    for event in events:
+        key = (event['user_id'], event['ai_model_id'], event['date'])
+        total = totals.get(key)
+        if total is None:
+            total = totals[key] = {'requests': 0, 'successes': 0, 'errors': 0, 'tokens': 0, 'cost': Decimal('0')}
+        total['requests'] += event['requests']
+        total['successes'] += event['successes']
+        total['errors'] += event['errors']
+        total['tokens'] += event['tokens']
+        total['cost'] += Decimal(event['cost'])
+    return totals
+
+
+def apply_usage_totals(totals: Dict[Tuple[Any, Any, str], Dict[str, Any]]) -> int:
+    """把汇总结果原子地累加到统计表，返回更新的行数
+
+    先用 bulk_create(ignore_conflicts=True) 补齐缺少的行，再逐行执行 F() 累加，
+    不读取现有计数，并发写入时不会丢失更新。按键排序更新，避免多个写入者相互死锁。
+    """
+    from .models import AIUsageStats
+
+    if not totals:
+        return 0
+    with transaction.atomic():
+        AIUsageStats.objects.bulk_create(
+            [AIUsageStats(user_id=user_id, ai_model_id=ai_model_id, date=date)
+             for user_id, ai_model_id, date in totals],
+            ignore_conflicts=True
+        )
+        for (user_id, ai_model_id, date), total in sorted(totals.items(), key=lambda item: str(item[0])):
+            AIUsageStats.objects.filter(user_id=user_id, ai_model_id=ai_model_id, date=date).update(
+                request_count=F('request_count') + total['requests'],
+                success_count=F('success_count') + total['successes'],
+                error_count=F('error_count') + total['errors'],
+                token_count=F('token_count') + total['tokens'],
+                total_cost=F('total_cost') + total['cost'],
+                updated_at=timezone.now()
+            )
+    return len(totals)
+
+
+class LocalUsageBuffer:
+    """进程内环形缓冲区：超过 max_events 时丢弃最早的事件；后台线程定期写入数据库，进程退出前再写入一次"""
+
+    def __init__(self, max_events: int = USAGE_BUFFER_MAX_EVENTS, flush_interval: float = USAGE_FLUSH_INTERVAL):
+        self.events: deque = deque(maxlen=max_events)
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def append(self, event: Dict[str, Any]):
+        with self._lock:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append(event)
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='ai-usage-flush', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"写入AI使用统计失败: {str(e)}")
+
+    def flush(self, batch_size: int = USAGE_FLUSH_BATCH_SIZE) -> int:
+        """取出缓冲区中的事件写入数据库，返回写入的事件数；写入失败的事件放回缓冲区"""
+        flushed = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    events = [self.events.popleft() for _ in range(min(batch_size, len(self.events)))]
+                if not events:
+                    return flushed
+                try:
+                    apply_usage_totals(aggregate_usage_events(events))
+                except Exception:
+                    with self._lock:
+                        self.events.extendleft(reversed(events))
+                    raise
+                flushed += len(events)
+
+    def stop(self):
+        self._stopped.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"写入AI使用统计失败: {str(e)}")
+
+    def __len__(self):
+        return len(self.events)
+
+
+class RedisUsageBuffer:
+    """Redis Stream 缓冲区：各进程追加事件，flush_ai_usage 任务持锁读取、写入数据库后删除
+
+    写入期间由后台线程每隔 lock_ttl/3 秒续期写入锁，写入耗时超过 lock_ttl 时其他写入者也不会重复读取同一批事件；
+    续期失败（锁已过期被他人取得）时处理完当前批次后停止。事件在数据库事务提交后才删除，
+    写入数据库后、删除事件前进程退出时，这批事件会被重复累加一次。
+    """
+
+    def __init__(self, url: str = USAGE_REDIS_URL, stream_key: str = USAGE_STREAM_KEY,
+                 max_events: int = USAGE_BUFFER_MAX_EVENTS, lock_ttl: int = 60):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.stream_key = stream_key
+        self.lock_key = f"{stream_key}:flush_lock"
+        # 写入任务长时间停止时的兜底上限（近似裁剪）
+        self.max_events = max_events
+        self.lock_ttl = lock_ttl
+        self._renew_script = self.client.register_script(FLUSH_LOCK_RENEW_SCRIPT)
+        self._release_script = self.client.register_script(FLUSH_LOCK_RELEASE_SCRIPT)
+
+    def append(self, event: Dict[str, Any]):
+        self.client.xadd(
+            self.stream_key, {'event': json.dumps(event, separators=(',', ':'))},
+            maxlen=self.max_events, approximate=True
+        )
+
+    def _renew_lock(self, token: str) -> bool:
+        return bool(self._renew_script(keys=[self.lock_key], args=[token, int(self.lock_ttl * 1000)]))
+
+    def _keep_lock(self, token: str, stopped: threading.Event, lost: threading.Event):
+        """写入期间定期续期写入锁，续期失败时标记锁已丢失"""
+        while not stopped.wait(self.lock_ttl / 3):
+            try:
+                if not self._renew_lock(token):
+                    lost.set()
+                    return
+            except Exception as e:
+                logger.error(f"续期AI使用统计写入锁失败: {str(e)}")
+
+    def flush(self, batch_size: int = USAGE_FLUSH_BATCH_SIZE) -> int:
+        """持锁（同一时刻只有一个写入者）读取事件写入数据库，返回写入的事件数"""
+        token = uuid.uuid4().hex
+        if not self.client.set(self.lock_key, token, nx=True, ex=self.lock_ttl):
+            return 0
+        stopped = threading.Event()
+        lost = threading.Event()
+        keeper = threading.Thread(
+            target=self._keep_lock, args=(token, stopped, lost), name='ai-usage-flush-lock', daemon=True
+        )
+        keeper.start()
+        flushed = 0
+        try:
+            while True:
+                if lost.is_set() or not self._renew_lock(token):
+                    logger.warning("AI使用统计写入锁已失效, 停止本次写入")
+                    return flushed
+                entries = self.client.xrange(self.stream_key, '-', '+', count=batch_size)
+                if not entries:
+                    return flushed
+                events = []
+                for entry_id, fields in entries:
+                    try:
+                        events.append(json.loads(fields[b'event']))
+                    except (KeyError, ValueError):
+                        logger.warning(f"忽略无法解析的使用事件: {entry_id}")
+                apply_usage_totals(aggregate_usage_events(events))
+                self.client.xdel(self.stream_key, *(entry_id for entry_id, _ in entries))
+                flushed += len(entries)
+                if len(entries) < batch_size:
+                    return flushed
+        finally:
+            stopped.set()
+            keeper.join()
+            self._release_script(keys=[self.lock_key], args=[token])
+
+    def __len__(self):
+        return self.client.xlen(self.stream_key)
+
+
+_usage_buffer = None
+_usage_buffer_lock = threading.Lock()
+
+
+def get_usage_buffer():
+    """获取使用事件缓冲区（按 AI_USAGE_BUFFER 设置创建）"""
+    global _usage_buffer
+    if _usage_buffer is None:
+        with _usage_buffer_lock:
+            if _usage_buffer is None:
+                if USAGE_BUFFER_BACKEND == 'local':
+                    _usage_buffer = LocalUsageBuffer()
+                else:
+                    _usage_buffer = RedisUsageBuffer()
+    return _usage_buffer
+
+
+def record_usage_event(user, ai_model, tokens: int = 0, cost=0, success: bool = True, **counts):
+    """记录一次使用（只写入缓冲区）；缓冲区不可用时记录日志并丢弃，不影响请求本身"""
+    user_id = getattr(user, 'pk', user)
+    ai_model_id = getattr(ai_model, 'pk', ai_model)
+    if user_id is None or ai_model_id is None:
+        return
+    try:
+        get_usage_buffer().append(build_usage_event(user_id, ai_model_id, tokens, cost, success, **counts))
+    except Exception as e:
+        logger.error(f"记录AI使用事件失败: {str(e)}")
+
+
+def flush_usage() -> int:
+    """把缓冲区中的使用事件写入统计表，返回写入的事件数"""
+    return get_usage_buffer().flush()
@@ -1,29 +1,63 @@
 from django.shortcuts import get_object_or_404
-from django.db.models import Q, Count, Sum, Avg
+from django.http import Http404
+from django.db.models import Q, F, Count, Sum, Avg, Prefetch
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from asgiref.sync import sync_to_async
 from rest_framework import status, permissions, generics
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from rest_framework import exceptions
 from django.core.cache import cache
+from datetime import datetime
 from decimal import Decimal
+import asyncio
+import base64
+import hmac
 import json
+import math
 import time
+import uuid
 
 from .models import (
     AIModel, AIRequest, ChatConversation, ChatMessage,
-    AITemplate, AIUsageStats
+    AITemplate, AIUsageStats, BatchJob
 )
 from .serializers import (
-    AIModelSerializer, AIRequestSerializer, AIRequestCreateSerializer,
+    AIModelSerializer, AIRequestSerializer, AIRequestCreateSerializer, ArchivedAIRequestSerializer,
     ChatConversationSerializer, ChatConversationListSerializer,
     ChatMessageSerializer, SendMessageSerializer, AITemplateSerializer,
     AIUsageStatsSerializer, UserUsageStatsSerializer, ModelUsageStatsSerializer,
     ChatCompletionSerializer, TextGenerationSerializer, ImageGenerationSerializer,
-    TemplateRenderSerializer
+    TemplateRenderSerializer, TemplateBatchRenderSerializer, BatchJobSerializer, BatchJobCreateSerializer
 )
+from .tasks import run_ai_batch_job
+from .providers import ModelProviderError, resolve_model
+from .usage import record_usage_event
+from .request_log import record_request
+from .archive import get_archived_request, page_archived_requests
+from .metrics import collect_provider_telemetry
+from .templating import TemplateVariableError, get_compiled_template
 from apps.core.models import SystemLog
+from server.ai_manager import get_ai_manager, get_agent_manager
+from server.token_estimator import estimate_tokens, count_messages_tokens
+from server.telemetry import get_provider_telemetry
+
+# send_message 携带的最近历史消息条数（可由模型配置 history_messages 覆盖）
+CHAT_HISTORY_MESSAGES = 20
+# 可在模型配置中设置默认值的生成参数
+CHAT_MODEL_PARAMS = ('temperature', 'max_tokens', 'top_p')
+# 归档请求按日期范围查询的最大跨度（天）
+ARCHIVE_QUERY_MAX_DAYS = 31
 
 
 class AIModelListView(generics.ListAPIView):
@@ -73,13 +107,103 @@ class AIRequestListView(generics.ListCreateAPIView):
 
 
 class AIRequestDetailView(generics.RetrieveAPIView):
-    """AI请求详情"""
+    """AI请求详情（已归档的请求从归档文件中读取）"""
     serializer_class = AIRequestSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         return AIRequest.objects.filter(user=self.request.user)
 
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            record = get_archived_request(int(kwargs['pk']), user_id=request.user.pk)
+            if record is None:
+                raise
+            return Response(ArchivedAIRequestSerializer(_archived_records(request.user, [record])[0]).data)
+
+
+class ArchivedAIRequestListView(generics.GenericAPIView):
+    """已归档的AI请求（?start=YYYY-MM-DD&end=YYYY-MM-DD，按创建日期查询，包含结束日期）
+
+    按 (创建时间, ID) 倒序分页，下一页使用响应中的 next（cursor 参数）。
+    """
+    serializer_class = ArchivedAIRequestSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        start_date = parse_date(request.query_params.get('start') or '')
+        end_date = parse_date(request.query_params.get('end') or '')
+        if start_date is None or end_date is None:
+            raise exceptions.ValidationError({'error': '请提供 start 和 end 日期（YYYY-MM-DD）'})
+        if end_date < start_date or (end_date - start_date).days >= ARCHIVE_QUERY_MAX_DAYS:
+            raise exceptions.ValidationError({'error': f'日期范围无效（最多 {ARCHIVE_QUERY_MAX_DAYS} 天）'})
+
+        filters = {}
+        status_filter = request.query_params.get('status', None)
+        model_id = request.query_params.get('model_id', None)
+        request_type = request.query_params.get('request_type', None)
+        if status_filter:
+            filters['status'] = status_filter
+        if model_id:
+            try:
+                filters['ai_model_id'] = int(model_id)
+            except ValueError:
+                raise exceptions.ValidationError({'error': 'model_id 无效'})
+        if request_type:
+            filters['request_type'] = request_type
+
+        page_size = api_settings.PAGE_SIZE or 20
+        records = page_archived_requests(
+            timezone.make_aware(datetime.combine(start_date, datetime.min.time())),
+            timezone.make_aware(datetime.combine(end_date + timezone.timedelta(days=1), datetime.min.time())),
+            user_id=request.user.pk,
+            before=_decode_archive_cursor(request.query_params.get('cursor')),
+            limit=page_size + 1,
+            **filters
+        )
+        next_url = None
+        if len(records) > page_size:
+            records = records[:page_size]
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor', _encode_archive_cursor(records[-1])
+            )
+        return Response({
+            'next': next_url,
+            'results': self.get_serializer(_archived_records(request.user, records), many=True).data
+        })
+
+
+def _encode_archive_cursor(record) -> str:
+    raw = f"{record['created_at'].isoformat()}|{record['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def _decode_archive_cursor(cursor):
+    """解析分页游标为 (创建时间, ID)"""
+    if not cursor:
+        return None
+    try:
+        created_at, request_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        position = (datetime.fromisoformat(created_at), int(request_id))
+    except (ValueError, UnicodeError):
+        raise exceptions.ValidationError({'error': 'cursor 无效'})
+    if timezone.is_naive(position[0]):
+        raise exceptions.ValidationError({'error': 'cursor 无效'})
+    return position
+
+
+def _archived_records(user, records):
+    """为归档记录补充用户名和模型名称（与 AIRequestSerializer 的字段一致）"""
+    model_names = dict(
+        AIModel.objects.filter(pk__in={record['ai_model_id'] for record in records}).values_list('pk', 'name')
+    )
+    for record in records:
+        record['user'] = str(user)
+        record['ai_model_name'] = model_names.get(record['ai_model_id'])
+    return records
+
 
 class ChatConversationListView(generics.ListCreateAPIView):
     """聊天对话列表和创建"""
@@ -106,7 +230,8 @@ class ChatConversationListView(generics.ListCreateAPIView):
         if model_id:
             queryset = queryset.filter(ai_model_id=model_id)
 
-        return queryset.order_by('-updated_at')
+        # 消息数和最后消息时间已物化在对话表中，模型名称随列表查询一并取出
+        return queryset.annotate(ai_model_name=F('ai_model__name')).order_by('-updated_at')
 
 
 class ChatConversationDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -118,6 +243,8 @@ class ChatConversationDetailView(generics.RetrieveUpdateDestroyAPIView):
         return ChatConversation.objects.filter(
             user=self.request.user,
             is_active=True
+        ).select_related('ai_model').prefetch_related(
+            Prefetch('messages', queryset=ChatMessage.objects.order_by('created_at', 'id'))
         )
 
     def delete(self, request, *args, **kwargs):
@@ -128,55 +255,75 @@ class ChatConversationDetailView(generics.RetrieveUpdateDestroyAPIView):
         return Response({'message': '对话已删除'})
 
 
-@api_view(['POST'])
-@permission_classes([permissions.IsAuthenticated])
-def send_message(request):
-    """发送聊天消息"""
-    serializer = SendMessageSerializer(data=request.data, context={'request': request})
-    if serializer.is_valid():
-        conversation = serializer.validated_data['conversation_id']
-        content = serializer.validated_data['content']
-
-        # 创建用户消息
-        user_message = ChatMessage.objects.create(
-            conversation=conversation,
-            role='user',
-            content=content
-        )
-
-        # 这里应该调用AI模型API获取回复
-        # 暂时返回模拟回复
-        ai_response = f"这是对 '{content}' 的AI回复"
-
-        # 创建AI回复消息
-        ai_message = ChatMessage.objects.create(
-            conversation=conversation,
-            role='assistant',
-            content=ai_response,
-            tokens=50,  # 模拟token数
-            cost=Decimal('0.0010')  # 模拟成本
-        )
-
-        # 更新对话统计
-        conversation.total_tokens += 50
-        conversation.total_cost += Decimal('0.0010')
-        conversation.save()
-
-        # 记录使用统计
-        AIUsageStats.record_usage(
-            user=request.user,
-            ai_model=conversation.ai_model,
-            tokens=50,
-            cost=Decimal('0.0010'),
-            success=True
-        )
+@csrf_exempt
+@require_POST
+async def send_message(request):
+    """发送聊天消息
 
-        return Response({
-            'user_message': ChatMessageSerializer(user_message).data,
-            'ai_message': ChatMessageSerializer(ai_message).data
-        })
-
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    携带系统提示和最近的对话历史调用对话所用模型的服务提供商，保存用户消息和AI回复。
+    对话的token/成本统计和使用统计由 chat_message_created 信号记录。
+    """
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse({'error': '身份认证信息未提供或无效'}, status=status.HTTP_401_UNAUTHORIZED)
+    try:
+        body = json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': '请求体不是有效的JSON'}, status=status.HTTP_400_BAD_REQUEST)
+
+    request.user = user
+    serializer = SendMessageSerializer(data=body, context={'request': request})
+    if not await sync_to_async(serializer.is_valid)():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    conversation = serializer.validated_data['conversation_id']
+    content = serializer.validated_data['content']
+    ai_model = await AIModel.objects.aget(pk=conversation.ai_model_id)
+    if not ai_model.is_available():
+        return JsonResponse({'error': 'AI模型当前不可用'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    try:
+        route = resolve_model(ai_model)
+    except ModelProviderError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    model_name = ai_model.name
+    messages = await _conversation_history(conversation, ai_model)
+    messages.append({'role': 'user', 'content': content})
+
+    # 创建用户消息
+    user_message = await ChatMessage.objects.acreate(
+        conversation=conversation,
+        role='user',
+        content=content,
+        tokens=estimate_tokens(content, model_name)
+    )
+
+    start_time = time.monotonic()
+    result = await get_ai_manager().chat_completion(
+        route.provider_name, messages, model=route.model, priority=route.priority,
+        **_model_params(ai_model)
+    )
+    if not result.get('success'):
+        await sync_to_async(record_usage_event)(user, ai_model, success=False)
+        return _upstream_error(result)
+
+    ai_response = result.get('content') or ''
+    usage = _complete_usage(result.get('usage'), messages, ai_response, model_name)
+
+    # 创建AI回复消息
+    ai_message = await ChatMessage.objects.acreate(
+        conversation=conversation,
+        role='assistant',
+        content=ai_response,
+        tokens=usage['completion_tokens'],
+        cost=ai_model.cost_per_request * usage['total_tokens'],
+        metadata={'usage': usage, 'processing_time': time.monotonic() - start_time}
+    )
+
+    return JsonResponse({
+        'user_message': ChatMessageSerializer(user_message).data,
+        'ai_message': ChatMessageSerializer(ai_message).data
+    })
 
 
 @api_view(['POST'])
@@ -250,10 +397,7 @@ def render_template(request):
         variables = serializer.validated_data['variables']
 
         try:
-            # 简单的变量替换（实际应用中可能需要更复杂的模板引擎）
-            rendered_content = template.content
-            for key, value in variables.items():
-                rendered_content = rendered_content.replace(f'{{{key}}}', str(value))
+            rendered_content = get_compiled_template(template).render(variables)
 
             # 增加使用次数
             template.increment_usage()
@@ -264,6 +408,8 @@ def render_template(request):
                 'variables_used': variables
             })
 
+        except TemplateVariableError as e:
+            return Response({'error': str(e), 'missing': e.missing}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response(
                 {'error': f'模板渲染失败: {str(e)}'},
@@ -273,6 +419,41 @@ def render_template(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def render_template_batch(request):
+    """用多组变量批量渲染同一模板（任何一组缺少必填变量时整批返回400）"""
+    serializer = TemplateBatchRenderSerializer(data=request.data, context={'request': request})
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    template = serializer.validated_data['template_id']
+    variables_list = serializer.validated_data['variables_list']
+    compiled = get_compiled_template(template)
+    missing = {}
+    for index, variables in enumerate(variables_list):
+        names = compiled.missing(variables)
+        if names:
+            missing[index] = names
+    if missing:
+        return Response({'error': '缺少必填变量', 'missing': missing}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        rendered = compiled.render_many(variables_list)
+    except Exception as e:
+        return Response(
+            {'error': f'模板渲染失败: {str(e)}'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    template.increment_usage(len(rendered))
+
+    return Response({
+        'template_name': template.name,
+        'rendered_contents': rendered,
+        'count': len(rendered)
+    })
+
+
 class UserUsageStatsView(APIView):
     """用户使用统计"""
     permission_classes = [permissions.IsAuthenticated]
@@ -357,122 +538,175 @@ class ModelUsageStatsView(APIView):
         return Response(serializer.data)
 
 
-@api_view(['POST'])
-@permission_classes([permissions.IsAuthenticated])
-def chat_completion(request):
-    """聊天完成接口（兼容OpenAI格式）"""
-    serializer = ChatCompletionSerializer(data=request.data)
-    if serializer.is_valid():
-        model_name = serializer.validated_data['model']
-        messages = serializer.validated_data['messages']
-
-        try:
-            # 获取AI模型
-            ai_model = AIModel.objects.get(name=model_name, is_active=True)
-            if not ai_model.is_available():
-                return Response(
-                    {'error': 'AI模型当前不可用'},
-                    status=status.HTTP_503_SERVICE_UNAVAILABLE
-                )
-
-            # 创建请求记录
-            ai_request = AIRequest.objects.create(
-                user=request.user,
-                ai_model=ai_model,
-                request_type='text',
-                input_data=serializer.validated_data,
-                status='processing'
-            )
-
-            start_time = time.time()
-
-            # 这里应该调用实际的AI模型API
-            # 暂时返回模拟响应
-            response_text = f"这是来自{model_name}的回复"
-            tokens_used = 50
-
-            processing_time = time.time() - start_time
-            cost = ai_model.cost_per_request * tokens_used
-
-            # 更新请求记录
-            ai_request.mark_completed({
-                'choices': [{
-                    'message': {
-                        'role': 'assistant',
-                        'content': response_text
-                    },
-                    'finish_reason': 'stop'
-                }],
-                'usage': {
-                    'total_tokens': tokens_used
-                }
-            }, processing_time)
-
-            ai_request.cost = cost
-            ai_request.save()
-
-            # 记录使用统计
-            AIUsageStats.record_usage(
-                user=request.user,
-                ai_model=ai_model,
-                tokens=tokens_used,
-                cost=cost,
-                success=True
-            )
-
-            return Response({
-                'id': f'chatcmpl-{ai_request.id}',
-                'object': 'chat.completion',
-                'created': int(ai_request.created_at.timestamp()),
-                'model': model_name,
-                'choices': [{
-                    'index': 0,
-                    'message': {
-                        'role': 'assistant',
-                        'content': response_text
-                    },
-                    'finish_reason': 'stop'
-                }],
-                'usage': {
-                    'prompt_tokens': tokens_used // 2,
-                    'completion_tokens': tokens_used // 2,
-                    'total_tokens': tokens_used
-                }
-            })
-
-        except AIModel.DoesNotExist:
-            return Response(
-                {'error': '指定的AI模型不存在'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        except Exception as e:
-            # 记录错误
-            if 'ai_request' in locals():
-                ai_request.mark_failed(str(e))
-
-            # 记录失败统计
-            AIUsageStats.record_usage(
-                user=request.user,
-                ai_model=ai_model if 'ai_model' in locals() else None,
-                success=False
-            )
+@csrf_exempt
+@require_POST
+async def chat_completion(request):
+    """聊天完成接口（兼容OpenAI格式）
 
-            SystemLog.log(
-                level='error',
-                module='ai',
-                action='chat_completion',
-                message=f'聊天完成失败: {str(e)}',
-                user=request.user,
-                request=request,
-                error=str(e)
-            )
+    通过 AIManager 调用模型配置的服务提供商（连接池、速率限制、响应缓存），等待上游期间不占用工作线程。
+    需要以ASGI方式部署（backend.asgi.application）。
+    """
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse({'error': '身份认证信息未提供或无效'}, status=status.HTTP_401_UNAUTHORIZED)
+    try:
+        body = json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': '请求体不是有效的JSON'}, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = ChatCompletionSerializer(data=body)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    input_data = serializer.validated_data
+    model_name = input_data['model']
+    messages = input_data['messages']
+
+    ai_model = await AIModel.objects.filter(name=model_name, is_active=True).afirst()
+    if ai_model is None:
+        return JsonResponse({'error': '指定的AI模型不存在'}, status=status.HTTP_404_NOT_FOUND)
+    if not ai_model.is_available():
+        return JsonResponse({'error': 'AI模型当前不可用'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    try:
+        route = resolve_model(ai_model)
+    except ModelProviderError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    # 请求记录在结束后由写入器批量插入
+    completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+    created = int(time.time())
+    ai_request = AIRequest(
+        user=user,
+        ai_model=ai_model,
+        request_type='text',
+        input_data=input_data,
+        status='processing',
+        metadata={'completion_id': completion_id}
+    )
+
+    start_time = time.monotonic()
+    result = await get_ai_manager().chat_completion(
+        route.provider_name,
+        messages,
+        model=route.model,
+        priority=route.priority,
+        temperature=input_data['temperature'],
+        max_tokens=input_data['max_tokens'],
+        top_p=input_data['top_p']
+    )
+    processing_time = time.monotonic() - start_time
+
+    if not result.get('success'):
+        await sync_to_async(_fail_request)(user, ai_model, ai_request, result.get('message', 'AI服务请求失败'))
+        return _upstream_error(result)
+
+    response_text = result.get('content') or ''
+    usage = _complete_usage(result.get('usage'), messages, response_text, model_name)
+    choice = {
+        'index': 0,
+        'message': {
+            'role': 'assistant',
+            'content': response_text
+        },
+        'finish_reason': _finish_reason(result)
+    }
+    await sync_to_async(_complete_request)(
+        user, ai_model, ai_request, {'choices': [choice], 'usage': usage}, usage, processing_time
+    )
+
+    return JsonResponse({
+        'id': completion_id,
+        'object': 'chat.completion',
+        'created': created,
+        'model': model_name,
+        'choices': [choice],
+        'usage': usage
+    })
+
+
+async def _conversation_history(conversation, ai_model) -> list:
+    """对话的系统提示和最近的历史消息（条数由模型配置 history_messages 指定，默认20）"""
+    limit = ai_model.configuration.get('history_messages', CHAT_HISTORY_MESSAGES)
+    recent = [
+        message async for message in ChatMessage.objects.filter(
+            conversation=conversation, is_active=True, role__in=['user', 'assistant']
+        ).order_by('-created_at', '-id').values('role', 'content')[:limit]
+    ]
+    history = [{'role': 'system', 'content': conversation.system_prompt}] if conversation.system_prompt else []
+    return history + recent[::-1]
+
+
+def _model_params(ai_model) -> dict:
+    """模型配置中的默认生成参数"""
+    return {key: ai_model.configuration[key] for key in CHAT_MODEL_PARAMS if key in ai_model.configuration}
+
+
+def _complete_usage(usage, prompt_messages, content: str, model_name: str) -> dict:
+    """补全提供商返回的用量（缺少的部分本地估算）"""
+    usage = dict(usage or {})
+    if usage.get('total_tokens') is None and (
+            usage.get('prompt_tokens') is None or usage.get('completion_tokens') is None):
+        prompt_tokens = count_messages_tokens(prompt_messages, model_name)
+        completion_tokens = estimate_tokens(content, model_name)
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'estimated': True
+        }
+    if usage.get('completion_tokens') is None:
+        usage['completion_tokens'] = min(estimate_tokens(content, model_name), usage['total_tokens'])
+    if usage.get('prompt_tokens') is None:
+        usage['prompt_tokens'] = usage['total_tokens'] - usage['completion_tokens']
+    if usage.get('total_tokens') is None:
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+    return usage
 
-            return Response(
-                {'error': f'处理请求失败: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
 
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+def _finish_reason(result) -> str:
+    try:
+        return result['data']['choices'][0].get('finish_reason') or 'stop'
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return 'stop'
+
+
+def _upstream_error(result) -> JsonResponse:
+    """上游调用失败的响应：被限流时返回429、暂不可用（如上游全部熔断）时返回503（均带 Retry-After），其余返回502"""
+    if result.get('status') in (status.HTTP_429_TOO_MANY_REQUESTS, status.HTTP_503_SERVICE_UNAVAILABLE):
+        response_status = result['status']
+    else:
+        response_status = status.HTTP_502_BAD_GATEWAY
+    response = JsonResponse({'error': result.get('message', 'AI服务请求失败')}, status=response_status)
+    if result.get('retry_after'):
+        response['Retry-After'] = str(math.ceil(result['retry_after']))
+    return response
+
+
+def _complete_request(user, ai_model, ai_request, output_data, usage, processing_time):
+    """写入请求结果与使用统计"""
+    cost = ai_model.cost_per_request * usage['total_tokens']
+    ai_request.status = 'completed'
+    ai_request.output_data = output_data
+    ai_request.processing_time = processing_time
+    ai_request.cost = cost
+    record_request(ai_request)
+    record_usage_event(user, ai_model, tokens=usage['total_tokens'], cost=cost, success=True)
+
+
+def _fail_request(user, ai_model, ai_request, error_message):
+    """记录失败的请求"""
+    ai_request.status = 'failed'
+    ai_request.error_message = error_message
+    record_request(ai_request)
+    record_usage_event(user, ai_model, success=False)
+    SystemLog.log(
+        level='error',
+        module='ai',
+        action='chat_completion',
+        message=f'聊天完成失败: {error_message}',
+        user=user,
+        ai_model=ai_model.name,
+        error=error_message
+    )
 
 
 @api_view(['GET'])
@@ -503,3 +737,325 @@ def available_models(request):
         cache.set(cache_key, models, 300)
 
     return Response(models)
+
+
+def _dispatch_batch_job(job):
+    """投递批量推理任务到Celery"""
+    result = run_ai_batch_job.delay(job.id)
+    job.task_id = result.id
+    job.save(update_fields=['task_id', 'updated_at'])
+
+
+class BatchJobListView(generics.ListCreateAPIView):
+    """批量推理任务列表和创建（上传JSONL文件）"""
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PageNumberPagination
+
+    def get_serializer_class(self):
+        if self.request.method == 'POST':
+            return BatchJobCreateSerializer
+        return BatchJobSerializer
+
+    def get_queryset(self):
+        queryset = BatchJob.objects.filter(user=self.request.user, is_active=True).select_related('ai_model')
+        status_filter = self.request.query_params.get('status', None)
+        if status_filter:
+            queryset = queryset.filter(status=status_filter)
+        return queryset.order_by('-created_at')
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = serializer.save()
+        _dispatch_batch_job(job)
+        return Response(BatchJobSerializer(job).data, status=status.HTTP_201_CREATED)
+
+
+class BatchJobDetailView(generics.RetrieveAPIView):
+    """批量推理任务详情（含进度）"""
+    serializer_class = BatchJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return BatchJob.objects.filter(user=self.request.user, is_active=True).select_related('ai_model')
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def cancel_batch_job(request, pk):
+    """取消批量推理任务（正在执行的任务在当前段完成后停止）"""
+    updated = BatchJob.objects.filter(
+        id=pk, user=request.user, is_active=True, status__in=['pending', 'running']
+    ).update(status='cancelled', completed_at=timezone.now())
+    if not updated:
+        return Response({'error': '任务不存在或已结束'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'message': '任务已取消'})
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def resume_batch_job(request, pk):
+    """从断点继续已取消或失败的批量推理任务"""
+    job = get_object_or_404(BatchJob, id=pk, user=request.user, is_active=True)
+    updated = BatchJob.objects.filter(id=job.id, status__in=['cancelled', 'failed']).update(
+        status='pending', completed_at=None
+    )
+    if not updated:
+        return Response({'error': '只有已取消或失败的任务可以继续'}, status=status.HTTP_400_BAD_REQUEST)
+    job.refresh_from_db()
+    _dispatch_batch_job(job)
+    return Response(BatchJobSerializer(job).data)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def batch_job_results(request, pk):
+    """下载批量推理结果（JSONL，任务运行中时为已完成部分）"""
+    job = get_object_or_404(BatchJob, id=pk, user=request.user, is_active=True)
+    if not job.output_file or not job.processed_items:
+        return Response({'error': '暂无结果'}, status=status.HTTP_404_NOT_FOUND)
+    output = job.output_file.open('rb')
+    # 只返回已记录断点之前的内容，不包含正在写入的段
+    response = StreamingHttpResponse(
+        _read_until(output, job.checkpoint_offset),
+        content_type='application/jsonl'
+    )
+    response['Content-Length'] = job.checkpoint_offset
+    response['Content-Disposition'] = f'attachment; filename="batch-{job.id}-results.jsonl"'
+    return response
+
+
+def _read_until(file, limit: int, chunk_size: int = 64 * 1024):
+    """按块读取文件的前 limit 个字节"""
+    try:
+        remaining = limit
+        while remaining > 0:
+            data = file.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def _authenticate(request):
+    """复用DRF的认证类（Token/Session）认证普通Django请求"""
+    drf_request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    )
+    try:
+        user = drf_request.user
+    except exceptions.APIException:
+        return None
+    return user if user and user.is_authenticated else None
+
+
+def _format_sse(data) -> bytes:
+    """编码为SSE事件"""
+    if isinstance(data, str):
+        return f"data: {data}\n\n".encode('utf-8')
+    return f"data: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n".encode('utf-8')
+
+
+def _finish_stream_request(user, ai_model, ai_request, request_status, content, usage,
+                           processing_time, first_token_time, error_message):
+    """流结束后写入请求记录与使用统计"""
+    tokens = (usage or {}).get('total_tokens', 0)
+    cost = ai_model.cost_per_request * tokens
+
+    ai_request.status = request_status
+    ai_request.output_data = {
+        'choices': [{
+            'message': {
+                'role': 'assistant',
+                'content': content
+            },
+            'finish_reason': 'stop' if request_status == 'completed' else None
+        }],
+        'usage': usage or {'total_tokens': tokens}
+    }
+    ai_request.processing_time = processing_time
+    ai_request.cost = cost
+    ai_request.error_message = error_message or ''
+    ai_request.metadata = {**ai_request.metadata, 'stream': True, 'time_to_first_token': first_token_time}
+    record_request(ai_request)
+
+    record_usage_event(user, ai_model, tokens=tokens, cost=cost, success=request_status == 'completed')
+
+
+async def _relay_stream(stream, user, ai_model, ai_request, completion_id: str, model_name: str,
+                        prompt_messages):
+    """把提供商增量转发为OpenAI兼容的SSE数据块，流关闭后记录用量（提供商未返回用量时本地估算）
+
+    每个数据块都要等 send() 完成才会继续读取上游，客户端读得慢时上游读取随之暂停（背压）。
+    客户端断开时 backend/asgi.py 会取消当前任务，这里关闭上游流以释放连接。
+    """
+    start_time = time.monotonic()
+    first_token_time = None
+    content_parts = []
+    usage = None
+    request_status = 'cancelled'
+    error_message = ''
+
+    try:
+        async for chunk in stream:
+            if chunk.get('error'):
+                request_status = 'failed'
+                error_message = chunk.get('message', '')
+                yield _format_sse({'error': {'message': error_message}})
+                break
+
+            data = chunk.get('data') or {}
+            if data.get('usage'):
+                usage = data['usage']
+            delta = chunk.get('delta') or {}
+            if not delta:
+                continue
+            if delta.get('content'):
+                if first_token_time is None:
+                    first_token_time = time.monotonic() - start_time
+                content_parts.append(delta['content'])
+
+            yield _format_sse({
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model_name,
+                'choices': [{
+                    'index': 0,
+                    'delta': delta,
+                    'finish_reason': None
+                }]
+            })
+        else:
+            request_status = 'completed'
+            yield _format_sse({
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model_name,
+                'choices': [{
+                    'index': 0,
+                    'delta': {},
+                    'finish_reason': 'stop'
+                }],
+                'usage': usage
+            })
+            yield _format_sse('[DONE]')
+    finally:
+        # 主动关闭上游流，确保被取消时及时释放提供商连接
+        await stream.aclose()
+        content = ''.join(content_parts)
+        usage = _complete_usage(usage, prompt_messages, content, model_name)
+        if ai_model is not None:
+            record = sync_to_async(_finish_stream_request)(
+                user, ai_model, ai_request, request_status, content, usage,
+                time.monotonic() - start_time, first_token_time, error_message
+            )
+            await asyncio.shield(record)
+
+
+@csrf_exempt
+@require_POST
+async def chat_completion_stream(request):
+    """流式聊天完成接口（SSE，兼容OpenAI格式）
+
+    请求体与 chat/completions/ 相同；也可以传入 agent_id 和 message 与已创建的智能体流式对话。
+    需要以ASGI方式部署（backend.asgi.application）。
+    """
+    user = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse({'error': '身份认证信息未提供或无效'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        body = json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': '请求体不是有效的JSON'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if body.get('agent_id'):
+        agent = get_agent_manager().get_agent(body['agent_id'])
+        if agent is None:
+            return JsonResponse({'error': '智能体不存在'}, status=status.HTTP_404_NOT_FOUND)
+        message = body.get('message')
+        if not message:
+            return JsonResponse({'error': 'message不能为空'}, status=status.HTTP_400_BAD_REQUEST)
+
+        model_name = agent.model
+        input_data = {'agent_id': agent.agent_id, 'message': message}
+        prompt_messages = agent.get_messages(message)
+        ai_model = await AIModel.objects.filter(name=model_name, is_active=True).afirst()
+        stream = agent.stream_chat(message)
+    else:
+        serializer = ChatCompletionSerializer(data=body)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        model_name = serializer.validated_data['model']
+        input_data = serializer.validated_data
+        prompt_messages = input_data['messages']
+        ai_model = await AIModel.objects.filter(name=model_name, is_active=True).afirst()
+        if ai_model is None:
+            return JsonResponse({'error': '指定的AI模型不存在'}, status=status.HTTP_404_NOT_FOUND)
+        if not ai_model.is_available():
+            return JsonResponse({'error': 'AI模型当前不可用'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        try:
+            route = resolve_model(ai_model)
+        except ModelProviderError as e:
+            return JsonResponse({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        stream = get_ai_manager().stream_chat_completion(
+            route.provider_name,
+            input_data['messages'],
+            model=route.model,
+            priority=route.priority,
+            temperature=input_data['temperature'],
+            max_tokens=input_data['max_tokens'],
+            top_p=input_data['top_p']
+        )
+
+    completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+    ai_request = None
+    if ai_model is not None:
+        # 请求记录在流结束后由写入器批量插入
+        ai_request = AIRequest(
+            user=user,
+            ai_model=ai_model,
+            request_type='text',
+            input_data=input_data,
+            status='processing',
+            metadata={'completion_id': completion_id}
+        )
+
+    response = StreamingHttpResponse(
+        _relay_stream(stream, user, ai_model, ai_request, completion_id, model_name, prompt_messages),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # 关闭Nginx等反向代理的响应缓冲，保证首个Token尽快到达客户端
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_GET
+def provider_metrics(request):
+    """AI服务提供商调用指标（Prometheus文本格式，?format=json 返回JSON）
+
+    配置 AI_METRICS_TOKEN 后可用 Authorization: Bearer <token> 抓取，否则仅管理员可访问。
+    默认返回经共享缓存汇总的所有工作进程的指标，?scope=worker 只返回处理本次请求的进程的指标。
+    """
+    token = getattr(settings, 'AI_METRICS_TOKEN', None)
+    authorization = request.headers.get('Authorization', '')
+    if not (token and hmac.compare_digest(authorization.encode('utf-8'), f'Bearer {token}'.encode('utf-8'))):
+        user = _authenticate(request)
+        if user is None or not user.is_staff:
+            return JsonResponse({'error': '无权访问指标'}, status=status.HTTP_403_FORBIDDEN)
+
+    if request.GET.get('scope') == 'worker':
+        telemetry = get_provider_telemetry()
+    else:
+        telemetry = collect_provider_telemetry()
+    if request.GET.get('format') == 'json':
+        return JsonResponse(telemetry.snapshot())
+    return HttpResponse(telemetry.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
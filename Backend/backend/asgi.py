@@ -7,10 +7,76 @@ For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
 
+import asyncio
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# 流式响应路径：客户端断开连接时取消请求处理，从而取消上游AI请求
+STREAMING_PATHS = (
+    '/api/v1/ai/chat/completions/stream/',
+)
+
+
+async def lifespan(receive, send):
+    """处理服务器的 lifespan 事件：启动时预建AI提供商连接池并预热，关闭时释放连接池"""
+    from server.ai_manager import get_ai_manager
+
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await get_ai_manager().startup()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            try:
+                await get_ai_manager().shutdown()
+            except Exception as e:
+                await send({'type': 'lifespan.shutdown.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI入口：处理 lifespan 事件；流式路径在读取完请求体后监听 http.disconnect"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http' or not scope['path'].startswith(STREAMING_PATHS):
+        return await django_application(scope, receive, send)
+
+    body_received = asyncio.Event()
+
+    async def tracked_receive():
+        message = await receive()
+        if message['type'] != 'http.request' or not message.get('more_body', False):
+            body_received.set()
+        return message
+
+    async def wait_disconnect():
+        # Django读取完请求体后不会再调用receive，此后由这里独占接收断开消息
+        await body_received.wait()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    handler = asyncio.ensure_future(django_application(scope, tracked_receive, send))
+    watcher = asyncio.ensure_future(wait_disconnect())
+    try:
+        await asyncio.wait({handler, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not handler.done():
+            handler.cancel()
+        try:
+            await handler
+        except asyncio.CancelledError:
+            pass
@@ -395,6 +395,33 @@ API_VERSION = 'v1'
 AI_DEFAULT_MODEL = 'gpt-3.5-turbo'
 AI_MAX_TOKENS = 4096
 AI_TEMPERATURE = 0.7
+# 使用统计写回缓冲区：redis（多进程共享，由 flush_ai_usage 任务写入）或 local（进程内，后台线程写入）
+AI_USAGE_BUFFER = config('AI_USAGE_BUFFER', default='redis')
+AI_USAGE_REDIS_URL = config('AI_USAGE_REDIS_URL', default=config('REDIS_URL', default='redis://127.0.0.1:6379/1'))
+AI_USAGE_FLUSH_INTERVAL = config('AI_USAGE_FLUSH_INTERVAL', default=10, cast=int)
+
+# AI模型速率限制（AIModel.max_requests_per_minute）的共享令牌桶；设为空字符串时各进程分别限制
+AI_RATE_LIMIT_REDIS_URL = config('AI_RATE_LIMIT_REDIS_URL', default=config('REDIS_URL', default='redis://127.0.0.1:6379/1'))
+
+# AI响应缓存：AIManager.configure_response_cache 的参数（如 {'backend': 'django', 'models': {'*': {'ttl': 300}}}），
+# 为空时不缓存响应
+AI_RESPONSE_CACHE = {}
+
+# AI请求归档：超过保留天数的请求按月写入压缩文件（默认存储的 AI_REQUEST_ARCHIVE_DIR 下）并从请求表删除
+AI_REQUEST_ARCHIVE_DAYS = config('AI_REQUEST_ARCHIVE_DAYS', default=90, cast=int)
+AI_REQUEST_ARCHIVE_DIR = config('AI_REQUEST_ARCHIVE_DIR', default='ai_archive/requests')
+
+# 定期写入使用统计（DatabaseScheduler 启动时同步到数据库）
+CELERY_BEAT_SCHEDULE = {
+    'flush-ai-usage': {
+        'task': 'flush_ai_usage',
+        'schedule': AI_USAGE_FLUSH_INTERVAL,
+    },
+    'archive-ai-requests': {
+        'task': 'archive_ai_requests',
+        'schedule': 24 * 60 * 60,
+    },
+}
 
 # 元宇宙模块设置
 METAVERSE_MAX_WORLD_CAPACITY = 1000
@@ -0,0 +1,304 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from .token_estimator import estimate_tokens, MESSAGE_OVERHEAD
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BaseMemoryBackend(ABC):
+    """智能体对话记忆存储后端
+
+    每个会话保存一段滚动摘要和摘要之后的消息列表。
+    """
+
+    @abstractmethod
+    async def load(self, session_id: str) -> Dict[str, Any]:
+        """读取会话，返回 {'summary': str, 'messages': [{'role', 'content'}]}"""
+        pass
+
+    @abstractmethod
+    async def append(self, session_id: str, messages: List[Dict[str, str]]):
+        """追加消息"""
+        pass
+
+    @abstractmethod
+    async def fold(self, session_id: str, summary: str, count: int):
+        """把最早的 count 条消息折叠进摘要（摘要替换原有摘要）"""
+        pass
+
+    @abstractmethod
+    async def clear(self, session_id: str):
+        """清除会话"""
+        pass
+
+
+class InMemoryBackend(BaseMemoryBackend):
+    """进程内存储（重启丢失，不跨进程共享）"""
+
+    def __init__(self):
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+
+    def _session(self, session_id: str) -> Dict[str, Any]:
+        return self.sessions.setdefault(session_id, {'summary': '', 'messages': []})
+
+    async def load(self, session_id: str) -> Dict[str, Any]:
+        session = self._session(session_id)
+        return {'summary': session['summary'], 'messages': list(session['messages'])}
+
+    async def append(self, session_id: str, messages: List[Dict[str, str]]):
+        self._session(session_id)['messages'].extend(messages)
+
+    async def fold(self, session_id: str, summary: str, count: int):
+        session = self._session(session_id)
+        session['summary'] = summary
+        del session['messages'][:count]
+
+    async def clear(self, session_id: str):
+        self.sessions.pop(session_id, None)
+
+
+class RedisMemoryBackend(BaseMemoryBackend):
+    """Redis存储：消息保存在列表中，摘要保存在字符串键中，可跨工作进程共享"""
+
+    def __init__(self, url: str = 'redis://127.0.0.1:6379/1', key_prefix: str = 'agent:memory:',
+                 ttl: Optional[int] = 7 * 24 * 3600, max_messages: int = 1000):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+        # 兜底上限，防止摘要未开启时列表无限增长
+        self.max_messages = max_messages
+
+    def _keys(self, session_id: str):
+        return f"{self.key_prefix}{session_id}:messages", f"{self.key_prefix}{session_id}:summary"
+
+    async def load(self, session_id: str) -> Dict[str, Any]:
+        messages_key, summary_key = self._keys(session_id)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.get(summary_key)
+            pipe.lrange(messages_key, 0, -1)
+            summary, messages = await pipe.execute()
+        return {
+            'summary': summary.decode('utf-8') if summary else '',
+            'messages': [json.loads(message) for message in messages]
+        }
+
+    async def append(self, session_id: str, messages: List[Dict[str, str]]):
+        if not messages:
+            return
+        messages_key, summary_key = self._keys(session_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.rpush(messages_key, *(json.dumps(message, ensure_ascii=False) for message in messages))
+            pipe.ltrim(messages_key, -self.max_messages, -1)
+            if self.ttl:
+                pipe.expire(messages_key, self.ttl)
+                pipe.expire(summary_key, self.ttl)
+            await pipe.execute()
+
+    async def fold(self, session_id: str, summary: str, count: int):
+        messages_key, summary_key = self._keys(session_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.set(summary_key, summary, ex=self.ttl)
+            pipe.ltrim(messages_key, count, -1)
+            await pipe.execute()
+
+    async def clear(self, session_id: str):
+        await self.client.delete(*self._keys(session_id))
+
+
+class ConversationMemoryBackend(BaseMemoryBackend):
+    """Django存储：session_id 为 ChatConversation 的ID，消息保存为 ChatMessage
+
+    摘要保存为一条不显示的系统消息（is_active=False），metadata 记录其覆盖到的最后一条消息ID。
+    """
+
+    def __init__(self, token_counter: Callable[[str], int] = estimate_tokens):
+        from apps.ai.models import ChatMessage
+        self.message_model = ChatMessage
+        self.token_counter = token_counter
+
+    async def _latest_summary(self, session_id: str):
+        return await self.message_model.objects.filter(
+            conversation_id=session_id,
+            role='system',
+            is_active=False,
+            metadata__summary=True
+        ).order_by('-id').afirst()
+
+    def _messages_after(self, session_id: str, summary):
+        queryset = self.message_model.objects.filter(
+            conversation_id=session_id,
+            role__in=['user', 'assistant'],
+            is_active=True
+        )
+        if summary is not None:
+            queryset = queryset.filter(id__gt=summary.metadata.get('covers_until', 0))
+        return queryset.order_by('id')
+
+    async def load(self, session_id: str) -> Dict[str, Any]:
+        summary = await self._latest_summary(session_id)
+        messages = [
+            {'role': role, 'content': content}
+            async for role, content in self._messages_after(session_id, summary).values_list('role', 'content')
+        ]
+        return {
+            'summary': summary.content if summary else '',
+            'messages': messages
+        }
+
+    async def append(self, session_id: str, messages: List[Dict[str, str]]):
+        # 逐条创建以触发 chat_message_created 信号（更新对话统计）
+        for message in messages:
+            await self.message_model.objects.acreate(
+                conversation_id=session_id,
+                role=message['role'],
+                content=message['content'],
+                tokens=self.token_counter(message['content'])
+            )
+
+    async def fold(self, session_id: str, summary: str, count: int):
+        previous = await self._latest_summary(session_id)
+        ids = [
+            message_id
+            async for message_id in self._messages_after(session_id, previous).values_list('id', flat=True)[:count]
+        ]
+        if not ids:
+            return
+        await self.message_model.objects.acreate(
+            conversation_id=session_id,
+            role='system',
+            content=summary,
+            is_active=False,
+            metadata={'summary': True, 'covers_until': ids[-1]}
+        )
+
+    async def clear(self, session_id: str):
+        await self.message_model.objects.filter(
+            conversation_id=session_id,
+            role='system',
+            is_active=False,
+            metadata__summary=True
+        ).adelete()
+        await self.message_model.objects.filter(conversation_id=session_id).aupdate(is_active=False)
+
+
+SUMMARY_PROMPT = (
+    "请把下面的对话内容与已有摘要合并成一段简洁的摘要，保留用户的关键信息、偏好、"
+    "已确认的结论和未完成的事项，不要编造内容。"
+)
+
+
+def make_llm_summarizer(ai_manager, provider_name: str, model: Optional[str] = None,
+                        max_tokens: int = 512) -> Callable[[str, List[Dict[str, str]]], Awaitable[Optional[str]]]:
+    """使用AI模型生成滚动摘要"""
+
+    async def summarize(summary: str, messages: List[Dict[str, str]]) -> Optional[str]:
+        transcript = '\n'.join(f"{message['role']}: {message['content']}" for message in messages)
+        content = f"已有摘要:\n{summary or '无'}\n\n对话内容:\n{transcript}"
+        params = {'model': model} if model else {}
+        result = await ai_manager.chat_completion(
+            provider_name,
+            [
+                {'role': 'system', 'content': SUMMARY_PROMPT},
+                {'role': 'user', 'content': content}
+            ],
+            temperature=0.2,
+            max_tokens=max_tokens,
+            **params
+        )
+        if not result.get('success'):
+            logger.warning(f"对话摘要生成失败: {result.get('message')}")
+            return None
+        return result.get('content')
+
+    return summarize
+
+
+class ConversationMemory:
+    """智能体对话记忆
+
+    按Token预算截断历史：从最新的消息向前选取，直到达到 max_tokens。
+    配置 summarizer 后，未摘要的历史超过 summarize_threshold 时，把超出预算的较早消息
+    折叠进滚动摘要，摘要以系统消息的形式放在历史之前。
+    """
+
+    def __init__(self, backend: Optional[BaseMemoryBackend] = None, max_tokens: int = 2000,
+                 token_counter: Callable[[str], int] = estimate_tokens,
+                 summarizer: Optional[Callable[[str, List[Dict[str, str]]], Awaitable[Optional[str]]]] = None,
+                 summarize_threshold: Optional[int] = None):
+        self.backend = backend or InMemoryBackend()
+        self.max_tokens = max_tokens
+        self.token_counter = token_counter
+        self.summarizer = summarizer
+        self.summarize_threshold = summarize_threshold or max_tokens * 2
+
+    def count_message(self, message: Dict[str, str]) -> int:
+        """单条消息的Token数（含角色等格式开销）"""
+        content = message.get('content')
+        return self.token_counter(content if isinstance(content, str) else str(content)) + MESSAGE_OVERHEAD
+
+    def _split_by_budget(self, messages: List[Dict[str, str]], budget: int) -> int:
+        """返回在预算内能保留的最早消息下标"""
+        used = 0
+        start = len(messages)
+        while start > 0:
+            cost = self.count_message(messages[start - 1])
+            if used + cost > budget:
+                break
+            used += cost
+            start -= 1
+        # 不从助手回复开始，避免丢失对应的用户提问
+        while start < len(messages) and messages[start].get('role') == 'assistant':
+            start += 1
+        return start
+
+    async def get_history(self, session_id: str, max_tokens: Optional[int] = None) -> List[Dict[str, str]]:
+        """读取预算内的历史消息（含摘要）"""
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        state = await self.backend.load(session_id)
+
+        history = []
+        if state['summary']:
+            summary_message = {'role': 'system', 'content': f"之前对话的摘要：{state['summary']}"}
+            budget -= self.count_message(summary_message)
+            history.append(summary_message)
+
+        messages = state['messages']
+        history.extend(messages[self._split_by_budget(messages, max(budget, 0)):])
+        return history
+
+    async def add_turn(self, session_id: str, user_message: str, assistant_message: str):
+        """记录一轮对话，必要时折叠较早的消息"""
+        await self.backend.append(session_id, [
+            {'role': 'user', 'content': user_message},
+            {'role': 'assistant', 'content': assistant_message}
+        ])
+        if self.summarizer is not None:
+            await self.maybe_summarize(session_id)
+
+    async def maybe_summarize(self, session_id: str) -> bool:
+        """未摘要的历史超过阈值时生成新的滚动摘要"""
+        state = await self.backend.load(session_id)
+        messages = state['messages']
+        if sum(self.count_message(message) for message in messages) <= self.summarize_threshold:
+            return False
+
+        count = self._split_by_budget(messages, self.max_tokens)
+        if count <= 0:
+            return False
+        try:
+            summary = await self.summarizer(state['summary'], messages[:count])
+        except Exception as e:
+            logger.warning(f"对话摘要生成失败: {session_id} - {str(e)}")
+            return False
+        if not summary:
+            return False
+
+        await self.backend.fold(session_id, summary, count)
+        return True
+
+    async def clear(self, session_id: str):
+        """清除会话记忆"""
+        await self.backend.clear(session_id)
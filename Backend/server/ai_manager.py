@@ -1,16 +1,51 @@
 import asyncio
-from typing import Dict, Any, List, Optional, Type
+import hashlib
+import math
+import time
+from collections import Counter
+from typing import Dict, Any, AsyncIterator, List, Optional, Type, Union
 from .ai_providers.base import BaseAIProvider, MultiModalProvider, AgentProvider
 from .ai_providers.siliconflow import SiliconFlowProvider
 from .ai_providers.alibaba_bailian import AlibabaBailianProvider
 from .ai_providers.openrouter import OpenRouterProvider
 from .ai_providers.volcengine_ark import VolcengineArkProvider
 from .ai_providers.baidu_qianfan import BaiduQianfanProvider
+from .ai_providers.routed import RoutedProvider
+from .ai_providers.media import MediaInput, is_remote_media, read_media
+from .hedging import HedgePolicy
+from .response_cache import ResponseCache, LocalCacheBackend, DjangoCacheBackend
+from .embedding_batcher import EmbeddingBatcher
+from .rate_limiter import RateLimiter
+from .image_preprocessor import ImagePreprocessor
+from .tts_cache import TTSCache, DiskAudioBackend, RedisAudioBackend, iter_audio_chunks
+from .single_flight import SingleFlight
+from .token_estimator import check_budget, fit_messages, get_context_window
+from .agent_memory import (
+    ConversationMemory, InMemoryBackend, RedisMemoryBackend, ConversationMemoryBackend,
+    make_llm_summarizer
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# chat_completion_many 的聚合策略
+FANOUT_STRATEGIES = ('all', 'first', 'majority')
+
+
+def normalize_vote(content: Optional[str]) -> Optional[str]:
+    """多数表决前归一化回答：去除首尾空白、引号和句末标点，忽略大小写"""
+    if not content:
+        return None
+    label = content.strip().strip('"\'`“”‘’').rstrip('。.!！').strip()
+    return label.casefold() or None
+
+
+def _normalize_vector(vector: List[float]) -> List[float]:
+    """归一化向量（与嵌入存储中保存的向量一致）"""
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm else list(vector)
+
 class AIManager:
     """AI服务管理器"""
 
@@ -21,20 +56,155 @@ class AIManager:
             'ALIBABA_BAILIAN': AlibabaBailianProvider,
             'OPENROUTER': OpenRouterProvider,
             'VOLCENGINE_ARK': VolcengineArkProvider,
-            'BAIDU_QIANFAN': BaiduQianfanProvider
+            'BAIDU_QIANFAN': BaiduQianfanProvider,
+            'ROUTED': RoutedProvider
+        }
+        # 被重新注册替换下来、尚未关闭的提供商：有运行中的事件循环时由后台任务在进行中的调用结束后关闭，
+        # 其余在关闭时统一释放连接池
+        self._retired_providers: List[BaseAIProvider] = []
+        self._retire_tasks: Dict[BaseAIProvider, asyncio.Task] = {}
+        self.hedge_policy = HedgePolicy()
+        self.response_cache: Optional[ResponseCache] = None
+        # 嵌入请求合并器，按 (事件循环, 提供商, 模型) 维护
+        self._embedding_batchers: Dict[tuple, EmbeddingBatcher] = {}
+        self.embedding_stores = None
+        self.rate_limiter: Optional[RateLimiter] = None
+        self.image_preprocessor: Optional[ImagePreprocessor] = None
+        self.image_preprocessing_providers: set = set()
+        self.tts_cache: Optional[TTSCache] = None
+        self.single_flight: Optional[SingleFlight] = None
+
+    def configure_response_cache(self, backend: str = 'django', cache_alias: str = 'default',
+                                 semantic_provider: Optional[str] = None,
+                                 semantic_model: Optional[str] = None, **cache_config):
+        """配置响应缓存
+
+        backend 为 'django' 时使用 settings.CACHES（django-redis），'local' 时使用进程内LRU。
+        指定 semantic_provider 后，开启了 semantic 的模型会基于文本嵌入做语义近邻匹配。
+        """
+        if backend == 'django':
+            cache_backend = DjangoCacheBackend(cache_alias)
+        else:
+            cache_backend = LocalCacheBackend(cache_config.pop('max_entries', 10000))
+
+        async def _embed(texts: List[str]) -> Optional[List[List[float]]]:
+            params = {'model': semantic_model} if semantic_model else {}
+            result = await self.embeddings(semantic_provider, texts, **params)
+            return result.get('embeddings') if result.get('success') else None
+
+        self.response_cache = ResponseCache(
+            backend=cache_backend, embed_fn=_embed if semantic_provider else None, **cache_config
+        )
+        return self.response_cache
+
+    def configure_embedding_store(self, base_dir: str, **store_config):
+        """配置持久化嵌入存储：已计算过的文本嵌入直接从本地读取"""
+        from .embedding_store import EmbeddingStoreRegistry
+        self.embedding_stores = EmbeddingStoreRegistry(base_dir, **store_config)
+        return self.embedding_stores
+
+    def configure_rate_limiter(self, redis_url: Optional[str] = None, **limiter_config):
+        """配置速率限制：指定 redis_url 时各工作进程共享同一请求预算，否则仅限制当前进程"""
+        self.rate_limiter = RateLimiter(redis_url=redis_url, **limiter_config)
+
+    def set_rate_limit(self, provider_name: str, model: Optional[str], requests_per_minute: Optional[int] = None,
+                       max_concurrent: Optional[int] = None, burst: Optional[float] = None):
+        """设置 (提供商, 模型) 的每分钟请求数与并发上限（如 AIModel.max_requests_per_minute）"""
+        if self.rate_limiter is None:
+            self.configure_rate_limiter()
+        self.rate_limiter.set_limit(provider_name, model, requests_per_minute, max_concurrent, burst)
+
+    def _rate_limit_error(self, provider_name: str, model: Optional[str]) -> Dict[str, Any]:
+        return {
+            'error': True,
+            'message': f'请求排队超时, 已达到速率限制: {provider_name}/{model or "*"}',
+            'retryable': True,
+            'status': 429
         }
 
+    async def _call_limited(self, provider_name: str, model: Optional[str], priority: int, call) -> Dict[str, Any]:
+        """在速率限制下调用提供商，并把结果反馈给限流器"""
+        if self.rate_limiter is None:
+            return await call()
+        async with self.rate_limiter.slot(provider_name, model, priority) as granted:
+            if not granted:
+                return self._rate_limit_error(provider_name, model)
+            result = await call()
+        await self.rate_limiter.feedback(provider_name, model, result)
+        return result
+
+    def configure_image_preprocessing(self, providers: tuple = ('VOLCENGINE_ARK', 'ALIBABA_BAILIAN'),
+                                      cache_backend: Optional[str] = 'django', cache_alias: str = 'default',
+                                      **preprocessor_config):
+        """配置图像输入预处理：对指定提供商的图像分析请求先缩放、重新编码，并按感知哈希缓存分析结果
+
+        cache_backend 为 'django' 时使用 settings.CACHES，'local' 时使用进程内LRU，None 时不缓存结果。
+        """
+        if cache_backend == 'django':
+            result_cache = DjangoCacheBackend(cache_alias)
+        elif cache_backend == 'local':
+            result_cache = LocalCacheBackend(preprocessor_config.pop('max_cache_entries', 1000))
+        else:
+            result_cache = None
+        if self.image_preprocessor is not None:
+            self.image_preprocessor.shutdown()
+        self.image_preprocessor = ImagePreprocessor(result_cache=result_cache, **preprocessor_config)
+        self.image_preprocessing_providers = set(providers)
+
+    async def _prepare_image(self, data: MediaInput, model: Optional[str]) -> Optional[Dict[str, Any]]:
+        """预处理单张图像，无法解码的图像返回None（按原图发送）"""
+        try:
+            return await self.image_preprocessor.prepare(await read_media(data), model)
+        except Exception as e:
+            logger.warning(f"图像预处理失败, 按原图发送: {str(e)}")
+            return None
+
+    def configure_tts_cache(self, backend: str = 'disk', directory: Optional[str] = None,
+                            redis_url: Optional[str] = None, max_bytes: Optional[int] = None, **cache_config):
+        """配置语音合成缓存
+
+        backend 为 'disk' 时音频写入 directory，'redis' 时存入 redis_url；总大小超过 max_bytes 时按LRU淘汰。
+        """
+        if backend == 'redis':
+            backend_config = {'max_bytes': max_bytes} if max_bytes else {}
+            if 'key_prefix' in cache_config:
+                backend_config['key_prefix'] = cache_config.pop('key_prefix')
+            audio_backend = RedisAudioBackend(redis_url or 'redis://127.0.0.1:6379/1', **backend_config)
+        else:
+            if not directory:
+                raise ValueError('磁盘语音合成缓存需要指定 directory')
+            audio_backend = DiskAudioBackend(directory, **({'max_bytes': max_bytes} if max_bytes else {}))
+        self.tts_cache = TTSCache(audio_backend, **cache_config)
+        return self.tts_cache
+
+    def configure_single_flight(self, redis_url: Optional[str] = None, **flight_config):
+        """配置相同请求合并：指定 redis_url 时在工作进程间合并，否则仅合并当前进程内的请求"""
+        self.single_flight = SingleFlight(redis_url=redis_url, **flight_config)
+        return self.single_flight
+
+    def configure_hedging(self, **policy_config):
+        """配置对冲请求策略（分位数、预算比例、延迟下限等）"""
+        self.hedge_policy = HedgePolicy(**policy_config)
+
     def register_provider(self, provider_name: str, api_key: str, api_url: str, **kwargs) -> bool:
-        """注册AI服务提供商"""
+        """注册AI服务提供商（provider_type 指定提供商类型时，可用任意名称注册同类型的多个实例）"""
         try:
-            if provider_name not in self.provider_classes:
-                logger.error(f"不支持的AI服务提供商: {provider_name}")
+            provider_type = kwargs.pop('provider_type', None) or provider_name
+            if provider_type not in self.provider_classes:
+                logger.error(f"不支持的AI服务提供商: {provider_type}")
                 return False
 
-            provider_class = self.provider_classes[provider_name]
+            provider_class = self.provider_classes[provider_type]
+            kwargs.setdefault('name', provider_name)
+            if issubclass(provider_class, RoutedProvider):
+                # 路由提供商通过管理器解析上游提供商
+                kwargs.setdefault('provider_resolver', self.get_provider)
             provider = provider_class(api_key, api_url, **kwargs)
 
             if provider.validate_config():
+                old_provider = self.providers.get(provider_name)
+                if old_provider is not None:
+                    self._retire_provider(old_provider)
                 self.providers[provider_name] = provider
                 logger.info(f"成功注册AI服务提供商: {provider_name}")
                 return True
@@ -46,6 +216,46 @@ class AIManager:
             logger.error(f"注册AI服务提供商失败: {provider_name} - {str(e)}")
             return False
 
+    def unregister_provider(self, provider_name: str) -> bool:
+        """注销AI服务提供商（进行中的调用结束后释放连接池）"""
+        provider = self.providers.pop(provider_name, None)
+        if provider is None:
+            return False
+        self._retire_provider(provider)
+        logger.info(f"已注销AI服务提供商: {provider_name}")
+        return True
+
+    def _retire_provider(self, provider: BaseAIProvider):
+        """在后台等待提供商进行中的调用结束后关闭其连接池；没有运行中的事件循环时留到下次启动或关闭时释放"""
+        self._retired_providers.append(provider)
+        self._schedule_retired_close()
+
+    def _schedule_retired_close(self):
+        """为尚未安排关闭的被替换提供商创建后台关闭任务"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        for provider in self._retired_providers:
+            task = self._retire_tasks.get(provider)
+            if task is not None and not task.done() and not task.get_loop().is_closed():
+                continue
+            self._retire_tasks[provider] = loop.create_task(self._close_retired_provider(provider))
+
+    async def _close_retired_provider(self, provider: BaseAIProvider, poll_interval: float = 0.5):
+        # 调用最长持续 provider.timeout 秒（aiohttp 的总超时），超过后不再等待
+        deadline = time.monotonic() + provider.timeout + poll_interval
+        while provider.active_calls > 0 and time.monotonic() < deadline:
+            await asyncio.sleep(poll_interval)
+        self._retire_tasks.pop(provider, None)
+        if provider not in self._retired_providers:
+            return
+        self._retired_providers.remove(provider)
+        try:
+            await provider.aclose()
+        except Exception as e:
+            logger.warning(f"关闭已替换的AI服务提供商失败: {provider.name} - {str(e)}")
+
     def get_provider(self, provider_name: str) -> Optional[BaseAIProvider]:
         """获取AI服务提供商"""
         return self.providers.get(provider_name)
@@ -54,8 +264,60 @@ class AIManager:
         """列出所有已注册的提供商"""
         return list(self.providers.keys())
 
-    async def chat_completion(self, provider_name: str, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
-        """聊天完成"""
+    async def startup(self):
+        """启动：为已注册的提供商预建当前事件循环下的连接池，并预取访问令牌等"""
+        self._schedule_retired_close()
+        for provider in self.providers.values():
+            provider.get_session()
+        warm_ups = [provider.warm_up() for provider in self.providers.values() if hasattr(provider, 'warm_up')]
+        for result in await asyncio.gather(*warm_ups, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.warning(f"AI服务提供商预热失败: {str(result)}")
+        logger.info(f"AI服务管理器已启动, 提供商: {self.list_providers()}")
+
+    async def shutdown(self):
+        """关闭：释放所有提供商的HTTP连接池"""
+        # 不再等待被替换提供商的进行中调用
+        retiring, self._retire_tasks = self._retire_tasks, {}
+        current_loop = asyncio.get_running_loop()
+        retiring = [task for task in retiring.values() if task.get_loop() is current_loop]
+        for task in retiring:
+            task.cancel()
+        await asyncio.gather(*retiring, return_exceptions=True)
+        providers = list(self.providers.values()) + self._retired_providers
+        self._retired_providers = []
+        await asyncio.gather(
+            *(provider.aclose() for provider in providers),
+            return_exceptions=True
+        )
+        if self.rate_limiter is not None:
+            await self.rate_limiter.aclose()
+        if self.embedding_stores is not None:
+            await asyncio.to_thread(self.embedding_stores.close)
+        if self.image_preprocessor is not None:
+            self.image_preprocessor.shutdown()
+        logger.info("AI服务管理器已关闭, HTTP连接池已释放")
+
+    async def release_sessions(self):
+        """释放当前事件循环下各提供商的连接池（Celery任务等在结束事件循环前调用）"""
+        await asyncio.gather(
+            *(provider.release_session() for provider in self.providers.values()),
+            return_exceptions=True
+        )
+        if self.rate_limiter is not None:
+            await self.rate_limiter.aclose()
+
+    async def chat_completion(self, provider_name: str, messages: List[Dict[str, str]],
+                              hedge_provider: Optional[str] = None, hedge_model: Optional[str] = None,
+                              **kwargs) -> Dict[str, Any]:
+        """聊天完成
+
+        传入 hedge_provider 开启对冲请求：主提供商超过其延迟分位数仍未返回时，
+        向对冲提供商发送相同请求，先成功者胜出，另一请求被取消。
+        已配置响应缓存时，确定性请求优先读取缓存；传入 use_cache=False 可跳过。
+        已配置速率限制时，超出限制的请求按 priority（越大越优先）排队等待。
+        已配置请求合并时，与进行中请求完全相同的请求等待并共享其结果；传入 coalesce=False 可跳过。
+        """
         provider = self.get_provider(provider_name)
         if not provider:
             return {
@@ -63,7 +325,251 @@ class AIManager:
                 'message': f'AI服务提供商未找到: {provider_name}'
             }
 
-        return await provider.chat_completion(messages, **kwargs)
+        priority = kwargs.pop('priority', 0)
+        budget_error = self.apply_token_budget(messages, kwargs)
+        if budget_error:
+            return budget_error
+
+        use_cache = kwargs.pop('use_cache', True) and self.response_cache is not None
+        coalesce = kwargs.pop('coalesce', True) and self.single_flight is not None
+        if use_cache:
+            cached = await self.response_cache.get(provider_name, messages, kwargs)
+            if cached is not None:
+                return cached
+
+        async def upstream_call():
+            if hedge_provider and hedge_provider != provider_name and self.get_provider(hedge_provider):
+                result = await self._call_limited(provider_name, kwargs.get('model'), priority, lambda: (
+                    self._hedged_chat_completion(
+                        provider_name, provider, hedge_provider, hedge_model, messages, priority=priority, **kwargs
+                    )
+                ))
+            else:
+                async def timed_call():
+                    # 延迟统计不含排队时间
+                    start_time = time.monotonic()
+                    response = await provider.chat_completion(messages, **kwargs)
+                    if response.get('success'):
+                        self.hedge_policy.record_latency(provider_name, time.monotonic() - start_time)
+                    return response
+
+                result = await self._call_limited(provider_name, kwargs.get('model'), priority, timed_call)
+
+            if use_cache and result.get('success'):
+                await self.response_cache.set(provider_name, messages, kwargs, result)
+            return result
+
+        if coalesce and self.single_flight.should_coalesce(kwargs):
+            # 合并的请求只由第一个调用方写入缓存、占用速率限制配额
+            key = self.single_flight.build_key(provider_name, messages, kwargs)
+            return await self.single_flight.do(key, upstream_call)
+        return await upstream_call()
+
+    def apply_token_budget(self, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """请求前估算提示词Token数：超出上下文长度时直接返回错误，否则按剩余空间收紧 max_tokens
+
+        上下文长度取 params 中的 context_window 或按模型名推断，未知模型不做检查。
+        """
+        budget = check_budget(
+            messages, params.get('model'), params.get('max_tokens'), params.pop('context_window', None)
+        )
+        if not budget['fits']:
+            return {
+                'error': True,
+                'message': f"请求超出模型上下文长度: 预计 {budget['prompt_tokens']} Token, 上限 {budget['context_window']}",
+                'retryable': False,
+                'prompt_tokens': budget['prompt_tokens']
+            }
+        if budget['max_tokens'] is not None and budget['max_tokens'] != params.get('max_tokens'):
+            logger.debug(f"max_tokens 按上下文长度收紧: {params.get('max_tokens')} -> {budget['max_tokens']}")
+            params['max_tokens'] = budget['max_tokens']
+        return None
+
+    async def _hedged_chat_completion(self, provider_name: str, provider: BaseAIProvider,
+                                      hedge_provider: str, hedge_model: Optional[str],
+                                      messages: List[Dict[str, str]], priority: int = 0, **kwargs) -> Dict[str, Any]:
+        """对冲请求：先成功者胜出，取消落后的请求
+
+        对冲请求同样受对冲提供商的速率限制，排队优先级低于主请求。
+        """
+        policy = self.hedge_policy
+        policy.on_request()
+
+        start_time = time.monotonic()
+        primary = asyncio.ensure_future(provider.chat_completion(messages, **kwargs))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=policy.hedge_delay(provider_name))
+            if done or not policy.try_acquire():
+                result = await primary
+                if result.get('success'):
+                    policy.record_latency(provider_name, time.monotonic() - start_time)
+                return result
+
+            hedge_kwargs = dict(kwargs)
+            if hedge_model:
+                hedge_kwargs['model'] = hedge_model
+            started = {provider_name: start_time}
+
+            async def hedge_call():
+                # 延迟统计不含排队时间
+                started[hedge_provider] = time.monotonic()
+                return await self.get_provider(hedge_provider).chat_completion(messages, **hedge_kwargs)
+
+            hedge = asyncio.ensure_future(
+                self._call_limited(hedge_provider, hedge_kwargs.get('model'), priority - 1, hedge_call)
+            )
+            tasks.append(hedge)
+            owners = {primary: provider_name, hedge: hedge_provider}
+            logger.info(f"发起对冲请求: {provider_name} -> {hedge_provider}")
+
+            pending = {primary, hedge}
+            errors: Dict[asyncio.Future, Dict[str, Any]] = {}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = owners[task]
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        result = await provider.handle_error(e, "chat_completion")
+                    if result.get('success'):
+                        policy.record_latency(name, time.monotonic() - started[name])
+                        result['provider'] = name
+                        result['hedged'] = True
+                        return result
+                    errors[task] = result
+
+            # 两路均失败时优先返回主请求的错误
+            return errors.get(primary) or errors.get(hedge)
+        finally:
+            # 取消落后或被放弃的请求
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def chat_completion_many(self, targets: List[Union[str, Dict[str, Any]]], messages: List[Dict[str, str]],
+                                   strategy: str = 'all', deadline: Optional[float] = None,
+                                   **kwargs) -> Dict[str, Any]:
+        """并发向多个提供商/模型发送相同消息（模型对比、集成调用）
+
+        targets 中每项为提供商名称，或 {'provider', 'model', 其余参数} 字典（覆盖公共参数）。
+        strategy：'all' 等待全部结果；'first' 取最先成功的结果并取消其余请求；
+        'majority' 对归一化后的回答多数表决（用于分类提示词），某个答案已过半数时提前结束。
+        deadline 为整体时限（秒），到期未返回的请求被取消并标记为超时，其余结果照常返回。
+        每个请求都经过 chat_completion，因此同样适用响应缓存、Token预算和速率限制。
+        """
+        if strategy not in FANOUT_STRATEGIES:
+            return {'error': True, 'message': f'不支持的聚合策略: {strategy}', 'retryable': False}
+        if not targets:
+            return {'error': True, 'message': '未指定请求目标', 'retryable': False}
+
+        specs = []
+        for target in targets:
+            spec = {'provider': target} if isinstance(target, str) else dict(target)
+            params = {**kwargs, **{key: value for key, value in spec.items() if key != 'provider'}}
+            specs.append((spec['provider'], params))
+
+        async def call(provider_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+            start_time = time.monotonic()
+            try:
+                result = await self.chat_completion(provider_name, messages, **params)
+            except Exception as e:
+                result = {'error': True, 'message': str(e) or e.__class__.__name__, 'retryable': False}
+            return {'model': params.get('model'), **result, 'provider': provider_name,
+                    'latency': time.monotonic() - start_time}
+
+        tasks = [asyncio.ensure_future(call(provider_name, params)) for provider_name, params in specs]
+        index_of = {task: index for index, task in enumerate(tasks)}
+        results: List[Optional[Dict[str, Any]]] = [None] * len(tasks)
+        votes: Counter = Counter()
+        winner: Optional[int] = None
+        loop = asyncio.get_running_loop()
+        expires_at = loop.time() + deadline if deadline is not None else None
+
+        pending = set(tasks)
+        try:
+            while pending and winner is None:
+                timeout = max(0.0, expires_at - loop.time()) if expires_at is not None else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                # 同一批完成的结果按目标顺序处理，保证结果确定
+                for task in sorted(done, key=index_of.get):
+                    index = index_of[task]
+                    results[index] = task.result()
+                    if not results[index].get('success'):
+                        continue
+                    if strategy == 'first':
+                        winner = index
+                        break
+                    if strategy == 'majority':
+                        label = normalize_vote(results[index].get('content'))
+                        if label is not None:
+                            votes[label] += 1
+                            if votes[label] * 2 > len(tasks):
+                                winner = index
+                                break
+        finally:
+            for task in pending:
+                task.cancel()
+
+        timed_out = 0
+        for index, task in enumerate(tasks):
+            if results[index] is not None:
+                continue
+            provider_name, params = specs[index]
+            if task in pending and winner is None:
+                timed_out += 1
+                message = f'请求超过时限 {deadline} 秒'
+            else:
+                message = '已取得结果, 请求被取消'
+            results[index] = {'error': True, 'message': message, 'retryable': True, 'cancelled': True,
+                              'provider': provider_name, 'model': params.get('model')}
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        succeeded = sum(1 for result in results if result.get('success'))
+        response = {
+            'strategy': strategy,
+            'results': results,
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded - timed_out,
+            'timed_out': timed_out
+        }
+
+        if strategy == 'majority':
+            if winner is None and votes:
+                # 全部返回后：得票最多且超过有效回答半数的答案胜出
+                label, count = votes.most_common(1)[0]
+                if count * 2 > sum(votes.values()) and list(votes.values()).count(count) == 1:
+                    winner = next(index for index, result in enumerate(results)
+                                  if result.get('success') and normalize_vote(result.get('content')) == label)
+            response['votes'] = dict(votes)
+            if winner is not None:
+                response['label'] = normalize_vote(results[winner].get('content'))
+                response['agreement'] = votes[response['label']] / sum(votes.values())
+        elif strategy == 'all':
+            response['success'] = succeeded > 0
+            return response
+
+        if winner is None:
+            response.update({
+                'success': False,
+                'error': True,
+                'message': '未形成多数意见' if strategy == 'majority' and succeeded else '所有请求均失败或超时',
+                'retryable': True
+            })
+            return response
+
+        response.update({
+            'success': True,
+            'winner': winner,
+            'provider': results[winner]['provider'],
+            'model': results[winner].get('model'),
+            'content': results[winner].get('content')
+        })
+        return response
 
     async def stream_chat_completion(self, provider_name: str, messages: List[Dict[str, str]], **kwargs):
         """流式聊天完成"""
@@ -75,8 +581,29 @@ class AIManager:
             }
             return
 
-        async for chunk in provider.stream_chat_completion(messages, **kwargs):
-            yield chunk
+        priority = kwargs.pop('priority', 0)
+        budget_error = self.apply_token_budget(messages, kwargs)
+        if budget_error:
+            yield budget_error
+            return
+
+        if self.rate_limiter is None:
+            async for chunk in provider.stream_chat_completion(messages, **kwargs):
+                yield chunk
+            return
+
+        # 流式请求在整个输出期间占用并发名额
+        model = kwargs.get('model')
+        outcome: Dict[str, Any] = {'success': True}
+        async with self.rate_limiter.slot(provider_name, model, priority) as granted:
+            if not granted:
+                yield self._rate_limit_error(provider_name, model)
+                return
+            async for chunk in provider.stream_chat_completion(messages, **kwargs):
+                if isinstance(chunk, dict) and chunk.get('error'):
+                    outcome = chunk
+                yield chunk
+        await self.rate_limiter.feedback(provider_name, model, outcome)
 
     async def speech_to_text(self, provider_name: str, audio_file: bytes, **kwargs) -> Dict[str, Any]:
         """语音转文字"""
@@ -95,7 +622,53 @@ class AIManager:
         if not provider:
             raise Exception(f'AI服务提供商未找到: {provider_name}')
 
-        return await provider.text_to_speech(text, **kwargs)
+        use_cache = kwargs.pop('use_cache', True)
+        if self.tts_cache is None or not use_cache:
+            return await provider.text_to_speech(text, **kwargs)
+
+        cache_key = self.tts_cache.build_key(provider_name, text, kwargs)
+        audio = await self.tts_cache.get(cache_key)
+        if audio is not None:
+            return audio
+        audio = await provider.text_to_speech(text, **kwargs)
+        await self.tts_cache.set(cache_key, audio)
+        return audio
+
+    async def stream_text_to_speech(self, provider_name: str, text: str, **kwargs) -> AsyncIterator[bytes]:
+        """流式文字转语音：音频数据到达即产出
+
+        命中缓存时直接分块回放；未命中时边转发边收集，完整接收后写入缓存（中途断开的不缓存）。
+        """
+        provider = self.get_provider(provider_name)
+        if not provider:
+            raise Exception(f'AI服务提供商未找到: {provider_name}')
+
+        cache = self.tts_cache if kwargs.pop('use_cache', True) else None
+        if cache is None:
+            async for chunk in provider.stream_text_to_speech(text, **kwargs):
+                yield chunk
+            return
+
+        cache_key = cache.build_key(provider_name, text, kwargs)
+        audio = await cache.get(cache_key)
+        if audio is not None:
+            for chunk in iter_audio_chunks(audio):
+                yield chunk
+            return
+
+        chunks: Optional[List[bytes]] = []
+        size = 0
+        async for chunk in provider.stream_text_to_speech(text, **kwargs):
+            if chunks is not None:
+                size += len(chunk)
+                if size <= cache.max_entry_bytes:
+                    chunks.append(chunk)
+                else:
+                    # 超过单条上限的音频不缓存，也不再继续收集
+                    chunks = None
+            yield chunk
+        if chunks:
+            await cache.set(cache_key, b''.join(chunks))
 
     async def image_generation(self, provider_name: str, prompt: str, **kwargs) -> Dict[str, Any]:
         """图像生成"""
@@ -108,8 +681,8 @@ class AIManager:
 
         return await provider.image_generation(prompt, **kwargs)
 
-    async def image_analysis(self, provider_name: str, image_data: bytes, prompt: str, **kwargs) -> Dict[str, Any]:
-        """图像分析"""
+    async def image_analysis(self, provider_name: str, image_data: MediaInput, prompt: str, **kwargs) -> Dict[str, Any]:
+        """图像分析（配置了图像预处理时先缩放、重新编码，并按感知哈希缓存结果；传入 use_cache=False 可跳过缓存）"""
         provider = self.get_provider(provider_name)
         if not provider:
             return {
@@ -117,7 +690,30 @@ class AIManager:
                 'message': f'AI服务提供商未找到: {provider_name}'
             }
 
-        return await provider.image_analysis(image_data, prompt, **kwargs)
+        use_cache = kwargs.pop('use_cache', True)
+        preprocessor = self.image_preprocessor
+        if preprocessor is None or provider_name not in self.image_preprocessing_providers or is_remote_media(image_data):
+            return await provider.image_analysis(image_data, prompt, **kwargs)
+
+        # 文件对象和异步迭代器只能读取一次，读出的数据同时用于预处理和预处理失败时按原图发送
+        raw = await read_media(image_data)
+        prepared = await self._prepare_image(raw, kwargs.get('model'))
+        if prepared is None:
+            return await provider.image_analysis(raw, prompt, **kwargs)
+
+        # 预处理后图像已重新编码，使用预处理结果的MIME类型
+        kwargs.pop('mime_type', None)
+
+        key = preprocessor.build_key(provider_name, kwargs.get('model'), [prompt, prepared['phash']], kwargs)
+        if use_cache:
+            cached = await preprocessor.get_cached(key)
+            if cached is not None:
+                return cached
+
+        result = await provider.image_analysis(prepared['data'], prompt, mime_type=prepared['mime_type'], **kwargs)
+        if use_cache:
+            await preprocessor.set_cached(key, result)
+        return result
 
     async def multimodal_completion(self, provider_name: str, inputs: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
         """多模态完成"""
@@ -128,9 +724,47 @@ class AIManager:
                 'message': f'多模态AI服务提供商未找到或不支持: {provider_name}'
             }
 
-        return await provider.multimodal_completion(inputs, **kwargs)
-
-    async def video_analysis(self, provider_name: str, video_data: bytes, prompt: str, **kwargs) -> Dict[str, Any]:
+        use_cache = kwargs.pop('use_cache', True)
+        preprocessor = self.image_preprocessor
+        if preprocessor is None or provider_name not in self.image_preprocessing_providers:
+            return await provider.multimodal_completion(inputs, **kwargs)
+
+        # 并发预处理所有二进制图像输入，缓存键按输入顺序由文本和图像感知哈希组成
+        image_indexes = [
+            index for index, item in enumerate(inputs)
+            if item.get('type') == 'image' and isinstance(item.get('content'), (bytes, bytearray, memoryview))
+        ]
+        prepared_images = await asyncio.gather(
+            *(self._prepare_image(inputs[index]['content'], kwargs.get('model')) for index in image_indexes)
+        )
+        prepared_inputs = list(inputs)
+        for index, prepared in zip(image_indexes, prepared_images):
+            if prepared is not None:
+                prepared_inputs[index] = {
+                    **inputs[index], 'content': prepared['data'], 'mime_type': prepared['mime_type'], 'phash': prepared['phash']
+                }
+
+        parts = []
+        for item in prepared_inputs:
+            content = item.get('content')
+            if 'phash' in item:
+                parts.append(['image', item['phash']])
+            elif isinstance(content, (bytes, bytearray, memoryview)):
+                parts.append([item.get('type'), hashlib.sha256(content).hexdigest()])
+            else:
+                parts.append([item.get('type'), content])
+        key = preprocessor.build_key(provider_name, kwargs.get('model'), parts, kwargs)
+        if use_cache:
+            cached = await preprocessor.get_cached(key)
+            if cached is not None:
+                return cached
+
+        result = await provider.multimodal_completion(prepared_inputs, **kwargs)
+        if use_cache:
+            await preprocessor.set_cached(key, result)
+        return result
+
+    async def video_analysis(self, provider_name: str, video_data: MediaInput, prompt: str, **kwargs) -> Dict[str, Any]:
         """视频分析"""
         provider = self.get_provider(provider_name)
         if not provider or not isinstance(provider, MultiModalProvider):
@@ -141,7 +775,7 @@ class AIManager:
 
         return await provider.video_analysis(video_data, prompt, **kwargs)
 
-    async def document_analysis(self, provider_name: str, document_data: bytes, document_type: str, **kwargs) -> Dict[str, Any]:
+    async def document_analysis(self, provider_name: str, document_data: MediaInput, document_type: str, **kwargs) -> Dict[str, Any]:
         """文档分析"""
         provider = self.get_provider(provider_name)
         if not provider or not isinstance(provider, MultiModalProvider):
@@ -153,7 +787,7 @@ class AIManager:
         return await provider.document_analysis(document_data, document_type, **kwargs)
 
     async def embeddings(self, provider_name: str, texts: List[str], **kwargs) -> Dict[str, Any]:
-        """文本嵌入"""
+        """文本嵌入（配置了嵌入存储且指定模型时，只为未存储过的文本调用提供商）"""
         provider = self.get_provider(provider_name)
         if not provider:
             return {
@@ -161,14 +795,142 @@ class AIManager:
                 'message': f'AI服务提供商未找到: {provider_name}'
             }
 
-        return await provider.embeddings(texts, **kwargs)
+        priority = kwargs.pop('priority', 0)
+        use_store = kwargs.pop('use_store', True)
+        model = kwargs.get('model')
+        if not (use_store and model and self.embedding_stores is not None):
+            return await self._call_limited(
+                provider_name, model, priority, lambda: provider.embeddings(texts, **kwargs)
+            )
+
+        try:
+            store = await asyncio.to_thread(self.embedding_stores.get_store, model)
+            vectors = await asyncio.to_thread(store.get_many, texts)
+        except Exception as e:
+            # 存储不可用时直接调用提供商，不影响请求本身
+            logger.error(f"读取嵌入存储失败, 直接调用提供商: {model} - {str(e)}")
+            return await self._call_limited(
+                provider_name, model, priority, lambda: provider.embeddings(texts, **kwargs)
+            )
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            result = await self._call_limited(
+                provider_name, model, priority, lambda: provider.embeddings(missing, **kwargs)
+            )
+            if not result.get('success'):
+                return result
+            computed = dict(zip(missing, result['embeddings']))
+            try:
+                await asyncio.to_thread(store.put_many, [(text, computed[text], None) for text in missing])
+                # 存储中的向量已归一化，重新读取以保证同一批结果一致
+                vectors = await asyncio.to_thread(store.get_many, texts)
+            except Exception as e:
+                logger.error(f"写入嵌入存储失败: {model} - {str(e)}")
+                vectors = [
+                    vector if vector is not None else _normalize_vector(computed[text])
+                    for text, vector in zip(texts, vectors)
+                ]
+
+        return {
+            'success': True,
+            'embeddings': vectors,
+            'model': model,
+            'stored_hits': len(texts) - len(missing)
+        }
+
+    async def index_texts(self, provider_name: str, items: List[Dict[str, Any]], model: str) -> Dict[str, Any]:
+        """把文本及其元数据写入嵌入存储，items: [{'text': ..., 'metadata': {...}}]"""
+        if self.embedding_stores is None:
+            return {
+                'error': True,
+                'message': '嵌入存储未配置'
+            }
+
+        texts = [item['text'] for item in items]
+        result = await self.embeddings(provider_name, texts, model=model)
+        if not result.get('success'):
+            return result
+
+        store = await asyncio.to_thread(self.embedding_stores.get_store, model)
+        await asyncio.to_thread(store.put_many, [
+            (item['text'], vector, item.get('metadata') or {})
+            for item, vector in zip(items, result['embeddings'])
+        ])
+        return {
+            'success': True,
+            'indexed': len(items),
+            'model': model
+        }
+
+    async def delete_indexed_texts(self, model: str, texts: List[str]) -> int:
+        """从嵌入存储中删除文本，返回删除数量"""
+        if self.embedding_stores is None:
+            return 0
+
+        def delete():
+            store = self.embedding_stores.get_store(model)
+            return sum(1 for text in texts if store.delete(text))
+
+        return await asyncio.to_thread(delete)
+
+    async def semantic_search(self, provider_name: str, query: str, model: str,
+                              top_k: int = 10, min_score: Optional[float] = None) -> Dict[str, Any]:
+        """语义检索：在嵌入存储中查找与查询最相似的文本"""
+        if self.embedding_stores is None:
+            return {
+                'error': True,
+                'message': '嵌入存储未配置'
+            }
+
+        result = await self.embeddings(provider_name, [query], model=model)
+        if not result.get('success'):
+            return result
+
+        store = await asyncio.to_thread(self.embedding_stores.get_store, model)
+        matches = await asyncio.to_thread(store.search, result['embeddings'][0], top_k, None, min_score)
+        return {
+            'success': True,
+            'results': matches,
+            'model': model
+        }
+
+    def get_embedding_batcher(self, provider_name: str, model: Optional[str] = None, **config) -> EmbeddingBatcher:
+        """获取嵌入请求合并器（同一事件循环内共享）"""
+        loop = asyncio.get_running_loop()
+        for key in [key for key in self._embedding_batchers if key[0].is_closed()]:
+            del self._embedding_batchers[key]
+
+        key = (loop, provider_name, model)
+        batcher = self._embedding_batchers.get(key)
+        if batcher is None:
+            # 批量上限按提供商类型确定（按模型注册的提供商名称与类型不同）
+            provider = self.get_provider(provider_name)
+            provider_type = next(
+                (name for name, provider_class in self.provider_classes.items() if type(provider) is provider_class),
+                provider_name
+            )
+            config.setdefault('provider_type', provider_type)
+            batcher = EmbeddingBatcher(self, provider_name, model, **config)
+            self._embedding_batchers[key] = batcher
+        return batcher
+
+    async def embed_text(self, provider_name: str, text: str, model: Optional[str] = None) -> Dict[str, Any]:
+        """单条文本嵌入，与并发请求自动合并为批量调用"""
+        if not self.get_provider(provider_name):
+            return {
+                'error': True,
+                'message': f'AI服务提供商未找到: {provider_name}'
+            }
+
+        return await self.get_embedding_batcher(provider_name, model).embed(text)
 
 
 class AIAgent:
     """AI智能体"""
 
     def __init__(self, agent_id: str, name: str, description: str, provider_name: str,
-                 model: str, system_prompt: str, ai_manager: AIManager, **config):
+                 model: str, system_prompt: str, ai_manager: AIManager,
+                 memory: Optional[ConversationMemory] = None, **config):
         self.agent_id = agent_id
         self.name = name
         self.description = description
@@ -177,6 +939,8 @@ class AIAgent:
         self.system_prompt = system_prompt
         self.ai_manager = ai_manager
         self.config = config
+        # 未配置记忆时沿用进程内历史列表（按 max_history 条数截断）
+        self.memory = memory
         self.conversation_history: List[Dict[str, str]] = []
         self.functions: List[Dict[str, Any]] = []
 
@@ -188,7 +952,13 @@ class AIAgent:
         """清除对话历史"""
         self.conversation_history = []
 
-    def get_messages(self, user_message: str) -> List[Dict[str, str]]:
+    async def aclear_history(self, session_id: Optional[str] = None):
+        """清除对话历史（含持久化记忆）"""
+        self.clear_history()
+        if self.memory is not None:
+            await self.memory.clear(session_id or self.agent_id)
+
+    def get_messages(self, user_message: str, history: Optional[List[Dict[str, str]]] = None) -> List[Dict[str, str]]:
         """构建消息列表"""
         messages = []
 
@@ -200,7 +970,7 @@ class AIAgent:
             })
 
         # 添加历史对话
-        messages.extend(self.conversation_history)
+        messages.extend(self.conversation_history if history is None else history)
 
         # 添加用户消息
         messages.append({
@@ -208,12 +978,52 @@ class AIAgent:
             "content": user_message
         })
 
+        # 按提示词预算丢弃最早的历史：config 中的 max_prompt_tokens，或上下文长度减去 max_tokens
+        budget = self.config.get('max_prompt_tokens')
+        if budget is None:
+            context_window = self.config.get('context_window') or get_context_window(self.model)
+            if context_window:
+                budget = context_window - self.config.get('max_tokens', 0)
+        if budget:
+            messages = fit_messages(messages, self.model, budget)
+
         return messages
 
+    async def load_messages(self, user_message: str, session_id: str) -> List[Dict[str, str]]:
+        """从记忆中读取预算内的历史并构建消息列表"""
+        if self.memory is None:
+            return self.get_messages(user_message)
+        history = await self.memory.get_history(session_id)
+        return self.get_messages(user_message, history)
+
+    async def remember(self, session_id: str, user_message: str, assistant_message: str):
+        """记录一轮对话"""
+        if self.memory is not None:
+            await self.memory.add_turn(session_id, user_message, assistant_message)
+            return
+
+        self.conversation_history.append({
+            "role": "user",
+            "content": user_message
+        })
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": assistant_message
+        })
+
+        # 限制历史长度
+        max_history = self.config.get('max_history', 20)
+        if len(self.conversation_history) > max_history:
+            self.conversation_history = self.conversation_history[-max_history:]
+
     async def chat(self, user_message: str, **kwargs) -> Dict[str, Any]:
-        """智能体对话"""
+        """智能体对话（config或参数中设置 hedge_provider/hedge_model 可开启对冲请求）
+
+        传入 session_id 可区分同一智能体下的不同会话（默认使用 agent_id）。
+        """
         try:
-            messages = self.get_messages(user_message)
+            session_id = kwargs.pop('session_id', None) or self.agent_id
+            messages = await self.load_messages(user_message, session_id)
 
             # 合并配置参数
             params = {**self.config, **kwargs}
@@ -228,19 +1038,7 @@ class AIAgent:
 
             if result.get('success'):
                 # 更新对话历史
-                self.conversation_history.append({
-                    "role": "user",
-                    "content": user_message
-                })
-                self.conversation_history.append({
-                    "role": "assistant",
-                    "content": result.get('content', '')
-                })
-
-                # 限制历史长度
-                max_history = self.config.get('max_history', 20)
-                if len(self.conversation_history) > max_history:
-                    self.conversation_history = self.conversation_history[-max_history:]
+                await self.remember(session_id, user_message, result.get('content', ''))
 
             return result
 
@@ -254,7 +1052,8 @@ class AIAgent:
     async def stream_chat(self, user_message: str, **kwargs):
         """智能体流式对话"""
         try:
-            messages = self.get_messages(user_message)
+            session_id = kwargs.pop('session_id', None) or self.agent_id
+            messages = await self.load_messages(user_message, session_id)
 
             # 合并配置参数
             params = {**self.config, **kwargs}
@@ -268,19 +1067,7 @@ class AIAgent:
 
             # 更新对话历史
             if full_response:
-                self.conversation_history.append({
-                    "role": "user",
-                    "content": user_message
-                })
-                self.conversation_history.append({
-                    "role": "assistant",
-                    "content": full_response
-                })
-
-                # 限制历史长度
-                max_history = self.config.get('max_history', 20)
-                if len(self.conversation_history) > max_history:
-                    self.conversation_history = self.conversation_history[-max_history:]
+                await self.remember(session_id, user_message, full_response)
 
         except Exception as e:
             logger.error(f"智能体流式对话失败: {self.agent_id} - {str(e)}")
@@ -300,7 +1087,8 @@ class AIAgent:
             'system_prompt': self.system_prompt,
             'config': self.config,
             'functions_count': len(self.functions),
-            'history_length': len(self.conversation_history)
+            'history_length': len(self.conversation_history),
+            'memory': self.memory.backend.__class__.__name__ if self.memory else None
         }
 
 
@@ -310,9 +1098,39 @@ class AgentManager:
     def __init__(self, ai_manager: AIManager):
         self.ai_manager = ai_manager
         self.agents: Dict[str, AIAgent] = {}
+        # 新建智能体默认使用的对话记忆
+        self.memory: Optional[ConversationMemory] = None
+
+    def configure_memory(self, backend: str = 'redis', summarize_provider: Optional[str] = None,
+                         summarize_model: Optional[str] = None, **memory_config) -> ConversationMemory:
+        """配置智能体对话记忆
+
+        backend 为 'redis' 时跨工作进程共享，'conversation' 时保存到 ChatConversation/ChatMessage
+        （session_id 为对话ID），'local' 时保存在进程内。指定 summarize_provider 后开启滚动摘要。
+        """
+        if backend == 'redis':
+            backend_config = {
+                key: memory_config.pop(key)
+                for key in ('url', 'key_prefix', 'ttl', 'max_messages')
+                if key in memory_config
+            }
+            memory_backend = RedisMemoryBackend(**backend_config)
+        elif backend == 'conversation':
+            memory_backend = ConversationMemoryBackend()
+        else:
+            memory_backend = InMemoryBackend()
+
+        if summarize_provider:
+            memory_config['summarizer'] = make_llm_summarizer(
+                self.ai_manager, summarize_provider, summarize_model
+            )
+
+        self.memory = ConversationMemory(backend=memory_backend, **memory_config)
+        return self.memory
 
     def create_agent(self, agent_id: str, name: str, description: str,
-                    provider_name: str, model: str, system_prompt: str, **config) -> AIAgent:
+                    provider_name: str, model: str, system_prompt: str,
+                    memory: Optional[ConversationMemory] = None, **config) -> AIAgent:
         """创建智能体"""
         agent = AIAgent(
             agent_id=agent_id,
@@ -322,6 +1140,7 @@ class AgentManager:
             model=model,
             system_prompt=system_prompt,
             ai_manager=self.ai_manager,
+            memory=memory or self.memory,
             **config
         )
 
@@ -377,6 +1196,14 @@ class AgentManager:
             return True
         return False
 
+    async def aclear_agent_history(self, agent_id: str, session_id: Optional[str] = None) -> bool:
+        """清除智能体对话历史（含持久化记忆）"""
+        agent = self.get_agent(agent_id)
+        if agent:
+            await agent.aclear_history(session_id)
+            return True
+        return False
+
 
 # 全局AI管理器实例
 ai_manager = AIManager()
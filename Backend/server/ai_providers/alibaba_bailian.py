@@ -1,18 +1,31 @@
 import aiohttp
+import asyncio
+import io
 import json
-from typing import Dict, Any, List, AsyncIterator
-from .base import BaseAIProvider, MultiModalProvider
+import os
+import time
+import uuid
+from typing import Dict, Any, List, AsyncIterator, Optional
+from .base import MultiModalProvider, ProviderHTTPError
+from .media import (
+    MediaInput, is_remote_media, media_size, media_filename, iter_media,
+    streamed_json_body, media_placeholder
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-class AlibabaBailianProvider(BaseAIProvider, MultiModalProvider):
+class AlibabaBailianProvider(MultiModalProvider):
     """阿里云百炼AI服务提供商"""
 
     def __init__(self, api_key: str, api_url: str = "https://dashscope.aliyuncs.com/api/v1", **kwargs):
         super().__init__(api_key, api_url, **kwargs)
-        self.timeout = kwargs.get('timeout', 30)
+        # 超过该大小的媒体先上传到临时存储，避免超出请求体大小限制
+        self.upload_threshold = kwargs.get('upload_threshold', 8 * 1024 * 1024)
+        # 上传和大请求体不受默认的总超时限制
+        self.upload_timeout = kwargs.get('upload_timeout', 600)
+        self._upload_policies: Dict[str, Dict[str, Any]] = {}
 
     def get_headers(self) -> Dict[str, str]:
         """获取请求头"""
@@ -46,34 +59,34 @@ class AlibabaBailianProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/services/aigc/text-generation/generation",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('output') and result['output'].get('choices'):
-                            choice = result['output']['choices'][0]
-                            return {
-                                'success': True,
-                                'data': result,
-                                'content': choice['message']['content'],
-                                'usage': result.get('usage', {}),
-                                'model': model
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"API响应格式错误: {result}"),
-                                "chat_completion"
-                            )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/services/aigc/text-generation/generation",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    if result.get('output') and result['output'].get('choices'):
+                        choice = result['output']['choices'][0]
+                        return {
+                            'success': True,
+                            'data': result,
+                            'content': choice['message']['content'],
+                            'usage': result.get('usage', {}),
+                            'model': model
+                        }
                     else:
-                        error_text = await response.text()
                         return await self.handle_error(
-                            Exception(f"API请求失败: {response.status} - {error_text}"),
+                            Exception(f"API响应格式错误: {result}"),
                             "chat_completion"
                         )
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"API请求失败: {response.status} - {error_text}"),
+                        "chat_completion"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "chat_completion")
@@ -103,38 +116,34 @@ class AlibabaBailianProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/services/aigc/text-generation/generation",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        async for line in response.content:
-                            line_text = line.decode('utf-8').strip()
-                            if line_text.startswith('data:'):
-                                data_text = line_text[5:].strip()
-                                if data_text and data_text != '[DONE]':
-                                    try:
-                                        data = json.loads(data_text)
-                                        if data.get('output') and data['output'].get('choices'):
-                                            choice = data['output']['choices'][0]
-                                            yield {
-                                                'success': True,
-                                                'data': data,
-                                                'delta': {
-                                                    'content': choice['message'].get('content', '')
-                                                },
-                                                'model': model
-                                            }
-                                    except json.JSONDecodeError:
-                                        continue
-                    else:
-                        error_text = await response.text()
-                        yield await self.handle_error(
-                            Exception(f"流式API请求失败: {response.status} - {error_text}"),
-                            "stream_chat_completion"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/services/aigc/text-generation/generation",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    async for payload in self.iter_sse_events(response):
+                        try:
+                            data = json.loads(payload)
+                        except json.JSONDecodeError:
+                            continue
+                        if data.get('output') and data['output'].get('choices'):
+                            choice = data['output']['choices'][0]
+                            yield {
+                                'success': True,
+                                'data': data,
+                                'delta': {
+                                    'content': choice['message'].get('content', '')
+                                },
+                                'model': model
+                            }
+                else:
+                    error_text = await response.text()
+                    yield await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"流式API请求失败: {response.status} - {error_text}"),
+                        "stream_chat_completion"
+                    )
 
         except Exception as e:
             yield await self.handle_error(e, "stream_chat_completion")
@@ -164,39 +173,43 @@ class AlibabaBailianProvider(BaseAIProvider, MultiModalProvider):
                 'Authorization': f'Bearer {self.api_key}'
             }
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/services/audio/asr/transcription",
-                    headers=headers,
-                    data=form_data
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('output') and result['output'].get('transcription'):
-                            return {
-                                'success': True,
-                                'data': result,
-                                'text': result['output']['transcription'],
-                                'language': language,
-                                'model': model
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"语音识别响应格式错误: {result}"),
-                                "speech_to_text"
-                            )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/services/audio/asr/transcription",
+                headers=headers,
+                data=form_data
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    if result.get('output') and result['output'].get('transcription'):
+                        return {
+                            'success': True,
+                            'data': result,
+                            'text': result['output']['transcription'],
+                            'language': language,
+                            'model': model
+                        }
                     else:
-                        error_text = await response.text()
                         return await self.handle_error(
-                            Exception(f"语音转文字失败: {response.status} - {error_text}"),
+                            Exception(f"语音识别响应格式错误: {result}"),
                             "speech_to_text"
                         )
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"语音转文字失败: {response.status} - {error_text}"),
+                        "speech_to_text"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "speech_to_text")
 
     async def text_to_speech(self, text: str, **kwargs) -> bytes:
         """文字转语音"""
+        return b''.join([chunk async for chunk in self.stream_text_to_speech(text, **kwargs)])
+
+    async def stream_text_to_speech(self, text: str, **kwargs) -> AsyncIterator[bytes]:
+        """流式文字转语音：音频数据到达即产出"""
         try:
             model = kwargs.get('model', 'sambert-zhichu-v1')
             voice = kwargs.get('voice', 'zhichu')
@@ -216,17 +229,18 @@ class AlibabaBailianProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/services/audio/tts/synthesis",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        return await response.read()
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"文字转语音失败: {response.status} - {error_text}")
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/services/audio/tts/synthesis",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    async for chunk in self.iter_response_chunks(response):
+                        yield chunk
+                else:
+                    error_text = await response.text()
+                    raise ProviderHTTPError.from_response(response, f"文字转语音失败: {response.status} - {error_text}")
 
         except Exception as e:
             logger.error(f"文字转语音失败: {str(e)}")
@@ -254,98 +268,43 @@ class AlibabaBailianProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/services/aigc/text2image/image-synthesis",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('output') and result['output'].get('results'):
-                            return {
-                                'success': True,
-                                'data': result,
-                                'images': [{'url': item['url']} for item in result['output']['results']],
-                                'model': model
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"图像生成响应格式错误: {result}"),
-                                "image_generation"
-                            )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/services/aigc/text2image/image-synthesis",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    if result.get('output') and result['output'].get('results'):
+                        return {
+                            'success': True,
+                            'data': result,
+                            'images': [{'url': item['url']} for item in result['output']['results']],
+                            'model': model
+                        }
                     else:
-                        error_text = await response.text()
                         return await self.handle_error(
-                            Exception(f"图像生成失败: {response.status} - {error_text}"),
+                            Exception(f"图像生成响应格式错误: {result}"),
                             "image_generation"
                         )
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"图像生成失败: {response.status} - {error_text}"),
+                        "image_generation"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "image_generation")
 
-    async def image_analysis(self, image_data: bytes, prompt: str, **kwargs) -> Dict[str, Any]:
-        """图像分析"""
+    async def image_analysis(self, image_data: MediaInput, prompt: str, **kwargs) -> Dict[str, Any]:
+        """图像分析（image_data 可以是bytes、文件路径、文件对象、异步字节迭代器或URL）"""
         try:
-            model = kwargs.get('model', 'qwen-vl-max')
-
-            # 将图片转换为base64
-            import base64
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-
-            payload = {
-                "model": model,
-                "input": {
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "text": prompt
-                                },
-                                {
-                                    "image": f"data:image/jpeg;base64,{image_base64}"
-                                }
-                            ]
-                        }
-                    ]
-                },
-                "parameters": {
-                    "result_format": "message"
-                }
-            }
-
-            headers = self.get_headers()
-
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/services/aigc/multimodal-generation/generation",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('output') and result['output'].get('choices'):
-                            choice = result['output']['choices'][0]
-                            return {
-                                'success': True,
-                                'data': result,
-                                'content': choice['message']['content'],
-                                'usage': result.get('usage', {}),
-                                'model': model
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"图像分析响应格式错误: {result}"),
-                                "image_analysis"
-                            )
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"图像分析失败: {response.status} - {error_text}"),
-                            "image_analysis"
-                        )
-
+            return await self._media_generation(
+                kwargs.get('model', 'qwen-vl-max'), prompt, 'image', image_data,
+                kwargs.get('mime_type', 'image/jpeg'), "image_analysis", "图像分析", **kwargs
+            )
         except Exception as e:
             return await self.handle_error(e, "image_analysis")
 
@@ -366,32 +325,32 @@ class AlibabaBailianProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/services/embeddings/text-embedding/text-embedding",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('output') and result['output'].get('embeddings'):
-                            return {
-                                'success': True,
-                                'data': result,
-                                'embeddings': [item['embedding'] for item in result['output']['embeddings']],
-                                'model': model
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"文本嵌入响应格式错误: {result}"),
-                                "embeddings"
-                            )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/services/embeddings/text-embedding/text-embedding",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    if result.get('output') and result['output'].get('embeddings'):
+                        return {
+                            'success': True,
+                            'data': result,
+                            'embeddings': [item['embedding'] for item in result['output']['embeddings']],
+                            'model': model
+                        }
                     else:
-                        error_text = await response.text()
                         return await self.handle_error(
-                            Exception(f"文本嵌入失败: {response.status} - {error_text}"),
+                            Exception(f"文本嵌入响应格式错误: {result}"),
                             "embeddings"
                         )
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"文本嵌入失败: {response.status} - {error_text}"),
+                        "embeddings"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "embeddings")
@@ -416,7 +375,7 @@ class AlibabaBailianProvider(BaseAIProvider, MultiModalProvider):
                         image_base64 = input_item['content']
 
                     content_list.append({
-                        "image": f"data:image/jpeg;base64,{image_base64}"
+                        "image": f"data:{input_item.get('mime_type', 'image/jpeg')};base64,{image_base64}"
                     })
 
             payload = {
@@ -436,166 +395,211 @@ class AlibabaBailianProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/services/aigc/multimodal-generation/generation",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('output') and result['output'].get('choices'):
-                            choice = result['output']['choices'][0]
-                            return {
-                                'success': True,
-                                'data': result,
-                                'content': choice['message']['content'],
-                                'usage': result.get('usage', {}),
-                                'model': model
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"多模态完成响应格式错误: {result}"),
-                                "multimodal_completion"
-                            )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/services/aigc/multimodal-generation/generation",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    if result.get('output') and result['output'].get('choices'):
+                        choice = result['output']['choices'][0]
+                        return {
+                            'success': True,
+                            'data': result,
+                            'content': choice['message']['content'],
+                            'usage': result.get('usage', {}),
+                            'model': model
+                        }
                     else:
-                        error_text = await response.text()
                         return await self.handle_error(
-                            Exception(f"多模态完成失败: {response.status} - {error_text}"),
+                            Exception(f"多模态完成响应格式错误: {result}"),
                             "multimodal_completion"
                         )
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"多模态完成失败: {response.status} - {error_text}"),
+                        "multimodal_completion"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "multimodal_completion")
 
-    async def video_analysis(self, video_data: bytes, prompt: str, **kwargs) -> Dict[str, Any]:
-        """视频分析"""
+    async def video_analysis(self, video_data: MediaInput, prompt: str, **kwargs) -> Dict[str, Any]:
+        """视频分析（video_data 可以是bytes、文件路径、文件对象、异步字节迭代器或URL）"""
         try:
-            model = kwargs.get('model', 'qwen-vl-max')
-
-            # 将视频转换为base64
-            import base64
-            video_base64 = base64.b64encode(video_data).decode('utf-8')
-
-            payload = {
-                "model": model,
-                "input": {
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "text": prompt
-                                },
-                                {
-                                    "video": f"data:video/mp4;base64,{video_base64}"
-                                }
-                            ]
-                        }
-                    ]
-                },
-                "parameters": {
-                    "result_format": "message"
-                }
-            }
-
-            headers = self.get_headers()
-
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/services/aigc/multimodal-generation/generation",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('output') and result['output'].get('choices'):
-                            choice = result['output']['choices'][0]
-                            return {
-                                'success': True,
-                                'data': result,
-                                'content': choice['message']['content'],
-                                'usage': result.get('usage', {}),
-                                'model': model
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"视频分析响应格式错误: {result}"),
-                                "video_analysis"
-                            )
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"视频分析失败: {response.status} - {error_text}"),
-                            "video_analysis"
-                        )
-
+            return await self._media_generation(
+                kwargs.get('model', 'qwen-vl-max'), prompt, 'video', video_data,
+                kwargs.get('mime_type', 'video/mp4'), "video_analysis", "视频分析", **kwargs
+            )
         except Exception as e:
             return await self.handle_error(e, "video_analysis")
 
-    async def document_analysis(self, document_data: bytes, document_type: str, **kwargs) -> Dict[str, Any]:
-        """文档分析"""
+    async def document_analysis(self, document_data: MediaInput, document_type: str, **kwargs) -> Dict[str, Any]:
+        """文档分析（document_data 可以是bytes、文件路径、文件对象、异步字节迭代器或URL）"""
         try:
             # 使用百炼的文档理解能力
-            model = kwargs.get('model', 'qwen-vl-max')
-            prompt = kwargs.get('prompt', '请分析这份文档的内容')
-
-            # 将文档转换为base64
-            import base64
-            doc_base64 = base64.b64encode(document_data).decode('utf-8')
-
-            payload = {
-                "model": model,
-                "input": {
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "text": prompt
-                                },
-                                {
-                                    "image": f"data:{document_type};base64,{doc_base64}"
-                                }
-                            ]
-                        }
-                    ]
-                },
-                "parameters": {
-                    "result_format": "message"
-                }
-            }
+            return await self._media_generation(
+                kwargs.get('model', 'qwen-vl-max'), kwargs.get('prompt', '请分析这份文档的内容'), 'image',
+                document_data, document_type, "document_analysis", "文档分析", **kwargs
+            )
+        except Exception as e:
+            return await self.handle_error(e, "document_analysis")
 
-            headers = self.get_headers()
+    async def get_upload_policy(self, model: str) -> Dict[str, Any]:
+        """获取百炼临时存储的上传凭证（按模型缓存到过期前）"""
+        cached = self._upload_policies.get(model)
+        if cached and cached['expires_at'] > time.monotonic():
+            return cached['policy']
+
+        session = self.get_session()
+        async with session.get(
+            f"{self.api_url}/uploads",
+            headers={'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'},
+            params={'action': 'getPolicy', 'model': model}
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise ProviderHTTPError.from_response(response, f"获取上传凭证失败: {response.status} - {error_text}")
+            policy = (await response.json())['data']
+
+        # 提前1分钟过期，避免上传过程中凭证失效
+        self._upload_policies[model] = {
+            'policy': policy,
+            'expires_at': time.monotonic() + max(0, policy.get('expire_in_seconds', 300) - 60)
+        }
+        return policy
+
+    async def upload_file(self, source: MediaInput, model: str, mime_type: str,
+                          filename: Optional[str] = None, size: Optional[int] = None) -> str:
+        """流式上传文件到百炼临时存储（OSS），返回可在请求中使用的 oss:// 地址"""
+        policy = await self.get_upload_policy(model)
+        size = media_size(source) if size is None else size
+        max_size_mb = policy.get('max_file_size_mb')
+        if size is not None and max_size_mb and size > max_size_mb * 1024 * 1024:
+            raise ValueError(f"文件大小超过上传上限 {max_size_mb}MB")
+
+        key = f"{policy['upload_dir']}/{uuid.uuid4().hex[:8]}_{filename or media_filename(source, mime_type)}"
+        opened = None
+        if isinstance(source, (str, os.PathLike)):
+            opened = await asyncio.to_thread(open, source, 'rb')
+            file_value = opened
+        elif isinstance(source, (bytes, bytearray, memoryview, io.IOBase)):
+            file_value = source
+        else:
+            # 异步迭代器及其他文件对象按块读取，使用分块传输编码
+            file_value = iter_media(source)
+
+        # OSS表单上传要求 file 字段位于最后
+        form = aiohttp.FormData()
+        form.add_field('OSSAccessKeyId', policy['oss_access_key_id'])
+        form.add_field('Signature', policy['signature'])
+        form.add_field('policy', policy['policy'])
+        form.add_field('x-oss-object-acl', policy['x_oss_object_acl'])
+        form.add_field('x-oss-forbid-overwrite', policy['x_oss_forbid_overwrite'])
+        form.add_field('key', key)
+        form.add_field('success_action_status', '200')
+        form.add_field('file', file_value, filename=os.path.basename(key), content_type=mime_type)
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/services/aigc/multimodal-generation/generation",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('output') and result['output'].get('choices'):
-                            choice = result['output']['choices'][0]
-                            return {
-                                'success': True,
-                                'data': result,
-                                'content': choice['message']['content'],
-                                'usage': result.get('usage', {}),
-                                'model': model
+        try:
+            session = self.get_session()
+            async with session.post(
+                policy['upload_host'],
+                data=form,
+                timeout=aiohttp.ClientTimeout(total=self.upload_timeout)
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise ProviderHTTPError.from_response(response, f"文件上传失败: {response.status} - {error_text}")
+        finally:
+            if opened is not None:
+                await asyncio.to_thread(opened.close)
+
+        return f"oss://{key}"
+
+    async def _media_generation(self, model: str, prompt: str, media_key: str, source: MediaInput,
+                                mime_type: str, operation: str, label: str, **kwargs) -> Dict[str, Any]:
+        """多模态理解请求，媒体数据不整体读入内存
+
+        - URL（http/https/oss）直接放入请求
+        - 大小未知或超过 upload_threshold 的媒体先流式上传到百炼临时存储，请求中只传 oss:// 地址
+        - 其余媒体以base64增量编码进流式请求体；传入 upload=True/False 可强制选择方式
+        """
+        headers = self.get_headers()
+        media_url = None
+        size = None
+        if is_remote_media(source):
+            media_url = source
+        else:
+            size = media_size(source)
+            upload = kwargs.get('upload')
+            if upload is None:
+                upload = size is None or size > self.upload_threshold
+            if upload:
+                media_url = await self.upload_file(source, model, mime_type, kwargs.get('filename'), size)
+        if media_url and media_url.startswith('oss://'):
+            headers['X-DashScope-OssResourceResolve'] = 'enable'
+
+        placeholder = media_placeholder()
+        payload = {
+            "model": model,
+            "input": {
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "text": prompt
+                            },
+                            {
+                                media_key: media_url or placeholder
                             }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"文档分析响应格式错误: {result}"),
-                                "document_analysis"
-                            )
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"文档分析失败: {response.status} - {error_text}"),
-                            "document_analysis"
-                        )
+                        ]
+                    }
+                ]
+            },
+            "parameters": {
+                "result_format": "message"
+            }
+        }
 
-        except Exception as e:
-            return await self.handle_error(e, "document_analysis")
+        if media_url:
+            request_kwargs = {'json': payload}
+        else:
+            body, content_length = streamed_json_body(
+                payload, placeholder, source, prefix=f"data:{mime_type};base64,", size=size
+            )
+            if content_length is not None:
+                headers['Content-Length'] = str(content_length)
+            request_kwargs = {'data': body, 'timeout': aiohttp.ClientTimeout(total=self.upload_timeout)}
+
+        session = self.get_session()
+        async with session.post(
+            f"{self.api_url}/services/aigc/multimodal-generation/generation",
+            headers=headers,
+            **request_kwargs
+        ) as response:
+            if response.status == 200:
+                result = await response.json()
+                if result.get('output') and result['output'].get('choices'):
+                    choice = result['output']['choices'][0]
+                    return {
+                        'success': True,
+                        'data': result,
+                        'content': choice['message']['content'],
+                        'usage': result.get('usage', {}),
+                        'model': model
+                    }
+                else:
+                    return await self.handle_error(
+                        Exception(f"{label}响应格式错误: {result}"),
+                        operation
+                    )
+            else:
+                error_text = await response.text()
+                return await self.handle_error(
+                    ProviderHTTPError.from_response(response, f"{label}失败: {response.status} - {error_text}"),
+                    operation
+                )
@@ -1,7 +1,9 @@
-import aiohttp
+import asyncio
+import functools
+import inspect
 import json
-from typing import Dict, Any, List, AsyncIterator
-from .base import BaseAIProvider, MultiModalProvider
+from typing import Dict, Any, List, AsyncIterator, Awaitable, Callable, Optional
+from .base import MultiModalProvider, ProviderHTTPError
 import logging
 import hashlib
 import hmac
@@ -10,50 +12,240 @@ from urllib.parse import quote
 
 logger = logging.getLogger(__name__)
 
+# access_token 无效或过期的错误码
+AUTH_ERROR_CODES = {110, 111}
+
+
+class QianfanAuthError(ProviderHTTPError):
+    """access_token 无效或已过期"""
+
+    def __init__(self, message: str):
+        super().__init__(401, message)
+
+
+def default_token_cache():
+    """默认令牌缓存：已配置Django时使用 settings.CACHES（跨工作进程共享），否则使用进程内缓存"""
+    from ..response_cache import LocalCacheBackend, DjangoCacheBackend
+    try:
+        from django.conf import settings
+        if settings.configured:
+            return DjangoCacheBackend()
+    except ImportError:
+        pass
+    return LocalCacheBackend(max_entries=100)
+
+
+class QianfanTokenManager:
+    """百度千帆 access_token 管理
+
+    - 令牌及过期时间保存在共享缓存中，冷启动的工作进程直接复用其他进程获取的令牌
+    - 距过期不足 refresh_margin 秒（最多为有效期的1/5）时仍返回当前令牌，同时在后台刷新
+    - 进程内用单个刷新任务、跨进程用缓存锁（add/SET NX）保证同一时间只有一个刷新请求
+    """
+
+    def __init__(self, fetch_token: Callable[[], Awaitable[Dict[str, Any]]], api_key: str, cache=None,
+                 refresh_margin: float = 24 * 3600, lock_timeout: float = 30.0,
+                 key_prefix: str = 'ai:qianfan:token:'):
+        self.fetch_token = fetch_token
+        self.cache = cache or default_token_cache()
+        self.refresh_margin = refresh_margin
+        self.lock_timeout = lock_timeout
+        key_hash = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+        self.cache_key = f"{key_prefix}{key_hash}"
+        self.lock_key = f"{self.cache_key}:lock"
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def _use(self, entry: Dict[str, Any]):
+        self._token = entry['access_token']
+        self._expires_at = entry['expires_at']
+        self._refresh_at = entry['refresh_at']
+
+    async def get_token(self) -> str:
+        """获取有效的访问令牌"""
+        now = time.time()
+        if not self._token or self._expires_at <= now:
+            cached = await self.cache.get(self.cache_key)
+            if cached and cached['expires_at'] > now:
+                self._use(cached)
+
+        if self._token and self._expires_at > now:
+            if now >= self._refresh_at:
+                self._start_refresh()
+            return self._token
+
+        return await self.refresh()
+
+    async def refresh(self, invalid_token: Optional[str] = None) -> str:
+        """刷新令牌（并发调用合并为一次刷新）"""
+        task = self._start_refresh(invalid_token)
+        return await asyncio.shield(task)
+
+    async def invalidate(self, token: str):
+        """令牌被服务端拒绝时作废（只作废同一个令牌，避免删掉其他进程刚刷新的令牌）"""
+        if self._token == token:
+            self._token = None
+            self._expires_at = 0.0
+            self._refresh_at = 0.0
+        cached = await self.cache.get(self.cache_key)
+        if cached and cached['access_token'] == token:
+            await self.cache.delete(self.cache_key)
+
+    def _start_refresh(self, invalid_token: Optional[str] = None) -> asyncio.Task:
+        task = self._refresh_task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._do_refresh(invalid_token))
+            task.add_done_callback(self._on_refresh_done)
+            self._refresh_task = task
+        return task
+
+    @staticmethod
+    def _on_refresh_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"百度千帆访问令牌刷新失败: {task.exception()}")
+
+    async def _do_refresh(self, invalid_token: Optional[str]) -> str:
+        stale_token = invalid_token or self._token
+        if not await self.cache.add(self.lock_key, 1, int(self.lock_timeout)):
+            # 其他进程正在刷新，等待其写入新令牌
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.2)
+                cached = await self.cache.get(self.cache_key)
+                if cached and cached['access_token'] != stale_token and cached['expires_at'] > time.time():
+                    self._use(cached)
+                    return self._token
+            logger.warning("等待百度千帆访问令牌刷新超时, 直接获取")
 
-class BaiduQianfanProvider(BaseAIProvider, MultiModalProvider):
+        try:
+            result = await self.fetch_token()
+            expires_in = int(result.get('expires_in', 30 * 24 * 3600))
+            now = time.time()
+            entry = {
+                'access_token': result['access_token'],
+                'expires_at': now + expires_in,
+                'refresh_at': now + expires_in - min(self.refresh_margin, expires_in / 5)
+            }
+            self._use(entry)
+            await self.cache.set(self.cache_key, entry, expires_in)
+            logger.info(f"百度千帆访问令牌已刷新, 有效期 {expires_in} 秒")
+            return self._token
+        finally:
+            await self.cache.delete(self.lock_key)
+
+
+def retry_on_auth_failure(method):
+    """令牌无效或过期时作废令牌并重试一次（流式接口仅在输出内容前重试）"""
+    def is_auth_failure(result) -> bool:
+        return isinstance(result, dict) and result.get('error') and result.get('status') == 401
+
+    async def current_token(provider) -> Optional[str]:
+        # 获取失败时交给被装饰的方法按原有方式返回错误
+        try:
+            return await provider.get_access_token()
+        except Exception:
+            return None
+
+    if inspect.isasyncgenfunction(method):
+        @functools.wraps(method)
+        async def stream_wrapper(self, *args, **kwargs):
+            token = await current_token(self)
+            first = True
+            try:
+                async for chunk in method(self, *args, **kwargs):
+                    if first and token and is_auth_failure(chunk):
+                        break
+                    first = False
+                    yield chunk
+                else:
+                    return
+            except QianfanAuthError:
+                # 语音合成等以异常报告令牌错误的流式接口
+                if not first or not token:
+                    raise
+            await self.token_manager.invalidate(token)
+            async for retry_chunk in method(self, *args, **kwargs):
+                yield retry_chunk
+        return stream_wrapper
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        token = await current_token(self)
+        try:
+            result = await method(self, *args, **kwargs)
+        except QianfanAuthError:
+            if not token:
+                raise
+            result = None
+        if token and (result is None or is_auth_failure(result)):
+            await self.token_manager.invalidate(token)
+            return await method(self, *args, **kwargs)
+        return result
+    return wrapper
+
+
+class BaiduQianfanProvider(MultiModalProvider):
     """百度千帆大模型平台AI服务提供商"""
 
     def __init__(self, api_key: str, api_url: str = "https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop", **kwargs):
         super().__init__(api_key, api_url, **kwargs)
-        self.timeout = kwargs.get('timeout', 30)
         self.secret_key = kwargs.get('secret_key', '')
-        self.access_token = None
-
-    async def get_access_token(self) -> str:
-        """获取访问令牌"""
-        if self.access_token:
-            return self.access_token
+        self.token_url = kwargs.get('token_url', 'https://aip.baidubce.com/oauth/2.0/token')
+        self.token_manager = QianfanTokenManager(
+            self.fetch_access_token,
+            api_key,
+            cache=kwargs.get('token_cache'),
+            refresh_margin=kwargs.get('token_refresh_margin', 24 * 3600)
+        )
 
+    async def fetch_access_token(self) -> Dict[str, Any]:
+        """向OAuth接口请求新的访问令牌"""
         try:
             # 使用API Key和Secret Key获取access_token
-            token_url = f"https://aip.baidubce.com/oauth/2.0/token"
             params = {
                 'grant_type': 'client_credentials',
                 'client_id': self.api_key,
                 'client_secret': self.secret_key
             }
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(token_url, params=params) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        self.access_token = result['access_token']
-                        return self.access_token
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"获取访问令牌失败: {response.status} - {error_text}")
+            session = self.get_session()
+            async with session.post(self.token_url, params=params) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    if 'access_token' not in result:
+                        raise ProviderHTTPError(401, f"获取访问令牌失败: {result}")
+                    return result
+                else:
+                    error_text = await response.text()
+                    raise ProviderHTTPError.from_response(response, f"获取访问令牌失败: {response.status} - {error_text}")
 
         except Exception as e:
             logger.error(f"获取百度千帆访问令牌失败: {str(e)}")
             raise e
 
+    async def get_access_token(self) -> str:
+        """获取访问令牌（共享缓存，过期前后台刷新）"""
+        return await self.token_manager.get_token()
+
+    async def warm_up(self):
+        """预先获取访问令牌，避免首个用户请求承担OAuth往返"""
+        await self.get_access_token()
+
+    @staticmethod
+    def check_auth_error(result: Dict[str, Any]):
+        """响应中的令牌错误转换为 QianfanAuthError"""
+        if isinstance(result, dict) and result.get('error_code') in AUTH_ERROR_CODES:
+            raise QianfanAuthError(f"访问令牌无效: {result.get('error_msg', '')}")
+
     def get_headers(self) -> Dict[str, str]:
         """获取请求头"""
         return {
             'Content-Type': 'application/json'
         }
 
+    @retry_on_auth_failure
     async def chat_completion(self, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
         """聊天完成"""
         try:
@@ -90,37 +282,39 @@ class BaiduQianfanProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/{endpoint}?access_token={access_token}",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if 'result' in result:
-                            return {
-                                'success': True,
-                                'data': result,
-                                'content': result['result'],
-                                'usage': result.get('usage', {}),
-                                'model': model
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"API响应格式错误: {result}"),
-                                "chat_completion"
-                            )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/{endpoint}?access_token={access_token}",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    self.check_auth_error(result)
+                    if 'result' in result:
+                        return {
+                            'success': True,
+                            'data': result,
+                            'content': result['result'],
+                            'usage': result.get('usage', {}),
+                            'model': model
+                        }
                     else:
-                        error_text = await response.text()
                         return await self.handle_error(
-                            Exception(f"API请求失败: {response.status} - {error_text}"),
+                            Exception(f"API响应格式错误: {result}"),
                             "chat_completion"
                         )
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"API请求失败: {response.status} - {error_text}"),
+                        "chat_completion"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "chat_completion")
 
+    @retry_on_auth_failure
     async def stream_chat_completion(self, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[Dict[str, Any]]:
         """流式聊天完成"""
         try:
@@ -157,37 +351,34 @@ class BaiduQianfanProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/{endpoint}?access_token={access_token}",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        async for line in response.content:
-                            line_text = line.decode('utf-8').strip()
-                            if line_text.startswith('data: '):
-                                data_text = line_text[6:]
-                                if data_text and data_text != '[DONE]':
-                                    try:
-                                        data = json.loads(data_text)
-                                        if 'result' in data:
-                                            yield {
-                                                'success': True,
-                                                'data': data,
-                                                'delta': {
-                                                    'content': data['result']
-                                                },
-                                                'model': model
-                                            }
-                                    except json.JSONDecodeError:
-                                        continue
-                    else:
-                        error_text = await response.text()
-                        yield await self.handle_error(
-                            Exception(f"流式API请求失败: {response.status} - {error_text}"),
-                            "stream_chat_completion"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/{endpoint}?access_token={access_token}",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    async for payload in self.iter_sse_events(response):
+                        try:
+                            data = json.loads(payload)
+                        except json.JSONDecodeError:
+                            continue
+                        self.check_auth_error(data)
+                        if 'result' in data:
+                            yield {
+                                'success': True,
+                                'data': data,
+                                'delta': {
+                                    'content': data['result']
+                                },
+                                'model': model
+                            }
+                else:
+                    error_text = await response.text()
+                    yield await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"流式API请求失败: {response.status} - {error_text}"),
+                        "stream_chat_completion"
+                    )
 
         except Exception as e:
             yield await self.handle_error(e, "stream_chat_completion")
@@ -197,6 +388,7 @@ class BaiduQianfanProvider(BaseAIProvider, MultiModalProvider):
         messages = [{"role": "user", "content": prompt}]
         return await self.chat_completion(messages, **kwargs)
 
+    @retry_on_auth_failure
     async def speech_to_text(self, audio_file: bytes, **kwargs) -> Dict[str, Any]:
         """语音转文字"""
         try:
@@ -222,39 +414,45 @@ class BaiduQianfanProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    asr_url,
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if result.get('err_no') == 0:
-                            return {
-                                'success': True,
-                                'data': result,
-                                'text': result['result'][0] if result.get('result') else '',
-                                'language': 'zh',
-                                'model': 'baidu-asr'
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"语音识别失败: {result.get('err_msg', '未知错误')}"),
-                                "speech_to_text"
-                            )
+            session = self.get_session()
+            async with session.post(
+                asr_url,
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    self.check_auth_error(result)
+                    if result.get('err_no') == 0:
+                        return {
+                            'success': True,
+                            'data': result,
+                            'text': result['result'][0] if result.get('result') else '',
+                            'language': 'zh',
+                            'model': 'baidu-asr'
+                        }
                     else:
-                        error_text = await response.text()
                         return await self.handle_error(
-                            Exception(f"语音转文字失败: {response.status} - {error_text}"),
+                            Exception(f"语音识别失败: {result.get('err_msg', '未知错误')}"),
                             "speech_to_text"
                         )
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"语音转文字失败: {response.status} - {error_text}"),
+                        "speech_to_text"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "speech_to_text")
 
     async def text_to_speech(self, text: str, **kwargs) -> bytes:
         """文字转语音"""
+        return b''.join([chunk async for chunk in self.stream_text_to_speech(text, **kwargs)])
+
+    @retry_on_auth_failure
+    async def stream_text_to_speech(self, text: str, **kwargs) -> AsyncIterator[bytes]:
+        """流式文字转语音：音频数据到达即产出"""
         try:
             # 获取访问令牌
             access_token = await self.get_access_token()
@@ -278,24 +476,27 @@ class BaiduQianfanProvider(BaseAIProvider, MultiModalProvider):
                 'cuid': 'ai_platform'
             }
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(tts_url, data=params) as response:
-                    if response.status == 200:
-                        content_type = response.headers.get('Content-Type', '')
-                        if 'audio' in content_type:
-                            return await response.read()
-                        else:
-                            # 返回的是错误信息（JSON格式）
-                            error_info = await response.json()
-                            raise Exception(f"文字转语音失败: {error_info}")
+            session = self.get_session()
+            async with session.post(tts_url, data=params) as response:
+                if response.status == 200:
+                    content_type = response.headers.get('Content-Type', '')
+                    if 'audio' in content_type:
+                        async for chunk in self.iter_response_chunks(response):
+                            yield chunk
                     else:
-                        error_text = await response.text()
-                        raise Exception(f"文字转语音失败: {response.status} - {error_text}")
+                        # 返回的是错误信息（JSON格式）
+                        error_info = await response.json()
+                        self.check_auth_error(error_info)
+                        raise Exception(f"文字转语音失败: {error_info}")
+                else:
+                    error_text = await response.text()
+                    raise ProviderHTTPError.from_response(response, f"文字转语音失败: {response.status} - {error_text}")
 
         except Exception as e:
             logger.error(f"文字转语音失败: {str(e)}")
             raise e
 
+    @retry_on_auth_failure
     async def image_generation(self, prompt: str, **kwargs) -> Dict[str, Any]:
         """图像生成"""
         try:
@@ -315,36 +516,38 @@ class BaiduQianfanProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/text2image?access_token={access_token}",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if 'data' in result:
-                            return {
-                                'success': True,
-                                'data': result,
-                                'images': [{'url': item['image']} for item in result['data']],
-                                'model': 'stable-diffusion-xl'
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"图像生成响应格式错误: {result}"),
-                                "image_generation"
-                            )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/text2image?access_token={access_token}",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    self.check_auth_error(result)
+                    if 'data' in result:
+                        return {
+                            'success': True,
+                            'data': result,
+                            'images': [{'url': item['image']} for item in result['data']],
+                            'model': 'stable-diffusion-xl'
+                        }
                     else:
-                        error_text = await response.text()
                         return await self.handle_error(
-                            Exception(f"图像生成失败: {response.status} - {error_text}"),
+                            Exception(f"图像生成响应格式错误: {result}"),
                             "image_generation"
                         )
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"图像生成失败: {response.status} - {error_text}"),
+                        "image_generation"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "image_generation")
 
+    @retry_on_auth_failure
     async def image_analysis(self, image_data: bytes, prompt: str, **kwargs) -> Dict[str, Any]:
         """图像分析"""
         try:
@@ -376,37 +579,39 @@ class BaiduQianfanProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/ernie_vilg?access_token={access_token}",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if 'result' in result:
-                            return {
-                                'success': True,
-                                'data': result,
-                                'content': result['result'],
-                                'usage': result.get('usage', {}),
-                                'model': 'ernie-vilg'
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"图像分析响应格式错误: {result}"),
-                                "image_analysis"
-                            )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/ernie_vilg?access_token={access_token}",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    self.check_auth_error(result)
+                    if 'result' in result:
+                        return {
+                            'success': True,
+                            'data': result,
+                            'content': result['result'],
+                            'usage': result.get('usage', {}),
+                            'model': 'ernie-vilg'
+                        }
                     else:
-                        error_text = await response.text()
                         return await self.handle_error(
-                            Exception(f"图像分析失败: {response.status} - {error_text}"),
+                            Exception(f"图像分析响应格式错误: {result}"),
                             "image_analysis"
                         )
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"图像分析失败: {response.status} - {error_text}"),
+                        "image_analysis"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "image_analysis")
 
+    @retry_on_auth_failure
     async def embeddings(self, texts: List[str], **kwargs) -> Dict[str, Any]:
         """文本嵌入"""
         try:
@@ -421,36 +626,38 @@ class BaiduQianfanProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/embeddings/{model}?access_token={access_token}",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if 'data' in result:
-                            return {
-                                'success': True,
-                                'data': result,
-                                'embeddings': [item['embedding'] for item in result['data']],
-                                'model': model
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"文本嵌入响应格式错误: {result}"),
-                                "embeddings"
-                            )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/embeddings/{model}?access_token={access_token}",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    self.check_auth_error(result)
+                    if 'data' in result:
+                        return {
+                            'success': True,
+                            'data': result,
+                            'embeddings': [item['embedding'] for item in result['data']],
+                            'model': model
+                        }
                     else:
-                        error_text = await response.text()
                         return await self.handle_error(
-                            Exception(f"文本嵌入失败: {response.status} - {error_text}"),
+                            Exception(f"文本嵌入响应格式错误: {result}"),
                             "embeddings"
                         )
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"文本嵌入失败: {response.status} - {error_text}"),
+                        "embeddings"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "embeddings")
 
+    @retry_on_auth_failure
     async def multimodal_completion(self, inputs: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
         """多模态完成"""
         try:
@@ -488,33 +695,34 @@ class BaiduQianfanProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/ernie_vilg?access_token={access_token}",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if 'result' in result:
-                            return {
-                                'success': True,
-                                'data': result,
-                                'content': result['result'],
-                                'usage': result.get('usage', {}),
-                                'model': 'ernie-vilg'
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"多模态完成响应格式错误: {result}"),
-                                "multimodal_completion"
-                            )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/ernie_vilg?access_token={access_token}",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    self.check_auth_error(result)
+                    if 'result' in result:
+                        return {
+                            'success': True,
+                            'data': result,
+                            'content': result['result'],
+                            'usage': result.get('usage', {}),
+                            'model': 'ernie-vilg'
+                        }
                     else:
-                        error_text = await response.text()
                         return await self.handle_error(
-                            Exception(f"多模态完成失败: {response.status} - {error_text}"),
+                            Exception(f"多模态完成响应格式错误: {result}"),
                             "multimodal_completion"
                         )
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"多模态完成失败: {response.status} - {error_text}"),
+                        "multimodal_completion"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "multimodal_completion")
@@ -527,6 +735,7 @@ class BaiduQianfanProvider(BaseAIProvider, MultiModalProvider):
             "video_analysis"
         )
 
+    @retry_on_auth_failure
     async def document_analysis(self, document_data: bytes, document_type: str, **kwargs) -> Dict[str, Any]:
         """文档分析"""
         try:
@@ -549,50 +758,52 @@ class BaiduQianfanProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    ocr_url,
-                    headers=headers,
-                    data=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if 'words_result' in result:
-                            # 提取文本内容
-                            text_content = '\n'.join([item['words'] for item in result['words_result']])
-
-                            # 使用ERNIE模型分析文档内容
-                            analysis_prompt = kwargs.get('prompt', '请分析这份文档的内容') + f"\n\n文档内容:\n{text_content}"
-                            analysis_result = await self.text_generation(analysis_prompt)
-
-                            if analysis_result['success']:
-                                return {
-                                    'success': True,
-                                    'data': {
-                                        'ocr_result': result,
-                                        'analysis_result': analysis_result['data']
-                                    },
-                                    'content': analysis_result['content'],
-                                    'extracted_text': text_content,
-                                    'model': 'baidu-ocr+ernie'
-                                }
-                            else:
-                                return analysis_result
+            session = self.get_session()
+            async with session.post(
+                ocr_url,
+                headers=headers,
+                data=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    self.check_auth_error(result)
+                    if 'words_result' in result:
+                        # 提取文本内容
+                        text_content = '\n'.join([item['words'] for item in result['words_result']])
+
+                        # 使用ERNIE模型分析文档内容
+                        analysis_prompt = kwargs.get('prompt', '请分析这份文档的内容') + f"\n\n文档内容:\n{text_content}"
+                        analysis_result = await self.text_generation(analysis_prompt)
+
+                        if analysis_result['success']:
+                            return {
+                                'success': True,
+                                'data': {
+                                    'ocr_result': result,
+                                    'analysis_result': analysis_result['data']
+                                },
+                                'content': analysis_result['content'],
+                                'extracted_text': text_content,
+                                'model': 'baidu-ocr+ernie'
+                            }
                         else:
-                            return await self.handle_error(
-                                Exception(f"OCR识别失败: {result}"),
-                                "document_analysis"
-                            )
+                            return analysis_result
                     else:
-                        error_text = await response.text()
                         return await self.handle_error(
-                            Exception(f"文档分析失败: {response.status} - {error_text}"),
+                            Exception(f"OCR识别失败: {result}"),
                             "document_analysis"
                         )
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"文档分析失败: {response.status} - {error_text}"),
+                        "document_analysis"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "document_analysis")
 
+    @retry_on_auth_failure
     async def function_calling(self, messages: List[Dict[str, str]], functions: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
         """函数调用"""
         try:
@@ -609,34 +820,35 @@ class BaiduQianfanProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/ernie-func-8k?access_token={access_token}",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        if 'result' in result:
-                            return {
-                                'success': True,
-                                'data': result,
-                                'content': result.get('result', ''),
-                                'function_call': result.get('function_call'),
-                                'usage': result.get('usage', {}),
-                                'model': model
-                            }
-                        else:
-                            return await self.handle_error(
-                                Exception(f"函数调用响应格式错误: {result}"),
-                                "function_calling"
-                            )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/ernie-func-8k?access_token={access_token}",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    self.check_auth_error(result)
+                    if 'result' in result:
+                        return {
+                            'success': True,
+                            'data': result,
+                            'content': result.get('result', ''),
+                            'function_call': result.get('function_call'),
+                            'usage': result.get('usage', {}),
+                            'model': model
+                        }
                     else:
-                        error_text = await response.text()
                         return await self.handle_error(
-                            Exception(f"函数调用失败: {response.status} - {error_text}"),
+                            Exception(f"函数调用响应格式错误: {result}"),
                             "function_calling"
                         )
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"函数调用失败: {response.status} - {error_text}"),
+                        "function_calling"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "function_calling")
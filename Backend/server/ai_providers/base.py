@@ -1,17 +1,446 @@
 from abc import ABC, abstractmethod
+from contextvars import ContextVar
 from typing import Dict, Any, List, Optional, AsyncIterator
+import asyncio
+import functools
+import inspect
+import json
+import re
+import time
+from email.utils import parsedate_to_datetime
+import aiohttp
 import logging
 
+from ..telemetry import provider_telemetry
+
 logger = logging.getLogger(__name__)
 
 
+class ProviderHTTPError(Exception):
+    """上游API返回非200状态码"""
+
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @classmethod
+    def from_response(cls, response: aiohttp.ClientResponse, message: str) -> 'ProviderHTTPError':
+        """根据响应创建错误，429/503 时解析 Retry-After 头"""
+        return cls(response.status, message, parse_retry_after(response.headers.get('Retry-After')))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After（秒数或HTTP日期），无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """判断错误是否可重试（5xx、429、超时、连接失败）"""
+    if isinstance(error, (asyncio.TimeoutError, aiohttp.ClientConnectionError)):
+        return True
+    status = getattr(error, 'status', None)
+    return bool(status and (status >= 500 or status == 429))
+
+
+class SSEParser:
+    """增量SSE解析器
+
+    直接在字节缓冲区上按行切分，正确处理跨网络分片的半行、CRLF、注释行，
+    以及同一事件中的多行 data:（按规范以换行拼接）。feed() 返回已完整的事件数据（bytes）。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """输入一段原始字节，返回其中已结束的事件数据"""
+        buffer = self._buffer
+        buffer += chunk
+        events = []
+        start = 0
+        while True:
+            end = buffer.find(b'\n', start)
+            if end < 0:
+                break
+            line_end = end - 1 if end > start and buffer[end - 1] == 13 else end
+            if line_end == start:
+                # 空行：事件结束
+                if self._data:
+                    events.append(self._data[0] if len(self._data) == 1 else b'\n'.join(self._data))
+                    self._data = []
+            elif buffer.startswith(b'data:', start, line_end):
+                value_start = start + 5
+                if value_start < line_end and buffer[value_start] == 32:
+                    value_start += 1
+                self._data.append(bytes(buffer[value_start:line_end]))
+            # 其余字段（event/id/retry）与注释行无需处理
+            start = end + 1
+        if start:
+            del buffer[:start]
+        return events
+
+    def close(self) -> List[bytes]:
+        """流结束时返回未以空行结束的最后一个事件"""
+        if self._buffer:
+            events = self.feed(b'\n\n')
+        else:
+            events = self.feed(b'\n')
+        self._buffer = bytearray()
+        return events
+
+
+# OpenAI兼容格式中只含文本增量的数据块，例如
+# {"id":"...","choices":[{"index":0,"delta":{"content":"你好"},"finish_reason":null}]}
+_CONTENT_DELTA_PATTERN = re.compile(
+    rb'"delta":\s*\{\s*(?:"role":\s*"assistant",\s*)?"content":\s*"((?:[^"\\]|\\.)*)"\s*\}'
+)
+# 带有用量统计的数据块（冒号前后可能有空白）
+_USAGE_PATTERN = re.compile(rb'"usage"\s*:\s*\{')
+
+
+def fast_content_delta(payload: bytes) -> Optional[str]:
+    """快速路径：数据块只是纯文本增量时直接提取内容，否则返回None交给完整JSON解析"""
+    if _USAGE_PATTERN.search(payload) or b'"tool_calls"' in payload or payload.count(b'"delta"') != 1:
+        return None
+    match = _CONTENT_DELTA_PATTERN.search(payload)
+    if match is None or re.search(rb'"finish_reason":\s*"', payload):
+        return None
+    content = match.group(1)
+    if b'\\' in content:
+        return json.loads(b'"' + content + b'"')
+    return content.decode('utf-8')
+
+
+# 自动记录调用指标的提供商方法
+INSTRUMENTED_METHODS = (
+    'chat_completion', 'stream_chat_completion', 'text_generation', 'speech_to_text', 'text_to_speech',
+    'stream_text_to_speech', 'image_generation', 'image_analysis', 'embeddings', 'multimodal_completion',
+    'video_analysis', 'document_analysis', 'create_agent', 'agent_chat', 'agent_function_call'
+)
+
+# 当前正在记录的调用（HTTP追踪回调据此把连接、字节数等归到对应调用上）
+_current_call: ContextVar[Optional['CallMetrics']] = ContextVar('ai_provider_call', default=None)
+
+
+class CallMetrics:
+    """单次提供商调用的指标：连接耗时、首字节时间、首个输出时间、总耗时、字节数与Token数"""
+
+    def __init__(self, owner: 'BaseAIProvider', method: str, model: Optional[str]):
+        self.owner = owner
+        self.provider = owner.name
+        self.method = method
+        self.model = model
+        self.started_at = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.ttfb: Optional[float] = None
+        self.ttft: Optional[float] = None
+        self.connect_times: List[float] = []
+        self.pool_waits: List[float] = []
+        self.reused_connections = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.content_chunks = 0
+        self.outcome = 'success'
+        self._request_started: Optional[float] = None
+        self._connect_started: Optional[float] = None
+        self._queue_started: Optional[float] = None
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def _set_usage(self, usage: Any):
+        # 流式响应中的usage通常是累计值，因此取最新值而不是累加
+        if not isinstance(usage, dict):
+            return
+        prompt_tokens = usage.get('prompt_tokens', usage.get('input_tokens'))
+        completion_tokens = usage.get('completion_tokens', usage.get('output_tokens'))
+        if prompt_tokens:
+            self.prompt_tokens = prompt_tokens
+        if completion_tokens:
+            self.completion_tokens = completion_tokens
+
+    def _set_error(self, result: Dict[str, Any]):
+        self.outcome = 'throttled' if result.get('status') == 429 else 'error'
+
+    def on_result(self, result: Any):
+        """记录非流式调用的返回值"""
+        if not isinstance(result, dict):
+            return
+        if result.get('error'):
+            self._set_error(result)
+        self.model = self.model or result.get('model')
+        self._set_usage(result.get('usage'))
+
+    def on_chunk(self, chunk: Any):
+        """记录流式调用的一个分片"""
+        if isinstance(chunk, (bytes, bytearray)):
+            if self.ttft is None and chunk:
+                self.ttft = self.elapsed()
+            return
+        if not isinstance(chunk, dict):
+            return
+        if chunk.get('error'):
+            self._set_error(chunk)
+            return
+        if (chunk.get('delta') or {}).get('content'):
+            self.content_chunks += 1
+            if self.ttft is None:
+                self.ttft = self.elapsed()
+        data = chunk.get('data')
+        self._set_usage(chunk.get('usage') or (data.get('usage') if isinstance(data, dict) else None))
+
+    def on_exception(self, error: BaseException):
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            self.outcome = 'cancelled'
+        elif isinstance(error, asyncio.TimeoutError):
+            self.outcome = 'timeout'
+        elif getattr(error, 'status', None) == 429:
+            self.outcome = 'throttled'
+        else:
+            self.outcome = 'exception'
+
+    def tokens_per_second(self) -> Optional[float]:
+        """输出速率：流式调用按首个输出之后的时间计算；上游未返回usage时按内容分片数近似"""
+        tokens = self.completion_tokens or self.content_chunks
+        if not tokens or self.duration is None:
+            return None
+        window = self.duration - self.ttft if self.ttft is not None and self.duration > self.ttft else self.duration
+        return tokens / window if window > 0 else None
+
+    def finish(self):
+        self.duration = self.elapsed()
+        provider_telemetry.record_call(self)
+
+
+def _traced(handler):
+    """HTTP追踪回调：只处理属于当前调用的事件"""
+    async def callback(session, trace_config_ctx, params):
+        metrics = _current_call.get()
+        if metrics is not None:
+            handler(metrics, params)
+    return callback
+
+
+def _on_request_start(metrics: CallMetrics, params):
+    metrics._request_started = time.perf_counter()
+
+
+def _on_request_end(metrics: CallMetrics, params):
+    # 一次调用包含多个HTTP请求（如先获取令牌）时，以最后一个请求为准
+    if metrics._request_started is not None:
+        metrics.ttfb = time.perf_counter() - metrics._request_started
+
+
+def _on_queued_start(metrics: CallMetrics, params):
+    metrics._queue_started = time.perf_counter()
+
+
+def _on_queued_end(metrics: CallMetrics, params):
+    if metrics._queue_started is not None:
+        metrics.pool_waits.append(time.perf_counter() - metrics._queue_started)
+
+
+def _on_connection_create_start(metrics: CallMetrics, params):
+    metrics._connect_started = time.perf_counter()
+
+
+def _on_connection_create_end(metrics: CallMetrics, params):
+    if metrics._connect_started is not None:
+        metrics.connect_times.append(time.perf_counter() - metrics._connect_started)
+
+
+def _on_connection_reuse(metrics: CallMetrics, params):
+    metrics.reused_connections += 1
+
+
+def _on_request_chunk_sent(metrics: CallMetrics, params):
+    metrics.bytes_sent += len(params.chunk)
+
+
+def _on_response_chunk_received(metrics: CallMetrics, params):
+    metrics.bytes_received += len(params.chunk)
+
+
+def telemetry_trace_config() -> aiohttp.TraceConfig:
+    """把连接建立、首字节和收发字节数记录到当前调用的 aiohttp 追踪配置"""
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_traced(_on_request_start))
+    trace_config.on_request_end.append(_traced(_on_request_end))
+    trace_config.on_connection_queued_start.append(_traced(_on_queued_start))
+    trace_config.on_connection_queued_end.append(_traced(_on_queued_end))
+    trace_config.on_connection_create_start.append(_traced(_on_connection_create_start))
+    trace_config.on_connection_create_end.append(_traced(_on_connection_create_end))
+    trace_config.on_connection_reuseconn.append(_traced(_on_connection_reuse))
+    trace_config.on_request_chunk_sent.append(_traced(_on_request_chunk_sent))
+    trace_config.on_response_chunk_received.append(_traced(_on_response_chunk_received))
+    return trace_config
+
+
+def _is_nested_call(provider: 'BaseAIProvider') -> bool:
+    """同一提供商内部的嵌套调用（如 text_to_speech 调用 stream_text_to_speech）只记录最外层"""
+    current = _current_call.get()
+    return current is not None and current.owner is provider
+
+
+def instrument(method_name: str, method):
+    """包装提供商方法，记录调用指标和进行中的调用数"""
+    if inspect.isasyncgenfunction(method):
+        @functools.wraps(method)
+        async def stream_wrapper(self, *args, **kwargs):
+            self.active_calls += 1
+            try:
+                if not self.telemetry_enabled or _is_nested_call(self):
+                    async for chunk in method(self, *args, **kwargs):
+                        yield chunk
+                    return
+
+                metrics = CallMetrics(self, method_name, kwargs.get('model'))
+                stream = method(self, *args, **kwargs)
+                try:
+                    while True:
+                        # 只在生成下一个分片期间标记当前调用，调用方处理分片时发出的请求不计入
+                        token = _current_call.set(metrics)
+                        try:
+                            chunk = await stream.__anext__()
+                        except StopAsyncIteration:
+                            break
+                        finally:
+                            _current_call.reset(token)
+                        metrics.on_chunk(chunk)
+                        yield chunk
+                except BaseException as e:
+                    metrics.on_exception(e)
+                    raise
+                finally:
+                    await stream.aclose()
+                    metrics.finish()
+            finally:
+                self.active_calls -= 1
+        stream_wrapper.__instrumented__ = True
+        return stream_wrapper
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        self.active_calls += 1
+        try:
+            if not self.telemetry_enabled or _is_nested_call(self):
+                return await method(self, *args, **kwargs)
+
+            metrics = CallMetrics(self, method_name, kwargs.get('model'))
+            token = _current_call.set(metrics)
+            try:
+                result = await method(self, *args, **kwargs)
+                metrics.on_result(result)
+                return result
+            except BaseException as e:
+                metrics.on_exception(e)
+                raise
+            finally:
+                _current_call.reset(token)
+                metrics.finish()
+        finally:
+            self.active_calls -= 1
+    wrapper.__instrumented__ = True
+    return wrapper
+
+
 class BaseAIProvider(ABC):
-    """AI服务提供商基础抽象类"""
+    """AI服务提供商基础抽象类
+
+    子类中定义的 INSTRUMENTED_METHODS 会被自动包装，调用指标记录到 server.telemetry。
+    """
+
+    # 进行中的调用数（含嵌套调用），被替换的提供商等到归零后再关闭连接池
+    active_calls = 0
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for method_name in INSTRUMENTED_METHODS:
+            method = cls.__dict__.get(method_name)
+            if (inspect.iscoroutinefunction(method) or inspect.isasyncgenfunction(method)) \
+                    and not getattr(method, '__instrumented__', False) \
+                    and not getattr(method, '__isabstractmethod__', False):
+                setattr(cls, method_name, instrument(method_name, method))
 
     def __init__(self, api_key: str, api_url: str, **kwargs):
         self.api_key = api_key
         self.api_url = api_url
         self.config = kwargs
+        # 指标中的提供商名称（AIManager 注册时传入注册名）
+        self.name = kwargs.get('name') or self.__class__.__name__
+        self.telemetry_enabled = kwargs.get('telemetry', True)
+        self.timeout = kwargs.get('timeout', 30)
+        # 连接池参数：总连接数、单主机连接数、DNS缓存时间、keep-alive时间
+        self.pool_limit = kwargs.get('pool_limit', 100)
+        self.pool_limit_per_host = kwargs.get('pool_limit_per_host', 20)
+        self.dns_cache_ttl = kwargs.get('dns_cache_ttl', 300)
+        self.keepalive_timeout = kwargs.get('keepalive_timeout', 30)
+        # aiohttp会话绑定事件循环，因此按事件循环分别维护连接池
+        self._sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """获取当前事件循环下的共享HTTP会话（连接池）"""
+        loop = asyncio.get_running_loop()
+
+        # 清理已关闭事件循环遗留的会话
+        for stale_loop in [item for item in self._sessions if item.is_closed()]:
+            del self._sessions[stale_loop]
+
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.pool_limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+                enable_cleanup_closed=True
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trace_configs=[telemetry_trace_config()] if self.telemetry_enabled else None
+            )
+            self._sessions[loop] = session
+
+        return session
+
+    async def aclose(self):
+        """关闭所有事件循环下的HTTP会话，释放连接池"""
+        current_loop = asyncio.get_running_loop()
+        sessions, self._sessions = self._sessions, {}
+
+        for loop, session in sessions.items():
+            if session.closed or loop.is_closed():
+                continue
+            try:
+                if loop is current_loop:
+                    await session.close()
+                elif loop.is_running():
+                    # 会话只能在其所属的事件循环中关闭
+                    future = asyncio.run_coroutine_threadsafe(session.close(), loop)
+                    await asyncio.wrap_future(future)
+            except Exception as e:
+                logger.warning(f"关闭AI服务提供商HTTP会话失败: {str(e)}")
+
+    async def release_session(self):
+        """关闭当前事件循环下的HTTP会话（用于 asyncio.run 等短生命周期的事件循环）"""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
 
     @abstractmethod
     async def chat_completion(self, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
@@ -33,6 +462,10 @@ class BaseAIProvider(ABC):
         """文字转语音"""
         pass
 
+    async def stream_text_to_speech(self, text: str, **kwargs) -> AsyncIterator[bytes]:
+        """流式文字转语音（默认一次性产出完整音频，支持流式返回的提供商应覆盖）"""
+        yield await self.text_to_speech(text, **kwargs)
+
     @abstractmethod
     async def image_generation(self, prompt: str, **kwargs) -> Dict[str, Any]:
         """图像生成"""
@@ -53,6 +486,56 @@ class BaseAIProvider(ABC):
         """流式聊天完成"""
         pass
 
+    async def iter_response_chunks(self, response: aiohttp.ClientResponse) -> AsyncIterator[bytes]:
+        """逐块产出响应体（数据到达即产出），并计入当前调用的接收字节数"""
+        metrics = _current_call.get()
+        async for chunk in response.content.iter_any():
+            if metrics is not None:
+                metrics.bytes_received += len(chunk)
+            yield chunk
+
+    async def iter_sse_events(self, response: aiohttp.ClientResponse) -> AsyncIterator[bytes]:
+        """逐个产出SSE事件的数据（原始字节），遇到 [DONE] 结束"""
+        parser = SSEParser()
+        async for chunk in self.iter_response_chunks(response):
+            for data in parser.feed(chunk):
+                if data == b'[DONE]':
+                    return
+                yield data
+        for data in parser.close():
+            if data == b'[DONE]':
+                return
+            yield data
+
+    async def iter_openai_stream(self, response: aiohttp.ClientResponse, model: str,
+                                 fast_path: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """解析OpenAI兼容的流式响应
+
+        fast_path 开启时，纯文本增量不做完整JSON解析，此时数据块的 'data' 为None。
+        """
+        async for payload in self.iter_sse_events(response):
+            if fast_path:
+                content = fast_content_delta(payload)
+                if content is not None:
+                    yield {
+                        'success': True,
+                        'data': None,
+                        'delta': {'content': content},
+                        'model': model
+                    }
+                    continue
+            try:
+                data = json.loads(payload)
+            except json.JSONDecodeError:
+                continue
+            choices = data.get('choices')
+            yield {
+                'success': True,
+                'data': data,
+                'delta': choices[0].get('delta', {}) if choices else {},
+                'model': model
+            }
+
     def validate_config(self) -> bool:
         """验证配置"""
         return bool(self.api_key and self.api_url)
@@ -67,11 +550,19 @@ class BaseAIProvider(ABC):
     async def handle_error(self, error: Exception, context: str = "") -> Dict[str, Any]:
         """处理错误"""
         logger.error(f"AI Provider Error in {context}: {str(error)}")
-        return {
+        result = {
             'error': True,
-            'message': str(error),
-            'context': context
+            'message': str(error) or error.__class__.__name__,
+            'context': context,
+            'retryable': is_retryable_error(error)
         }
+        status = getattr(error, 'status', None)
+        if status:
+            result['status'] = status
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is not None:
+            result['retry_after'] = retry_after
+        return result
 
 
 class MultiModalProvider(BaseAIProvider):
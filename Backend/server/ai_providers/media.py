@@ -0,0 +1,141 @@
+import asyncio
+import base64
+import json
+import mimetypes
+import os
+import uuid
+from typing import Dict, Any, AsyncIterator, BinaryIO, Optional, Tuple, Union
+
+# 多模态输入：bytes、文件路径、文件对象（含Django UploadedFile）、异步字节迭代器或URL
+MediaInput = Union[bytes, str, os.PathLike, BinaryIO, AsyncIterator[bytes]]
+
+MEDIA_CHUNK_SIZE = 3 * 256 * 1024
+REMOTE_SCHEMES = ('http://', 'https://', 'oss://', 'data:')
+
+
+def is_remote_media(source: Any) -> bool:
+    """是否为可直接传给提供商的URL"""
+    return isinstance(source, str) and source.startswith(REMOTE_SCHEMES)
+
+
+def media_size(source: Any) -> Optional[int]:
+    """获取媒体剩余字节数，异步迭代器等无法预知大小时返回None"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if hasattr(source, 'fileno'):
+        try:
+            position = source.tell() if hasattr(source, 'tell') else 0
+            return os.fstat(source.fileno()).st_size - position
+        except (OSError, ValueError, AttributeError):
+            pass
+    if hasattr(source, 'seek') and hasattr(source, 'tell'):
+        try:
+            position = source.tell()
+            end = source.seek(0, os.SEEK_END)
+            source.seek(position)
+            return end - position
+        except (OSError, ValueError):
+            pass
+    return None
+
+
+def media_filename(source: Any, mime_type: str) -> str:
+    """推断上传文件名"""
+    name = source if isinstance(source, (str, os.PathLike)) else getattr(source, 'name', None)
+    if isinstance(name, (str, os.PathLike)) and os.path.basename(name):
+        return os.path.basename(name)
+    extension = mimetypes.guess_extension(mime_type) or ''
+    return f"{uuid.uuid4().hex}{extension}"
+
+
+async def iter_media(source: MediaInput, chunk_size: int = MEDIA_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """按块读取媒体数据，文件读取在线程池中执行，不阻塞事件循环
+
+    异步迭代器只能读取一次，因此传入异步迭代器的请求失败后不能重试。
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start:start + chunk_size])
+        return
+
+    if hasattr(source, '__aiter__'):
+        async for chunk in source:
+            if chunk:
+                yield bytes(chunk)
+        return
+
+    if isinstance(source, (str, os.PathLike)):
+        file = await asyncio.to_thread(open, source, 'rb')
+        owned = True
+    elif hasattr(source, 'read'):
+        file = source
+        owned = False
+    else:
+        raise TypeError(f"不支持的媒体输入类型: {type(source).__name__}")
+
+    try:
+        while True:
+            chunk = await asyncio.to_thread(file.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if owned:
+            await asyncio.to_thread(file.close)
+
+
+async def iter_base64(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """增量base64编码：每次只编码3字节对齐的部分，余下字节并入下一块"""
+    remainder = b''
+    async for chunk in chunks:
+        data = remainder + chunk
+        cut = len(data) - len(data) % 3
+        remainder = data[cut:]
+        if cut:
+            yield base64.b64encode(data[:cut])
+    if remainder:
+        yield base64.b64encode(remainder)
+
+
+def base64_length(size: int) -> int:
+    """base64编码后的长度"""
+    return (size + 2) // 3 * 4
+
+
+async def read_media(source: MediaInput) -> bytes:
+    """读取全部媒体数据（仅用于需要完整数据的小文件）"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    return b''.join([chunk async for chunk in iter_media(source)])
+
+
+def streamed_json_body(payload: Dict[str, Any], placeholder: str, source: MediaInput,
+                       prefix: str = '', size: Optional[int] = None) -> Tuple[AsyncIterator[bytes], Optional[int]]:
+    """构造流式JSON请求体：payload 中值为 placeholder 的字符串被替换为 prefix + 媒体的base64编码
+
+    返回 (异步字节迭代器, 请求体长度)，媒体大小未知时长度为None（使用分块传输编码）。
+    峰值内存只有一个数据块，而不是整个媒体的base64字符串。
+    """
+    body = json.dumps(payload, ensure_ascii=False)
+    head, tail = body.split(placeholder, 1)
+    head = (head + prefix).encode('utf-8')
+    tail = tail.encode('utf-8')
+
+    size = media_size(source) if size is None else size
+    content_length = len(head) + base64_length(size) + len(tail) if size is not None else None
+
+    async def generate() -> AsyncIterator[bytes]:
+        yield head
+        async for chunk in iter_base64(iter_media(source)):
+            yield chunk
+        yield tail
+
+    return generate(), content_length
+
+
+def media_placeholder() -> str:
+    """生成不会与请求内容冲突的占位符"""
+    return f"__media_{uuid.uuid4().hex}__"
@@ -1,13 +1,12 @@
 import aiohttp
-import json
 from typing import Dict, Any, List, AsyncIterator
-from .base import BaseAIProvider, MultiModalProvider
+from .base import MultiModalProvider, ProviderHTTPError
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-class OpenRouterProvider(BaseAIProvider, MultiModalProvider):
+class OpenRouterProvider(MultiModalProvider):
     """OpenRouter AI服务提供商"""
 
     def __init__(self, api_key: str, api_url: str = "https://openrouter.ai/api/v1", **kwargs):
@@ -43,27 +42,27 @@ class OpenRouterProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'content': result['choices'][0]['message']['content'],
-                            'usage': result.get('usage', {}),
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"API请求失败: {response.status} - {error_text}"),
-                            "chat_completion"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/completions",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'content': result['choices'][0]['message']['content'],
+                        'usage': result.get('usage', {}),
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"API请求失败: {response.status} - {error_text}"),
+                        "chat_completion"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "chat_completion")
@@ -87,35 +86,21 @@ class OpenRouterProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        async for line in response.content:
-                            line_text = line.decode('utf-8').strip()
-                            if line_text.startswith('data: '):
-                                data_text = line_text[6:]
-                                if data_text == '[DONE]':
-                                    break
-                                try:
-                                    data = json.loads(data_text)
-                                    yield {
-                                        'success': True,
-                                        'data': data,
-                                        'delta': data['choices'][0]['delta'] if data['choices'] else {},
-                                        'model': model
-                                    }
-                                except json.JSONDecodeError:
-                                    continue
-                    else:
-                        error_text = await response.text()
-                        yield await self.handle_error(
-                            Exception(f"流式API请求失败: {response.status} - {error_text}"),
-                            "stream_chat_completion"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/completions",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    async for chunk in self.iter_openai_stream(response, model, kwargs.get('fast_path', True)):
+                        yield chunk
+                else:
+                    error_text = await response.text()
+                    yield await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"流式API请求失败: {response.status} - {error_text}"),
+                        "stream_chat_completion"
+                    )
 
         except Exception as e:
             yield await self.handle_error(e, "stream_chat_completion")
@@ -143,33 +128,37 @@ class OpenRouterProvider(BaseAIProvider, MultiModalProvider):
                 'X-Title': self.app_name
             }
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/audio/transcriptions",
-                    headers=headers,
-                    data=form_data
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'text': result.get('text', ''),
-                            'language': result.get('language', language),
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"语音转文字失败: {response.status} - {error_text}"),
-                            "speech_to_text"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/audio/transcriptions",
+                headers=headers,
+                data=form_data
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'text': result.get('text', ''),
+                        'language': result.get('language', language),
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"语音转文字失败: {response.status} - {error_text}"),
+                        "speech_to_text"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "speech_to_text")
 
     async def text_to_speech(self, text: str, **kwargs) -> bytes:
         """文字转语音"""
+        return b''.join([chunk async for chunk in self.stream_text_to_speech(text, **kwargs)])
+
+    async def stream_text_to_speech(self, text: str, **kwargs) -> AsyncIterator[bytes]:
+        """流式文字转语音：音频数据到达即产出"""
         try:
             model = kwargs.get('model', 'openai/tts-1')
             voice = kwargs.get('voice', 'alloy')
@@ -184,17 +173,18 @@ class OpenRouterProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/audio/speech",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        return await response.read()
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"文字转语音失败: {response.status} - {error_text}")
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/audio/speech",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    async for chunk in self.iter_response_chunks(response):
+                        yield chunk
+                else:
+                    error_text = await response.text()
+                    raise ProviderHTTPError.from_response(response, f"文字转语音失败: {response.status} - {error_text}")
 
         except Exception as e:
             logger.error(f"文字转语音失败: {str(e)}")
@@ -218,26 +208,26 @@ class OpenRouterProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/images/generations",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'images': result.get('data', []),
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"图像生成失败: {response.status} - {error_text}"),
-                            "image_generation"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/images/generations",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'images': result.get('data', []),
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"图像生成失败: {response.status} - {error_text}"),
+                        "image_generation"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "image_generation")
@@ -286,26 +276,26 @@ class OpenRouterProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/embeddings",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'embeddings': [item['embedding'] for item in result['data']],
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"文本嵌入失败: {response.status} - {error_text}"),
-                            "embeddings"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/embeddings",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'embeddings': [item['embedding'] for item in result['data']],
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"文本嵌入失败: {response.status} - {error_text}"),
+                        "embeddings"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "embeddings")
@@ -420,24 +410,24 @@ class OpenRouterProvider(BaseAIProvider, MultiModalProvider):
         try:
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.get(
-                    f"{self.api_url}/models",
-                    headers=headers
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'models': result.get('data', [])
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"获取模型列表失败: {response.status} - {error_text}"),
-                            "get_available_models"
-                        )
+            session = self.get_session()
+            async with session.get(
+                f"{self.api_url}/models",
+                headers=headers
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'models': result.get('data', [])
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"获取模型列表失败: {response.status} - {error_text}"),
+                        "get_available_models"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "get_available_models")
@@ -447,23 +437,23 @@ class OpenRouterProvider(BaseAIProvider, MultiModalProvider):
         try:
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.get(
-                    f"{self.api_url}/models/{model_id}",
-                    headers=headers
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"获取模型信息失败: {response.status} - {error_text}"),
-                            "get_model_info"
-                        )
+            session = self.get_session()
+            async with session.get(
+                f"{self.api_url}/models/{model_id}",
+                headers=headers
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"获取模型信息失败: {response.status} - {error_text}"),
+                        "get_model_info"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "get_model_info")
@@ -0,0 +1,472 @@
+import asyncio
+import math
+import random
+import time
+from typing import Dict, Any, List, Optional, AsyncIterator, Callable, Tuple
+from .base import BaseAIProvider, MultiModalProvider, ProviderHTTPError, is_retryable_error
+from ..token_estimator import check_budget
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """单个提供商的熔断器（closed -> open -> half_open -> closed）
+
+    半开状态只放行一个探测请求；探测请求被取消时调用 release_trial 释放，
+    未释放（如流被丢弃）的探测超过 recovery_timeout 后视为放弃，允许新的探测。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._trial_started_at = 0.0
+
+    def allow_request(self) -> bool:
+        """是否允许请求通过"""
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+
+        # 半开状态只放行一个探测请求
+        if self._trial_in_flight and time.monotonic() - self._trial_started_at < self.recovery_timeout:
+            return False
+        self._trial_in_flight = True
+        self._trial_started_at = time.monotonic()
+        return True
+
+    def is_trial(self) -> bool:
+        """刚放行的请求是否为半开状态的探测请求"""
+        return self.state == self.HALF_OPEN and self._trial_in_flight
+
+    def release_trial(self):
+        """探测请求未得出结果（被取消）时释放，不改变熔断状态"""
+        self._trial_in_flight = False
+
+    def retry_after(self) -> float:
+        """距离允许下一次探测的秒数"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        """记录成功"""
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        """记录失败"""
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"提供商熔断器打开, 连续失败次数: {self.consecutive_failures}")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class ProviderHealth:
+    """提供商健康度：延迟与错误率的指数加权移动平均（EWMA）"""
+
+    def __init__(self, alpha: float = 0.2, **breaker_config):
+        self.alpha = alpha
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error_rate = 0.0
+        self.total_requests = 0
+        self.total_failures = 0
+        self.breaker = CircuitBreaker(**breaker_config)
+
+    def record(self, latency: float, success: bool):
+        """记录一次调用结果"""
+        self.total_requests += 1
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = self.alpha * latency + (1 - self.alpha) * self.ewma_latency
+
+        error = 0.0 if success else 1.0
+        self.ewma_error_rate = self.alpha * error + (1 - self.alpha) * self.ewma_error_rate
+
+        if success:
+            self.breaker.record_success()
+        else:
+            self.total_failures += 1
+            self.breaker.record_failure()
+
+    def score(self, error_penalty: float) -> float:
+        """路由评分，越小越优先；尚无观测数据的提供商优先探测"""
+        if self.ewma_latency is None:
+            return 0.0
+        return self.ewma_latency * (1 + error_penalty * self.ewma_error_rate)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典"""
+        return {
+            'ewma_latency': self.ewma_latency,
+            'ewma_error_rate': round(self.ewma_error_rate, 4),
+            'total_requests': self.total_requests,
+            'total_failures': self.total_failures,
+            'circuit_state': self.breaker.state
+        }
+
+
+class RoutedProvider(MultiModalProvider):
+    """多提供商路由：逻辑模型映射到一组上游提供商，按延迟/错误率选择并自动故障转移
+
+    routes 配置示例::
+
+        {
+            'qwen-chat': [
+                {'provider': 'SILICONFLOW', 'model': 'Qwen/Qwen3-30B-A3B', 'weight': 2},
+                {'provider': 'VOLCENGINE_ARK', 'model': 'doubao-pro-4k', 'weight': 1},
+                {'provider': 'OPENROUTER', 'model': 'qwen/qwen3-30b-a3b'}
+            ]
+        }
+
+    聊天请求会按各上游模型的上下文长度（target 中的 context_window 或按模型名推断）预估提示词，
+    放不下的上游直接跳过，放得下的按剩余空间收紧 max_tokens。
+    """
+
+    STRATEGIES = ('ordered', 'weighted', 'latency')
+
+    def __init__(self, api_key: str = '', api_url: str = '', **kwargs):
+        super().__init__(api_key, api_url, **kwargs)
+        self.routes: Dict[str, List[Dict[str, Any]]] = kwargs.get('routes', {})
+        self.strategy = kwargs.get('strategy', 'latency')
+        self.default_route = kwargs.get('default_route')
+        self.attempt_timeout = kwargs.get('attempt_timeout', self.timeout)
+        self.max_attempts = kwargs.get('max_attempts', 3)
+        self.error_penalty = kwargs.get('error_penalty', 10.0)
+        self.breaker_config = {
+            'failure_threshold': kwargs.get('failure_threshold', 5),
+            'recovery_timeout': kwargs.get('recovery_timeout', 30.0)
+        }
+        self.ewma_alpha = kwargs.get('ewma_alpha', 0.2)
+        # 由AIManager注入：按名称获取已注册的提供商
+        self.provider_resolver: Optional[Callable[[str], Optional[BaseAIProvider]]] = kwargs.get('provider_resolver')
+        self.health: Dict[str, ProviderHealth] = {}
+
+    def validate_config(self) -> bool:
+        """验证配置"""
+        return bool(self.routes) and self.provider_resolver is not None and self.strategy in self.STRATEGIES
+
+    def get_health(self, provider_name: str) -> ProviderHealth:
+        """获取提供商健康度"""
+        health = self.health.get(provider_name)
+        if health is None:
+            health = ProviderHealth(alpha=self.ewma_alpha, **self.breaker_config)
+            self.health[provider_name] = health
+        return health
+
+    def health_report(self) -> Dict[str, Dict[str, Any]]:
+        """提供商健康度报告"""
+        return {name: health.to_dict() for name, health in self.health.items()}
+
+    def select_targets(self, logical_model: Optional[str]) -> List[Dict[str, Any]]:
+        """按路由策略对候选上游排序"""
+        targets = self.routes.get(logical_model) if logical_model else None
+        if targets is None and self.default_route:
+            targets = self.routes.get(self.default_route)
+        if not targets:
+            return []
+
+        if self.strategy == 'ordered':
+            return list(targets)
+
+        if self.strategy == 'weighted':
+            # 加权随机排序（Efraimidis-Spirakis）
+            return sorted(
+                targets,
+                key=lambda target: random.random() ** (1.0 / max(target.get('weight', 1), 1e-6)),
+                reverse=True
+            )
+
+        # latency：EWMA评分升序，同分时保持配置顺序
+        return sorted(
+            targets,
+            key=lambda target: self.get_health(target['provider']).score(self.error_penalty)
+        )
+
+    def _resolve_candidates(self, kwargs: Dict[str, Any],
+                            messages: Optional[List[Dict[str, Any]]] = None) -> List[Tuple[str, BaseAIProvider, Dict[str, Any]]]:
+        """解析可用候选：(提供商名称, 提供商实例, 调用参数)"""
+        candidates = []
+        for target in self.select_targets(kwargs.get('model')):
+            provider_name = target['provider']
+            provider = self.provider_resolver(provider_name)
+            if provider is None or provider is self:
+                continue
+            params = {**kwargs, **target.get('params', {})}
+            if target.get('model'):
+                params['model'] = target['model']
+            else:
+                params.pop('model', None)
+
+            if messages is not None:
+                budget = check_budget(
+                    messages, params.get('model'), params.get('max_tokens'), target.get('context_window')
+                )
+                if not budget['fits']:
+                    logger.debug(f"提示词超出上游上下文长度, 跳过: {provider_name} - {budget['prompt_tokens']}")
+                    continue
+                if budget['max_tokens'] is not None:
+                    params['max_tokens'] = budget['max_tokens']
+
+            candidates.append((provider_name, provider, params))
+        return candidates
+
+    def _all_open_error(self, candidates: List[Tuple[str, BaseAIProvider, Dict[str, Any]]],
+                        kwargs: Dict[str, Any]) -> ProviderHTTPError:
+        """所有候选上游均处于熔断状态：属于暂时状态，按503（可重试）报告，Retry-After 为最早允许探测的时间"""
+        retry_after = min(self.get_health(provider_name).breaker.retry_after() for provider_name, _, _ in candidates)
+        return ProviderHTTPError(
+            503, f"所有上游提供商均处于熔断状态: {kwargs.get('model')}", retry_after=max(1, math.ceil(retry_after))
+        )
+
+    def _no_candidates_error(self, kwargs: Dict[str, Any], messages: Optional[List[Dict[str, Any]]]) -> Exception:
+        if messages is not None and self.select_targets(kwargs.get('model')):
+            return Exception(f"请求超出所有上游模型的上下文长度: {kwargs.get('model')}")
+        return Exception(f"未找到模型的路由配置: {kwargs.get('model')}")
+
+    async def _call_with_failover(self, method_name: str, *args, **kwargs):
+        """依次尝试候选上游，遇到5xx/超时/连接错误时故障转移"""
+        messages = args[0] if method_name == 'chat_completion' else None
+        candidates = self._resolve_candidates(kwargs, messages)
+        if not candidates:
+            return await self.handle_error(self._no_candidates_error(kwargs, messages), method_name)
+
+        last_error: Any = None
+        attempts = 0
+        for provider_name, provider, params in candidates:
+            if attempts >= self.max_attempts:
+                break
+
+            health = self.get_health(provider_name)
+            if not health.breaker.allow_request():
+                continue
+
+            attempts += 1
+            trial = health.breaker.is_trial()
+            start_time = time.monotonic()
+            try:
+                result = await asyncio.wait_for(
+                    getattr(provider, method_name)(*args, **params),
+                    timeout=self.attempt_timeout
+                )
+            except Exception as e:
+                health.record(time.monotonic() - start_time, False)
+                last_error = e
+                if not is_retryable_error(e):
+                    raise
+                logger.warning(f"路由调用失败, 故障转移: {provider_name}.{method_name} - {str(e) or e.__class__.__name__}")
+                continue
+            except BaseException:
+                # 调用被取消（对冲落败、客户端断开等）：没有结果，释放探测名额
+                if trial:
+                    health.breaker.release_trial()
+                raise
+
+            latency = time.monotonic() - start_time
+            if isinstance(result, dict) and result.get('error'):
+                health.record(latency, False)
+                last_error = result
+                if not result.get('retryable'):
+                    return result
+                logger.warning(f"路由调用失败, 故障转移: {provider_name}.{method_name} - {result.get('message')}")
+                continue
+
+            health.record(latency, True)
+            if isinstance(result, dict):
+                result['provider'] = provider_name
+            return result
+
+        if isinstance(last_error, Exception):
+            raise last_error
+        if last_error is not None:
+            return last_error
+        return await self.handle_error(self._all_open_error(candidates, kwargs), method_name)
+
+    async def chat_completion(self, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
+        """聊天完成"""
+        return await self._call_with_failover('chat_completion', messages, **kwargs)
+
+    async def stream_chat_completion(self, messages: List[Dict[str, str]], **kwargs) -> AsyncIterator[Dict[str, Any]]:
+        """流式聊天完成：仅在尚未输出任何内容前进行故障转移"""
+        candidates = self._resolve_candidates(kwargs, messages)
+        if not candidates:
+            yield await self.handle_error(self._no_candidates_error(kwargs, messages), "stream_chat_completion")
+            return
+
+        last_error = None
+        attempts = 0
+        for provider_name, provider, params in candidates:
+            if attempts >= self.max_attempts:
+                break
+
+            health = self.get_health(provider_name)
+            if not health.breaker.allow_request():
+                continue
+
+            attempts += 1
+            trial = health.breaker.is_trial()
+            start_time = time.monotonic()
+            started = False
+            stream = provider.stream_chat_completion(messages, **params)
+            try:
+                while True:
+                    try:
+                        if started:
+                            chunk = await stream.__anext__()
+                        else:
+                            # 首个分片受单次尝试超时约束
+                            chunk = await asyncio.wait_for(stream.__anext__(), timeout=self.attempt_timeout)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError as e:
+                        chunk = await self.handle_error(e, "stream_chat_completion")
+
+                    if chunk.get('error') and not started:
+                        last_error = chunk
+                        break
+
+                    if not started:
+                        health.record(time.monotonic() - start_time, True)
+                        started = True
+                    chunk['provider'] = provider_name
+                    yield chunk
+            except Exception:
+                if not started:
+                    health.record(time.monotonic() - start_time, False)
+                raise
+            except BaseException:
+                # 输出前被取消：没有结果，释放探测名额
+                if not started and trial:
+                    health.breaker.release_trial()
+                raise
+            finally:
+                await stream.aclose()
+
+            if started:
+                return
+
+            if last_error is None:
+                # 上游未返回任何内容即结束，视为成功
+                health.record(time.monotonic() - start_time, True)
+                return
+
+            health.record(time.monotonic() - start_time, False)
+            if not last_error.get('retryable'):
+                yield last_error
+                return
+            logger.warning(f"流式路由调用失败, 故障转移: {provider_name} - {last_error.get('message')}")
+
+        if last_error is None:
+            last_error = await self.handle_error(self._all_open_error(candidates, kwargs), "stream_chat_completion")
+        yield last_error
+
+    async def text_generation(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        """文本生成"""
+        return await self._call_with_failover('text_generation', prompt, **kwargs)
+
+    async def speech_to_text(self, audio_file: bytes, **kwargs) -> Dict[str, Any]:
+        """语音转文字"""
+        return await self._call_with_failover('speech_to_text', audio_file, **kwargs)
+
+    async def text_to_speech(self, text: str, **kwargs) -> bytes:
+        """文字转语音"""
+        return await self._call_with_failover('text_to_speech', text, **kwargs)
+
+    async def stream_text_to_speech(self, text: str, **kwargs) -> AsyncIterator[bytes]:
+        """流式文字转语音：仅在尚未输出音频前进行故障转移"""
+        candidates = self._resolve_candidates(kwargs)
+        if not candidates:
+            raise self._no_candidates_error(kwargs, None)
+
+        last_error: Optional[Exception] = None
+        attempts = 0
+        for provider_name, provider, params in candidates:
+            if attempts >= self.max_attempts:
+                break
+
+            health = self.get_health(provider_name)
+            if not health.breaker.allow_request():
+                continue
+
+            attempts += 1
+            trial = health.breaker.is_trial()
+            start_time = time.monotonic()
+            started = False
+            stream = provider.stream_text_to_speech(text, **params)
+            try:
+                while True:
+                    try:
+                        if started:
+                            chunk = await stream.__anext__()
+                        else:
+                            chunk = await asyncio.wait_for(stream.__anext__(), timeout=self.attempt_timeout)
+                    except StopAsyncIteration:
+                        break
+                    if not started:
+                        health.record(time.monotonic() - start_time, True)
+                        started = True
+                    yield chunk
+            except Exception as e:
+                if started:
+                    raise
+                health.record(time.monotonic() - start_time, False)
+                last_error = e
+                if not is_retryable_error(e):
+                    raise
+                logger.warning(f"流式路由调用失败, 故障转移: {provider_name}.stream_text_to_speech - {str(e) or e.__class__.__name__}")
+                continue
+            except BaseException:
+                # 输出前被取消：没有结果，释放探测名额
+                if not started and trial:
+                    health.breaker.release_trial()
+                raise
+            finally:
+                await stream.aclose()
+
+            if not started:
+                health.record(time.monotonic() - start_time, True)
+            return
+
+        raise last_error or self._all_open_error(candidates, kwargs)
+
+    async def image_generation(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        """图像生成"""
+        return await self._call_with_failover('image_generation', prompt, **kwargs)
+
+    async def image_analysis(self, image_data: bytes, prompt: str, **kwargs) -> Dict[str, Any]:
+        """图像分析"""
+        return await self._call_with_failover('image_analysis', image_data, prompt, **kwargs)
+
+    async def embeddings(self, texts: List[str], **kwargs) -> Dict[str, Any]:
+        """文本嵌入"""
+        return await self._call_with_failover('embeddings', texts, **kwargs)
+
+    async def multimodal_completion(self, inputs: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        """多模态完成"""
+        return await self._call_with_failover('multimodal_completion', inputs, **kwargs)
+
+    async def video_analysis(self, video_data: bytes, prompt: str, **kwargs) -> Dict[str, Any]:
+        """视频分析"""
+        return await self._call_with_failover('video_analysis', video_data, prompt, **kwargs)
+
+    async def document_analysis(self, document_data: bytes, document_type: str, **kwargs) -> Dict[str, Any]:
+        """文档分析"""
+        return await self._call_with_failover('document_analysis', document_data, document_type, **kwargs)
@@ -1,18 +1,16 @@
 import aiohttp
-import json
 from typing import Dict, Any, List, AsyncIterator
-from .base import BaseAIProvider, MultiModalProvider
+from .base import MultiModalProvider, ProviderHTTPError
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-class SiliconFlowProvider(BaseAIProvider, MultiModalProvider):
+class SiliconFlowProvider(MultiModalProvider):
     """硅基流动AI服务提供商"""
 
     def __init__(self, api_key: str, api_url: str = "https://api.siliconflow.cn/v1", **kwargs):
         super().__init__(api_key, api_url, **kwargs)
-        self.timeout = kwargs.get('timeout', 30)
 
     async def chat_completion(self, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
         """聊天完成"""
@@ -33,27 +31,27 @@ class SiliconFlowProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'content': result['choices'][0]['message']['content'],
-                            'usage': result.get('usage', {}),
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"API请求失败: {response.status} - {error_text}"),
-                            "chat_completion"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/completions",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'content': result['choices'][0]['message']['content'],
+                        'usage': result.get('usage', {}),
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"API请求失败: {response.status} - {error_text}"),
+                        "chat_completion"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "chat_completion")
@@ -77,35 +75,21 @@ class SiliconFlowProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        async for line in response.content:
-                            line_text = line.decode('utf-8').strip()
-                            if line_text.startswith('data: '):
-                                data_text = line_text[6:]
-                                if data_text == '[DONE]':
-                                    break
-                                try:
-                                    data = json.loads(data_text)
-                                    yield {
-                                        'success': True,
-                                        'data': data,
-                                        'delta': data['choices'][0]['delta'] if data['choices'] else {},
-                                        'model': model
-                                    }
-                                except json.JSONDecodeError:
-                                    continue
-                    else:
-                        error_text = await response.text()
-                        yield await self.handle_error(
-                            Exception(f"流式API请求失败: {response.status} - {error_text}"),
-                            "stream_chat_completion"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/completions",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    async for chunk in self.iter_openai_stream(response, model, kwargs.get('fast_path', True)):
+                        yield chunk
+                else:
+                    error_text = await response.text()
+                    yield await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"流式API请求失败: {response.status} - {error_text}"),
+                        "stream_chat_completion"
+                    )
 
         except Exception as e:
             yield await self.handle_error(e, "stream_chat_completion")
@@ -130,33 +114,37 @@ class SiliconFlowProvider(BaseAIProvider, MultiModalProvider):
             form_data.add_field('model', model)
             form_data.add_field('language', language)
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/audio/transcriptions",
-                    headers=headers,
-                    data=form_data
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'text': result.get('text', ''),
-                            'language': result.get('language', language),
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"语音转文字失败: {response.status} - {error_text}"),
-                            "speech_to_text"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/audio/transcriptions",
+                headers=headers,
+                data=form_data
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'text': result.get('text', ''),
+                        'language': result.get('language', language),
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"语音转文字失败: {response.status} - {error_text}"),
+                        "speech_to_text"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "speech_to_text")
 
     async def text_to_speech(self, text: str, **kwargs) -> bytes:
         """文字转语音"""
+        return b''.join([chunk async for chunk in self.stream_text_to_speech(text, **kwargs)])
+
+    async def stream_text_to_speech(self, text: str, **kwargs) -> AsyncIterator[bytes]:
+        """流式文字转语音：音频数据到达即产出"""
         try:
             model = kwargs.get('model', 'FishAudio/fish-speech-1.4')
             voice = kwargs.get('voice', 'default')
@@ -171,17 +159,18 @@ class SiliconFlowProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/audio/speech",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        return await response.read()
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"文字转语音失败: {response.status} - {error_text}")
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/audio/speech",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    async for chunk in self.iter_response_chunks(response):
+                        yield chunk
+                else:
+                    error_text = await response.text()
+                    raise ProviderHTTPError.from_response(response, f"文字转语音失败: {response.status} - {error_text}")
 
         except Exception as e:
             logger.error(f"文字转语音失败: {str(e)}")
@@ -205,26 +194,26 @@ class SiliconFlowProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/images/generations",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'images': result.get('data', []),
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"图像生成失败: {response.status} - {error_text}"),
-                            "image_generation"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/images/generations",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'images': result.get('data', []),
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"图像生成失败: {response.status} - {error_text}"),
+                        "image_generation"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "image_generation")
@@ -274,26 +263,26 @@ class SiliconFlowProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/embeddings",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'embeddings': [item['embedding'] for item in result['data']],
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"文本嵌入失败: {response.status} - {error_text}"),
-                            "embeddings"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/embeddings",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'embeddings': [item['embedding'] for item in result['data']],
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"文本嵌入失败: {response.status} - {error_text}"),
+                        "embeddings"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "embeddings")
@@ -1,18 +1,16 @@
 import aiohttp
-import json
 from typing import Dict, Any, List, AsyncIterator
-from .base import BaseAIProvider, MultiModalProvider
+from .base import MultiModalProvider, ProviderHTTPError
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
+class VolcengineArkProvider(MultiModalProvider):
     """火山方舟（豆包）AI服务提供商"""
 
     def __init__(self, api_key: str, api_url: str = "https://ark.cn-beijing.volces.com/api/v3", **kwargs):
         super().__init__(api_key, api_url, **kwargs)
-        self.timeout = kwargs.get('timeout', 30)
         self.region = kwargs.get('region', 'cn-beijing')
 
     def get_headers(self) -> Dict[str, str]:
@@ -42,27 +40,27 @@ class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'content': result['choices'][0]['message']['content'],
-                            'usage': result.get('usage', {}),
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"API请求失败: {response.status} - {error_text}"),
-                            "chat_completion"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/completions",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'content': result['choices'][0]['message']['content'],
+                        'usage': result.get('usage', {}),
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"API请求失败: {response.status} - {error_text}"),
+                        "chat_completion"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "chat_completion")
@@ -86,35 +84,21 @@ class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        async for line in response.content:
-                            line_text = line.decode('utf-8').strip()
-                            if line_text.startswith('data: '):
-                                data_text = line_text[6:]
-                                if data_text == '[DONE]':
-                                    break
-                                try:
-                                    data = json.loads(data_text)
-                                    yield {
-                                        'success': True,
-                                        'data': data,
-                                        'delta': data['choices'][0]['delta'] if data['choices'] else {},
-                                        'model': model
-                                    }
-                                except json.JSONDecodeError:
-                                    continue
-                    else:
-                        error_text = await response.text()
-                        yield await self.handle_error(
-                            Exception(f"流式API请求失败: {response.status} - {error_text}"),
-                            "stream_chat_completion"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/completions",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    async for chunk in self.iter_openai_stream(response, model, kwargs.get('fast_path', True)):
+                        yield chunk
+                else:
+                    error_text = await response.text()
+                    yield await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"流式API请求失败: {response.status} - {error_text}"),
+                        "stream_chat_completion"
+                    )
 
         except Exception as e:
             yield await self.handle_error(e, "stream_chat_completion")
@@ -141,33 +125,37 @@ class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
                 'X-Region': self.region
             }
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/audio/transcriptions",
-                    headers=headers,
-                    data=form_data
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'text': result.get('text', ''),
-                            'language': result.get('language', language),
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"语音转文字失败: {response.status} - {error_text}"),
-                            "speech_to_text"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/audio/transcriptions",
+                headers=headers,
+                data=form_data
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'text': result.get('text', ''),
+                        'language': result.get('language', language),
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"语音转文字失败: {response.status} - {error_text}"),
+                        "speech_to_text"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "speech_to_text")
 
     async def text_to_speech(self, text: str, **kwargs) -> bytes:
         """文字转语音"""
+        return b''.join([chunk async for chunk in self.stream_text_to_speech(text, **kwargs)])
+
+    async def stream_text_to_speech(self, text: str, **kwargs) -> AsyncIterator[bytes]:
+        """流式文字转语音：音频数据到达即产出"""
         try:
             model = kwargs.get('model', 'doubao-tts-1')
             voice = kwargs.get('voice', 'zh_female_tianmei')
@@ -183,17 +171,18 @@ class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/audio/speech",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        return await response.read()
-                    else:
-                        error_text = await response.text()
-                        raise Exception(f"文字转语音失败: {response.status} - {error_text}")
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/audio/speech",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    async for chunk in self.iter_response_chunks(response):
+                        yield chunk
+                else:
+                    error_text = await response.text()
+                    raise ProviderHTTPError.from_response(response, f"文字转语音失败: {response.status} - {error_text}")
 
         except Exception as e:
             logger.error(f"文字转语音失败: {str(e)}")
@@ -219,26 +208,26 @@ class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/images/generations",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'images': result.get('data', []),
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"图像生成失败: {response.status} - {error_text}"),
-                            "image_generation"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/images/generations",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'images': result.get('data', []),
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"图像生成失败: {response.status} - {error_text}"),
+                        "image_generation"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "image_generation")
@@ -246,7 +235,8 @@ class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
     async def image_analysis(self, image_data: bytes, prompt: str, **kwargs) -> Dict[str, Any]:
         """图像分析"""
         try:
-            model = kwargs.get('model', 'doubao-vision-pro')
+            model = kwargs.pop('model', 'doubao-vision-pro')
+            mime_type = kwargs.pop('mime_type', 'image/jpeg')
 
             # 将图片转换为base64
             import base64
@@ -263,7 +253,7 @@ class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{mime_type};base64,{image_base64}"
                             }
                         }
                     ]
@@ -288,26 +278,26 @@ class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/embeddings",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'embeddings': [item['embedding'] for item in result['data']],
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"文本嵌入失败: {response.status} - {error_text}"),
-                            "embeddings"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/embeddings",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'embeddings': [item['embedding'] for item in result['data']],
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"文本嵌入失败: {response.status} - {error_text}"),
+                        "embeddings"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "embeddings")
@@ -315,7 +305,7 @@ class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
     async def multimodal_completion(self, inputs: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
         """多模态完成"""
         try:
-            model = kwargs.get('model', 'doubao-vision-pro')
+            model = kwargs.pop('model', 'doubao-vision-pro')
 
             content_list = []
             for input_item in inputs:
@@ -335,7 +325,7 @@ class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
                     content_list.append({
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_base64}"
+                            "url": f"data:{input_item.get('mime_type', 'image/jpeg')};base64,{image_base64}"
                         }
                     })
 
@@ -411,29 +401,29 @@ class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        choice = result['choices'][0]
-                        return {
-                            'success': True,
-                            'data': result,
-                            'content': choice['message'].get('content', ''),
-                            'function_call': choice['message'].get('function_call'),
-                            'usage': result.get('usage', {}),
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"函数调用失败: {response.status} - {error_text}"),
-                            "function_calling"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/completions",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    choice = result['choices'][0]
+                    return {
+                        'success': True,
+                        'data': result,
+                        'content': choice['message'].get('content', ''),
+                        'function_call': choice['message'].get('function_call'),
+                        'usage': result.get('usage', {}),
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"函数调用失败: {response.status} - {error_text}"),
+                        "function_calling"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "function_calling")
@@ -456,29 +446,29 @@ class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        choice = result['choices'][0]
-                        return {
-                            'success': True,
-                            'data': result,
-                            'content': choice['message']['content'],
-                            'reasoning': choice['message'].get('reasoning', ''),  # 思考过程
-                            'usage': result.get('usage', {}),
-                            'model': model
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"思考模式完成失败: {response.status} - {error_text}"),
-                            "thinking_completion"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/completions",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    choice = result['choices'][0]
+                    return {
+                        'success': True,
+                        'data': result,
+                        'content': choice['message']['content'],
+                        'reasoning': choice['message'].get('reasoning', ''),  # 思考过程
+                        'usage': result.get('usage', {}),
+                        'model': model
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"思考模式完成失败: {response.status} - {error_text}"),
+                        "thinking_completion"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "thinking_completion")
@@ -519,28 +509,28 @@ class VolcengineArkProvider(BaseAIProvider, MultiModalProvider):
 
             headers = self.get_headers()
 
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
-                async with session.post(
-                    f"{self.api_url}/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            'success': True,
-                            'data': result,
-                            'content': result['choices'][0]['message']['content'],
-                            'usage': result.get('usage', {}),
-                            'model': model,
-                            'domain': domain
-                        }
-                    else:
-                        error_text = await response.text()
-                        return await self.handle_error(
-                            Exception(f"专业领域完成失败: {response.status} - {error_text}"),
-                            "specialized_completion"
-                        )
+            session = self.get_session()
+            async with session.post(
+                f"{self.api_url}/chat/completions",
+                headers=headers,
+                json=payload
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        'success': True,
+                        'data': result,
+                        'content': result['choices'][0]['message']['content'],
+                        'usage': result.get('usage', {}),
+                        'model': model,
+                        'domain': domain
+                    }
+                else:
+                    error_text = await response.text()
+                    return await self.handle_error(
+                        ProviderHTTPError.from_response(response, f"专业领域完成失败: {response.status} - {error_text}"),
+                        "specialized_completion"
+                    )
 
         except Exception as e:
             return await self.handle_error(e, "specialized_completion")
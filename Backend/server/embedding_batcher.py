@@ -0,0 +1,150 @@
+import asyncio
+from typing import Dict, Any, List, Optional, Callable, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# 各类型提供商（AIManager.provider_classes 的键）嵌入接口的单次请求上限：文本条数、总Token数
+PROVIDER_EMBEDDING_LIMITS = {
+    'SILICONFLOW': {'max_batch_size': 32, 'max_batch_tokens': 16384},
+    'ALIBABA_BAILIAN': {'max_batch_size': 25, 'max_batch_tokens': 50000},
+    'VOLCENGINE_ARK': {'max_batch_size': 256, 'max_batch_tokens': 65536},
+    'OPENROUTER': {'max_batch_size': 512, 'max_batch_tokens': 300000},
+    'BAIDU_QIANFAN': {'max_batch_size': 16, 'max_batch_tokens': 8192},
+}
+
+
+class EmbeddingBatcher:
+    """嵌入请求合并器（micro-batching）
+
+    在 max_wait 时间窗口内收集并发的单条文本嵌入请求，去重后按提供商的批量上限
+    拆分为若干批次调用 embeddings()，再把结果分发给各个等待者。
+    """
+
+    def __init__(self, ai_manager, provider_name: str, model: Optional[str] = None,
+                 max_wait: float = 0.01, max_batch_size: Optional[int] = None,
+                 max_batch_tokens: Optional[int] = None,
+                 token_counter: Optional[Callable[[str], int]] = None, provider_type: Optional[str] = None):
+        limits = PROVIDER_EMBEDDING_LIMITS.get(provider_type or provider_name, {})
+        self.ai_manager = ai_manager
+        self.provider_name = provider_name
+        self.model = model
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size or limits.get('max_batch_size', 16)
+        self.max_batch_tokens = max_batch_tokens or limits.get('max_batch_tokens', 8192)
+        # 默认按字符数估算Token（对中文近似准确，对英文偏保守）
+        self.token_counter = token_counter or len
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        # 批量上限按去重后的文本计算
+        self._pending_texts: set = set()
+        self._pending_tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 进行中的分发任务（事件循环只保留任务的弱引用）
+        self._dispatch_tasks: set = set()
+        self.stats = {
+            'requests': 0,
+            'deduplicated': 0,
+            'batches': 0,
+            'texts_sent': 0
+        }
+
+    async def embed(self, text: str) -> Dict[str, Any]:
+        """获取单条文本的嵌入向量"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if text not in self._pending_texts:
+            self._pending_texts.add(text)
+            self._pending_tokens += self.token_counter(text)
+        self.stats['requests'] += 1
+
+        if len(self._pending_texts) >= self.max_batch_size or self._pending_tokens >= self.max_batch_tokens:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush_now)
+
+        result = await future
+        if isinstance(result, dict):
+            return result
+        return {
+            'success': True,
+            'embedding': result,
+            'model': self.model
+        }
+
+    async def embed_many(self, texts: List[str]) -> Dict[str, Any]:
+        """获取多条文本的嵌入向量（与其他并发请求合并发送）"""
+        results = await asyncio.gather(*(self.embed(text) for text in texts))
+        for result in results:
+            if not result.get('success'):
+                return result
+        return {
+            'success': True,
+            'embeddings': [result['embedding'] for result in results],
+            'model': self.model
+        }
+
+    def _flush_now(self):
+        """取出当前待处理请求并异步发送"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, []
+        self._pending_texts = set()
+        self._pending_tokens = 0
+        task = asyncio.get_running_loop().create_task(self._dispatch(pending))
+        self._dispatch_tasks.add(task)
+        task.add_done_callback(self._dispatch_tasks.discard)
+
+    def _split_batches(self, texts: List[str]) -> List[List[str]]:
+        """按条数和Token上限拆分批次"""
+        batches: List[List[str]] = []
+        current: List[str] = []
+        current_tokens = 0
+        for text in texts:
+            tokens = self.token_counter(text)
+            if current and (len(current) >= self.max_batch_size or current_tokens + tokens > self.max_batch_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _dispatch(self, pending: List[Tuple[str, asyncio.Future]]):
+        """去重、分批调用提供商并分发结果"""
+        waiters: Dict[str, List[asyncio.Future]] = {}
+        for text, future in pending:
+            waiters.setdefault(text, []).append(future)
+        unique_texts = list(waiters.keys())
+        self.stats['deduplicated'] += len(pending) - len(unique_texts)
+
+        params = {'model': self.model} if self.model else {}
+        batches = self._split_batches(unique_texts)
+        responses = await asyncio.gather(
+            *(self.ai_manager.embeddings(self.provider_name, batch, **params) for batch in batches),
+            return_exceptions=True
+        )
+
+        for batch, response in zip(batches, responses):
+            self.stats['batches'] += 1
+            self.stats['texts_sent'] += len(batch)
+
+            if isinstance(response, Exception):
+                response = {'error': True, 'message': f'文本嵌入失败: {str(response)}'}
+
+            embeddings = response.get('embeddings') if response.get('success') else None
+            if embeddings is not None and len(embeddings) != len(batch):
+                response = {'error': True, 'message': '文本嵌入返回数量与请求不一致'}
+                embeddings = None
+
+            for index, text in enumerate(batch):
+                value = embeddings[index] if embeddings is not None else response
+                for future in waiters[text]:
+                    if not future.done():
+                        future.set_result(value)
@@ -0,0 +1,483 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(text: str) -> str:
+    """文本内容哈希"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class IVFIndex:
+    """倒排文件（IVF）近似最近邻索引
+
+    使用球面k-means把向量划分到 nlist 个簇，查询时只在距离最近的 nprobe 个簇中做精确比较。
+    """
+
+    def __init__(self, nlist: int = 64, nprobe: int = 8, iterations: int = 10, seed: int = 0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[set] = []
+        self.assignments: Dict[int, int] = {}
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, vectors: np.ndarray):
+        """在（已归一化的）样本向量上训练簇中心"""
+        rng = np.random.default_rng(self.seed)
+        nlist = min(self.nlist, len(vectors))
+        centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+
+        for _ in range(self.iterations):
+            labels = np.argmax(vectors @ centroids.T, axis=1)
+            for index in range(nlist):
+                members = vectors[labels == index]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                else:
+                    # 空簇重新随机取点
+                    centroid = vectors[rng.integers(len(vectors))].copy()
+                norm = np.linalg.norm(centroid)
+                centroids[index] = centroid / norm if norm else centroid
+
+        self.centroids = centroids.astype(np.float32)
+        self.lists = [set() for _ in range(nlist)]
+        self.assignments = {}
+
+    def assign(self, rows: np.ndarray, vectors: np.ndarray):
+        """把向量加入最近的簇"""
+        if not len(rows):
+            return
+        labels = np.argmax(vectors @ self.centroids.T, axis=1)
+        for row, label in zip(rows.tolist(), labels.tolist()):
+            self.remove(row)
+            self.lists[label].add(row)
+            self.assignments[row] = label
+
+    def remove(self, row: int):
+        """从索引中移除"""
+        label = self.assignments.pop(row, None)
+        if label is not None:
+            self.lists[label].discard(row)
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """返回查询向量最近的若干簇中的候选行号"""
+        nprobe = min(nprobe or self.nprobe, len(self.lists))
+        scores = self.centroids @ query
+        probes = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        rows = set()
+        for probe in probes.tolist():
+            rows.update(self.lists[probe])
+        return np.fromiter(rows, dtype=np.int64, count=len(rows))
+
+
+class EmbeddingStore:
+    """单个嵌入模型的持久化向量存储
+
+    - 向量：磁盘上的 float32 内存映射矩阵（vectors.f32），按需倍增扩容，已删除的行会被复用
+    - 键值：SQLite 保存 内容哈希 -> 行号 以及元数据
+    - 检索：向量入库前归一化，按余弦相似度检索；数据量达到阈值后启用IVF近似索引
+    - 只有带元数据写入的条目参与检索，不带元数据的条目仅作为嵌入缓存
+
+    多个进程可以共享同一目录：行号在 SQLite 写事务（BEGIN IMMEDIATE）中分配，向量写入内存映射后才提交；
+    每次读写前用 PRAGMA data_version 检测其他进程的提交，并按提交序号增量同步键值映射。
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, path: str, dim: Optional[int] = None, nlist: int = 64, nprobe: int = 8,
+                 train_threshold: Optional[int] = None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(
+            os.path.join(path, 'entries.sqlite3'), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._db.execute('PRAGMA journal_mode=WAL')
+        with self._write_transaction():
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, row INTEGER NOT NULL UNIQUE, metadata TEXT, seq INTEGER NOT NULL DEFAULT 0)'
+            )
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS deletions (seq INTEGER NOT NULL, key TEXT NOT NULL, '
+                             'row INTEGER NOT NULL)')
+            columns = {column[1] for column in self._db.execute('PRAGMA table_info(entries)')}
+            if 'seq' not in columns:
+                self._db.execute('ALTER TABLE entries ADD COLUMN seq INTEGER NOT NULL DEFAULT 0')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entries_seq ON entries (seq)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS deletions_seq ON deletions (seq)')
+            if self._get_meta('next_row') is None:
+                # 旧版本的存储没有空闲行表，按已用行号补齐
+                used = {row for (row,) in self._db.execute('SELECT row FROM entries')}
+                next_row = max(used, default=-1) + 1
+                self._db.executemany('INSERT OR IGNORE INTO free_rows (row) VALUES (?)',
+                                     [(row,) for row in range(next_row) if row not in used])
+                self._set_meta('next_row', str(next_row))
+
+        self.dim = dim
+        self.index = IVFIndex(nlist=nlist, nprobe=nprobe)
+        self.train_threshold = train_threshold or nlist * 40
+        self._trained_size = 0
+
+        self.key_to_row: Dict[str, int] = {}
+        self.row_to_key: Dict[int, str] = {}
+        self.searchable_rows: set = set()
+        # 已同步到的提交序号，以及上次同步时的 data_version
+        self._seq = -1
+        self._data_version = None
+
+        self.capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        self._sync()
+        if self.dim:
+            self._load_index()
+
+    @contextmanager
+    def _write_transaction(self):
+        """SQLite 写事务：BEGIN IMMEDIATE 立即取得数据库写锁，多个进程的行号分配和向量写入依次进行"""
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        self._db.execute('COMMIT')
+
+    def _get_meta(self, name: str) -> Optional[str]:
+        row = self._db.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name: str, value: str):
+        self._db.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, value))
+
+    def _next_seq(self) -> int:
+        """在写事务中取得新的提交序号"""
+        seq = int(self._get_meta('seq') or 0) + 1
+        self._set_meta('seq', str(seq))
+        return seq
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.path, 'vectors.f32')
+
+    @property
+    def _centroids_path(self) -> str:
+        return os.path.join(self.path, 'centroids.npy')
+
+    def _open_vectors(self, capacity: int):
+        """打开（必要时扩容）内存映射文件"""
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+
+        size = capacity * self.dim * 4
+        mode = 'r+b' if os.path.exists(self._vectors_path) else 'w+b'
+        with open(self._vectors_path, mode) as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < size:
+                f.truncate(size)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        self.capacity = capacity
+
+    def _ensure_capacity(self, rows: int):
+        """保证内存映射至少容纳 rows 行（文件可能已被其他进程扩容，按实际大小打开）"""
+        if self._vectors is not None and rows <= self.capacity:
+            return
+        file_rows = os.path.getsize(self._vectors_path) // (self.dim * 4) if os.path.exists(self._vectors_path) else 0
+        capacity = self.INITIAL_CAPACITY if self._vectors is None else self.capacity * 2
+        self._open_vectors(max(rows, file_rows, capacity))
+
+    def _sync(self):
+        """加载其他进程提交的写入和删除（本进程启动时加载全部条目）"""
+        data_version = self._db.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+
+        if not self.dim:
+            stored_dim = self._get_meta('dim')
+            if not stored_dim:
+                return
+            self.dim = int(stored_dim)
+        self._ensure_capacity(self.INITIAL_CAPACITY)
+
+        seq = self._seq
+        # 先处理删除再处理写入：删除后重新写入的键以最后的写入为准
+        for deletion_seq, key, row in self._db.execute(
+                'SELECT seq, key, row FROM deletions WHERE seq > ? ORDER BY seq', (self._seq,)):
+            if self.key_to_row.get(key) == row:
+                self._forget(key)
+            seq = max(seq, deletion_seq)
+
+        changed = []
+        max_row = -1
+        for key, row, searchable, entry_seq in self._db.execute(
+                'SELECT key, row, metadata IS NOT NULL, seq FROM entries WHERE seq > ?', (self._seq,)):
+            if self.key_to_row.get(key, row) != row:
+                self._forget(key)
+            previous_key = self.row_to_key.get(row)
+            if previous_key is not None and previous_key != key:
+                self._forget(previous_key)
+            self.key_to_row[key] = row
+            self.row_to_key[row] = key
+            if searchable:
+                self.searchable_rows.add(row)
+                changed.append(row)
+            seq = max(seq, entry_seq)
+            max_row = max(max_row, row)
+        self._seq = seq
+
+        self._ensure_capacity(max_row + 1)
+        if self.index.is_trained and changed:
+            rows = np.asarray(changed, dtype=np.int64)
+            self.index.assign(rows, np.asarray(self._vectors[rows]))
+
+    def _forget(self, key: str):
+        row = self.key_to_row.pop(key, None)
+        if row is None:
+            return
+        self.row_to_key.pop(row, None)
+        self.searchable_rows.discard(row)
+        self.index.remove(row)
+
+    def _load_index(self):
+        """加载簇中心并重建倒排表"""
+        if not os.path.exists(self._centroids_path) or not self.searchable_rows:
+            return
+        centroids = np.load(self._centroids_path)
+        if centroids.shape[1] != self.dim:
+            return
+        self.index.centroids = centroids
+        self.index.lists = [set() for _ in range(len(centroids))]
+        rows = self._searchable_array()
+        for start in range(0, len(rows), 65536):
+            chunk = rows[start:start + 65536]
+            self.index.assign(chunk, np.asarray(self._vectors[chunk]))
+        self._trained_size = len(rows)
+
+    def _searchable_array(self) -> np.ndarray:
+        return np.fromiter(self.searchable_rows, dtype=np.int64, count=len(self.searchable_rows))
+
+    def _allocate_row(self) -> int:
+        """在写事务中分配行号，优先复用已删除的行"""
+        free = self._db.execute('SELECT row FROM free_rows ORDER BY row LIMIT 1').fetchone()
+        if free is not None:
+            row = free[0]
+            self._db.execute('DELETE FROM free_rows WHERE row = ?', (row,))
+        else:
+            row = int(self._get_meta('next_row') or 0)
+            self._set_meta('next_row', str(row + 1))
+        self._ensure_capacity(row + 1)
+        return row
+
+    def _maybe_train(self):
+        """数据量达到阈值或较上次训练增长4倍时（重新）训练IVF索引"""
+        size = len(self.searchable_rows)
+        if size < self.train_threshold:
+            return
+        if self.index.is_trained and size < self._trained_size * 4:
+            return
+
+        rows = self._searchable_array()
+        sample = np.random.default_rng(0).choice(rows, min(size, 20000), replace=False)
+        self.index.train(np.asarray(self._vectors[np.sort(sample)]))
+        self.index.assign(rows, np.asarray(self._vectors[rows]))
+        np.save(self._centroids_path, self.index.centroids)
+        self._trained_size = size
+        logger.info(f"嵌入存储IVF索引已训练: {self.path} - {size} 条向量")
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """按文本读取已存储的向量"""
+        return self.get_many([text])[0]
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """批量读取，未命中的位置为None"""
+        with self._lock:
+            self._sync()
+            rows = [self.key_to_row.get(content_hash(text)) for text in texts]
+            return [self._vectors[row].tolist() if row is not None else None for row in rows]
+
+    def put(self, text: str, vector: List[float], metadata: Optional[Dict[str, Any]] = None):
+        """写入（或覆盖）文本向量，metadata 为None时保留已有元数据"""
+        self.put_many([(text, vector, metadata)])
+
+    def put_many(self, items: List[Tuple[str, List[float], Optional[Dict[str, Any]]]]):
+        """批量写入（同一目录的多个进程依次写入，行号不会冲突）"""
+        if not items:
+            return
+
+        with self._lock:
+            written = {}
+            with self._write_transaction():
+                self._sync()
+                if self._get_meta('dim') is None:
+                    self.dim = self.dim or len(items[0][1])
+                    self._set_meta('dim', str(self.dim))
+                    self._ensure_capacity(self.INITIAL_CAPACITY)
+                seq = self._next_seq()
+
+                for text, vector, metadata in items:
+                    array = np.asarray(vector, dtype=np.float32)
+                    if array.shape != (self.dim,):
+                        raise ValueError(f"向量维度不匹配: {array.shape} != ({self.dim},)")
+                    norm = np.linalg.norm(array)
+                    if norm:
+                        array = array / norm
+
+                    key = content_hash(text)
+                    if key in written:
+                        row, searchable = written[key]
+                    else:
+                        row, searchable = self.key_to_row.get(key), False
+                    if row is None:
+                        row = self._allocate_row()
+                    self._vectors[row] = array
+                    written[key] = (row, searchable or metadata is not None)
+                    self._db.execute(
+                        'INSERT INTO entries (key, row, metadata, seq) VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT(key) DO UPDATE SET metadata = COALESCE(excluded.metadata, entries.metadata), '
+                        'seq = excluded.seq',
+                        (key, row, json.dumps(metadata, ensure_ascii=False) if metadata is not None else None, seq)
+                    )
+
+            # 提交成功后才更新本进程的映射
+            self._seq = max(self._seq, seq)
+            new_rows = []
+            for key, (row, searchable) in written.items():
+                self.key_to_row[key] = row
+                self.row_to_key[row] = key
+                if searchable:
+                    self.searchable_rows.add(row)
+                if row in self.searchable_rows:
+                    new_rows.append(row)
+            if self.index.is_trained and new_rows:
+                rows = np.asarray(new_rows, dtype=np.int64)
+                self.index.assign(rows, np.asarray(self._vectors[rows]))
+            self._maybe_train()
+
+    def delete(self, text: str) -> bool:
+        """删除文本向量"""
+        return self.delete_key(content_hash(text))
+
+    def delete_key(self, key: str) -> bool:
+        """按内容哈希删除"""
+        with self._lock:
+            with self._write_transaction():
+                self._sync()
+                found = self._db.execute('SELECT row FROM entries WHERE key = ?', (key,)).fetchone()
+                if found is None:
+                    return False
+                seq = self._next_seq()
+                self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._db.execute('INSERT OR IGNORE INTO free_rows (row) VALUES (?)', (found[0],))
+                self._db.execute('INSERT INTO deletions (seq, key, row) VALUES (?, ?, ?)', (seq, key, found[0]))
+            self._seq = max(self._seq, seq)
+            self._forget(key)
+            return True
+
+    def search(self, vector: List[float], top_k: int = 10, nprobe: Optional[int] = None,
+               min_score: Optional[float] = None) -> List[Dict[str, Any]]:
+        """近似最近邻检索，返回 [{'key', 'score', 'metadata'}]"""
+        with self._lock:
+            self._sync()
+            if not self.searchable_rows:
+                return []
+
+            query = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(query)
+            if not norm:
+                return []
+            query = query / norm
+
+            if self.index.is_trained:
+                rows = self.index.candidates(query, nprobe)
+            else:
+                rows = self._searchable_array()
+            if not len(rows):
+                return []
+
+            rows.sort()
+            scores = np.asarray(self._vectors[rows]) @ query
+            k = min(top_k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            matches = []
+            for position in top.tolist():
+                score = float(scores[position])
+                if min_score is not None and score < min_score:
+                    break
+                matches.append((self.row_to_key[int(rows[position])], score))
+
+            metadata = self._load_metadata([key for key, _ in matches])
+            return [{'key': key, 'score': score, 'metadata': metadata.get(key)} for key, score in matches]
+
+    def _load_metadata(self, keys: List[str]) -> Dict[str, Any]:
+        if not keys:
+            return {}
+        placeholders = ','.join('?' * len(keys))
+        rows = self._db.execute(f'SELECT key, metadata FROM entries WHERE key IN ({placeholders})', keys)
+        return {key: json.loads(metadata) if metadata else None for key, metadata in rows}
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return len(self.row_to_key)
+
+    def flush(self):
+        """落盘"""
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+
+    def close(self):
+        """关闭存储"""
+        with self._lock:
+            self.flush()
+            self._vectors = None
+            self._db.close()
+
+
+class EmbeddingStoreRegistry:
+    """按嵌入模型管理多个向量存储（不同模型维度不同，各自独立）"""
+
+    def __init__(self, base_dir: str, **store_config):
+        self.base_dir = base_dir
+        self.store_config = store_config
+        self.stores: Dict[str, EmbeddingStore] = {}
+        self._lock = threading.Lock()
+
+    def get_store(self, model: str) -> EmbeddingStore:
+        """获取模型对应的存储"""
+        with self._lock:
+            store = self.stores.get(model)
+            if store is None:
+                # 目录名保留可读的模型名，并附加哈希避免不同模型名清洗后冲突
+                directory = f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', model)}-{content_hash(model)[:8]}"
+                store = EmbeddingStore(os.path.join(self.base_dir, directory), **self.store_config)
+                self.stores[model] = store
+            return store
+
+    def close(self):
+        """关闭所有存储"""
+        with self._lock:
+            for store in self.stores.values():
+                store.close()
+            self.stores = {}
@@ -0,0 +1,87 @@
+from collections import deque
+from typing import Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyWindow:
+    """滚动延迟窗口，用于计算分位数"""
+
+    def __init__(self, size: int = 500):
+        self.samples = deque(maxlen=size)
+
+    def record(self, latency: float):
+        """记录一次延迟（秒）"""
+        self.samples.append(latency)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """计算分位数，无样本时返回None"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, int(round(percentile / 100.0 * len(ordered))) - 1))
+        return ordered[index]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class HedgePolicy:
+    """对冲请求策略：按主提供商延迟分位数确定对冲时机，并按流量比例限制对冲预算
+
+    预算采用令牌桶：每个请求补充 budget_ratio 个令牌，每次对冲消耗1个令牌，
+    因此长期对冲比例不会超过 budget_ratio。
+    """
+
+    def __init__(self, percentile: float = 95.0, budget_ratio: float = 0.05,
+                 min_delay: float = 0.05, fallback_delay: float = 2.0,
+                 min_samples: int = 20, max_burst: float = 10.0, window_size: int = 500):
+        self.percentile = percentile
+        self.budget_ratio = budget_ratio
+        self.min_delay = min_delay
+        self.fallback_delay = fallback_delay
+        self.min_samples = min_samples
+        self.max_burst = max_burst
+        self.window_size = window_size
+        self.windows: Dict[str, LatencyWindow] = {}
+        self.tokens = 0.0
+        self.total_requests = 0
+        self.total_hedges = 0
+
+    def record_latency(self, provider_name: str, latency: float):
+        """记录提供商成功请求的延迟"""
+        window = self.windows.get(provider_name)
+        if window is None:
+            window = LatencyWindow(self.window_size)
+            self.windows[provider_name] = window
+        window.record(latency)
+
+    def hedge_delay(self, provider_name: str) -> float:
+        """主请求等待多久后发起对冲请求"""
+        window = self.windows.get(provider_name)
+        if window is None or len(window) < self.min_samples:
+            return self.fallback_delay
+        return max(self.min_delay, window.percentile(self.percentile))
+
+    def on_request(self):
+        """每个可对冲请求到来时补充预算"""
+        self.total_requests += 1
+        self.tokens = min(self.max_burst, self.tokens + self.budget_ratio)
+
+    def try_acquire(self) -> bool:
+        """尝试消耗一次对冲预算"""
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        self.total_hedges += 1
+        return True
+
+    def stats(self) -> Dict[str, float]:
+        """对冲统计"""
+        return {
+            'total_requests': self.total_requests,
+            'total_hedges': self.total_hedges,
+            'hedge_ratio': round(self.total_hedges / self.total_requests, 4) if self.total_requests else 0.0,
+            'tokens': round(self.tokens, 4)
+        }
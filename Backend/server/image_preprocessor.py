@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# 各视觉模型的最大有效分辨率（按模型名前缀匹配）：超过后模型内部也会缩放，多传只增加上传时间和Token
+MODEL_IMAGE_LIMITS = {
+    'qwen-vl': {'max_pixels': 1280 * 28 * 28, 'max_side': 2048},
+    'qwen2.5-vl': {'max_pixels': 1280 * 28 * 28, 'max_side': 2048},
+    'qvq': {'max_pixels': 1280 * 28 * 28, 'max_side': 2048},
+    'doubao-1.5-vision': {'max_pixels': 4014080, 'max_side': 4096},
+    'doubao-vision': {'max_pixels': 1024 * 1024 * 2, 'max_side': 2048},
+    '*': {'max_pixels': 1536 * 1536, 'max_side': 2048},
+}
+
+# 重新编码后支持的格式及对应MIME类型
+IMAGE_MIME_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'}
+
+PHASH_SIZE = 16
+
+
+def _perceptual_hash(image, hash_size: int = PHASH_SIZE) -> str:
+    """DCT感知哈希：灰度缩小到 4*hash_size 见方，取低频系数与中位数比较"""
+    import numpy as np
+    from PIL import Image
+
+    size = hash_size * 4
+    pixels = np.asarray(image.convert('L').resize((size, size), Image.Resampling.LANCZOS), dtype=np.float64)
+    index = np.arange(size)
+    dct_matrix = np.cos(np.pi * (2 * index[None, :] + 1) * index[:, None] / (2 * size))
+    low_freq = (dct_matrix @ pixels @ dct_matrix.T)[:hash_size, :hash_size]
+    bits = (low_freq > np.median(low_freq)).flatten()
+    return np.packbits(bits).tobytes().hex()
+
+
+def preprocess_image(data: bytes, max_pixels: int, max_side: int, output_format: Optional[str] = None,
+                     quality: int = 85) -> Dict[str, Any]:
+    """缩放并重新编码图像（在进程池中执行）
+
+    透明图像编码为WEBP，其余编码为JPEG；未缩放且重新编码后反而更大时保留原图。
+    """
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(data))
+    original_format = image.format
+    width, height = image.size
+    scale = min(1.0, (max_pixels / (width * height)) ** 0.5, max_side / max(width, height))
+    target = (max(1, int(width * scale)), max(1, int(height * scale)))
+    if scale < 1.0 and original_format == 'JPEG':
+        # JPEG解码时直接按2的幂缩小，显著减少大图的解码开销
+        image.draft('RGB', target)
+
+    image = ImageOps.exif_transpose(image)
+    phash = _perceptual_hash(image)
+
+    resized = scale < 1.0
+    if resized:
+        image = image.resize(target, Image.Resampling.LANCZOS)
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    fmt = output_format or ('WEBP' if has_alpha else 'JPEG')
+    if fmt == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    buffer = io.BytesIO()
+    save_options = {'optimize': True} if fmt in ('JPEG', 'PNG') else {'method': 4}
+    if fmt != 'PNG':
+        save_options['quality'] = quality
+    image.save(buffer, format=fmt, **save_options)
+    encoded = buffer.getvalue()
+
+    if not resized and len(encoded) >= len(data) and original_format in IMAGE_MIME_TYPES:
+        encoded, fmt = data, original_format
+
+    return {
+        'data': encoded,
+        'mime_type': IMAGE_MIME_TYPES[fmt],
+        'phash': phash,
+        'width': image.width,
+        'height': image.height,
+        'original_size': len(data)
+    }
+
+
+class ImagePreprocessor:
+    """图像输入预处理：按模型的最大有效分辨率缩放、重新编码，并计算感知哈希
+
+    缩放和编码在进程池中执行，不占用事件循环。感知哈希用于缓存图像分析结果：
+    同一张图片重复分析时命中缓存，轻微的重新压缩通常不改变哈希。
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, model_limits: Optional[Dict[str, Dict[str, int]]] = None,
+                 output_format: Optional[str] = None, quality: int = 85, max_memo_entries: int = 256,
+                 result_cache=None, cache_ttl: int = 86400, key_prefix: str = 'ai:image:'):
+        self.max_workers = max_workers
+        self.model_limits = {**MODEL_IMAGE_LIMITS, **(model_limits or {})}
+        self.output_format = output_format
+        self.quality = quality
+        self.result_cache = result_cache
+        self.cache_ttl = cache_ttl
+        self.key_prefix = key_prefix
+        # 相同原始字节的预处理结果（进程内LRU），避免重复解码
+        self._memo: OrderedDict = OrderedDict()
+        self.max_memo_entries = max_memo_entries
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.stats = {'processed': 0, 'memo_hits': 0, 'bytes_in': 0, 'bytes_out': 0, 'cache_hits': 0}
+
+    def get_limits(self, model: Optional[str]) -> Dict[str, int]:
+        """按模型名获取分辨率上限"""
+        name = (model or '').lower().rsplit('/', 1)[-1]
+        for prefix in sorted(self.model_limits, key=len, reverse=True):
+            if prefix != '*' and name.startswith(prefix):
+                return self.model_limits[prefix]
+        return self.model_limits['*']
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # 使用spawn启动工作进程，避免在多线程的Web/Celery进程中fork
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    async def prepare(self, data: bytes, model: Optional[str] = None) -> Dict[str, Any]:
+        """预处理单张图像，返回 {'data', 'mime_type', 'phash', 'width', 'height', 'original_size'}"""
+        limits = self.get_limits(model)
+        memo_key = (hashlib.blake2b(data, digest_size=16).digest(), limits['max_pixels'], limits['max_side'])
+        prepared = self._memo.get(memo_key)
+        if prepared is not None:
+            self._memo.move_to_end(memo_key)
+            self.stats['memo_hits'] += 1
+            return prepared
+
+        loop = asyncio.get_running_loop()
+        try:
+            prepared = await loop.run_in_executor(
+                self._get_executor(), preprocess_image, data, limits['max_pixels'], limits['max_side'],
+                self.output_format, self.quality
+            )
+        except BrokenProcessPool:
+            # 工作进程异常退出后进程池不可再用，下次请求时重建
+            self._executor = None
+            raise
+        self.stats['processed'] += 1
+        self.stats['bytes_in'] += len(data)
+        self.stats['bytes_out'] += len(prepared['data'])
+
+        self._memo[memo_key] = prepared
+        if len(self._memo) > self.max_memo_entries:
+            self._memo.popitem(last=False)
+        return prepared
+
+    def build_key(self, provider_name: str, model: Optional[str], parts: List[Any], params: Dict[str, Any]) -> str:
+        """图像分析结果的缓存键：提供商、模型、按顺序排列的文本与图像感知哈希、其余参数"""
+        params = {key: value for key, value in params.items() if key not in ('use_cache', 'priority')}
+        raw = json.dumps([provider_name, model, parts, params], sort_keys=True, ensure_ascii=False, default=str)
+        return self.key_prefix + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    async def get_cached(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.result_cache is None:
+            return None
+        try:
+            cached = await self.result_cache.get(key)
+        except Exception as e:
+            logger.warning(f"图像分析缓存读取失败: {str(e)}")
+            return None
+        if cached is not None:
+            self.stats['cache_hits'] += 1
+            return {**cached, 'cached': True}
+        return None
+
+    async def set_cached(self, key: str, result: Dict[str, Any]):
+        if self.result_cache is None or not result.get('success'):
+            return
+        try:
+            await self.result_cache.set(key, result, self.cache_ttl)
+        except Exception as e:
+            logger.warning(f"图像分析缓存写入失败: {str(e)}")
+
+    def shutdown(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
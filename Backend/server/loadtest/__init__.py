@@ -0,0 +1 @@
+# 离线模拟服务与压测工具
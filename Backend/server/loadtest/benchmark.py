@@ -0,0 +1,316 @@
+"""
+AIManager / AgentManager 压测脚本：在指定并发下驱动模拟上游，报告吞吐量、延迟分位数和内存占用
+
+    python -m server.loadtest.benchmark --scenario stream --providers SILICONFLOW --concurrency 64 --requests 2000
+    python -m server.loadtest.benchmark --scenario routed --providers SILICONFLOW,VOLCENGINE_ARK --throttle-rate 0.05
+
+未指定 --mock-url 时在同一事件循环中启动模拟服务；需要排除模拟服务自身的开销时，
+可先用 python -m server.loadtest.mock_server 在单独的进程中启动。
+"""
+import asyncio
+import json
+import os
+import resource
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, Any, Awaitable, Callable, List, Optional, Tuple
+import logging
+
+from ..ai_manager import AIManager, AgentManager
+from ..telemetry import HdrHistogram
+from .mock_server import (
+    MockProviderServer, add_behavior_arguments, behavior_from_args, register_mock_providers, start_mock_server
+)
+
+logger = logging.getLogger(__name__)
+
+
+SCENARIOS = ('chat', 'stream', 'embeddings', 'agent', 'routed', 'cached', 'coalesced', 'fanout')
+REPORT_QUANTILES = (0.5, 0.95, 0.99)
+
+# 单次操作：输入请求序号，返回 (是否成功, 首个输出时间, 错误信息)
+Operation = Callable[[int], Awaitable[Tuple[bool, Optional[float], Optional[str]]]]
+
+
+def _memory_usage() -> Dict[str, float]:
+    """当前与峰值常驻内存（MB）"""
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    usage = {'peak_rss_mb': round(peak_kb / 1024, 1)}
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        usage['rss_mb'] = round(pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024, 1)
+    except (OSError, ValueError):
+        pass
+    return usage
+
+
+def _messages(index: int, unique: bool = True) -> List[Dict[str, str]]:
+    content = f"压测请求 #{index}: 请用一句话介绍连接池的作用。" if unique else f"压测请求: 常见问题 {index}"
+    return [{'role': 'user', 'content': content}]
+
+
+def _result_error(result: Dict[str, Any]) -> str:
+    status = result.get('status')
+    return f"{status}" if status else (result.get('message') or '未知错误')[:60]
+
+
+def build_scenario(name: str, ai_manager: AIManager, agent_manager: AgentManager, providers: List[str],
+                   model: Optional[str] = None, cache_keys: int = 100, sessions: int = 100) -> Operation:
+    """构造压测场景的单次操作"""
+    params = {'model': model} if model else {}
+    provider_name = providers[0]
+
+    if name == 'chat':
+        async def operation(index: int):
+            result = await ai_manager.chat_completion(provider_name, _messages(index), **params)
+            return bool(result.get('success')), None, None if result.get('success') else _result_error(result)
+        return operation
+
+    if name == 'stream':
+        async def operation(index: int):
+            start_time = time.perf_counter()
+            ttft = None
+            async for chunk in ai_manager.stream_chat_completion(provider_name, _messages(index), **params):
+                if chunk.get('error'):
+                    return False, ttft, _result_error(chunk)
+                if ttft is None and (chunk.get('delta') or {}).get('content'):
+                    ttft = time.perf_counter() - start_time
+            return True, ttft, None
+        return operation
+
+    if name == 'embeddings':
+        async def operation(index: int):
+            result = await ai_manager.embeddings(provider_name, [f"压测文本 #{index}"], **params)
+            return bool(result.get('success')), None, None if result.get('success') else _result_error(result)
+        return operation
+
+    if name == 'agent':
+        agent_manager.configure_memory(backend='local')
+        agent_manager.create_agent(
+            'benchmark', '压测智能体', '压测用智能体', provider_name, model or '', '你是一个简洁的助手。'
+        )
+
+        async def operation(index: int):
+            result = await agent_manager.agent_chat(
+                'benchmark', _messages(index)[0]['content'], session_id=f"benchmark-{index % sessions}"
+            )
+            return bool(result.get('success')), None, None if result.get('success') else _result_error(result)
+        return operation
+
+    if name == 'routed':
+        targets = [{'provider': provider} for provider in providers]
+        ai_manager.register_provider('ROUTED', '', '', routes={'benchmark': targets}, strategy='latency')
+
+        async def operation(index: int):
+            result = await ai_manager.chat_completion('ROUTED', _messages(index), model='benchmark')
+            return bool(result.get('success')), None, None if result.get('success') else _result_error(result)
+        return operation
+
+    if name == 'cached':
+        # 请求从 cache_keys 个固定问题中选取，预热后主要命中缓存
+        ai_manager.configure_response_cache(backend='local', models={'*': {'ttl': 3600}})
+
+        async def operation(index: int):
+            result = await ai_manager.chat_completion(
+                provider_name, _messages(index % cache_keys, unique=False), temperature=0, **params
+            )
+            return bool(result.get('success')), None, None if result.get('success') else _result_error(result)
+        return operation
+
+    if name == 'coalesced':
+        # 同一时刻大量用户发送相同的问题（热门模板、共享智能体），相同请求合并为一次上游调用
+        ai_manager.configure_single_flight()
+
+        async def operation(index: int):
+            result = await ai_manager.chat_completion(
+                provider_name, _messages(index % cache_keys, unique=False), use_cache=False, **params
+            )
+            return bool(result.get('success')), None, None if result.get('success') else _result_error(result)
+        return operation
+
+    if name == 'fanout':
+        async def operation(index: int):
+            result = await ai_manager.chat_completion_many(providers, _messages(index), strategy='all', **params)
+            return bool(result.get('success')), None, None if result.get('success') else '全部失败'
+        return operation
+
+    raise ValueError(f"未知的压测场景: {name}")
+
+
+async def run_benchmark(operation: Operation, concurrency: int = 16, requests: int = 1000,
+                        duration: Optional[float] = None, warmup: int = 0) -> Dict[str, Any]:
+    """以固定并发执行操作，直到完成 requests 个请求（或持续 duration 秒）"""
+    for index in range(warmup):
+        await operation(-1 - index)
+
+    latency = HdrHistogram(1e-4, 3600.0)
+    ttft = HdrHistogram(1e-4, 3600.0)
+    errors: Counter = Counter()
+    counters = {'issued': 0, 'succeeded': 0, 'failed': 0}
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker():
+        while True:
+            if deadline is not None:
+                if time.perf_counter() >= deadline:
+                    return
+            elif counters['issued'] >= requests:
+                return
+            index = counters['issued']
+            counters['issued'] += 1
+            start_time = time.perf_counter()
+            try:
+                success, first_output, error = await operation(index)
+            except Exception as e:
+                success, first_output, error = False, None, e.__class__.__name__
+            latency.record(time.perf_counter() - start_time)
+            if first_output is not None:
+                ttft.record(first_output)
+            if success:
+                counters['succeeded'] += 1
+            else:
+                counters['failed'] += 1
+                errors[error] += 1
+
+    memory_before = _memory_usage()
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+
+    completed = counters['succeeded'] + counters['failed']
+    report = {
+        'concurrency': concurrency,
+        'requests': completed,
+        'succeeded': counters['succeeded'],
+        'failed': counters['failed'],
+        'errors': dict(errors.most_common(10)),
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(completed / elapsed, 1) if elapsed > 0 else None,
+        'latency_ms': _percentiles(latency),
+        'memory': {'before': memory_before, 'after': _memory_usage()}
+    }
+    if ttft.count:
+        report['ttft_ms'] = _percentiles(ttft)
+    return report
+
+
+def _percentiles(histogram: HdrHistogram) -> Dict[str, Optional[float]]:
+    report = {f"p{quantile * 100:g}": _milliseconds(histogram.value_at_quantile(quantile))
+              for quantile in REPORT_QUANTILES}
+    report['mean'] = _milliseconds(histogram.total / histogram.count) if histogram.count else None
+    report['max'] = _milliseconds(histogram.max)
+    return report
+
+
+def _milliseconds(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000, 2) if value is not None else None
+
+
+async def run(args) -> Dict[str, Any]:
+    """按命令行参数执行一次压测"""
+    providers = [name.strip() for name in args.providers.split(',') if name.strip()]
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    runner = None
+    mock_server = None
+    base_url = args.mock_url
+    if not base_url:
+        mock_server = MockProviderServer(behavior_from_args(args))
+        runner, base_url = await start_mock_server(mock_server)
+
+    ai_manager = AIManager()
+    agent_manager = AgentManager(ai_manager)
+    provider_config = {'pool_limit': args.pool_limit, 'pool_limit_per_host': args.pool_limit_per_host}
+    registered = register_mock_providers(ai_manager, base_url, providers, **provider_config)
+    if len(registered) != len(providers):
+        raise ValueError(f"提供商注册失败: {sorted(set(providers) - set(registered))}")
+    if args.rpm or args.max_concurrent:
+        for provider_name in providers:
+            ai_manager.set_rate_limit(provider_name, args.model, args.rpm, args.max_concurrent)
+
+    try:
+        await ai_manager.startup()
+        operation = build_scenario(args.scenario, ai_manager, agent_manager, providers, args.model,
+                                   cache_keys=args.cache_keys)
+        report = await run_benchmark(operation, args.concurrency, args.requests, args.duration, args.warmup)
+    finally:
+        await ai_manager.shutdown()
+        if runner is not None:
+            await runner.cleanup()
+
+    report.update({'scenario': args.scenario, 'providers': providers, 'mock_url': base_url})
+    if mock_server is not None:
+        report['upstream'] = mock_server.stats
+    if ai_manager.response_cache is not None:
+        report['response_cache'] = ai_manager.response_cache.stats()
+    if ai_manager.single_flight is not None:
+        report['single_flight'] = dict(ai_manager.single_flight.stats)
+    if ai_manager.rate_limiter is not None:
+        report['rate_limiter'] = ai_manager.rate_limiter.stats()
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report['memory']['python_heap_mb'] = round(current / 1024 / 1024, 1)
+        report['memory']['python_heap_peak_mb'] = round(peak / 1024 / 1024, 1)
+    return report
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """把压测结果格式化为文本"""
+    lines = [
+        f"场景: {report['scenario']}  提供商: {','.join(report['providers'])}  并发: {report['concurrency']}",
+        f"请求: {report['requests']}  成功: {report['succeeded']}  失败: {report['failed']}  "
+        f"耗时: {report['elapsed_seconds']}s  吞吐量: {report['throughput_rps']} req/s",
+    ]
+    for key, title in (('latency_ms', '延迟'), ('ttft_ms', '首Token')):
+        if key in report:
+            values = '  '.join(f"{name}={value}" for name, value in report[key].items())
+            lines.append(f"{title}(ms): {values}")
+    memory = report['memory']
+    lines.append(
+        f"内存(MB): 开始 {memory['before'].get('rss_mb')}  结束 {memory['after'].get('rss_mb')}  "
+        f"峰值 {memory['after']['peak_rss_mb']}"
+        + (f"  Python堆峰值 {memory['python_heap_peak_mb']}" if 'python_heap_peak_mb' in memory else '')
+    )
+    if report['errors']:
+        lines.append(f"错误: {report['errors']}")
+    for key, title in (('upstream', '上游请求'), ('response_cache', '响应缓存'), ('single_flight', '请求合并'),
+                       ('rate_limiter', '速率限制')):
+        if report.get(key):
+            lines.append(f"{title}: {report[key]}")
+    return '\n'.join(lines)
+
+
+def main():
+    """命令行入口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='AIManager / AgentManager 压测')
+    parser.add_argument('--scenario', choices=SCENARIOS, default='chat', help='压测场景')
+    parser.add_argument('--providers', default='SILICONFLOW', help='提供商（逗号分隔，routed/fanout 使用全部）')
+    parser.add_argument('--model', default=None, help='模型名称')
+    parser.add_argument('--concurrency', type=int, default=16, help='并发数')
+    parser.add_argument('--requests', type=int, default=1000, help='请求总数')
+    parser.add_argument('--duration', type=float, default=None, help='持续时间（秒），指定后忽略 --requests')
+    parser.add_argument('--warmup', type=int, default=10, help='预热请求数（不计入结果）')
+    parser.add_argument('--cache-keys', type=int, default=100, help='cached/coalesced 场景中不同问题的数量')
+    parser.add_argument('--pool-limit', type=int, default=100, help='连接池总连接数')
+    parser.add_argument('--pool-limit-per-host', type=int, default=20, help='连接池单主机连接数')
+    parser.add_argument('--rpm', type=int, default=None, help='每个提供商的每分钟请求数限制')
+    parser.add_argument('--max-concurrent', type=int, default=None, help='每个提供商的并发上限')
+    parser.add_argument('--mock-url', default=None, help='已启动的模拟服务地址（默认在进程内启动）')
+    parser.add_argument('--tracemalloc', action='store_true', help='统计Python堆内存（有额外开销）')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出')
+    add_behavior_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    report = asyncio.run(run(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_report(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,435 @@
+"""
+离线模拟上游服务：模拟 SiliconFlow、火山方舟、百炼、OpenRouter、千帆的接口（含SSE流式响应）
+
+可配置延迟、抖动、逐Token间隔、错误率和429限流比例，用于在不消耗配额的情况下验证
+连接池、路由、缓存等改动。命令行启动：
+
+    python -m server.loadtest.mock_server --port 8900 --latency 0.2 --jitter 0.05 --throttle-rate 0.02
+"""
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+# 各提供商在模拟服务中的路径前缀（与真实API的路径结构一致）
+PROVIDER_PATHS = {
+    'SILICONFLOW': '/siliconflow/v1',
+    'VOLCENGINE_ARK': '/ark/api/v3',
+    'OPENROUTER': '/openrouter/api/v1',
+    'ALIBABA_BAILIAN': '/bailian/api/v1',
+    'BAIDU_QIANFAN': '/qianfan/rpc/2.0/ai_custom/v1/wenxinworkshop',
+}
+QIANFAN_TOKEN_PATH = '/qianfan/oauth/2.0/token'
+QIANFAN_TOKEN = 'mock-access-token'
+
+
+class MockBehavior:
+    """模拟上游的行为参数
+
+    - latency / jitter：收到请求到返回响应头的时间（正态分布，秒）
+    - token_interval：流式响应中相邻Token的间隔（秒），非流式响应的总耗时也按Token数累加
+    - error_rate / throttle_rate：返回500 / 429（带 Retry-After）的比例
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, token_interval: float = 0.005,
+                 completion_tokens: int = 20, error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: float = 1.0, embedding_dim: int = 256, audio_bytes: int = 32 * 1024):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_interval = token_interval
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.embedding_dim = embedding_dim
+        self.audio_bytes = audio_bytes
+
+    def delay(self) -> float:
+        if not self.jitter:
+            return self.latency
+        return max(0.0, random.gauss(self.latency, self.jitter))
+
+    def fault(self) -> Optional[Tuple[int, Dict[str, str]]]:
+        """按比例返回模拟故障 (状态码, 响应头)，正常时返回None"""
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return 429, {'Retry-After': f'{self.retry_after:g}'}
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, {}
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+
+def _tokens(count: int) -> List[str]:
+    return [f"模拟{index} " for index in range(count)]
+
+
+def _embedding(text: str, dim: int) -> List[float]:
+    """由文本确定的伪随机单位向量（相同文本得到相同向量）"""
+    rng = random.Random(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest())
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = sum(value * value for value in vector) ** 0.5 or 1.0
+    return [value / norm for value in vector]
+
+
+def _prompt_tokens(messages: Any) -> int:
+    return max(1, len(json.dumps(messages, ensure_ascii=False)) // 4)
+
+
+class MockProviderServer:
+    """模拟上游服务，按提供商分别配置行为并统计请求"""
+
+    def __init__(self, behavior: Optional[MockBehavior] = None,
+                 provider_behaviors: Optional[Dict[str, MockBehavior]] = None):
+        self.behavior = behavior or MockBehavior()
+        self.provider_behaviors = provider_behaviors or {}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def behavior_for(self, provider_name: str) -> MockBehavior:
+        return self.provider_behaviors.get(provider_name, self.behavior)
+
+    def _count(self, provider_name: str, key: str):
+        stats = self.stats.setdefault(provider_name, {'requests': 0, 'streams': 0, 'throttled': 0, 'errors': 0})
+        stats[key] += 1
+
+    async def _begin(self, provider_name: str, stream: bool = False) -> Tuple[MockBehavior, Optional[web.Response]]:
+        """等待模拟延迟；需要模拟故障时返回错误响应"""
+        behavior = self.behavior_for(provider_name)
+        self._count(provider_name, 'requests')
+        if stream:
+            self._count(provider_name, 'streams')
+        await asyncio.sleep(behavior.delay())
+        fault = behavior.fault()
+        if fault is None:
+            return behavior, None
+        status, headers = fault
+        self._count(provider_name, 'throttled' if status == 429 else 'errors')
+        message = 'Rate limit exceeded' if status == 429 else 'Internal server error'
+        return behavior, web.json_response({'error': {'message': message, 'code': status}}, status=status, headers=headers)
+
+    async def _stream_events(self, request: web.Request, events) -> web.StreamResponse:
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        async for event in events:
+            await response.write(event)
+        await response.write_eof()
+        return response
+
+    # OpenAI兼容接口（SiliconFlow、火山方舟、OpenRouter）
+
+    async def openai_chat(self, request: web.Request, provider_name: str) -> web.StreamResponse:
+        body = await request.json()
+        stream = bool(body.get('stream'))
+        behavior, error = await self._begin(provider_name, stream)
+        if error is not None:
+            return error
+
+        model = body.get('model', 'mock-model')
+        tokens = _tokens(behavior.completion_tokens)
+        usage = {
+            'prompt_tokens': _prompt_tokens(body.get('messages')),
+            'completion_tokens': len(tokens),
+            'total_tokens': _prompt_tokens(body.get('messages')) + len(tokens)
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        if not stream:
+            await asyncio.sleep(behavior.token_interval * len(tokens))
+            return web.json_response({
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                             'finish_reason': 'stop'}],
+                'usage': usage
+            })
+
+        async def events():
+            for token in tokens:
+                chunk = {'id': completion_id, 'model': model,
+                         'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8')
+                await asyncio.sleep(behavior.token_interval)
+            final = {'id': completion_id, 'model': model,
+                     'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': usage}
+            yield f"data: {json.dumps(final)}\n\n".encode('utf-8')
+            yield b"data: [DONE]\n\n"
+
+        return await self._stream_events(request, events())
+
+    async def openai_embeddings(self, request: web.Request, provider_name: str) -> web.Response:
+        body = await request.json()
+        behavior, error = await self._begin(provider_name)
+        if error is not None:
+            return error
+        texts = body.get('input') or []
+        texts = [texts] if isinstance(texts, str) else texts
+        return web.json_response({
+            'object': 'list',
+            'model': body.get('model', 'mock-embedding'),
+            'data': [{'object': 'embedding', 'index': index, 'embedding': _embedding(text, behavior.embedding_dim)}
+                     for index, text in enumerate(texts)],
+            'usage': {'prompt_tokens': sum(len(text) for text in texts) // 4 or 1}
+        })
+
+    async def audio_speech(self, request: web.Request, provider_name: str) -> web.StreamResponse:
+        await request.read()
+        behavior, error = await self._begin(provider_name, stream=True)
+        if error is not None:
+            return error
+
+        async def chunks():
+            chunk = b'\xff\xfb' + b'\x00' * 4094
+            for _ in range(max(1, behavior.audio_bytes // len(chunk))):
+                yield chunk
+                await asyncio.sleep(behavior.token_interval)
+
+        response = web.StreamResponse(headers={'Content-Type': 'audio/mpeg'})
+        await response.prepare(request)
+        async for chunk in chunks():
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    # 阿里云百炼
+
+    async def bailian_generation(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        parameters = body.get('parameters') or {}
+        stream = bool(parameters.get('stream'))
+        behavior, error = await self._begin('ALIBABA_BAILIAN', stream)
+        if error is not None:
+            return error
+
+        tokens = _tokens(behavior.completion_tokens)
+        messages = (body.get('input') or {}).get('messages')
+        request_id = uuid.uuid4().hex
+        usage = {'input_tokens': _prompt_tokens(messages), 'output_tokens': len(tokens),
+                 'total_tokens': _prompt_tokens(messages) + len(tokens)}
+
+        if not stream:
+            await asyncio.sleep(behavior.token_interval * len(tokens))
+            return web.json_response({
+                'request_id': request_id,
+                'output': {'choices': [{'finish_reason': 'stop',
+                                        'message': {'role': 'assistant', 'content': ''.join(tokens)}}]},
+                'usage': usage
+            })
+
+        incremental = parameters.get('incremental_output', False)
+
+        async def events():
+            content = ''
+            for index, token in enumerate(tokens):
+                content += token
+                last = index == len(tokens) - 1
+                data = {
+                    'request_id': request_id,
+                    'output': {'choices': [{'finish_reason': 'stop' if last else 'null',
+                                            'message': {'role': 'assistant',
+                                                        'content': token if incremental else content}}]},
+                    'usage': {**usage, 'output_tokens': index + 1, 'total_tokens': usage['input_tokens'] + index + 1}
+                }
+                yield f"id:{index + 1}\nevent:result\n:HTTP_STATUS/200\ndata:{json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+                await asyncio.sleep(behavior.token_interval)
+
+        return await self._stream_events(request, events())
+
+    async def bailian_embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        behavior, error = await self._begin('ALIBABA_BAILIAN')
+        if error is not None:
+            return error
+        texts = (body.get('input') or {}).get('texts') or []
+        return web.json_response({
+            'request_id': uuid.uuid4().hex,
+            'output': {'embeddings': [{'text_index': index, 'embedding': _embedding(text, behavior.embedding_dim)}
+                                      for index, text in enumerate(texts)]},
+            'usage': {'total_tokens': sum(len(text) for text in texts) // 4 or 1}
+        })
+
+    # 百度千帆
+
+    async def qianfan_token(self, request: web.Request) -> web.Response:
+        self._count('BAIDU_QIANFAN', 'requests')
+        if not request.query.get('client_id'):
+            return web.json_response({'error': 'invalid_client', 'error_description': 'unknown client id'})
+        return web.json_response({'access_token': QIANFAN_TOKEN, 'expires_in': 2592000})
+
+    def _qianfan_auth_error(self, request: web.Request) -> Optional[web.Response]:
+        # 千帆以HTTP 200 + error_code 报告令牌错误
+        if request.query.get('access_token') != QIANFAN_TOKEN:
+            return web.json_response({'error_code': 110, 'error_msg': 'Access token invalid or no longer valid'})
+        return None
+
+    async def qianfan_chat(self, request: web.Request) -> web.StreamResponse:
+        auth_error = self._qianfan_auth_error(request)
+        if auth_error is not None:
+            return auth_error
+        body = await request.json()
+        stream = bool(body.get('stream'))
+        behavior, error = await self._begin('BAIDU_QIANFAN', stream)
+        if error is not None:
+            return error
+
+        tokens = _tokens(behavior.completion_tokens)
+        prompt_tokens = _prompt_tokens(body.get('messages'))
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens),
+                 'total_tokens': prompt_tokens + len(tokens)}
+        chat_id = f"as-{uuid.uuid4().hex[:10]}"
+
+        if not stream:
+            await asyncio.sleep(behavior.token_interval * len(tokens))
+            return web.json_response({'id': chat_id, 'object': 'chat.completion', 'created': int(time.time()),
+                                      'result': ''.join(tokens), 'is_truncated': False, 'usage': usage})
+
+        async def events():
+            for index, token in enumerate(tokens):
+                data = {'id': chat_id, 'object': 'chat.completion', 'sentence_id': index,
+                        'is_end': index == len(tokens) - 1, 'result': token, 'usage': usage}
+                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+                await asyncio.sleep(behavior.token_interval)
+
+        return await self._stream_events(request, events())
+
+    async def qianfan_embeddings(self, request: web.Request) -> web.Response:
+        auth_error = self._qianfan_auth_error(request)
+        if auth_error is not None:
+            return auth_error
+        body = await request.json()
+        behavior, error = await self._begin('BAIDU_QIANFAN')
+        if error is not None:
+            return error
+        texts = body.get('input') or []
+        return web.json_response({
+            'id': uuid.uuid4().hex,
+            'object': 'embedding_list',
+            'data': [{'object': 'embedding', 'index': index, 'embedding': _embedding(text, behavior.embedding_dim)}
+                     for index, text in enumerate(texts)],
+            'usage': {'prompt_tokens': sum(len(text) for text in texts) // 4 or 1}
+        })
+
+    async def stats_view(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        routes = []
+        for provider_name in ('SILICONFLOW', 'VOLCENGINE_ARK', 'OPENROUTER'):
+            prefix = PROVIDER_PATHS[provider_name]
+            routes += [
+                (f"{prefix}/chat/completions", self.openai_chat, provider_name),
+                (f"{prefix}/embeddings", self.openai_embeddings, provider_name),
+                (f"{prefix}/audio/speech", self.audio_speech, provider_name),
+            ]
+        for path, handler, provider_name in routes:
+            app.router.add_post(path, self._bind(handler, provider_name))
+
+        bailian = PROVIDER_PATHS['ALIBABA_BAILIAN']
+        app.router.add_post(f"{bailian}/services/aigc/text-generation/generation", self.bailian_generation)
+        app.router.add_post(f"{bailian}/services/embeddings/text-embedding/text-embedding", self.bailian_embeddings)
+        app.router.add_post(f"{bailian}/services/audio/tts/synthesis",
+                            self._bind(self.audio_speech, 'ALIBABA_BAILIAN'))
+
+        qianfan = PROVIDER_PATHS['BAIDU_QIANFAN']
+        app.router.add_post(QIANFAN_TOKEN_PATH, self.qianfan_token)
+        app.router.add_post(f"{qianfan}/chat/{{endpoint}}", self.qianfan_chat)
+        app.router.add_post(f"{qianfan}/embeddings/{{model}}", self.qianfan_embeddings)
+
+        app.router.add_get('/_stats', self.stats_view)
+        return app
+
+    @staticmethod
+    def _bind(handler, provider_name: str):
+        async def bound(request: web.Request) -> web.StreamResponse:
+            return await handler(request, provider_name)
+        return bound
+
+
+def mock_provider_configs(base_url: str) -> Dict[str, Dict[str, Any]]:
+    """模拟服务对应的提供商注册参数：{提供商: {'api_key', 'api_url', ...}}"""
+    base_url = base_url.rstrip('/')
+    configs = {
+        provider_name: {'api_key': 'mock-key', 'api_url': f"{base_url}{path}"}
+        for provider_name, path in PROVIDER_PATHS.items()
+    }
+    configs['BAIDU_QIANFAN'].update({'secret_key': 'mock-secret', 'token_url': f"{base_url}{QIANFAN_TOKEN_PATH}"})
+    return configs
+
+
+def register_mock_providers(ai_manager, base_url: str, providers: Optional[List[str]] = None,
+                            **provider_config) -> List[str]:
+    """把模拟服务注册为AIManager的提供商，返回注册成功的提供商"""
+    registered = []
+    for provider_name, config in mock_provider_configs(base_url).items():
+        if providers and provider_name not in providers:
+            continue
+        config = {**config, **provider_config}
+        if ai_manager.register_provider(provider_name, config.pop('api_key'), config.pop('api_url'), **config):
+            registered.append(provider_name)
+    return registered
+
+
+async def start_mock_server(server: Optional[MockProviderServer] = None, host: str = '127.0.0.1',
+                            port: int = 0) -> Tuple[web.AppRunner, str]:
+    """在当前事件循环中启动模拟服务，返回 (runner, 基础URL)；port 为0时自动分配端口"""
+    server = server or MockProviderServer()
+    runner = web.AppRunner(server.create_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, backlog=4096)
+    await site.start()
+    bound_port = runner.addresses[0][1]
+    return runner, f"http://{host}:{bound_port}"
+
+
+def add_behavior_arguments(parser):
+    """命令行中的模拟行为参数（模拟服务与压测脚本共用）"""
+    parser.add_argument('--latency', type=float, default=0.05, help='响应延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='延迟抖动（正态分布标准差，秒）')
+    parser.add_argument('--token-interval', type=float, default=0.005, help='流式Token间隔（秒）')
+    parser.add_argument('--completion-tokens', type=int, default=20, help='每次回复的Token数')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回500的比例')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='返回429的比例')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='429响应的 Retry-After（秒）')
+
+
+def behavior_from_args(args) -> MockBehavior:
+    return MockBehavior(
+        latency=args.latency, jitter=args.jitter, token_interval=args.token_interval,
+        completion_tokens=args.completion_tokens, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, retry_after=args.retry_after
+    )
+
+
+def main():
+    """命令行启动模拟服务"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='AI服务提供商离线模拟服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8900, help='监听端口')
+    add_behavior_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockProviderServer(behavior_from_args(args))
+    base_url = f"http://{args.host}:{args.port}"
+    print(f"模拟服务已启动: {base_url}")
+    for provider_name, config in mock_provider_configs(base_url).items():
+        print(f"  {provider_name}: {config['api_url']}")
+    web.run_app(server.create_app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# 令牌桶取令牌：按 rate * factor 补充令牌，处于 Retry-After 封禁期内时返回剩余封禁时间
+# 返回 {需等待秒数, 当前速率系数}（字符串形式，避免Lua数字被截断为整数）
+ACQUIRE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'factor', 'blocked_until')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+local factor = tonumber(state[3]) or 1
+local blocked_until = tonumber(state[4]) or 0
+local effective = rate * factor
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * effective)
+local wait = 0
+if now < blocked_until then
+    wait = blocked_until - now
+elseif tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / effective
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 3600)
+return {tostring(wait), tostring(factor)}
+"""
+
+# 反馈：429时速率系数减半、清空令牌并记录封禁期；成功时系数线性恢复
+FEEDBACK_SCRIPT = """
+local retry_after = tonumber(ARGV[2])
+local min_factor = tonumber(ARGV[3])
+local step = tonumber(ARGV[4])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local factor = tonumber(redis.call('HGET', KEYS[1], 'factor')) or 1
+if ARGV[1] == 'throttled' then
+    factor = math.max(min_factor, factor * 0.5)
+    redis.call('HSET', KEYS[1], 'tokens', 0, 'ts', now)
+    if retry_after > 0 then
+        local blocked_until = tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0
+        redis.call('HSET', KEYS[1], 'blocked_until', math.max(blocked_until, now + retry_after))
+    end
+else
+    factor = math.min(1, factor + step)
+end
+redis.call('HSET', KEYS[1], 'factor', factor)
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(factor)
+"""
+
+
+class LocalBucketBackend:
+    """进程内令牌桶（未配置Redis时使用，仅限制单个进程）"""
+
+    def __init__(self):
+        self.buckets: Dict[str, Dict[str, float]] = {}
+
+    def _bucket(self, key: str, capacity: float) -> Dict[str, float]:
+        return self.buckets.setdefault(key, {
+            'tokens': capacity, 'ts': time.monotonic(), 'factor': 1.0, 'blocked_until': 0.0
+        })
+
+    async def acquire(self, key: str, rate: float, capacity: float) -> Tuple[float, float]:
+        """尝试取一个令牌，返回(需等待秒数, 速率系数)"""
+        bucket = self._bucket(key, capacity)
+        now = time.monotonic()
+        effective = rate * bucket['factor']
+        bucket['tokens'] = min(capacity, bucket['tokens'] + max(0.0, now - bucket['ts']) * effective)
+        bucket['ts'] = now
+        if now < bucket['blocked_until']:
+            return bucket['blocked_until'] - now, bucket['factor']
+        if bucket['tokens'] >= 1:
+            bucket['tokens'] -= 1
+            return 0.0, bucket['factor']
+        return (1 - bucket['tokens']) / effective, bucket['factor']
+
+    async def feedback(self, key: str, kind: str, retry_after: float, min_factor: float, step: float) -> float:
+        """根据上游反馈调整速率系数，返回新系数"""
+        bucket = self._bucket(key, 0.0)
+        now = time.monotonic()
+        if kind == 'throttled':
+            bucket['factor'] = max(min_factor, bucket['factor'] * 0.5)
+            bucket['tokens'] = 0.0
+            bucket['ts'] = now
+            if retry_after > 0:
+                bucket['blocked_until'] = max(bucket['blocked_until'], now + retry_after)
+        else:
+            bucket['factor'] = min(1.0, bucket['factor'] + step)
+        return bucket['factor']
+
+
+class RedisBucketBackend:
+    """Redis令牌桶（Lua脚本原子执行，集群内所有工作进程共享同一预算）
+
+    redis.asyncio 的连接绑定事件循环，因此按事件循环分别创建客户端（如Celery任务中每次 asyncio.run）。
+    """
+
+    def __init__(self, url: str = 'redis://127.0.0.1:6379/1'):
+        self.url = url
+        self._clients: Dict[asyncio.AbstractEventLoop, Tuple[Any, Any, Any]] = {}
+
+    def _scripts(self) -> Tuple[Any, Any]:
+        """获取当前事件循环下的客户端注册的脚本"""
+        import redis.asyncio as redis
+
+        loop = asyncio.get_running_loop()
+        for stale_loop in [item for item in self._clients if item.is_closed()]:
+            del self._clients[stale_loop]
+        entry = self._clients.get(loop)
+        if entry is None:
+            client = redis.from_url(self.url)
+            entry = (client, client.register_script(ACQUIRE_SCRIPT), client.register_script(FEEDBACK_SCRIPT))
+            self._clients[loop] = entry
+        return entry[1], entry[2]
+
+    async def acquire(self, key: str, rate: float, capacity: float) -> Tuple[float, float]:
+        acquire_script, _ = self._scripts()
+        wait, factor = await acquire_script(keys=[key], args=[rate, capacity])
+        return float(wait), float(factor)
+
+    async def feedback(self, key: str, kind: str, retry_after: float, min_factor: float, step: float) -> float:
+        _, feedback_script = self._scripts()
+        return float(await feedback_script(keys=[key], args=[kind, retry_after, min_factor, step]))
+
+    async def aclose(self):
+        """关闭当前事件循环下的客户端"""
+        entry = self._clients.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            await entry[0].aclose()
+
+
+class _LimitState:
+    """单个 (提供商, 模型) 在当前事件循环中的排队状态"""
+
+    def __init__(self):
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.active = 0
+        self.released = asyncio.Event()
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.factor = 1.0
+        self.granted = 0
+        self.throttled = 0
+        self.timeouts = 0
+
+
+class RateLimiter:
+    """按 (提供商, 模型) 的速率与并发限制
+
+    - 速率：令牌桶，每分钟 requests_per_minute 个令牌，桶容量 burst
+    - 并发：同时进行中的请求数不超过 max_concurrent
+    - 自适应：上游返回429时速率减半并遵守 Retry-After，此后每次成功按 recovery_step 线性恢复
+    - 排队：超出限制的请求按 priority（越大越优先）排队等待，超过 max_queue_wait 秒才失败
+    """
+
+    def __init__(self, redis_url: Optional[str] = None, key_prefix: str = 'ai:ratelimit:',
+                 default_rpm: Optional[int] = None, max_queue_wait: float = 60.0,
+                 min_factor: float = 0.1, recovery_step: float = 0.05):
+        self.backend = RedisBucketBackend(redis_url) if redis_url else LocalBucketBackend()
+        self.key_prefix = key_prefix
+        self.default_rpm = default_rpm
+        self.max_queue_wait = max_queue_wait
+        self.min_factor = min_factor
+        self.recovery_step = recovery_step
+        self.limits: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._states: Dict[tuple, _LimitState] = {}
+        self._sequence = itertools.count()
+
+    def set_limit(self, provider_name: str, model: Optional[str], requests_per_minute: Optional[int] = None,
+                  max_concurrent: Optional[int] = None, burst: Optional[float] = None):
+        """设置限制，model 为 '*' 时作为该提供商的默认限制"""
+        key = (provider_name, model or '*')
+        if not requests_per_minute and not max_concurrent:
+            self.limits.pop(key, None)
+            return
+        self.limits[key] = {
+            'requests_per_minute': requests_per_minute,
+            'max_concurrent': max_concurrent,
+            # 默认允许约6秒的突发量
+            'burst': burst or (max(1.0, requests_per_minute / 10.0) if requests_per_minute else None)
+        }
+
+    def get_limit(self, provider_name: str, model: Optional[str]) -> Optional[Dict[str, Any]]:
+        """获取限制，未配置时返回None（不限制）"""
+        limit = self.limits.get((provider_name, model or '*')) or self.limits.get((provider_name, '*'))
+        if limit is None and self.default_rpm:
+            limit = {'requests_per_minute': self.default_rpm, 'max_concurrent': None,
+                     'burst': max(1.0, self.default_rpm / 10.0)}
+        return limit
+
+    def _bucket_key(self, provider_name: str, model: Optional[str]) -> str:
+        return f"{self.key_prefix}{provider_name}:{model or '*'}"
+
+    def _state(self, provider_name: str, model: Optional[str]) -> _LimitState:
+        loop = asyncio.get_running_loop()
+        for stale in [key for key in self._states if key[0].is_closed()]:
+            del self._states[stale]
+        key = (loop, provider_name, model or '*')
+        state = self._states.get(key)
+        if state is None:
+            state = _LimitState()
+            self._states[key] = state
+        return state
+
+    @asynccontextmanager
+    async def slot(self, provider_name: str, model: Optional[str], priority: int = 0):
+        """获取请求许可，产出是否获得许可（排队超时为False）"""
+        limit = self.get_limit(provider_name, model)
+        if limit is None:
+            yield True
+            return
+
+        state = self._state(provider_name, model)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(state.waiters, (-priority, next(self._sequence), future))
+        if state.dispatcher is None or state.dispatcher.done():
+            state.dispatcher = asyncio.ensure_future(self._dispatch(provider_name, model, limit, state))
+
+        try:
+            await asyncio.wait_for(future, self.max_queue_wait)
+        except asyncio.TimeoutError:
+            state.timeouts += 1
+            logger.warning(f"请求排队超时: {provider_name}/{model}")
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            state.active -= 1
+            state.released.set()
+
+    async def _dispatch(self, provider_name: str, model: Optional[str], limit: Dict[str, Any], state: _LimitState):
+        """按优先级依次放行排队的请求"""
+        bucket_key = self._bucket_key(provider_name, model)
+        rpm = limit.get('requests_per_minute')
+        while state.waiters:
+            if state.waiters[0][2].done():
+                heapq.heappop(state.waiters)
+                continue
+
+            max_concurrent = limit.get('max_concurrent')
+            if max_concurrent and state.active >= max_concurrent:
+                state.released.clear()
+                await state.released.wait()
+                continue
+
+            if rpm:
+                try:
+                    wait, state.factor = await self.backend.acquire(bucket_key, rpm / 60.0, limit['burst'])
+                except Exception as e:
+                    # 限流后端不可用时放行，避免影响正常请求
+                    logger.warning(f"限流后端不可用: {str(e)}")
+                    wait = 0.0
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+
+            while state.waiters:
+                _, _, future = heapq.heappop(state.waiters)
+                if not future.done():
+                    state.active += 1
+                    state.granted += 1
+                    future.set_result(True)
+                    break
+
+    async def feedback(self, provider_name: str, model: Optional[str], result: Any):
+        """根据请求结果调整速率：429降速，成功逐步恢复"""
+        if self.get_limit(provider_name, model) is None or not isinstance(result, dict):
+            return
+
+        state = self._state(provider_name, model)
+        bucket_key = self._bucket_key(provider_name, model)
+        try:
+            if result.get('error') and result.get('status') == 429:
+                state.throttled += 1
+                state.factor = await self.backend.feedback(
+                    bucket_key, 'throttled', float(result.get('retry_after') or 0),
+                    self.min_factor, self.recovery_step
+                )
+                logger.warning(f"上游限流, 降低请求速率: {provider_name}/{model} - 系数 {state.factor}")
+            elif result.get('success') and state.factor < 1.0:
+                state.factor = await self.backend.feedback(
+                    bucket_key, 'success', 0, self.min_factor, self.recovery_step
+                )
+        except Exception as e:
+            logger.warning(f"限流后端不可用: {str(e)}")
+
+    async def aclose(self):
+        """释放当前事件循环下的限流后端连接"""
+        if hasattr(self.backend, 'aclose'):
+            await self.backend.aclose()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """限流统计"""
+        report = {}
+        for (_, provider_name, model), state in self._states.items():
+            report[f"{provider_name}/{model}"] = {
+                'queued': sum(1 for _, _, future in state.waiters if not future.done()),
+                'active': state.active,
+                'factor': round(state.factor, 4),
+                'granted': state.granted,
+                'throttled': state.throttled,
+                'timeouts': state.timeouts
+            }
+        return report
@@ -0,0 +1,319 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple
+import logging
+
+try:
+    import numpy as np
+except ImportError:  # 语义缓存为可选功能
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# 除角色和内容外参与缓存键计算的消息字段
+MESSAGE_KEY_FIELDS = ('name', 'tool_call_id', 'tool_calls')
+
+# 带有这些参数的请求不缓存（结果依赖工具定义、停止序列或输出格式，而缓存键不包含它们）
+UNCACHEABLE_PARAMS = ('stream', 'functions', 'tools', 'tool_choice', 'stop', 'response_format')
+
+
+def normalize_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """规范化消息列表：统一角色大小写、去除内容首尾空白（内容中的空白和换行保留），保留工具调用相关字段"""
+    normalized = []
+    for message in messages:
+        content = message.get('content', '')
+        if isinstance(content, str):
+            content = content.strip()
+        item = {
+            'role': str(message.get('role', 'user')).lower(),
+            'content': content
+        }
+        for field in MESSAGE_KEY_FIELDS:
+            if message.get(field) is not None:
+                item[field] = message[field]
+        normalized.append(item)
+    return normalized
+
+
+class LocalCacheBackend:
+    """进程内LRU缓存后端（带TTL）"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._data: OrderedDict = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        """读取缓存"""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at and expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any, ttl: int):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        expires_at = time.monotonic() + ttl if ttl else 0
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    async def add(self, key: str, value: Any, ttl: int) -> bool:
+        """键不存在时写入，返回是否写入成功"""
+        if await self.get(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, key: str):
+        """删除缓存"""
+        self._data.pop(key, None)
+
+
+class DjangoCacheBackend:
+    """Django缓存后端（默认使用 settings.CACHES 中的 django-redis）
+
+    过期由TTL控制，容量淘汰依赖Redis的 maxmemory-policy（建议 allkeys-lru）。
+    """
+
+    def __init__(self, alias: str = 'default'):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+
+    async def get(self, key: str) -> Optional[Any]:
+        """读取缓存"""
+        return await self.cache.aget(key)
+
+    async def set(self, key: str, value: Any, ttl: int):
+        """写入缓存"""
+        await self.cache.aset(key, value, timeout=ttl or None)
+
+    async def add(self, key: str, value: Any, ttl: int) -> bool:
+        """键不存在时写入（Redis SET NX），返回是否写入成功"""
+        return await self.cache.aadd(key, value, timeout=ttl or None)
+
+    async def delete(self, key: str):
+        """删除缓存"""
+        await self.cache.adelete(key)
+
+
+class SemanticIndex:
+    """语义近邻索引：保存请求向量与对应的精确缓存键，按余弦相似度查找"""
+
+    def __init__(self, max_entries: int = 5000, threshold: float = 0.95):
+        if np is None:
+            raise ImportError("语义缓存需要安装 numpy")
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries: OrderedDict = OrderedDict()
+        self._matrix = None
+        self._keys: List[str] = []
+
+    def add(self, cache_key: str, vector: List[float]):
+        """加入向量"""
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        if not norm:
+            return
+        self._entries[cache_key] = array / norm
+        self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._matrix = None
+
+    def remove(self, cache_key: str):
+        """移除向量"""
+        if self._entries.pop(cache_key, None) is not None:
+            self._matrix = None
+
+    def search(self, vector: List[float]) -> Optional[Tuple[str, float]]:
+        """查找相似度超过阈值的最近邻，返回(缓存键, 相似度)"""
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            self._keys = list(self._entries.keys())
+            self._matrix = np.stack([self._entries[key] for key in self._keys])
+
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not norm:
+            return None
+        scores = self._matrix @ (query / norm)
+        best = int(np.argmax(scores))
+        similarity = float(scores[best])
+        if similarity < self.threshold:
+            return None
+        return self._keys[best], similarity
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResponseCache:
+    """AI响应缓存
+
+    精确模式：按 (provider, model, 规范化消息, temperature, top_p, max_tokens) 计算缓存键。
+    语义模式：对请求文本求嵌入向量，在近邻索引中查找足够相似的历史请求。
+    仅对开启缓存的模型、且 temperature 不超过 max_temperature 的确定性请求生效；
+    流式请求和带有工具、停止序列或输出格式参数的请求不缓存。
+
+    models 配置示例::
+
+        {
+            'qwen-turbo-latest': {'ttl': 3600},
+            'Qwen/Qwen3-30B-A3B': {'ttl': 600, 'semantic': True, 'max_temperature': 0.2},
+            '*': {'ttl': 300}
+        }
+    """
+
+    def __init__(self, backend=None, models: Optional[Dict[str, Dict[str, Any]]] = None,
+                 default_ttl: int = 3600, max_temperature: float = 0.0,
+                 key_prefix: str = 'ai:response:',
+                 embed_fn: Optional[Callable[[List[str]], Awaitable[Optional[List[List[float]]]]]] = None,
+                 semantic_threshold: float = 0.95, semantic_max_entries: int = 5000):
+        self.backend = backend or LocalCacheBackend()
+        self.models = models or {}
+        self.default_ttl = default_ttl
+        self.max_temperature = max_temperature
+        self.key_prefix = key_prefix
+        self.embed_fn = embed_fn
+        self.semantic_threshold = semantic_threshold
+        self.semantic_max_entries = semantic_max_entries
+        self.semantic_indexes: Dict[Tuple[str, str], SemanticIndex] = {}
+        # 未命中时计算出的向量，写入缓存时复用，避免重复计算嵌入
+        self._pending_vectors: OrderedDict = OrderedDict()
+        self.metrics = {
+            'hits': 0,
+            'semantic_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'bypass': 0
+        }
+
+    def get_model_config(self, model: str) -> Optional[Dict[str, Any]]:
+        """获取模型的缓存配置，未开启时返回None"""
+        if model in self.models:
+            return self.models[model]
+        return self.models.get('*')
+
+    def is_cacheable(self, model: str, params: Dict[str, Any]) -> bool:
+        """判断请求是否可缓存"""
+        model_config = self.get_model_config(model)
+        if model_config is None:
+            return False
+        if any(params.get(name) for name in UNCACHEABLE_PARAMS):
+            return False
+        max_temperature = model_config.get('max_temperature', self.max_temperature)
+        temperature = params.get('temperature')
+        return temperature is not None and temperature <= max_temperature
+
+    def build_key(self, provider_name: str, model: str, messages: List[Dict[str, Any]],
+                  params: Dict[str, Any]) -> str:
+        """计算精确缓存键"""
+        key_data = {
+            'provider': provider_name,
+            'model': model,
+            'messages': normalize_messages(messages),
+            'temperature': params.get('temperature'),
+            'top_p': params.get('top_p'),
+            'max_tokens': params.get('max_tokens')
+        }
+        digest = hashlib.sha256(
+            json.dumps(key_data, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        ).hexdigest()
+        return f"{self.key_prefix}{digest}"
+
+    def _semantic_enabled(self, model: str) -> bool:
+        model_config = self.get_model_config(model) or {}
+        return bool(model_config.get('semantic')) and self.embed_fn is not None and np is not None
+
+    @staticmethod
+    def _semantic_text(messages: List[Dict[str, Any]]) -> str:
+        return '\n'.join(
+            f"{message['role']}: {message['content']}"
+            for message in normalize_messages(messages)
+            if isinstance(message['content'], str)
+        )
+
+    async def _embed(self, messages: List[Dict[str, Any]]) -> Optional[List[float]]:
+        try:
+            vectors = await self.embed_fn([self._semantic_text(messages)])
+        except Exception as e:
+            logger.warning(f"语义缓存嵌入计算失败: {str(e)}")
+            return None
+        return vectors[0] if vectors else None
+
+    async def get(self, provider_name: str, messages: List[Dict[str, Any]],
+                  params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """查找缓存的响应"""
+        model = params.get('model', '')
+        if not self.is_cacheable(model, params):
+            self.metrics['bypass'] += 1
+            return None
+
+        key = self.build_key(provider_name, model, messages, params)
+        cached = await self.backend.get(key)
+        if cached is not None:
+            self.metrics['hits'] += 1
+            return {**cached, 'cached': True}
+
+        if self._semantic_enabled(model):
+            index = self.semantic_indexes.get((provider_name, model))
+            vector = await self._embed(messages) if index else None
+            if vector is not None:
+                self._pending_vectors[key] = vector
+                while len(self._pending_vectors) > 1000:
+                    self._pending_vectors.popitem(last=False)
+            match = index.search(vector) if vector is not None else None
+            if match:
+                similar_key, similarity = match
+                cached = await self.backend.get(similar_key)
+                if cached is not None:
+                    self.metrics['semantic_hits'] += 1
+                    return {**cached, 'cached': True, 'similarity': round(similarity, 4)}
+                # 对应条目已过期
+                index.remove(similar_key)
+
+        self.metrics['misses'] += 1
+        return None
+
+    async def set(self, provider_name: str, messages: List[Dict[str, Any]],
+                  params: Dict[str, Any], result: Dict[str, Any]):
+        """缓存成功的响应"""
+        model = params.get('model', '')
+        if not result.get('success') or not self.is_cacheable(model, params):
+            return
+
+        model_config = self.get_model_config(model) or {}
+        ttl = model_config.get('ttl', self.default_ttl)
+        key = self.build_key(provider_name, model, messages, params)
+        value = {k: v for k, v in result.items() if k not in ('cached', 'similarity', 'hedged')}
+        await self.backend.set(key, value, ttl)
+        self.metrics['stores'] += 1
+
+        if self._semantic_enabled(model):
+            vector = self._pending_vectors.pop(key, None)
+            if vector is None:
+                vector = await self._embed(messages)
+            if vector is not None:
+                index = self.semantic_indexes.get((provider_name, model))
+                if index is None:
+                    index = SemanticIndex(self.semantic_max_entries, self.semantic_threshold)
+                    self.semantic_indexes[(provider_name, model)] = index
+                index.add(key, vector)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率统计"""
+        lookups = self.metrics['hits'] + self.metrics['semantic_hits'] + self.metrics['misses']
+        hits = self.metrics['hits'] + self.metrics['semantic_hits']
+        return {
+            **self.metrics,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'semantic_index_size': sum(len(index) for index in self.semantic_indexes.values())
+        }
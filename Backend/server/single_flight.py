@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import json
+import uuid
+import weakref
+from typing import Dict, Any, Awaitable, Callable, List, Optional
+import logging
+
+from .response_cache import normalize_messages
+
+logger = logging.getLogger(__name__)
+
+
+# 仅当锁仍由自己持有时释放
+# KEYS: 锁; ARGV: 持有者令牌
+REDIS_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class _Flight:
+    """一次进行中的上游调用及其等待者数量"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """相同请求合并（single-flight）：同一时刻的相同请求只向上游发送一次，其余请求等待并共享结果
+
+    进程内按事件循环维护进行中的调用；指定 redis_url 时再用Redis锁在工作进程间选出一个执行者，
+    执行者通过发布/订阅把结果分发给其他进程中的等待者。执行者异常退出或等待超时时，
+    等待者自行调用上游，合并只影响负载，不影响可用性。
+    """
+
+    def __init__(self, redis_url: Optional[str] = None, lock_ttl: float = 120.0, wait_timeout: float = 120.0,
+                 result_ttl: float = 10.0, poll_interval: float = 1.0, max_temperature: Optional[float] = None,
+                 key_prefix: str = 'ai:flight:'):
+        self.redis_url = redis_url
+        self.client = None
+        if redis_url:
+            import redis.asyncio as redis
+            self.client = redis.from_url(redis_url)
+            self._release_script = self.client.register_script(REDIS_RELEASE_SCRIPT)
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        # 结果在Redis中保留的时间，覆盖订阅前已发布结果的竞态
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        # 超过此温度的请求不合并（None 表示不限制）：采样结果本应各不相同时可以关闭
+        self.max_temperature = max_temperature
+        self.key_prefix = key_prefix
+        self._flights: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, _Flight]]' = \
+            weakref.WeakKeyDictionary()
+        self.stats = {'leaders': 0, 'followers': 0, 'remote_leaders': 0, 'remote_followers': 0,
+                      'remote_fallbacks': 0}
+
+    def should_coalesce(self, params: Dict[str, Any]) -> bool:
+        """判断请求是否参与合并"""
+        if params.get('stream'):
+            return False
+        temperature = params.get('temperature')
+        return self.max_temperature is None or temperature is None or temperature <= self.max_temperature
+
+    def build_key(self, provider_name: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+        """合并键：提供商、规范化消息和全部请求参数"""
+        params = {key: value for key, value in params.items() if key not in ('use_cache', 'priority', 'coalesce')}
+        raw = json.dumps(
+            [provider_name, normalize_messages(messages), params],
+            ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str
+        )
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """执行 call，或等待进行中的相同调用并返回其结果（每个调用方得到独立的浅拷贝）"""
+        flights = self._flights.setdefault(asyncio.get_running_loop(), {})
+        flight = flights.get(key)
+        if flight is None:
+            self.stats['leaders'] += 1
+            coroutine = self._remote_do(key, call) if self.client is not None else call()
+            flight = _Flight(asyncio.ensure_future(coroutine))
+            flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(flights, key, flight))
+        else:
+            self.stats['followers'] += 1
+
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            # 所有等待者都已离开时取消上游调用；仍有等待者时继续执行
+            if not flight.task.done():
+                flight.waiters -= 1
+                if flight.waiters == 0:
+                    flight.task.cancel()
+            raise
+        flight.waiters -= 1
+        return dict(result) if isinstance(result, dict) else result
+
+    @staticmethod
+    def _forget(flights: Dict[str, _Flight], key: str, flight: _Flight):
+        if flights.get(key) is flight:
+            del flights[key]
+
+    def _lock_key(self, key: str) -> str:
+        return f"{self.key_prefix}lock:{key}"
+
+    def _result_key(self, key: str) -> str:
+        return f"{self.key_prefix}result:{key}"
+
+    async def _remote_do(self, key: str, call: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """在工作进程间合并：抢到锁的进程调用上游并发布结果，其余进程订阅结果"""
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.client.set(self._lock_key(key), token, nx=True, px=int(self.lock_ttl * 1000))
+        except Exception as e:
+            logger.warning(f"请求合并加锁失败, 直接调用上游: {str(e)}")
+            return await call()
+
+        if acquired:
+            self.stats['remote_leaders'] += 1
+            try:
+                result = await call()
+                await self._publish(key, result)
+                return result
+            finally:
+                try:
+                    await self._release_script(keys=[self._lock_key(key)], args=[token])
+                except Exception as e:
+                    logger.warning(f"请求合并释放锁失败: {str(e)}")
+
+        result = await self._wait_remote(key)
+        if result is not None:
+            self.stats['remote_followers'] += 1
+            return result
+        self.stats['remote_fallbacks'] += 1
+        return await call()
+
+    async def _publish(self, key: str, result: Dict[str, Any]):
+        try:
+            payload = json.dumps(result, ensure_ascii=False, default=str)
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.set(self._result_key(key), payload, px=int(self.result_ttl * 1000))
+                pipe.publish(self._result_key(key), payload)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"请求合并发布结果失败: {str(e)}")
+
+    async def _wait_remote(self, key: str) -> Optional[Dict[str, Any]]:
+        """等待其他进程发布结果；执行者的锁消失但没有结果（进程退出）或超时时返回None"""
+        channel = self._result_key(key)
+        pubsub = self.client.pubsub()
+        try:
+            await pubsub.subscribe(channel)
+            # 订阅前可能已经发布
+            payload = await self.client.get(channel)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.wait_timeout
+            while payload is None:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=min(self.poll_interval, remaining)
+                )
+                if message is not None:
+                    payload = message['data']
+                elif not await self.client.exists(self._lock_key(key)):
+                    payload = await self.client.get(channel)
+                    if payload is None:
+                        return None
+            return json.loads(payload)
+        except Exception as e:
+            logger.warning(f"请求合并等待结果失败: {str(e)}")
+            return None
+        finally:
+            try:
+                await pubsub.unsubscribe(channel)
+                await pubsub.aclose()
+            except Exception:
+                pass
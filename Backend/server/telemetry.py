@@ -0,0 +1,245 @@
+import math
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# 导出的分位数
+EXPORT_QUANTILES = (0.5, 0.9, 0.95, 0.99, 0.999)
+
+# 直方图指标：(名称, 说明, 取值范围)
+HISTOGRAMS = {
+    'request_duration_seconds': ('调用总耗时（秒）', 1e-4, 3600.0),
+    'connect_seconds': ('新建连接耗时，含DNS解析与TLS握手（秒）', 1e-5, 120.0),
+    'pool_wait_seconds': ('等待连接池空闲连接的时间（秒）', 1e-5, 600.0),
+    'ttfb_seconds': ('发出请求到收到响应头的时间（秒）', 1e-4, 3600.0),
+    'ttft_seconds': ('流式调用到首个输出的时间（秒）', 1e-4, 3600.0),
+    'tokens_per_second': ('输出Token速率', 1e-2, 1e5),
+}
+
+COUNTERS = {
+    'requests_total': '调用次数',
+    'bytes_sent_total': '发送字节数',
+    'bytes_received_total': '接收字节数',
+    'tokens_total': 'Token数',
+    'connections_total': '使用的连接数（新建或复用）',
+}
+
+
+class HdrHistogram:
+    """HDR风格直方图：按对数分桶，在取值范围内保持固定的相对精度
+
+    significant_figures=2 时每个桶的宽度约为其下界的1%，分位数误差不超过1%，
+    而内存只与实际出现过的桶数有关，与样本数无关。
+    """
+
+    def __init__(self, lowest: float, highest: float, significant_figures: int = 2):
+        self.lowest = lowest
+        self.highest = highest
+        self._log_base = math.log1p(10.0 ** -significant_figures)
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def _index(self, value: float) -> int:
+        value = min(max(value, self.lowest), self.highest)
+        return int(math.log(value / self.lowest) / self._log_base)
+
+    def _bucket_value(self, index: int) -> float:
+        # 取桶上下界的几何中点
+        return self.lowest * math.exp((index + 0.5) * self._log_base)
+
+    def record(self, value: float):
+        if value is None or value < 0 or math.isnan(value):
+            return
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, counts: Dict[int, int], count: int, total: float, minimum: Optional[float],
+              maximum: Optional[float]):
+        """合并另一个相同参数直方图的分桶计数（用于汇总多个进程的指标）"""
+        for index, bucket_count in counts.items():
+            self.counts[index] = self.counts.get(index, 0) + bucket_count
+        self.count += count
+        self.total += total
+        if minimum is not None:
+            self.min = minimum if self.min is None else min(self.min, minimum)
+        if maximum is not None:
+            self.max = maximum if self.max is None else max(self.max, maximum)
+
+    def value_at_quantile(self, quantile: float) -> Optional[float]:
+        """分位数（样本为空时返回None）"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(quantile * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(max(self._bucket_value(index), self.min), self.max)
+        return self.max
+
+
+class ProviderTelemetry:
+    """AI服务提供商调用指标（进程内），按 (提供商, 模型, 方法) 聚合，可导出为Prometheus文本格式"""
+
+    def __init__(self, namespace: str = 'ai_provider', significant_figures: int = 2):
+        self.namespace = namespace
+        self.significant_figures = significant_figures
+        self.histograms: Dict[Tuple[str, tuple], HdrHistogram] = {}
+        self.counters: Dict[Tuple[str, tuple], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, metric: str, labels: Dict[str, str], value: Optional[float]):
+        """记录一个直方图样本"""
+        if value is None:
+            return
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                _, lowest, highest = HISTOGRAMS[metric]
+                histogram = HdrHistogram(lowest, highest, self.significant_figures)
+                self.histograms[key] = histogram
+            histogram.record(value)
+
+    def increment(self, metric: str, labels: Dict[str, str], value: float = 1):
+        """累加计数器"""
+        if not value:
+            return
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record_call(self, metrics: Any):
+        """记录一次提供商调用（CallMetrics）"""
+        labels = {'provider': metrics.provider, 'model': metrics.model or '', 'method': metrics.method}
+        self.increment('requests_total', {**labels, 'outcome': metrics.outcome})
+        self.observe('request_duration_seconds', labels, metrics.duration)
+        for connect_time in metrics.connect_times:
+            self.observe('connect_seconds', labels, connect_time)
+        for wait_time in metrics.pool_waits:
+            self.observe('pool_wait_seconds', labels, wait_time)
+        self.increment('connections_total', {**labels, 'kind': 'new'}, len(metrics.connect_times))
+        self.increment('connections_total', {**labels, 'kind': 'reused'}, metrics.reused_connections)
+        self.observe('ttfb_seconds', labels, metrics.ttfb)
+        self.observe('ttft_seconds', labels, metrics.ttft)
+        self.increment('bytes_sent_total', labels, metrics.bytes_sent)
+        self.increment('bytes_received_total', labels, metrics.bytes_received)
+        self.increment('tokens_total', {**labels, 'kind': 'prompt'}, metrics.prompt_tokens)
+        self.increment('tokens_total', {**labels, 'kind': 'completion'}, metrics.completion_tokens)
+        if metrics.outcome == 'success':
+            # 中途断开或失败的调用输出不完整，不计入速率
+            self.observe('tokens_per_second', labels, metrics.tokens_per_second())
+
+    def export_state(self) -> Dict[str, Any]:
+        """可合并的指标状态（直方图分桶计数与计数器），用于跨进程汇总"""
+        with self._lock:
+            return {
+                'histograms': [
+                    (key, dict(histogram.counts), histogram.count, histogram.total, histogram.min, histogram.max)
+                    for key, histogram in self.histograms.items()
+                ],
+                'counters': dict(self.counters)
+            }
+
+    def merge_state(self, state: Dict[str, Any]):
+        """合并 export_state 导出的指标状态"""
+        with self._lock:
+            for key, counts, count, total, minimum, maximum in state.get('histograms', []):
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    _, lowest, highest = HISTOGRAMS[key[0]]
+                    histogram = HdrHistogram(lowest, highest, self.significant_figures)
+                    self.histograms[key] = histogram
+                histogram.merge(counts, count, total, minimum, maximum)
+            for key, value in state.get('counters', {}).items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        """当前指标（JSON友好格式）"""
+        with self._lock:
+            histograms = list(self.histograms.items())
+            counters = list(self.counters.items())
+        report: Dict[str, List[Dict[str, Any]]] = {}
+        for (metric, labels), histogram in histograms:
+            report.setdefault(metric, []).append({
+                'labels': dict(labels),
+                'count': histogram.count,
+                'sum': histogram.total,
+                'min': histogram.min,
+                'max': histogram.max,
+                **{f'p{quantile * 100:g}': histogram.value_at_quantile(quantile) for quantile in EXPORT_QUANTILES}
+            })
+        for (metric, labels), value in counters:
+            report.setdefault(metric, []).append({'labels': dict(labels), 'value': value})
+        return report
+
+    def render_prometheus(self) -> str:
+        """Prometheus文本格式（直方图以summary导出分位数）"""
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        lines = []
+        described = set()
+        for (metric, labels), histogram in histograms:
+            name = f"{self.namespace}_{metric}"
+            if metric not in described:
+                described.add(metric)
+                lines.append(f"# HELP {name} {HISTOGRAMS[metric][0]}")
+                lines.append(f"# TYPE {name} summary")
+            for quantile in EXPORT_QUANTILES:
+                value = histogram.value_at_quantile(quantile)
+                lines.append(f"{name}{_format_labels(labels + (('quantile', f'{quantile:g}'),))} {_format_value(value)}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+        for (metric, labels), value in counters:
+            name = f"{self.namespace}_{metric}"
+            if metric not in described:
+                described.add(metric)
+                lines.append(f"# HELP {name} {COUNTERS[metric]}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        f'{key}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in labels
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: Optional[float]) -> str:
+    if value is None:
+        return 'NaN'
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# 全局指标实例
+provider_telemetry = ProviderTelemetry()
+
+
+def get_provider_telemetry() -> ProviderTelemetry:
+    """获取提供商调用指标实例"""
+    return provider_telemetry
@@ -0,0 +1,89 @@
+import multiprocessing
+import tempfile
+import unittest
+
+import numpy as np
+
+from server.embedding_store import EmbeddingStore, content_hash
+
+
+def _write_entries(path: str, worker: int, count: int):
+    """子进程：逐条写入，与其他进程交错分配行号"""
+    store = EmbeddingStore(path)
+    for index in range(count):
+        store.put(f'w{worker}-{index}', [worker + 1, index + 1, 1], {'worker': worker})
+    store.close()
+
+
+class EmbeddingStoreSharingTests(unittest.TestCase):
+    """多个实例、多个进程共享同一存储目录"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assertSameDirection(self, stored, expected):
+        expected = np.asarray(expected, dtype=np.float32)
+        np.testing.assert_allclose(stored, expected / np.linalg.norm(expected), rtol=1e-5)
+
+    def test_instances_see_each_others_writes(self):
+        first, second = EmbeddingStore(self.path), EmbeddingStore(self.path)
+        try:
+            first.put('hello', [1, 0, 0])
+            second.put('world', [0, 1, 0])
+
+            self.assertSameDirection(second.get('hello'), [1, 0, 0])
+            self.assertSameDirection(first.get('world'), [0, 1, 0])
+            self.assertNotEqual(first.key_to_row[content_hash('hello')], first.key_to_row[content_hash('world')])
+            self.assertEqual(len(first), 2)
+            self.assertEqual(len(second), 2)
+        finally:
+            first.close()
+            second.close()
+
+    def test_deleted_row_is_reused_without_clobbering(self):
+        first, second = EmbeddingStore(self.path), EmbeddingStore(self.path)
+        try:
+            first.put('old', [1, 0, 0])
+            first.put('kept', [0, 1, 0])
+            second.delete('old')
+            self.assertIsNone(first.get('old'))
+
+            first.put('new', [0, 0, 1], {'title': 'new'})
+            self.assertSameDirection(second.get('kept'), [0, 1, 0])
+            self.assertSameDirection(second.get('new'), [0, 0, 1])
+            matches = second.search([0, 0, 1], top_k=1)
+            self.assertEqual(matches[0]['key'], content_hash('new'))
+            self.assertEqual(matches[0]['metadata'], {'title': 'new'})
+        finally:
+            first.close()
+            second.close()
+
+    def test_concurrent_processes_get_distinct_rows(self):
+        workers, count = 4, 100
+        processes = [
+            multiprocessing.Process(target=_write_entries, args=(self.path, worker, count))
+            for worker in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+
+        store = EmbeddingStore(self.path)
+        try:
+            self.assertEqual(len(store), workers * count)
+            self.assertEqual(len(set(store.key_to_row.values())), workers * count)
+            for worker in range(workers):
+                for index in range(count):
+                    self.assertSameDirection(store.get(f'w{worker}-{index}'), [worker + 1, index + 1, 1])
+        finally:
+            store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
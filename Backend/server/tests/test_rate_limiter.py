@@ -0,0 +1,116 @@
+import asyncio
+import os
+import unittest
+
+from server.rate_limiter import RateLimiter, RedisBucketBackend
+
+REDIS_URL = os.environ.get('AI_TEST_REDIS_URL', 'redis://127.0.0.1:6379/15')
+
+
+def _redis_available() -> bool:
+    try:
+        import redis
+        redis.Redis.from_url(REDIS_URL, socket_connect_timeout=0.5).ping()
+        return True
+    except Exception:
+        return False
+
+
+async def _take_slot(limiter: RateLimiter) -> bool:
+    async with limiter.slot('p', 'm') as granted:
+        return granted
+
+
+class RateLimiterEventLoopTests(unittest.TestCase):
+    """同一个限流器在先后多个事件循环中使用（如Celery任务中每次 asyncio.run）"""
+
+    def test_concurrency_limit_in_each_loop(self):
+        limiter = RateLimiter()
+        limiter.set_limit('p', 'm', max_concurrent=1)
+
+        async def run_batch():
+            active, peak = 0, 0
+
+            async def call():
+                nonlocal active, peak
+                async with limiter.slot('p', 'm') as granted:
+                    self.assertTrue(granted)
+                    active += 1
+                    peak = max(peak, active)
+                    await asyncio.sleep(0.01)
+                    active -= 1
+
+            await asyncio.gather(*(call() for _ in range(5)))
+            return peak
+
+        self.assertEqual(asyncio.run(run_batch()), 1)
+        self.assertEqual(asyncio.run(run_batch()), 1)
+        # 已关闭事件循环的排队状态被清理
+        asyncio.run(run_batch())
+        self.assertEqual(len(limiter._states), 1)
+
+    def test_token_bucket_shared_across_loops(self):
+        limiter = RateLimiter(max_queue_wait=0.2)
+        limiter.set_limit('p', 'm', requests_per_minute=6, burst=1)
+
+        self.assertTrue(asyncio.run(_take_slot(limiter)))
+        # 令牌每10秒补充一个，另一个事件循环中的请求排队超时
+        self.assertFalse(asyncio.run(_take_slot(limiter)))
+
+    def test_redis_clients_bound_per_loop(self):
+        backend = RedisBucketBackend(REDIS_URL)
+
+        async def client():
+            backend._scripts()
+            return backend._clients[asyncio.get_running_loop()][0]
+
+        first_loop, second_loop = asyncio.new_event_loop(), asyncio.new_event_loop()
+        try:
+            first = first_loop.run_until_complete(client())
+            second = second_loop.run_until_complete(client())
+            self.assertIsNot(first, second)
+            self.assertIs(second_loop.run_until_complete(client()), second)
+
+            first_loop.close()
+            second_loop.run_until_complete(client())
+            self.assertEqual(list(backend._clients), [second_loop])
+            second_loop.run_until_complete(backend.aclose())
+            self.assertEqual(backend._clients, {})
+        finally:
+            first_loop.close()
+            second_loop.close()
+
+
+@unittest.skipUnless(_redis_available(), 'Redis不可用')
+class RedisRateLimiterTests(unittest.TestCase):
+    """通过Redis共享的请求预算"""
+
+    def setUp(self):
+        self.key_prefix = f'ai:ratelimit:test:{os.getpid()}:'
+
+    def tearDown(self):
+        import redis
+        client = redis.Redis.from_url(REDIS_URL)
+        for key in client.scan_iter(f'{self.key_prefix}*'):
+            client.delete(key)
+
+    def test_budget_shared_between_limiters_and_loops(self):
+        # 两个限流器模拟两个工作进程
+        first = RateLimiter(redis_url=REDIS_URL, key_prefix=self.key_prefix, max_queue_wait=0.2)
+        second = RateLimiter(redis_url=REDIS_URL, key_prefix=self.key_prefix, max_queue_wait=0.2)
+        for limiter in (first, second):
+            limiter.set_limit('p', 'm', requests_per_minute=6, burst=1)
+
+        async def take(limiter):
+            try:
+                return await _take_slot(limiter)
+            finally:
+                await limiter.aclose()
+
+        self.assertTrue(asyncio.run(take(first)))
+        self.assertFalse(asyncio.run(take(second)))
+        self.assertFalse(asyncio.run(take(first)))
+
+
+if __name__ == '__main__':
+    unittest.main()
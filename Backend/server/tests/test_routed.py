@@ -0,0 +1,179 @@
+import asyncio
+import time
+import unittest
+
+from server.ai_providers.base import ProviderHTTPError
+from server.ai_providers.routed import CircuitBreaker, RoutedProvider
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    """熔断器状态转换"""
+
+    def open_breaker(self, **config) -> CircuitBreaker:
+        breaker = CircuitBreaker(failure_threshold=2, **config)
+        breaker.record_failure()
+        breaker.record_failure()
+        return breaker
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=3)
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+        self.assertGreater(breaker.retry_after(), 0)
+
+    def test_half_open_allows_single_trial(self):
+        breaker = self.open_breaker(recovery_timeout=0.05)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        self.assertTrue(breaker.is_trial())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow_request())
+
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.is_trial())
+
+    def test_failed_trial_reopens(self):
+        breaker = self.open_breaker(recovery_timeout=0.05)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+    def test_released_trial_allows_next_probe(self):
+        breaker = self.open_breaker(recovery_timeout=0.05)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        breaker.release_trial()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(breaker.allow_request())
+
+    def test_abandoned_trial_expires(self):
+        breaker = self.open_breaker(recovery_timeout=0.05)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+
+
+class FakeProvider:
+    """按预设行为响应的上游提供商"""
+
+    def __init__(self, delay: float = 0.0, result=None, error: Exception = None):
+        self.delay = delay
+        self.result = result or {'success': True, 'content': 'ok'}
+        self.error = error
+        self.calls = 0
+
+    async def chat_completion(self, messages, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return dict(self.result)
+
+    async def stream_chat_completion(self, messages, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        yield {'content': 'ok'}
+
+
+class RoutedProviderBreakerTests(unittest.TestCase):
+    """路由调用中的熔断探测"""
+
+    def make_router(self, upstream: FakeProvider) -> RoutedProvider:
+        return RoutedProvider(
+            routes={'chat': [{'provider': 'UP', 'model': 'm'}]},
+            provider_resolver=lambda name: upstream if name == 'UP' else None,
+            failure_threshold=1, recovery_timeout=0.05, telemetry=False
+        )
+
+    def trip(self, router: RoutedProvider):
+        breaker = router.get_health('UP').breaker
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        time.sleep(0.06)
+        return breaker
+
+    def test_cancelled_probe_releases_breaker(self):
+        upstream = FakeProvider(delay=1.0)
+        router = self.make_router(upstream)
+        breaker = self.trip(router)
+
+        async def run():
+            probe = asyncio.ensure_future(router.chat_completion([{'role': 'user', 'content': 'hi'}], model='chat'))
+            await asyncio.sleep(0.01)
+            probe.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await probe
+            upstream.delay = 0
+            return await router.chat_completion([{'role': 'user', 'content': 'hi'}], model='chat')
+
+        result = asyncio.run(run())
+        self.assertTrue(result['success'])
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_cancelled_stream_probe_releases_breaker(self):
+        upstream = FakeProvider(delay=1.0)
+        router = self.make_router(upstream)
+        breaker = self.trip(router)
+
+        async def consume():
+            return [chunk async for chunk in router.stream_chat_completion(
+                [{'role': 'user', 'content': 'hi'}], model='chat'
+            )]
+
+        async def run():
+            probe = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.01)
+            probe.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await probe
+            upstream.delay = 0
+            return await consume()
+
+        chunks = asyncio.run(run())
+        self.assertEqual(chunks[0]['provider'], 'UP')
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_all_open_error_is_retryable(self):
+        upstream = FakeProvider()
+        router = self.make_router(upstream)
+        router.get_health('UP').breaker.record_failure()
+
+        result = asyncio.run(router.chat_completion([{'role': 'user', 'content': 'hi'}], model='chat'))
+        self.assertTrue(result['error'])
+        self.assertTrue(result['retryable'])
+        self.assertEqual(result['status'], 503)
+        self.assertGreaterEqual(result['retry_after'], 1)
+        self.assertEqual(upstream.calls, 0)
+
+    def test_stream_failure_before_output_reopens(self):
+        upstream = FakeProvider(error=ProviderHTTPError(400, 'bad request'))
+        router = self.make_router(upstream)
+        breaker = self.trip(router)
+
+        async def consume():
+            return [chunk async for chunk in router.stream_chat_completion(
+                [{'role': 'user', 'content': 'hi'}], model='chat'
+            )]
+
+        with self.assertRaises(ProviderHTTPError):
+            asyncio.run(consume())
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+if __name__ == '__main__':
+    unittest.main()
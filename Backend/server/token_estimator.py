@@ -0,0 +1,169 @@
+import math
+import re
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
+
+# 各模型家族分词器的近似参数：
+#   chars_per_token  单字节字符（英文、数字、符号）平均每个Token的字符数
+#   cjk_per_token    多字节字符（中文等）平均每个Token的字符数
+MODEL_FAMILIES = [
+    ('qwen', ('qwen',), {'chars_per_token': 3.8, 'cjk_per_token': 1.5}),
+    ('ernie', ('ernie', 'eb-'), {'chars_per_token': 4.0, 'cjk_per_token': 1.3}),
+    ('doubao', ('doubao',), {'chars_per_token': 4.0, 'cjk_per_token': 1.5}),
+    ('deepseek', ('deepseek',), {'chars_per_token': 3.8, 'cjk_per_token': 1.6}),
+    ('glm', ('glm',), {'chars_per_token': 3.8, 'cjk_per_token': 1.6}),
+    ('gpt-4o', ('gpt-4o', 'gpt-4.1', 'o1', 'o3', 'o4'), {'chars_per_token': 4.0, 'cjk_per_token': 1.1}),
+    ('gpt', ('gpt-',), {'chars_per_token': 4.0, 'cjk_per_token': 0.7}),
+    ('claude', ('claude',), {'chars_per_token': 3.5, 'cjk_per_token': 0.8}),
+    ('llama', ('llama', 'mistral', 'mixtral', 'devstral', 'gemma'), {'chars_per_token': 3.6, 'cjk_per_token': 0.6}),
+]
+
+DEFAULT_FAMILY = {'chars_per_token': 4.0, 'cjk_per_token': 1.0}
+
+# 已知模型的上下文长度（按模型名前缀匹配），未知模型不做上下文长度检查
+KNOWN_CONTEXT_WINDOWS = {
+    'qwen-turbo': 1000000,
+    'qwen-plus': 131072,
+    'qwen-max': 32768,
+    'gpt-3.5-turbo': 16385,
+    'gpt-4o': 128000,
+    'gpt-4-turbo': 128000,
+    'deepseek-chat': 65536,
+}
+
+# 每条消息的格式开销（角色、分隔符）以及回复起始开销
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+# 图像等非文本内容按固定Token数估算
+IMAGE_TOKENS = 768
+
+_WINDOW_SUFFIX_PATTERN = re.compile(r'(\d+)k\b')
+
+
+@lru_cache(maxsize=256)
+def get_model_family(model: Optional[str]) -> Dict[str, Any]:
+    """按模型名获取分词近似参数"""
+    name = (model or '').lower().rsplit('/', 1)[-1]
+    for family, prefixes, config in MODEL_FAMILIES:
+        if any(name.startswith(prefix) or f'-{prefix}' in name for prefix in prefixes):
+            return {'family': family, **config}
+    return {'family': 'default', **DEFAULT_FAMILY}
+
+
+@lru_cache(maxsize=256)
+def get_context_window(model: Optional[str]) -> Optional[int]:
+    """获取模型上下文长度：优先取模型名中的 8K/128K 后缀，其次查已知模型表，未知返回None"""
+    if not model:
+        return None
+    name = model.lower().rsplit('/', 1)[-1]
+    match = _WINDOW_SUFFIX_PATTERN.search(name)
+    if match:
+        return int(match.group(1)) * 1024
+    for prefix in sorted(KNOWN_CONTEXT_WINDOWS, key=len, reverse=True):
+        if name.startswith(prefix):
+            return KNOWN_CONTEXT_WINDOWS[prefix]
+    return None
+
+
+def _estimate(text: str, chars_per_token: float, cjk_per_token: float) -> int:
+    length = len(text)
+    # UTF-8编码后多出的字节数：中日韩字符每个多2字节，借此在C层面统计宽字符数量
+    extra = len(text.encode('utf-8')) - length
+    if not extra:
+        return math.ceil(length / chars_per_token)
+    wide = min(extra // 2, length)
+    return math.ceil(wide / cjk_per_token + (length - wide) / chars_per_token)
+
+
+@lru_cache(maxsize=512)
+def _estimate_cached(text: str, chars_per_token: float, cjk_per_token: float) -> int:
+    return _estimate(text, chars_per_token, cjk_per_token)
+
+
+def estimate_tokens(text: str, model: Optional[str] = None) -> int:
+    """估算文本的Token数"""
+    if not text:
+        return 0
+    family = get_model_family(model)
+    return _estimate(text, family['chars_per_token'], family['cjk_per_token'])
+
+
+def _content_tokens(content: Any, family: Dict[str, Any], cached: bool = False) -> int:
+    if isinstance(content, str):
+        estimate = _estimate_cached if cached else _estimate
+        return estimate(content, family['chars_per_token'], family['cjk_per_token']) if content else 0
+    if isinstance(content, list):
+        tokens = 0
+        for part in content:
+            if isinstance(part, dict) and part.get('type', 'text') == 'text' and 'text' in part:
+                tokens += _content_tokens(part['text'], family)
+            else:
+                tokens += IMAGE_TOKENS
+        return tokens
+    return _content_tokens(str(content), family) if content is not None else 0
+
+
+def count_message_tokens(message: Dict[str, Any], model: Optional[str] = None) -> int:
+    """估算单条消息的Token数（系统提示走LRU缓存）"""
+    family = get_model_family(model)
+    return MESSAGE_OVERHEAD + _content_tokens(
+        message.get('content'), family, cached=message.get('role') == 'system'
+    )
+
+
+def count_messages_tokens(messages: List[Dict[str, Any]], model: Optional[str] = None) -> int:
+    """估算消息列表作为提示词的Token数"""
+    return sum(count_message_tokens(message, model) for message in messages) + REPLY_OVERHEAD
+
+
+def fit_messages(messages: List[Dict[str, Any]], model: Optional[str],
+                 max_prompt_tokens: int) -> List[Dict[str, Any]]:
+    """在提示词预算内保留消息：保留系统消息和最后一条消息，从最早的历史开始丢弃"""
+    costs = [count_message_tokens(message, model) for message in messages]
+    total = sum(costs) + REPLY_OVERHEAD
+    if total <= max_prompt_tokens:
+        return messages
+
+    drop = set()
+    for index, message in enumerate(messages[:-1]):
+        if total <= max_prompt_tokens:
+            break
+        if message.get('role') == 'system':
+            continue
+        drop.add(index)
+        total -= costs[index]
+
+    # 不以助手回复开头，避免丢失对应的用户提问
+    kept = [index for index in range(len(messages)) if index not in drop]
+    for index in kept:
+        role = messages[index].get('role')
+        if role == 'system':
+            continue
+        if role == 'assistant' and index != len(messages) - 1:
+            drop.add(index)
+            continue
+        break
+    return [message for index, message in enumerate(messages) if index not in drop]
+
+
+def check_budget(messages: List[Dict[str, Any]], model: Optional[str], max_tokens: Optional[int] = None,
+                 context_window: Optional[int] = None) -> Dict[str, Any]:
+    """请求前的上下文长度检查
+
+    返回 {'prompt_tokens', 'context_window', 'max_tokens', 'fits'}；提示词放得下但
+    prompt + max_tokens 超出上下文长度时，max_tokens 被收紧到剩余空间。
+    """
+    prompt_tokens = count_messages_tokens(messages, model)
+    window = context_window or get_context_window(model)
+    if not window:
+        return {'prompt_tokens': prompt_tokens, 'context_window': None, 'max_tokens': max_tokens, 'fits': True}
+
+    available = window - prompt_tokens
+    if max_tokens is not None and max_tokens > available:
+        max_tokens = available
+    return {
+        'prompt_tokens': prompt_tokens,
+        'context_window': window,
+        'max_tokens': max_tokens,
+        'fits': available > 0
+    }
@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Iterator, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# 命中缓存后按此大小分块回放音频
+TTS_REPLAY_CHUNK_SIZE = 64 * 1024
+
+# 写入音频并按LRU淘汰，直到总字节数不超过上限
+# KEYS: 音频键, LRU有序集合, 大小哈希, 总字节计数; ARGV: 条目键, 音频, 时间戳, 字节上限, 音频键前缀
+REDIS_SET_SCRIPT = """
+local old = tonumber(redis.call('HGET', KEYS[3], ARGV[1])) or 0
+redis.call('SET', KEYS[1], ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+redis.call('HSET', KEYS[3], ARGV[1], string.len(ARGV[2]))
+local total = redis.call('INCRBY', KEYS[4], string.len(ARGV[2]) - old)
+local max_bytes = tonumber(ARGV[4])
+while total > max_bytes do
+    local oldest = redis.call('ZPOPMIN', KEYS[2])
+    if #oldest == 0 then
+        break
+    end
+    local size = tonumber(redis.call('HGET', KEYS[3], oldest[1])) or 0
+    redis.call('HDEL', KEYS[3], oldest[1])
+    redis.call('DEL', ARGV[5] .. oldest[1])
+    total = redis.call('INCRBY', KEYS[4], -size)
+end
+return total
+"""
+
+
+class DiskAudioBackend:
+    """本地磁盘音频缓存：每条音频一个文件（按键的前两位分目录），总大小超过上限时淘汰最久未使用的文件
+
+    最近使用时间记录在文件的修改时间上，重启后据此重建LRU顺序。多个进程共享同一目录时，
+    各进程只按自己的索引统计大小，淘汰是近似的。
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index: Optional[OrderedDict] = None
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load_index(self) -> OrderedDict:
+        if self._index is not None:
+            return self._index
+        entries = []
+        if os.path.isdir(self.directory):
+            for shard in os.scandir(self.directory):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.is_file() and not entry.name.endswith('.tmp'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, entry.name, stat.st_size))
+        entries.sort()
+        self._index = OrderedDict((name, size) for _, name, size in entries)
+        self._total = sum(self._index.values())
+        return self._index
+
+    def _get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                index = self._load_index()
+                if key in index:
+                    self._total -= index.pop(key)
+            return None
+        with self._lock:
+            index = self._load_index()
+            if key not in index:
+                # 其他进程写入的文件
+                index[key] = len(data)
+                self._total += len(data)
+            index.move_to_end(key)
+        return data
+
+    def _set(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+
+        evicted = []
+        with self._lock:
+            index = self._load_index()
+            self._total += len(data) - index.pop(key, 0)
+            index[key] = len(data)
+            while self._total > self.max_bytes and len(index) > 1:
+                oldest, size = index.popitem(last=False)
+                self._total -= size
+                evicted.append(oldest)
+        for oldest in evicted:
+            try:
+                os.remove(self._path(oldest))
+            except FileNotFoundError:
+                pass
+
+    def _delete(self, key: str):
+        with self._lock:
+            index = self._load_index()
+            if key in index:
+                self._total -= index.pop(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, data: bytes):
+        await asyncio.to_thread(self._set, key, data)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._delete, key)
+
+    def size(self) -> int:
+        """当前缓存总字节数"""
+        with self._lock:
+            self._load_index()
+            return self._total
+
+
+class RedisAudioBackend:
+    """Redis音频缓存：音频存为字符串，有序集合记录最近使用时间，写入时在Lua脚本中原子地按LRU淘汰"""
+
+    def __init__(self, url: str = 'redis://127.0.0.1:6379/1', max_bytes: int = 256 * 1024 * 1024,
+                 key_prefix: str = 'ai:tts:'):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+        self.max_bytes = max_bytes
+        self.key_prefix = key_prefix
+        self.lru_key = f"{key_prefix}lru"
+        self.sizes_key = f"{key_prefix}sizes"
+        self.bytes_key = f"{key_prefix}bytes"
+        self._set_script = self.client.register_script(REDIS_SET_SCRIPT)
+
+    def _data_key(self, key: str) -> str:
+        return f"{self.key_prefix}data:{key}"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.get(self._data_key(key))
+            pipe.zadd(self.lru_key, {key: time.time()}, xx=True)
+            data, _ = await pipe.execute()
+        return data
+
+    async def set(self, key: str, data: bytes):
+        await self._set_script(
+            keys=[self._data_key(key), self.lru_key, self.sizes_key, self.bytes_key],
+            args=[key, data, time.time(), self.max_bytes, f"{self.key_prefix}data:"]
+        )
+
+    async def delete(self, key: str):
+        size = await self.client.hget(self.sizes_key, key)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(self._data_key(key))
+            pipe.zrem(self.lru_key, key)
+            pipe.hdel(self.sizes_key, key)
+            if size:
+                pipe.decrby(self.bytes_key, int(size))
+            await pipe.execute()
+
+
+class TTSCache:
+    """语音合成结果缓存（按内容寻址）
+
+    缓存键由提供商、模型、音色、语速等合成参数和文本的哈希组成，相同文本和参数的合成结果直接复用，
+    例如智能体的固定问候语。
+    """
+
+    def __init__(self, backend, max_entry_bytes: int = 8 * 1024 * 1024):
+        self.backend = backend
+        # 超过此大小的音频不缓存，避免长文本挤掉常用短语
+        self.max_entry_bytes = max_entry_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'bytes_served': 0}
+
+    def build_key(self, provider_name: str, text: str, params: Dict[str, Any]) -> str:
+        """缓存键：(提供商, 模型, 音色, 语速, 其余合成参数, 文本哈希)"""
+        params = {key: value for key, value in params.items() if key not in ('use_cache', 'priority')}
+        text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        raw = json.dumps(
+            [provider_name, params.pop('model', None), params.pop('voice', None), params.pop('speed', None),
+             params, text_hash],
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        try:
+            audio = await self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"语音合成缓存读取失败: {str(e)}")
+            return None
+        if audio is None:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        self.stats['bytes_served'] += len(audio)
+        return audio
+
+    async def set(self, key: str, audio: Any):
+        if not isinstance(audio, bytes) or not audio or len(audio) > self.max_entry_bytes:
+            return
+        try:
+            await self.backend.set(key, audio)
+            self.stats['writes'] += 1
+        except Exception as e:
+            logger.warning(f"语音合成缓存写入失败: {str(e)}")
+
+    async def delete(self, key: str):
+        await self.backend.delete(key)
+
+
+def iter_audio_chunks(audio: bytes, chunk_size: int = TTS_REPLAY_CHUNK_SIZE) -> Iterator[bytes]:
+    """把缓存的音频按块切分，用于流式回放"""
+    view = memoryview(audio)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start:start + chunk_size])